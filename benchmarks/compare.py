@@ -0,0 +1,75 @@
+# =============================================================================
+# SNOMED Cluster Manager - Benchmark Comparison
+# =============================================================================
+#
+# Compares two benchmarks.run result files case by case and exits non-zero if
+# any case got slower than the threshold, started issuing more queries or
+# started failing.
+#
+#   python -m benchmarks.compare benchmark_results/abc123.json benchmark_results/def456.json
+
+import argparse
+import json
+import sys
+
+import pandas as pd
+
+KEY_COLUMNS = ["SCALE", "KIND", "NAME"]
+
+
+def load_results(path):
+    """Result rows of a benchmark file as a DataFrame"""
+    with open(path) as f:
+        data = json.load(f)
+    return data, pd.DataFrame(data["results"])
+
+
+def compare(base, head, metric="COLD_P50_MS", threshold=1.2, min_ms=5.0):
+    """Join two result frames and flag regressions
+
+    Args:
+        base, head: Result frames from load_results
+        metric: Latency column to compare
+        threshold: Head/base ratio above which a case is a regression
+        min_ms: Ignore latency changes smaller than this (timer noise)
+    """
+    columns = KEY_COLUMNS + [metric, "QUERIES", "PEAK_PY_MB", "ERRORS"]
+    merged = base[columns].merge(
+        head[columns],
+        on=KEY_COLUMNS, how="outer", suffixes=("_BASE", "_HEAD")
+    )
+    merged["RATIO"] = (merged[f"{metric}_HEAD"] / merged[f"{metric}_BASE"]).round(2)
+    slower = (merged["RATIO"] > threshold) & (merged[f"{metric}_HEAD"] - merged[f"{metric}_BASE"] > min_ms)
+    more_queries = merged["QUERIES_HEAD"] > merged["QUERIES_BASE"]
+    new_errors = merged["ERRORS_HEAD"] > merged["ERRORS_BASE"]
+    merged["REGRESSION"] = slower | more_queries | new_errors
+    return merged.sort_values(KEY_COLUMNS).reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("base", help="Results of the baseline commit")
+    parser.add_argument("head", help="Results of the commit under test")
+    parser.add_argument("--metric", default="COLD_P50_MS", help="Latency column to compare")
+    parser.add_argument("--threshold", type=float, default=1.2, help="Slowdown ratio that counts as a regression")
+    parser.add_argument("--min-ms", type=float, default=5.0, help="Ignore latency changes smaller than this")
+    args = parser.parse_args()
+
+    base_meta, base = load_results(args.base)
+    head_meta, head = load_results(args.head)
+    merged = compare(base, head, args.metric, args.threshold, args.min_ms)
+
+    print(f"Base {base_meta['commit']} ({base_meta['timestamp']})  ->  head {head_meta['commit']} ({head_meta['timestamp']})")
+    with pd.option_context("display.max_rows", None, "display.width", 200, "display.max_colwidth", 60):
+        print(merged.to_string(index=False))
+
+    regressions = merged[merged["REGRESSION"]]
+    if not regressions.empty:
+        print(f"\n{len(regressions)} regression(s):")
+        print(regressions[KEY_COLUMNS].to_string(index=False))
+        sys.exit(1)
+    print("\nNo regressions")
+
+
+if __name__ == "__main__":
+    main()
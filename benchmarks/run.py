@@ -0,0 +1,501 @@
+# =============================================================================
+# SNOMED Cluster Manager - Benchmark Harness
+# =============================================================================
+#
+# Times every public function in the analytics, cluster and demographics
+# services and a full render of each page (through Streamlit's AppTest)
+# against synthetic local datasets at one or more scales.
+#
+#   python -m benchmarks.run --scales 1 10 --repeat 5
+#
+# Each case is run cold (query cache cleared first) and, where it reads
+# through the cache, warm. Results record latency percentiles, warehouse
+# query counts from the diagnostics query log, errors and the Python heap
+# peak (tracemalloc - DuckDB's native allocations are not included), and are
+# written as JSON for benchmarks.compare.
+
+import argparse
+import inspect
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from config import BACKEND_ENV_VAR, LOCAL_DATA_ENV_VAR, LOCAL_DATA_DIR, TERMINOLOGY_INDEX_ENV_VAR, TERMINOLOGY_INDEX_DIR
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_FILE = os.path.join(ROOT, "streamlit_app.py")
+SERVICE_MODULES = (
+    "services.analytics_service", "services.cluster_service", "services.demographics_service",
+    "services.overlap_service", "services.cohort_service"
+)
+
+DATA_ROOT = os.path.join(LOCAL_DATA_DIR, "benchmarks")
+RESULTS_DIR = "benchmark_results"
+DATASET_MARKER = "benchmark_dataset.json"
+PAGE_TIMEOUT_SECONDS = 600
+
+
+class Case:
+    """A benchmarked call
+
+    Args:
+        kind: 'service' or 'page'
+        name: Case name in the results
+        run: Timed callable - run() or, with a setup, run(state)
+        setup: Untimed callable returning the state passed to run
+        warm: Whether a second, warm-cache call is meaningful
+    """
+
+    def __init__(self, kind, name, run, setup=None, warm=True):
+        self.kind = kind
+        self.name = name
+        self.run = run
+        self.setup = setup
+        self.warm = warm
+
+
+# =============================================================================
+# DATASETS
+# =============================================================================
+
+def prepare_dataset(data_root, scale, seed):
+    """Generate the dataset for a scale unless a matching one already exists"""
+    from local_backend.generate import generate, generate_terminology_index
+
+    data_dir = os.path.join(data_root, f"scale_{scale:g}_seed_{seed}")
+    marker = os.path.join(data_dir, DATASET_MARKER)
+    if os.path.exists(marker):
+        with open(marker) as f:
+            if json.load(f) == {"scale": scale, "seed": seed}:
+                # Rebuilt every run (it takes a moment) so it matches the index format
+                generate_terminology_index(data_dir)
+                return data_dir
+    generate(data_dir, scale, seed)
+    with open(marker, "w") as f:
+        json.dump({"scale": scale, "seed": seed}, f)
+    return data_dir
+
+
+def use_dataset(data_dir):
+    """Point the app at a local dataset and drop anything cached from the last one"""
+    os.environ[BACKEND_ENV_VAR] = "local"
+    os.environ[LOCAL_DATA_ENV_VAR] = data_dir
+    from database import get_connection
+    get_connection.clear()
+    reset_caches()
+
+
+def with_terminology_index(func, *args):
+    """Call func with the current dataset's terminology index in use for ECL"""
+    previous = os.environ.get(TERMINOLOGY_INDEX_ENV_VAR)
+    os.environ[TERMINOLOGY_INDEX_ENV_VAR] = os.path.join(os.environ[LOCAL_DATA_ENV_VAR], TERMINOLOGY_INDEX_DIR)
+    try:
+        return func(*args)
+    finally:
+        if previous is None:
+            os.environ.pop(TERMINOLOGY_INDEX_ENV_VAR, None)
+        else:
+            os.environ[TERMINOLOGY_INDEX_ENV_VAR] = previous
+
+
+def reset_caches():
+    """Clear the query cache, the cluster catalogue and the query log"""
+    from services.cache_service import get_query_cache
+    from services.catalogue_service import get_cluster_catalogue
+    from services.diagnostics_service import get_query_log
+    get_query_cache().clear()
+    get_cluster_catalogue().clear()
+    get_query_log().clear()
+
+
+def sample_clusters():
+    """First observation and medication clusters in the dataset, with an ECL expression"""
+    from services.cluster_service import get_all_clusters
+
+    clusters = get_all_clusters()
+    if clusters.empty:
+        raise RuntimeError("Benchmark dataset has no clusters")
+    by_type = {}
+    for _, cluster in clusters.sort_values("CLUSTER_ID").iterrows():
+        by_type.setdefault(cluster["CLUSTER_TYPE"], cluster)
+    if "OBSERVATION" not in by_type or "MEDICATION" not in by_type:
+        raise RuntimeError("Benchmark dataset needs an OBSERVATION and a MEDICATION cluster")
+    return by_type["OBSERVATION"], by_type["MEDICATION"]
+
+
+# =============================================================================
+# CASES
+# =============================================================================
+
+def service_cases(observation, medication):
+    """One case per public service function (two for cluster-type-dependent ones)"""
+    from services import analytics_service as analytics
+    from services import cluster_service as clusters
+    from services import demographics_service as demographics
+    from services import overlap_service as overlap
+    from services import cohort_service as cohorts
+    from services import cube_service as cube
+
+    obs_id, med_id = observation["CLUSTER_ID"], medication["CLUSTER_ID"]
+    ecl = observation["ECL_EXPRESSION"]
+    cases = [
+        Case("service", "analytics.get_observation_analytics", lambda: analytics.get_observation_analytics(obs_id)),
+        Case("service", "analytics.get_distinct_persons_obs", lambda: analytics.get_distinct_persons_obs(obs_id)),
+        Case("service", "analytics.get_observation_time_series", lambda: analytics.get_observation_time_series(obs_id)),
+        Case("service", "analytics.get_medication_analytics", lambda: analytics.get_medication_analytics(med_id)),
+        Case("service", "analytics.get_distinct_persons_med", lambda: analytics.get_distinct_persons_med(med_id)),
+        Case("service", "analytics.get_medication_time_series", lambda: analytics.get_medication_time_series(med_id)),
+    ]
+    for cluster_id, cluster_type in ((obs_id, "OBSERVATION"), (med_id, "MEDICATION")):
+        for name in ("get_cluster_usage", "get_cluster_equity", "get_cluster_demographics", "get_cluster_age_sex_distribution",
+                     "get_cluster_care_team_analysis", "get_cluster_standardized_rates",
+                     "get_cluster_ethnicity_analysis", "get_cluster_deprivation_analysis",
+                     "get_cluster_language_analysis", "get_cluster_neighbourhood_analysis"):
+            func = getattr(analytics, name)
+            cases.append(Case("service", f"analytics.{name}[{cluster_type}]",
+                              lambda func=func, cluster_id=cluster_id, cluster_type=cluster_type:
+                              func(cluster_id, cluster_type)))
+        # Fast mode: estimated usage plus the practice sketches the organisation tab rolls up
+        cases += [
+            Case("service", f"analytics.get_cluster_usage[{cluster_type},fast]",
+                 lambda cluster_id=cluster_id, cluster_type=cluster_type:
+                 analytics.get_cluster_usage(cluster_id, cluster_type, True)),
+            Case("service", f"cube.get_practice_sketches[{cluster_type}]",
+                 lambda cluster_id=cluster_id, cluster_type=cluster_type:
+                 cube.get_practice_sketches(cluster_id, cluster_type)),
+            # Progressive mode's provisional counts
+            Case("service", f"analytics.get_cluster_usage_sample[{cluster_type}]",
+                 lambda cluster_id=cluster_id, cluster_type=cluster_type:
+                 analytics.get_cluster_usage_sample(cluster_id, cluster_type)),
+        ]
+
+    cases += [
+        Case("service", "analytics.get_clusters_usage", analytics.get_clusters_usage),
+        Case("service", "cluster.get_all_clusters", clusters.get_all_clusters),
+        Case("service", "cluster.test_ecl_expression", lambda: clusters.test_ecl_expression(ecl)),
+        Case("service", "cluster.preview_ecl_expression", lambda: clusters.preview_ecl_expression(ecl)),
+        Case("service", "cluster.export_ecl_expression_csv", lambda: clusters.export_ecl_expression_csv(ecl), warm=False),
+        # Expanded in-process from the dataset's terminology index
+        Case("service", "cluster.local_ecl_available", lambda: with_terminology_index(clusters.local_ecl_available)),
+        Case("service", "cluster.test_ecl_expression[index]",
+             lambda: with_terminology_index(clusters.test_ecl_expression, ecl)),
+        Case("service", "cluster.preview_ecl_expression[index]",
+             lambda: with_terminology_index(clusters.preview_ecl_expression, ecl)),
+        Case("service", "cluster.export_ecl_expression_csv[index]",
+             lambda: with_terminology_index(clusters.export_ecl_expression_csv, ecl), warm=False),
+        Case("service", "cluster.get_cluster_cache", lambda: clusters.get_cluster_cache(obs_id)),
+        Case("service", "cluster.get_cluster_change_history", lambda: clusters.get_cluster_change_history(obs_id)),
+        Case("service", "cluster.get_cluster_change_summary", lambda: clusters.get_cluster_change_summary(obs_id)),
+        Case("service", "cluster.get_recent_cluster_changes", clusters.get_recent_cluster_changes),
+        Case("service", "cluster.cluster_matches_expected",
+             lambda: clusters.cluster_matches_expected(obs_id, ecl, observation["DESCRIPTION"]), warm=False),
+        Case("service", "cluster.refresh_cluster", lambda: clusters.refresh_cluster(obs_id, force=True), warm=False),
+    ]
+
+    # Cluster lifecycle on scratch IDs - every case runs the same number of
+    # times, so the Nth update/rename/delete acts on the Nth created cluster
+    created, updated, renamed, deleted = (itertools.count() for _ in range(4))
+
+    def rename(n):
+        return clusters.rename_cluster(f"BENCHMARK_{n}", f"BENCHMARK_{n}_RENAMED", ecl, "Benchmark cluster (updated)")
+
+    cases += [
+        Case("service", "cluster.create_new_cluster",
+             lambda: clusters.create_new_cluster(f"BENCHMARK_{next(created)}", ecl, "Benchmark cluster"), warm=False),
+        Case("service", "cluster.update_existing_cluster",
+             lambda: clusters.update_existing_cluster(f"BENCHMARK_{next(updated)}", ecl, "Benchmark cluster (updated)"),
+             warm=False),
+        Case("service", "cluster.rename_cluster", lambda: rename(next(renamed)), warm=False),
+        Case("service", "cluster.delete_cluster",
+             lambda: clusters.delete_cluster(f"BENCHMARK_{next(deleted)}_RENAMED"), warm=False),
+    ]
+
+    cases += [
+        Case("service", "demographics.get_demographics_summary", demographics.get_demographics_summary),
+        Case("service", "demographics.get_system_age_sex_distribution", demographics.get_system_age_sex_distribution),
+    ]
+    for level in ("Practice", "PCN"):
+        cases += [
+            Case("service", f"demographics.get_demographics_by_care_team[{level}]",
+                 lambda level=level: demographics.get_demographics_by_care_team(level)),
+            Case("service", f"demographics.get_care_team_summary[{level}]",
+                 lambda level=level: demographics.get_care_team_summary(level)),
+        ]
+    for column in ("ETHNICITY_SUBCATEGORY", "IMD_DECILE_19", "NEIGHBOURHOOD_REGISTERED"):
+        cases.append(Case("service", f"demographics.get_active_population[{column}]",
+                          lambda column=column: demographics.get_active_population(column)))
+
+    cases += [
+        Case("service", "overlap.get_overlap_index", overlap.get_overlap_index),
+        Case("service", "overlap.get_similar_clusters", lambda: overlap.get_similar_clusters(obs_id)),
+        Case("service", "overlap.get_overlapping_clusters", overlap.get_overlapping_clusters),
+        Case("service", "cohort.get_person_dictionary", cohorts.get_person_dictionary),
+        Case("service", "cohort.get_cluster_cohort", lambda: cohorts.get_cluster_cohort(obs_id, 'OBSERVATION')),
+        Case("service", "cohort.build_cohort", lambda: cohorts.build_cohort([obs_id], none_of=[med_id])),
+        Case("service", "cohort.get_cohort_overlap", lambda: cohorts.get_cohort_overlap([obs_id, med_id])),
+    ]
+    return cases
+
+
+def _app(session_state):
+    """An AppTest of the app with session state preset"""
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP_FILE, default_timeout=PAGE_TIMEOUT_SECONDS)
+    for key, value in session_state.items():
+        at.session_state[key] = value
+    return at
+
+
+def _click(at, label):
+    """Click a button by label and rerun"""
+    next(button for button in at.button if button.label == label).click()
+    return at.run()
+
+
+def page_cases(observation, medication):
+    """One case per page render, and one per analytics tab for each cluster type"""
+    from page_modules.analytics import ANALYTICS_TABS
+
+    obs_id = observation["CLUSTER_ID"]
+
+    def render(page, **state):
+        return Case("page", page, lambda at: at.run(),
+                    setup=lambda: _app({"page": page, "selected_cluster": None, **state}))
+
+    cases = [
+        render("home"),
+        render("details", selected_cluster=obs_id),
+        render("edit", selected_cluster=obs_id),
+        render("create"),
+        render("demographics"),
+        render("portfolio"),
+        render("diagnostics"),
+    ]
+    for cluster in (observation, medication):
+        for label, _ in ANALYTICS_TABS[cluster["CLUSTER_TYPE"]]:
+            case = render("analytics", selected_cluster=cluster["CLUSTER_ID"], analytics_tab=label)
+            case.name = f"analytics[{cluster['CLUSTER_TYPE']}]/{label.split(' ', 1)[-1]}"
+            cases.append(case)
+
+    # Playground: test the observation cluster's expression
+    cases.append(Case(
+        "page", "playground/test", lambda at: _click(at, "🔍 Test Expression"),
+        setup=lambda: _app({"page": "playground", "selected_cluster": None,
+                            "ecl_test_expr": observation["ECL_EXPRESSION"]}).run()
+    ))
+    return cases
+
+
+def uncovered_functions(cases):
+    """Public service functions without a benchmark case"""
+    covered = {case.name.split("[")[0] for case in cases if case.kind == "service"}
+    missing = []
+    for module_name in SERVICE_MODULES:
+        module = sys.modules[module_name]
+        prefix = module_name.split(".")[-1].replace("_service", "")
+        for name, func in inspect.getmembers(module, inspect.isfunction):
+            # Derivations over already loaded metrics or sketches run no queries
+            params = list(inspect.signature(func).parameters)
+            if params[:1] in (["metrics"], ["sketches"]):
+                continue
+            if func.__module__ == module_name and not name.startswith("_") and f"{prefix}.{name}" not in covered:
+                missing.append(f"{prefix}.{name}")
+    return missing
+
+
+# =============================================================================
+# MEASUREMENT
+# =============================================================================
+
+def _failures(result):
+    """Exceptions and st.error messages from a page render"""
+    from streamlit.testing.v1 import AppTest
+
+    if not isinstance(result, AppTest):
+        return []
+    return [str(e.value) for e in result.exception] + [str(e.value) for e in result.error]
+
+
+def _is_empty(result):
+    """Services return an empty frame (or False) when a query fails"""
+    if isinstance(result, tuple):
+        result = result[0]
+    if isinstance(result, pd.DataFrame):
+        return result.empty
+    return result is None or result is False or result == ""
+
+
+def _call(case, state):
+    """Run a case's timed callable, returning (result, wall ms)"""
+    started = time.perf_counter()
+    result = case.run(state) if case.setup else case.run()
+    return result, (time.perf_counter() - started) * 1000
+
+
+def _percentiles(samples, prefix):
+    """Summary statistics of latency samples in ms"""
+    if not samples:
+        return {}
+    values = np.array(samples)
+    return {
+        f"{prefix}_P50_MS": round(float(np.percentile(values, 50)), 2),
+        f"{prefix}_P95_MS": round(float(np.percentile(values, 95)), 2),
+        f"{prefix}_MEAN_MS": round(float(values.mean()), 2),
+        f"{prefix}_MIN_MS": round(float(values.min()), 2),
+        f"{prefix}_MAX_MS": round(float(values.max()), 2),
+    }
+
+
+def measure(case, repeat):
+    """Time a case cold and warm, count its queries and record its Python heap peak"""
+    from services.diagnostics_service import get_query_log
+
+    log = get_query_log()
+    setup = case.setup or (lambda: None)
+
+    # Warm-up run absorbs imports and connection setup
+    _call(case, setup())
+
+    cold, warm, queries, warm_queries, failures = [], [], [], [], []
+    empty = False
+    for _ in range(repeat):
+        state = setup()
+        reset_caches()
+        result, elapsed = _call(case, state)
+        cold.append(elapsed)
+        records = log.queries()
+        queries.append(len(records))
+        if not records.empty:
+            failures += [str(error) for error in records["ERROR"].dropna()]
+        failures += _failures(result)
+        empty = empty or (case.kind == "service" and _is_empty(result))
+        if case.warm:
+            log.clear()
+            result, elapsed = _call(case, state)
+            warm.append(elapsed)
+            warm_queries.append(len(log.queries()))
+
+    state = setup()
+    reset_caches()
+    tracemalloc.start()
+    try:
+        _call(case, state)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "KIND": case.kind,
+        "NAME": case.name,
+        "REPEAT": repeat,
+        **_percentiles(cold, "COLD"),
+        **_percentiles(warm, "WARM"),
+        "QUERIES": int(np.median(queries)),
+        "WARM_QUERIES": int(np.median(warm_queries)) if warm_queries else None,
+        "PEAK_PY_MB": round(peak / 1024 ** 2, 2),
+        "EMPTY_RESULT": bool(empty),
+        "ERRORS": len(failures),
+        "FIRST_ERROR": failures[0][:500] if failures else None,
+    }
+
+
+# =============================================================================
+# RUNNER
+# =============================================================================
+
+def _git(*args):
+    """Output of a git command in the repository, or None"""
+    try:
+        return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(scales, seed, repeat, data_root, kinds, only=None, cube=True):
+    """Run every case at every scale, returning result rows
+
+    With cube, usage cubes are brought up to date (untimed) before each case,
+    as the scheduled job would keep them; without, analytics read the event tables.
+    """
+    from jobs.usage_cube import update_usage_cubes
+
+    results = []
+    for scale in scales:
+        data_dir = prepare_dataset(data_root, scale, seed)
+        use_dataset(data_dir)
+        observation, medication = sample_clusters()
+        cases = []
+        if "service" in kinds:
+            cases += service_cases(observation, medication)
+            for name in uncovered_functions(cases):
+                print(f"WARNING: no benchmark case for {name}", file=sys.stderr)
+        if "page" in kinds:
+            cases += page_cases(observation, medication)
+        if only:
+            cases = [case for case in cases if any(term in case.name for term in only)]
+
+        for case in cases:
+            if cube:
+                update_usage_cubes(log=lambda message: None)
+            started = time.perf_counter()
+            row = {"SCALE": scale, **measure(case, repeat)}
+            results.append(row)
+            print(f"[scale {scale:g}] {case.kind:<7} {case.name:<60} "
+                  f"cold p50 {row['COLD_P50_MS']:>9.1f} ms  queries {row['QUERIES']:>3}  "
+                  f"errors {row['ERRORS']}  ({time.perf_counter() - started:.1f}s)", flush=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark service functions and page renders on local data")
+    parser.add_argument("--scales", type=float, nargs="+", default=[1.0],
+                        help="Dataset scales to run (see local_backend.generate)")
+    parser.add_argument("--seed", type=int, default=42, help="Dataset seed")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per case")
+    parser.add_argument("--data-root", default=DATA_ROOT, help="Directory for the generated datasets")
+    parser.add_argument("--out", default=None, help=f"Results file (default {RESULTS_DIR}/<commit>.json)")
+    parser.add_argument("--only", nargs="+", default=None, help="Only run cases whose name contains one of these")
+    parser.add_argument("--no-pages", action="store_true", help="Skip page renders")
+    parser.add_argument("--no-services", action="store_true", help="Skip service functions")
+    parser.add_argument("--no-cube", action="store_true", help="Don't build usage cubes - analytics read the event tables")
+    args = parser.parse_args()
+
+    # Bare-mode and deprecation warnings would drown the progress output; set
+    # the option too, as Streamlit re-applies it when the config is parsed
+    from streamlit import config as streamlit_config
+    from streamlit.logger import set_log_level
+    streamlit_config.set_option("logger.level", "critical")
+    set_log_level("critical")
+
+    kinds = {"service", "page"} - ({"page"} if args.no_pages else set()) - ({"service"} if args.no_services else set())
+    commit = _git("rev-parse", "--short", "HEAD")
+    results = run_benchmarks(args.scales, args.seed, args.repeat, args.data_root, kinds, args.only,
+                             not args.no_cube)
+
+    out = args.out or os.path.join(RESULTS_DIR, f"{commit or 'unknown'}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w") as f:
+        json.dump({
+            "commit": commit,
+            "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "results": results
+        }, f, indent=2)
+    print(f"Results written to {out}")
+
+
+if __name__ == "__main__":
+    main()
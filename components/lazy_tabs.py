@@ -0,0 +1,45 @@
+# =============================================================================
+# SNOMED Cluster Manager - Lazy Tab Components
+# =============================================================================
+#
+# st.tabs executes the body of every tab on every rerun. These helpers render
+# a tab bar whose selection decides which section body runs, and keep each
+# section's loaded data in session state for later reruns.
+
+import pandas as pd
+import streamlit as st
+
+
+def render_lazy_tabs(labels, key):
+    """Render a tab bar and return the selected label - only that section should run"""
+    # Drop a remembered selection that isn't offered here (e.g. other cluster type)
+    if key in st.session_state and st.session_state[key] not in labels:
+        del st.session_state[key]
+    return st.radio(
+        "Section",
+        options=labels,
+        horizontal=True,
+        key=key,
+        label_visibility="collapsed"
+    )
+
+
+def reset_section_results(scope):
+    """Start a new section result store when the scope (e.g. cluster + refresh) changes"""
+    state = st.session_state.get("section_results")
+    if state is None or state["scope"] != scope:
+        st.session_state["section_results"] = {"scope": scope, "results": {}}
+
+
+def load_section_data(name, loader):
+    """Load section data once per scope and reuse it on later reruns"""
+    if "section_results" not in st.session_state:
+        reset_section_results(None)
+    results = st.session_state["section_results"]["results"]
+    if name in results:
+        return results[name]
+    data = loader()
+    # Services return empty frames/dicts on error - retry those on the next view
+    if not ((isinstance(data, pd.DataFrame) and data.empty) or (isinstance(data, dict) and not data)):
+        results[name] = data
+    return data
@@ -2,8 +2,9 @@
 # SNOMED Cluster Manager - Configuration & Constants
 # =============================================================================
 
-# Labels
-STALE_LABEL = "Stale (>28 days)"
+# Cluster status
+STALE_AFTER_DAYS = 28
+STALE_LABEL = f"Stale (>{STALE_AFTER_DAYS} days)"
 
 # Database configuration
 DB_SCHEMA = "DATA_LAKE__NCL.TERMINOLOGY"
@@ -11,6 +12,76 @@ DB_ANALYTICS = "REPORTING"
 DB_STORE = "DATA_LAKE.OLIDS"
 DB_DEMOGRAPHICS = "REPORTING.OLIDS_PERSON_DEMOGRAPHICS"
 
+# Local development backend - set SNOMED_CLUSTER_BACKEND=local to run against
+# DuckDB files in LOCAL_DATA_DIR (or SNOMED_CLUSTER_LOCAL_DATA) instead of Snowflake
+BACKEND_ENV_VAR = "SNOMED_CLUSTER_BACKEND"
+LOCAL_DATA_ENV_VAR = "SNOMED_CLUSTER_LOCAL_DATA"
+LOCAL_DATA_DIR = "local_data"
+
+# Local SNOMED CT index (terminology/build.py) built from RF2 snapshots - set
+# SNOMED_CLUSTER_TERMINOLOGY_INDEX to use one outside TERMINOLOGY_INDEX_DIR
+TERMINOLOGY_INDEX_ENV_VAR = "SNOMED_CLUSTER_TERMINOLOGY_INDEX"
+TERMINOLOGY_INDEX_DIR = "terminology_index"
+
+# Language reference sets whose preferred synonym is a concept's term, in order
+# of preference (UK clinical, UK drug, GB English) - the FSN is used without one
+TERMINOLOGY_LANGUAGE_REFSETS = ('999001261000000100', '999000691000001104', '900000000000508004')
+
+# Code system of codes expanded from the local index, as ECL_DETAILS returns it
+SNOMED_SYSTEM = "http://snomed.info/sct"
+
+# Query result cache
+CACHE_TTL_SECONDS = 3600
+CACHE_MAX_ENTRIES = 512
+REFRESH_TOKEN_TTL_SECONDS = 60
+
+# Active-population denominators (services/denominator_service.py) - the person
+# dimension is reloaded overnight, so one scan serves every rate for hours
+DENOMINATOR_TTL_SECONDS = 6 * 3600
+
+# Cluster catalogue - seconds between delta syncs of the cluster list
+CATALOGUE_SYNC_SECONDS = 60
+
+# Each delta sync re-reads changes this far behind its watermark - a row whose
+# timestamp was set before a sync but committed after it is caught next time
+CATALOGUE_SYNC_OVERLAP_SECONDS = 300
+
+# Read queries see CURRENT_DATE()/CURRENT_TIMESTAMP() as a literal fixed for
+# this many seconds, so repeats within the window are warehouse result-cache hits
+QUERY_CLOCK_SECONDS = 3600
+
+# Timezone of the warehouse session - CURRENT_DATE() is the date there
+WAREHOUSE_TIMEZONE = "Europe/London"
+
+# Usage cube (jobs/usage_cube.py) - analytics read a cluster's cube only while it
+# matches the cluster's code set and was updated within USAGE_CUBE_MAX_AGE_HOURS.
+# The job updates cubes incrementally and rebuilds them from scratch every
+# USAGE_CUBE_FULL_REBUILD_DAYS, as cells keep the person attributes (age,
+# practice, active status) of when they were written
+USAGE_CUBE_MAX_AGE_HOURS = 48
+USAGE_CUBE_FULL_REBUILD_DAYS = 7
+
+# Similar clusters (services/overlap_service.py) - clusters listed on the details
+# page share at least this Jaccard overlap of codes, or contain one another
+SIMILAR_MIN_JACCARD = 0.5
+SIMILAR_CLUSTERS_LIMIT = 10
+
+# Rows fetched when previewing large results (the total is counted separately)
+ECL_PREVIEW_ROWS = 1000
+
+# Query diagnostics (hidden page: ?page=diagnostics)
+DIAGNOSTICS_MAX_QUERIES = 2000
+
+# Background query jobs (services/dispatch_service.py) - concurrent warehouse queries
+MAX_QUERY_WORKERS = 4
+
+# Progressive analytics - provisional counts are scaled up from this percentage
+# of patients (chosen by a hash of the person ID, so the same patients every
+# time) while the exact query runs in the background; the page checks on it
+# every PROGRESSIVE_POLL_SECONDS
+PROVISIONAL_SAMPLE_PERCENT = 5
+PROGRESSIVE_POLL_SECONDS = 0.5
+
 # Role and warehouse
 ROLE = "ISL-USERGROUP-SECONDEES-NCL"
 WAREHOUSE = "WH_NCL_ENGINEERING_XS"
@@ -29,6 +100,21 @@ CLUSTER_TYPE_DISPLAY = {
     'MEDICATION': '[medication]'
 }
 
+# Organisational aggregation levels -> demographics column
+ORG_LEVEL_COLUMNS = {
+    'Practice': 'PRACTICE_NAME',
+    'PCN': 'PCN_NAME',
+    'Borough': 'BOROUGH_REGISTERED',
+    'Neighbourhood': 'NEIGHBOURHOOD_REGISTERED'
+}
+
+# Analytics metrics
+SEX_MALE = 'Male'
+SEX_FEMALE = 'Female'
+TIME_SERIES_MONTHS = 60
+USAGE_TREND_MONTHS = 12  # Trend on the home list and portfolio page
+RECENT_DAYS = 30
+
 # Status emojis
 STATUS_EMOJI = {
     'error': '❌',
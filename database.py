@@ -2,13 +2,42 @@
 # SNOMED Cluster Manager - Database Connection Management
 # =============================================================================
 
+import io
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
 import streamlit as st
-from config import ROLE, WAREHOUSE
+from config import (
+    ROLE, WAREHOUSE, BACKEND_ENV_VAR, LOCAL_DATA_ENV_VAR, LOCAL_DATA_DIR, QUERY_CLOCK_SECONDS, WAREHOUSE_TIMEZONE
+)
+from services.diagnostics_service import timed_fetch, record_query
+
+# Column added by fetch_head to carry the full result size
+TOTAL_ROWS_COLUMN = "FETCH_TOTAL_ROWS"
+
+# Clock functions resolved client-side for read queries
+_CLOCK_FUNCTIONS = re.compile(r"\b(CURRENT_DATE|CURRENT_TIMESTAMP)\s*\(\s*\)", re.IGNORECASE)
+
+# Warehouse query each thread is waiting on, and threads whose queries were cancelled
+_running_queries = {}
+_cancelled_threads = set()
+_running_lock = threading.Lock()
+
+
+class QueryCancelled(Exception):
+    """Raised for queries of a thread whose queries were cancelled"""
 
 
 @st.cache_resource
 def get_connection():
     """Get Snowflake session for Snowflake Streamlit environment"""
+    if os.environ.get(BACKEND_ENV_VAR, "").lower() == "local":
+        from local_backend.session import LocalSession
+        return LocalSession(os.environ.get(LOCAL_DATA_ENV_VAR, LOCAL_DATA_DIR))
     from snowflake.snowpark.context import get_active_session
     return get_active_session()
 
@@ -18,4 +47,168 @@ def rerun():
     if hasattr(st, 'rerun'):
         st.rerun()
     else:
-        st.experimental_rerun()
\ No newline at end of file
+        st.experimental_rerun()
+
+
+def get_query_param(name):
+    """Read a URL query parameter across Streamlit versions"""
+    if hasattr(st, 'query_params'):
+        return st.query_params.get(name)
+    values = st.experimental_get_query_params().get(name)
+    return values[0] if values else None
+
+
+# =============================================================================
+# Fetch modes
+# =============================================================================
+#
+# Every fetch takes fixed statement text with `?` placeholders plus a params
+# list. Values are bound, never interpolated, so the same logical query sends
+# the same text for every cluster and user and can reuse the warehouse result
+# cache. Identifiers (tables, columns) can't be bound - services pick those
+# from whitelists.
+
+
+def query_clock():
+    """'Now' for read queries, in UTC - the start of the current QUERY_CLOCK_SECONDS window
+
+    UTC so the literals don't depend on the app server's local timezone.
+    """
+    now = time.time()
+    return datetime.fromtimestamp(now - now % QUERY_CLOCK_SECONDS, tz=timezone.utc)
+
+
+def resolve_clock(query):
+    """Replace CURRENT_DATE()/CURRENT_TIMESTAMP() with literals for the current clock window
+
+    The warehouse never serves statements calling these functions from its
+    result cache; with literals, repeats within the window are cache hits.
+    CURRENT_DATE() is the date in WAREHOUSE_TIMEZONE, as the warehouse would
+    give it; CURRENT_TIMESTAMP() is the window's start in UTC.
+    """
+    now = query_clock()
+    today = now.astimezone(ZoneInfo(WAREHOUSE_TIMEZONE)).date()
+
+    def literal(match):
+        if match.group(1).upper() == 'CURRENT_DATE':
+            return f"DATE '{today:%Y-%m-%d}'"
+        return f"TIMESTAMP '{now:%Y-%m-%d %H:%M:%S}'"
+    return _CLOCK_FUNCTIONS.sub(literal, query)
+
+
+def _sql(query, params=None):
+    """Create a Snowpark DataFrame for a statement with bound parameters"""
+    if params is None:
+        return get_connection().sql(query)
+    return get_connection().sql(query, params=list(params))
+
+
+def _collect(result, method):
+    """Run a Snowpark DataFrame asynchronously to learn its query ID, returning (result, sfqid)"""
+    thread_id = threading.get_ident()
+    if thread_id in _cancelled_threads:
+        raise QueryCancelled("Query cancelled")
+    try:
+        job = getattr(result, method)(block=False)
+    except TypeError:
+        # Connections without async support (e.g. the local backend)
+        return getattr(result, method)(), None
+    with _running_lock:
+        _running_queries[thread_id] = job
+        cancelled = thread_id in _cancelled_threads
+    try:
+        if cancelled:
+            job.cancel()
+        return job.result(), getattr(job, 'query_id', None)
+    finally:
+        with _running_lock:
+            _running_queries.pop(thread_id, None)
+
+
+def cancel_thread_queries(thread_id):
+    """Cancel the query a thread is waiting on and fail its later ones with QueryCancelled
+
+    Stays in force until resume_thread_queries - for threads running work the
+    user gave up on (e.g. a background exact count).
+    """
+    with _running_lock:
+        _cancelled_threads.add(thread_id)
+        job = _running_queries.get(thread_id)
+    if job is not None:
+        job.cancel()
+        return
+    # The local backend runs queries synchronously on a cursor per thread
+    interrupt = getattr(get_connection(), 'interrupt', None)
+    if interrupt is not None:
+        interrupt(thread_id)
+
+
+def resume_thread_queries(thread_id):
+    """Let a thread run queries again after cancel_thread_queries"""
+    with _running_lock:
+        _cancelled_threads.discard(thread_id)
+
+
+def _fetch_pandas(query, params, mode):
+    """Run a read query as pandas, recording it under a fetch mode"""
+    query = resolve_clock(query)
+    return timed_fetch(query, params, mode, lambda: _collect(_sql(query, params), 'to_pandas'))
+
+
+def fetch_pandas(query, params=None):
+    """Run a query and return the whole result as a pandas DataFrame"""
+    return _fetch_pandas(query, params, 'pandas')
+
+
+def fetch_batches(query, params=None):
+    """Run a query and yield the result as pandas DataFrames, one Arrow batch at a time"""
+    started = time.perf_counter()
+    rows = 0
+    result_bytes = 0
+    error = None
+    query = resolve_clock(query)
+    try:
+        result = _sql(query, params)
+        batches = result.to_pandas_batches() if hasattr(result, 'to_pandas_batches') else [result.to_pandas()]
+        for batch in batches:
+            rows += len(batch)
+            result_bytes += int(batch.memory_usage(index=False, deep=True).sum())
+            yield batch
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        record_query(query, params, 'batches', started, rows, result_bytes, error=error)
+
+
+def execute_statement(query, params=None):
+    """Run a statement (e.g. CALL, MERGE) and return its rows - clock functions are left as-is"""
+    return timed_fetch(query, params, 'statement', lambda: _collect(_sql(query, params), 'collect'))
+
+
+def fetch_head(query, limit, params=None):
+    """Run a query and return (first `limit` rows, total row count)
+
+    The count comes from a window over the full result, so only `limit` rows
+    are transferred however large the result is.
+    """
+    limit = max(1, int(limit))
+    df = _fetch_pandas(f"""
+        SELECT q.*, COUNT(*) OVER () AS {TOTAL_ROWS_COLUMN}
+        FROM ({query.strip().rstrip(';')}) q
+        LIMIT ?
+        """, list(params or []) + [limit], 'head')
+    if df.empty:
+        return df.drop(columns=[TOTAL_ROWS_COLUMN], errors='ignore'), 0
+    total = int(df[TOTAL_ROWS_COLUMN].iloc[0])
+    return df.drop(columns=[TOTAL_ROWS_COLUMN]), total
+
+
+def fetch_csv(query, params=None):
+    """Run a query and return it as CSV text, written batch by batch"""
+    buffer = io.StringIO()
+    header = True
+    for batch in fetch_batches(query, params):
+        batch.to_csv(buffer, index=False, header=header)
+        header = False
+    return buffer.getvalue()
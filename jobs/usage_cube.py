@@ -0,0 +1,102 @@
+# =============================================================================
+# SNOMED Cluster Manager - Usage Cube Job
+# =============================================================================
+#
+# Keeps ECL_USAGE_CUBE (services/cube_service.py) up to date and drops the
+# cubes of deleted clusters. Clusters without a cube, or whose last full build
+# is over USAGE_CUBE_FULL_REBUILD_DAYS old, are built from all their events.
+# The rest are updated incrementally, recomputing the months holding events
+# ingested since their watermark and the codes added or removed since their
+# code set, which costs a fraction of a full build. Clusters with nothing new
+# are skipped. Analytics stop reading a cube once the event table has rows
+# ingested past its watermark, so run it after each load:
+#
+#   python -m jobs.usage_cube                 # incremental where possible
+#   python -m jobs.usage_cube --full          # rebuild every refreshed cluster
+#   python -m jobs.usage_cube --cluster MY_CLUSTER
+#
+# It uses the app's connection: an active Snowpark session in Snowflake, or
+# the local DuckDB files with SNOMED_CLUSTER_BACKEND=local. Create the tables
+# in Snowflake with jobs/usage_cube.sql first.
+
+import argparse
+import sys
+import time
+
+import pandas as pd
+from services.cube_service import (
+    build_usage_cube, update_usage_cube, get_cube_clusters, get_events_through, recent_window_start,
+    drop_orphaned_cubes
+)
+from config import USAGE_CUBE_FULL_REBUILD_DAYS
+
+
+def _timestamp(value):
+    """Python datetime of a timestamp cell, or None"""
+    return None if pd.isna(value) else pd.Timestamp(value).to_pydatetime()
+
+
+def update_usage_cubes(cluster_ids=None, full=False, full_rebuild_days=USAGE_CUBE_FULL_REBUILD_DAYS, log=print):
+    """Build or incrementally update cubes, returning the IDs of clusters that failed
+
+    Args:
+        cluster_ids: Only consider these clusters
+        full: Rebuild every cube from scratch
+        full_rebuild_days: Age of a full build after which a cube is rebuilt
+        log: Progress callback taking a message
+    """
+    drop_orphaned_cubes()
+    clusters = get_cube_clusters(full_rebuild_days)
+    if cluster_ids:
+        wanted = {cluster_id.upper().strip() for cluster_id in cluster_ids}
+        clusters = clusters[clusters['CLUSTER_ID'].isin(wanted)]
+
+    # One watermark per event table, taken before any cube reads it
+    watermarks = {}
+    for cluster_type in clusters['CLUSTER_TYPE'].unique():
+        watermarks[cluster_type] = get_events_through(cluster_type)
+    recent_since = recent_window_start()
+
+    failed = []
+    for cluster in clusters.itertuples():
+        events_through = watermarks[cluster.CLUSTER_TYPE]
+        source_refresh = _timestamp(cluster.SOURCE_REFRESH)
+        previous_through = _timestamp(cluster.EVENTS_THROUGH)
+        rebuild = (full or cluster.FULL_REBUILD_DUE is not False
+                   or source_refresh is None or previous_through is None or events_through is None)
+        if (not rebuild and previous_through == events_through
+                and source_refresh == _timestamp(cluster.LAST_SUCCESSFUL_REFRESH)
+                and pd.Timestamp(cluster.RECENT_SINCE).date() == recent_since):
+            continue
+
+        started = time.perf_counter()
+        try:
+            if rebuild:
+                build_usage_cube(cluster.CLUSTER_ID, cluster.CLUSTER_TYPE, events_through)
+                log(f"{cluster.CLUSTER_ID}: built in {time.perf_counter() - started:.1f}s")
+            else:
+                update_usage_cube(cluster.CLUSTER_ID, cluster.CLUSTER_TYPE, source_refresh,
+                                  previous_through, events_through)
+                log(f"{cluster.CLUSTER_ID}: updated in {time.perf_counter() - started:.1f}s")
+        except Exception as e:
+            failed.append(cluster.CLUSTER_ID)
+            log(f"{cluster.CLUSTER_ID}: failed - {str(e)}")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and update the cluster usage cube")
+    parser.add_argument("--full", action="store_true", help="Rebuild every cube instead of updating incrementally")
+    parser.add_argument("--cluster", nargs="+", help="Only update these clusters")
+    parser.add_argument("--full-rebuild-days", type=float, default=USAGE_CUBE_FULL_REBUILD_DAYS,
+                        help="Age of a full build after which a cube is rebuilt")
+    args = parser.parse_args()
+
+    failed = update_usage_cubes(args.cluster, args.full, args.full_rebuild_days)
+    if failed:
+        print(f"{len(failed)} cube(s) failed: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
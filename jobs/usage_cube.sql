@@ -0,0 +1,44 @@
+-- =====================================================
+-- Usage cube tables for the SNOMED Cluster Manager
+-- =====================================================
+-- Run once before scheduling jobs/usage_cube.py. Until a cluster has a
+-- current cube the app reads the event tables as before.
+
+USE SCHEMA DATA_LAKE__NCL.TERMINOLOGY;
+
+-- One row per cluster, code, month, practice, age, sex and active status.
+-- Sketches are HLL_EXPORT(HLL_ACCUMULATE(person_id)) objects.
+CREATE TABLE IF NOT EXISTS ECL_USAGE_CUBE (
+    cluster_id VARCHAR,
+    code VARCHAR,
+    display VARCHAR,
+    month DATE,
+    is_active BOOLEAN,
+    practice_name VARCHAR,
+    pcn_name VARCHAR,
+    borough_registered VARCHAR,
+    neighbourhood_registered VARCHAR,
+    age INTEGER,
+    age_band_5y VARCHAR,
+    sex VARCHAR,
+    event_count NUMBER,
+    person_sketch OBJECT,
+    recent_person_sketch OBJECT
+)
+CLUSTER BY (cluster_id);
+
+-- What each cube is current to: the code set (ECL_CACHE_METADATA.last_successful_refresh),
+-- the recent window and the ingest watermark (event table lds_start_date_time), plus
+-- when it was last fully built and last updated
+CREATE TABLE IF NOT EXISTS ECL_USAGE_CUBE_METADATA (
+    cluster_id VARCHAR PRIMARY KEY,
+    source_refresh TIMESTAMP_NTZ,
+    recent_since DATE,
+    events_through TIMESTAMP_NTZ,
+    built_at TIMESTAMP_LTZ,
+    updated_at TIMESTAMP_LTZ
+);
+
+-- Cube tables created before incremental updates
+ALTER TABLE ECL_USAGE_CUBE_METADATA ADD COLUMN IF NOT EXISTS events_through TIMESTAMP_NTZ;
+ALTER TABLE ECL_USAGE_CUBE_METADATA ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP_LTZ;
@@ -0,0 +1,204 @@
+# =============================================================================
+# SNOMED Cluster Manager - Local ECL Stand-in
+# =============================================================================
+#
+# Evaluates the hierarchy subset of ECL (<<, <, >>, >, <!, >!, ^, *, AND, OR,
+# MINUS and parentheses) against the LOCAL_CONCEPT tables so ECL_DETAILS
+# works offline. Refinements and filters raise an error, as the terminology
+# server would for an expression it can't evaluate. build_local_index() turns
+# the same tables into a terminology index, to try local ECL expansion
+# (terminology/evaluate.py) without an RF2 release.
+
+import re
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+from terminology.build import FSN, INFERRED, IS_A, build_index
+
+_TERM = re.compile(r"\|[^|]*\|")
+_TOKEN = re.compile(r"<<|<!|<|>>|>!|>|\^|\(|\)|\*|\d+|AND\b|OR\b|MINUS\b|,", re.IGNORECASE)
+_CONSTRAINT_OPERATORS = {'<<', '<', '>>', '>', '<!', '>!', '^'}
+_BINARY_OPERATORS = {'AND', 'OR', 'MINUS', ','}
+
+
+class Hierarchy:
+    """Parent/child and reference set lookups over the local concept tables"""
+
+    def __init__(self, concepts, parents, refset_members):
+        self.concepts = concepts
+        self.active_codes = set(concepts.loc[concepts['ACTIVE'].fillna(True).astype(bool), 'CODE'])
+        self.children = defaultdict(set)
+        self.parents = defaultdict(set)
+        for code, parent in zip(parents['CODE'], parents['PARENT_CODE']):
+            self.children[parent].add(code)
+            self.parents[code].add(parent)
+        self.refsets = defaultdict(set)
+        for refset, code in zip(refset_members['REFSET_CODE'], refset_members['CODE']):
+            self.refsets[refset].add(code)
+
+    def _closure(self, codes, links):
+        """All codes reachable from a set through a link map"""
+        seen = set()
+        frontier = set(codes)
+        while frontier:
+            nxt = set()
+            for code in frontier:
+                nxt |= links.get(code, set())
+            frontier = nxt - seen
+            seen |= frontier
+        return seen
+
+    def apply(self, operator, codes):
+        """Apply a constraint operator to a set of focus codes"""
+        if operator is None:
+            return set(codes)
+        if operator == '<<':
+            return self._closure(codes, self.children) | set(codes)
+        if operator == '<':
+            return self._closure(codes, self.children)
+        if operator == '>>':
+            return self._closure(codes, self.parents) | set(codes)
+        if operator == '>':
+            return self._closure(codes, self.parents)
+        if operator == '<!':
+            return set().union(*(self.children.get(c, set()) for c in codes))
+        if operator == '>!':
+            return set().union(*(self.parents.get(c, set()) for c in codes))
+        # ^ reference set members
+        return set().union(*(self.refsets.get(c, set()) for c in codes))
+
+
+def _tokenize(ecl_expr):
+    """Split an ECL expression into tokens, rejecting unsupported syntax"""
+    text = _TERM.sub(" ", ecl_expr)
+    tokens = []
+    position = 0
+    while position < len(text):
+        if text[position].isspace():
+            position += 1
+            continue
+        match = _TOKEN.match(text, position)
+        if not match:
+            raise ValueError(f"ECL syntax not supported by the local stand-in near: {text[position:position + 20]!r}")
+        tokens.append(match.group(0).upper())
+        position = match.end()
+    return tokens
+
+
+class _Parser:
+    """Recursive descent over the tokens, evaluating as it goes"""
+
+    def __init__(self, tokens, hierarchy):
+        self.tokens = tokens
+        self.position = 0
+        self.hierarchy = hierarchy
+
+    def _peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def _take(self):
+        token = self._peek()
+        if token is None:
+            raise ValueError("Unexpected end of ECL expression")
+        self.position += 1
+        return token
+
+    def expression(self):
+        result = self.sub_expression()
+        while self._peek() in _BINARY_OPERATORS:
+            operator = self._take()
+            right = self.sub_expression()
+            if operator == 'MINUS':
+                result = result - right
+            elif operator == 'OR':
+                result = result | right
+            else:
+                result = result & right
+        return result
+
+    def sub_expression(self):
+        operator = self._take() if self._peek() in _CONSTRAINT_OPERATORS else None
+        token = self._take()
+        if token == '(':
+            focus = self.expression()
+            if self._take() != ')':
+                raise ValueError("Unbalanced parentheses in ECL expression")
+        elif token == '*':
+            focus = set(self.hierarchy.active_codes)
+        elif token.isdigit():
+            focus = {token}
+        else:
+            raise ValueError(f"Unexpected token in ECL expression: {token}")
+        return self.hierarchy.apply(operator, focus)
+
+    def parse(self):
+        result = self.expression()
+        if self._peek() is not None:
+            raise ValueError(f"ECL syntax not supported by the local stand-in: {self._peek()}")
+        return result
+
+
+def load_hierarchy(con):
+    """Load the local concept tables into a Hierarchy"""
+    prefix = "DATA_LAKE__NCL.TERMINOLOGY"
+    concepts = con.execute(f"SELECT code, display, system, active FROM {prefix}.LOCAL_CONCEPT").df()
+    parents = con.execute(f"SELECT code, parent_code FROM {prefix}.LOCAL_CONCEPT_PARENT").df()
+    members = con.execute(f"SELECT refset_code, code FROM {prefix}.LOCAL_REFSET_MEMBER").df()
+    for frame in (concepts, parents, members):
+        frame.columns = [c.upper() for c in frame.columns]
+    return Hierarchy(concepts, parents, members)
+
+
+def evaluate_ecl(con, ecl_expr, max_codes=None):
+    """Evaluate an ECL expression, returning CODE/DISPLAY/SYSTEM for active concepts"""
+    hierarchy = load_hierarchy(con)
+    codes = _Parser(_tokenize(ecl_expr), hierarchy).parse() & hierarchy.active_codes
+    if max_codes is not None and len(codes) > max_codes:
+        raise ValueError(f"ECL expression returned {len(codes):,} codes, more than the {max_codes:,} allowed")
+    result = hierarchy.concepts[hierarchy.concepts['CODE'].isin(codes)][['CODE', 'DISPLAY', 'SYSTEM']]
+    return result.sort_values('CODE').reset_index(drop=True)
+
+
+def build_local_index(con, out_dir):
+    """Write a terminology index of the local concept tables and return it opened
+
+    The tables hold IS-A parents, reference set members and one display per
+    concept, so the index has no attribute relationships.
+    """
+    hierarchy = load_hierarchy(con)
+    concepts = hierarchy.concepts
+    concept_ids = concepts['CODE'].astype(np.int64)
+    parents = con.execute("SELECT code, parent_code FROM DATA_LAKE__NCL.TERMINOLOGY.LOCAL_CONCEPT_PARENT").df()
+    members = con.execute("SELECT refset_code, code FROM DATA_LAKE__NCL.TERMINOLOGY.LOCAL_REFSET_MEMBER").df()
+    frames = {
+        'concepts': pd.DataFrame({'id': concept_ids, 'active': concepts['ACTIVE'].fillna(True).astype(bool)}),
+        'relationships': pd.DataFrame({
+            'active': True,
+            'sourceId': parents['code'].astype(np.int64),
+            'destinationId': parents['parent_code'].astype(np.int64),
+            'relationshipGroup': 0,
+            'typeId': IS_A,
+            'characteristicTypeId': INFERRED,
+        }),
+        # Displays stand in for fully specified names
+        'descriptions': pd.DataFrame({
+            'id': np.arange(len(concepts), dtype=np.int64),
+            'active': True,
+            'conceptId': concept_ids,
+            'typeId': FSN,
+            'term': concepts['DISPLAY'].fillna(''),
+        }),
+        'language': pd.DataFrame({
+            'active': pd.Series(dtype=bool),
+            'refsetId': pd.Series(dtype=np.int64),
+            'referencedComponentId': pd.Series(dtype=np.int64),
+            'acceptabilityId': pd.Series(dtype=np.int64),
+        }),
+        'refset_members': pd.DataFrame({
+            'active': True,
+            'refsetId': members['refset_code'].astype(np.int64),
+            'referencedComponentId': members['code'].astype(np.int64),
+        }),
+    }
+    return build_index(out_dir, **frames, sources=['LOCAL_CONCEPT'])
@@ -0,0 +1,356 @@
+# =============================================================================
+# SNOMED Cluster Manager - Synthetic Data Generator
+# =============================================================================
+#
+# Writes seeded synthetic OLIDS, demographics, terminology and ECL cluster data
+# into the local backend's DuckDB files. All randomness comes from hashing
+# (seed, row id, salt) inside DuckDB, so output is identical for a seed
+# regardless of thread count, and 100M-row tables are built in SQL without
+# passing through Python. Event dates count back from the day of generation,
+# so recent-activity metrics stay populated; runs on different days shift
+# every date by the days between them.
+#
+#   python -m local_backend.generate --scale 1 --out local_data
+#
+# Scale 1 is 10,000 persons and ~1M observations; scale 100 (1M persons,
+# ~100M observations, ~170 practices) approximates production.
+
+import argparse
+import os
+import time
+
+import duckdb
+from config import LOCAL_DATA_ENV_VAR, LOCAL_DATA_DIR, TERMINOLOGY_INDEX_DIR, SNOMED_SYSTEM
+from local_backend.ecl import build_local_index
+from local_backend.procedures import refresh_ecl_cluster
+from local_backend.schema import LOCAL_CATALOGS, TABLES, create_schema
+
+# Rows per unit of scale
+PERSONS_PER_SCALE = 10_000
+OBSERVATIONS_PER_PERSON = 100
+MEDICATIONS_PER_PERSON = 30
+PERSONS_PER_PRACTICE = 6_000
+PRACTICES_PER_PCN = 6
+MIN_PRACTICES = 20
+
+# Terminology size (independent of scale)
+OBSERVATION_CONCEPTS = 20_000
+MEDICATION_CONCEPTS = 8_000
+SAMPLE_CLUSTERS = 24
+
+# Years of event history
+HISTORY_DAYS = 3_650
+
+ROOT_CONCEPT = '138875005'
+FINDING_ROOT = '404684003'
+PRODUCT_ROOT = '373873005'
+
+BOROUGHS = [
+    # (name, typical IMD decile)
+    ('Barnet', 6), ('Camden', 5), ('Enfield', 4), ('Haringey', 3), ('Islington', 3)
+]
+
+SEX_WEIGHTS = [('Female', 0.51), ('Male', 0.49)]
+
+# (category, subcategory, weight) - approximate North Central London census mix
+ETHNICITY_WEIGHTS = [
+    ('White', 'White: British', 0.40),
+    ('White', 'White: Other White', 0.17),
+    ('White', 'White: Irish', 0.02),
+    ('Asian', 'Asian: Indian', 0.04),
+    ('Asian', 'Asian: Bangladeshi', 0.03),
+    ('Asian', 'Asian: Pakistani', 0.01),
+    ('Asian', 'Asian: Chinese', 0.02),
+    ('Asian', 'Asian: Other Asian', 0.04),
+    ('Black', 'Black: African', 0.06),
+    ('Black', 'Black: Caribbean', 0.03),
+    ('Black', 'Black: Other Black', 0.02),
+    ('Mixed', 'Mixed: White and Black Caribbean', 0.02),
+    ('Mixed', 'Mixed: Other Mixed', 0.03),
+    ('Other', 'Other: Any other ethnic group', 0.06),
+    (None, None, 0.05)
+]
+
+# (language, weight); English speakers never need an interpreter
+LANGUAGE_WEIGHTS = [
+    ('English', 0.80), ('Turkish', 0.03), ('Polish', 0.02), ('Bengali', 0.02),
+    ('Somali', 0.02), ('Portuguese', 0.02), ('Spanish', 0.02), ('Greek', 0.02),
+    ('Arabic', 0.02), ('Albanian', 0.01), ('Romanian', 0.02)
+]
+
+
+def _uniform(seed, key, salt):
+    """SQL expression for a uniform [0, 1) value from hashing (seed, key, salt)"""
+    return f"((hash({key}, {seed}, {salt}) % 1000000007) / 1000000007.0)"
+
+
+def _weighted_case(u, choices):
+    """SQL CASE picking a value by cumulative weight; choices are (sql_literal, weight)"""
+    total = sum(weight for _, weight in choices)
+    clauses = []
+    cumulative = 0.0
+    for value, weight in choices[:-1]:
+        cumulative += weight / total
+        clauses.append(f"WHEN {u} < {cumulative:.6f} THEN {value}")
+    return f"CASE {' '.join(clauses)} ELSE {choices[-1][0]} END"
+
+
+def _literal(value):
+    """SQL literal for a Python string or None"""
+    return "NULL" if value is None else "'" + value.replace("'", "''") + "'"
+
+
+def _log(message, started):
+    print(f"[{time.perf_counter() - started:7.1f}s] {message}", flush=True)
+
+
+def _generate_terminology(con, seed):
+    """Two random-recursive concept trees (findings and products) under the SNOMED root"""
+    t = "DATA_LAKE__NCL.TERMINOLOGY"
+    con.execute(f"DELETE FROM {t}.LOCAL_CONCEPT")
+    con.execute(f"DELETE FROM {t}.LOCAL_CONCEPT_PARENT")
+    con.execute(f"DELETE FROM {t}.LOCAL_REFSET_MEMBER")
+    con.execute(f"""
+        INSERT INTO {t}.LOCAL_CONCEPT (code, display, system, active) VALUES
+            ('{ROOT_CONCEPT}', 'SNOMED CT Concept', '{SNOMED_SYSTEM}', true),
+            ('{FINDING_ROOT}', 'Clinical finding', '{SNOMED_SYSTEM}', true),
+            ('{PRODUCT_ROOT}', 'Pharmaceutical / biologic product', '{SNOMED_SYSTEM}', true)
+        """)
+    con.execute(f"""
+        INSERT INTO {t}.LOCAL_CONCEPT_PARENT VALUES
+            ('{FINDING_ROOT}', '{ROOT_CONCEPT}'), ('{PRODUCT_ROOT}', '{ROOT_CONCEPT}')
+        """)
+    # Concept i's parent is a uniformly chosen earlier concept in the same tree,
+    # giving a random recursive tree of logarithmic depth
+    for kind, root, count, offset, label in (
+        ('OBS', FINDING_ROOT, OBSERVATION_CONCEPTS, 1_000_000_000, 'Finding'),
+        ('MED', PRODUCT_ROOT, MEDICATION_CONCEPTS, 2_000_000_000, 'Product')
+    ):
+        u = _uniform(seed, 'range', f"'{kind}_parent'")
+        con.execute(f"""
+            INSERT INTO {t}.LOCAL_CONCEPT (code, display, system, active)
+            SELECT ({offset} + range)::VARCHAR, '{label} ' || range, '{SNOMED_SYSTEM}',
+                   {_uniform(seed, 'range', f"'{kind}_active'")} >= 0.02
+            FROM range(1, {count} + 1)
+            """)
+        con.execute(f"""
+            INSERT INTO {t}.LOCAL_CONCEPT_PARENT
+            SELECT ({offset} + range)::VARCHAR,
+                   CASE WHEN range = 1 THEN '{root}'
+                        ELSE ({offset} + 1 + floor({u} * (range - 1))::BIGINT)::VARCHAR END
+            FROM range(1, {count} + 1)
+            """)
+    # A few simple reference sets over random concepts
+    con.execute(f"""
+        INSERT INTO {t}.LOCAL_CONCEPT (code, display, system, active)
+        SELECT (999000000000 + range)::VARCHAR, 'Reference set ' || range, '{SNOMED_SYSTEM}', true
+        FROM range(1, 6)
+        """)
+    con.execute(f"""
+        INSERT INTO {t}.LOCAL_REFSET_MEMBER
+        SELECT (999000000000 + r.range)::VARCHAR, c.code
+        FROM range(1, 6) r
+        CROSS JOIN {t}.LOCAL_CONCEPT c
+        WHERE c.code NOT IN ('{ROOT_CONCEPT}', '{FINDING_ROOT}', '{PRODUCT_ROOT}')
+        AND {_uniform(seed, 'c.code', 'r.range')} < 0.01
+        """)
+
+
+def _generate_people(con, seed, scale):
+    """Practices, PCNs and the DIM_PERSON_DEMOGRAPHICS table"""
+    persons = max(1, int(PERSONS_PER_SCALE * scale))
+    practices = max(MIN_PRACTICES, persons // PERSONS_PER_PRACTICE)
+    pcns = max(2 * len(BOROUGHS), practices // PRACTICES_PER_PCN)
+    boroughs = ", ".join(f"('{name}', {decile})" for name, decile in BOROUGHS)
+
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE practice AS
+        WITH borough AS (
+            SELECT row_number() OVER () - 1 AS borough_idx, name, imd_base
+            FROM (VALUES {boroughs}) b(name, imd_base)
+        )
+        SELECT
+            p.range AS practice_idx,
+            'F' || lpad((80000 + p.range)::VARCHAR, 5, '0') AS practice_code,
+            'Practice ' || (p.range + 1) AS practice_name,
+            'U' || lpad((p.range % {pcns} + 1)::VARCHAR, 5, '0') AS pcn_code,
+            b.name || ' PCN ' || (p.range % {pcns} // {len(BOROUGHS)} + 1) AS pcn_name,
+            b.name AS borough,
+            b.name || ' Neighbourhood ' || (p.range % {pcns} // {len(BOROUGHS)} % 4 + 1) AS neighbourhood,
+            b.imd_base
+        FROM range({practices}) p
+        JOIN borough b ON b.borough_idx = (p.range % {pcns}) % {len(BOROUGHS)}
+        """)
+
+    sex = _weighted_case(_uniform(seed, 'range', "'sex'"), [(_literal(v), w) for v, w in SEX_WEIGHTS])
+    u_eth = _uniform(seed, 'range', "'ethnicity'")
+    ethnicity_category = _weighted_case(u_eth, [(_literal(c), w) for c, _, w in ETHNICITY_WEIGHTS])
+    ethnicity_subcategory = _weighted_case(u_eth, [(_literal(s), w) for _, s, w in ETHNICITY_WEIGHTS])
+    language = _weighted_case(_uniform(seed, 'range', "'language'"), [(_literal(v), w) for v, w in LANGUAGE_WEIGHTS])
+
+    con.execute(f"""
+        INSERT INTO REPORTING.OLIDS_PERSON_DEMOGRAPHICS.DIM_PERSON_DEMOGRAPHICS
+        WITH person AS (
+            SELECT
+                range AS person_id,
+                {_uniform(seed, 'range', "'active'")} < 0.92 AS is_active,
+                -- Right-skewed ages, capped at 100
+                LEAST(100, floor(100 * pow({_uniform(seed, 'range', "'age'")}, 1.25)))::INTEGER AS age,
+                {sex} AS sex,
+                -- Skewed list sizes: a few large practices, many small ones
+                floor(pow({_uniform(seed, 'range', "'practice'")}, 1.3) * {practices})::BIGINT AS practice_idx,
+                {ethnicity_category} AS ethnicity_category,
+                {ethnicity_subcategory} AS ethnicity_subcategory,
+                {language} AS main_language,
+                {_uniform(seed, 'range', "'imd'")} AS u_imd,
+                {_uniform(seed, 'range', "'interpreter'")} AS u_interpreter
+            FROM range({persons})
+        )
+        SELECT
+            p.person_id,
+            p.is_active,
+            p.age,
+            CASE WHEN p.age >= 85 THEN '85+'
+                 ELSE (p.age // 5 * 5) || '-' || (p.age // 5 * 5 + 4) END AS age_band_5y,
+            p.sex,
+            pr.practice_code,
+            pr.practice_name,
+            pr.pcn_code,
+            pr.pcn_name,
+            pr.borough AS borough_registered,
+            pr.neighbourhood AS neighbourhood_registered,
+            p.ethnicity_category,
+            p.ethnicity_subcategory,
+            -- IMD clusters around the borough's typical decile
+            GREATEST(1, LEAST(10, pr.imd_base + floor(p.u_imd * 5)::INTEGER - 2)) AS imd_decile_19,
+            (GREATEST(1, LEAST(10, pr.imd_base + floor(p.u_imd * 5)::INTEGER - 2)) + 1) // 2 AS imd_quintile_19,
+            'Spoken' AS language_type,
+            p.main_language,
+            p.main_language <> 'English' AND p.u_interpreter < 0.25 AS interpreter_needed
+        FROM person p
+        JOIN practice pr ON pr.practice_idx = p.practice_idx
+        """)
+    return persons
+
+
+def _generate_events(con, seed, table, persons, per_person, offset, concepts, salt):
+    """Event rows with Zipf-like code frequencies and recency-weighted dates"""
+    events = persons * per_person
+    u_code = _uniform(seed, 'range', f"'{salt}_code'")
+    u_person = _uniform(seed, 'range', f"'{salt}_person'")
+    u_date = _uniform(seed, 'range', f"'{salt}_date'")
+    u_lag = _uniform(seed, 'range', f"'{salt}_lag'")
+    # floor(N ** u) is log-uniform over 1..N, i.e. Zipf(1) code ranks; ranks are
+    # scattered over the tree by a hash so frequent codes aren't all near the root
+    code_rank = f"(floor(pow({concepts}, {u_code}))::BIGINT - 1)"
+    code = f"({offset} + 1 + (hash({code_rank}, {seed}, '{salt}_rank') % {concepts}))::VARCHAR"
+    date = f"(CURRENT_DATE - floor(pow({u_date}, 1.6) * {HISTORY_DAYS})::INTEGER)"
+    columns = "id, person_id, mapped_concept_code, clinical_effective_date"
+    values = f"range, floor(pow({u_person}, 1.4) * {persons})::BIGINT, {code}, {date}"
+    if table == 'MEDICATION_ORDER':
+        columns += ", order_date"
+        values += f", {date}"
+    columns += ", lds_start_date_time"
+    # Records land in the data lake up to two weeks after the clinical date, and
+    # never after generation - watermarks on ingest time (the usage cube) assume so
+    values += f", LEAST({date} + to_minutes(floor({u_lag} * 20160)::BIGINT), LOCALTIMESTAMP)"
+    con.execute(f"""
+        INSERT INTO DATA_LAKE.OLIDS.{table} ({columns})
+        SELECT {values}
+        FROM range({events})
+        """)
+    return events
+
+
+def _generate_clusters(con, seed):
+    """Sample clusters on mid-level concepts, cached through the refresh stand-in"""
+    t = "DATA_LAKE__NCL.TERMINOLOGY"
+    for table in ('ECL_CLUSTERS', 'ECL_CACHE', 'ECL_CACHE_METADATA', 'ECL_CLUSTER_CHANGES'):
+        con.execute(f"DELETE FROM {t}.{table}")
+    con.execute(f"""
+        INSERT INTO {t}.ECL_CLUSTERS (cluster_id, ecl_expression, description, cluster_type, created_by, updated_by)
+        SELECT
+            'SYNTHETIC_' || CASE WHEN range % 3 = 2 THEN 'MED' ELSE 'OBS' END || '_' || lpad(range::VARCHAR, 3, '0'),
+            '<< ' || CASE WHEN range % 3 = 2
+                          THEN (2000000000 + 2 + hash(range, {seed}, 'cluster') % 200)::VARCHAR
+                          ELSE (1000000000 + 2 + hash(range, {seed}, 'cluster') % 500)::VARCHAR END,
+            'Synthetic cluster ' || range,
+            CASE WHEN range % 3 = 2 THEN 'MEDICATION' ELSE 'OBSERVATION' END,
+            'GENERATOR', 'GENERATOR'
+        FROM range({SAMPLE_CLUSTERS})
+        """)
+    for (cluster_id,) in con.execute(f"SELECT cluster_id FROM {t}.ECL_CLUSTERS ORDER BY cluster_id").fetchall():
+        refresh_ecl_cluster(con, cluster_id, 'GENERATOR', force=True)
+
+
+def generate(out_dir, scale=1.0, seed=42, parquet_dir=None):
+    """Generate a full local dataset into out_dir"""
+    started = time.perf_counter()
+    os.makedirs(out_dir, exist_ok=True)
+    con = duckdb.connect()
+    for catalog, filename in LOCAL_CATALOGS.items():
+        path = os.path.join(out_dir, filename)
+        if os.path.exists(path):
+            os.remove(path)
+        con.execute(f"ATTACH '{path}' AS {catalog}")
+    create_schema(con)
+    _log(f"Generating scale {scale} with seed {seed} into {out_dir}", started)
+
+    _generate_terminology(con, seed)
+    _log(f"Terminology: {OBSERVATION_CONCEPTS + MEDICATION_CONCEPTS:,} concepts", started)
+
+    persons = _generate_people(con, seed, scale)
+    _log(f"Demographics: {persons:,} persons", started)
+
+    observations = _generate_events(
+        con, seed, 'OBSERVATION', persons, OBSERVATIONS_PER_PERSON, 1_000_000_000, OBSERVATION_CONCEPTS, 'obs'
+    )
+    _log(f"Observations: {observations:,}", started)
+
+    medications = _generate_events(
+        con, seed, 'MEDICATION_ORDER', persons, MEDICATIONS_PER_PERSON, 2_000_000_000, MEDICATION_CONCEPTS, 'med'
+    )
+    _log(f"Medication orders: {medications:,}", started)
+
+    _generate_clusters(con, seed)
+    _log(f"Clusters: {SAMPLE_CLUSTERS} sample clusters cached", started)
+
+    if parquet_dir:
+        os.makedirs(parquet_dir, exist_ok=True)
+        for table in TABLES:
+            con.execute(f"COPY {table} TO '{os.path.join(parquet_dir, table.lower() + '.parquet')}' (FORMAT PARQUET)")
+        _log(f"Parquet copies written to {parquet_dir}", started)
+
+    con.execute("CHECKPOINT")
+    con.close()
+    index = generate_terminology_index(out_dir)
+    _log(f"Terminology index: {index!r}", started)
+    _log("Done", started)
+
+
+def generate_terminology_index(data_dir):
+    """Index a dataset's concept tables into data_dir/terminology_index - point
+    SNOMED_CLUSTER_TERMINOLOGY_INDEX at it to expand ECL in-process"""
+    con = duckdb.connect()
+    try:
+        for catalog, filename in LOCAL_CATALOGS.items():
+            con.execute(f"ATTACH '{os.path.join(data_dir, filename)}' AS {catalog} (READ_ONLY)")
+        return build_local_index(con, os.path.join(data_dir, TERMINOLOGY_INDEX_DIR))
+    finally:
+        con.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic data for the local DuckDB backend")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help=f"Multiple of {PERSONS_PER_SCALE:,} persons (100 ~ production)")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    parser.add_argument("--out", default=os.environ.get(LOCAL_DATA_ENV_VAR, LOCAL_DATA_DIR),
+                        help="Output directory for the DuckDB files")
+    parser.add_argument("--parquet", default=None, help="Also write each table as Parquet to this directory")
+    args = parser.parse_args()
+    generate(args.out, args.scale, args.seed, args.parquet)
+
+
+if __name__ == "__main__":
+    main()
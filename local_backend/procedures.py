@@ -0,0 +1,204 @@
+# =============================================================================
+# SNOMED Cluster Manager - Local Stored Procedure Stand-ins
+# =============================================================================
+#
+# Python versions of the TERMINOLOGY stored procedures the app CALLs. Each
+# takes a DuckDB connection plus the procedure's arguments and returns the
+# procedure's message ("SUCCESS: ..." / "ERROR: ...").
+
+import uuid
+from datetime import datetime, timedelta
+
+from local_backend.ecl import evaluate_ecl
+
+TERMINOLOGY = "DATA_LAKE__NCL.TERMINOLOGY"
+
+# Code limits of the ECL table functions
+ECL_FUNCTION_LIMITS = {
+    'ECL_DETAILS': 50000,
+    'ECL_TEST_DETAILS': 10000
+}
+
+# A non-forced refresh is skipped if the cache is newer than this and the ECL hasn't changed
+REFRESH_INTERVAL = timedelta(days=1)
+
+
+def _record_attempt(con, cluster_id, actor, now, error=None, record_count=None):
+    """Update ECL_CACHE_METADATA after a refresh attempt"""
+    if error is None:
+        con.execute(f"""
+            INSERT INTO {TERMINOLOGY}.ECL_CACHE_METADATA
+                (cluster_id, last_successful_refresh, last_attempted_refresh,
+                 last_refreshed_by, last_attempted_by, record_count, last_error_message)
+            VALUES (?, ?, ?, ?, ?, ?, NULL)
+            ON CONFLICT (cluster_id) DO UPDATE SET
+                last_successful_refresh = excluded.last_successful_refresh,
+                last_attempted_refresh = excluded.last_attempted_refresh,
+                last_refreshed_by = excluded.last_refreshed_by,
+                last_attempted_by = excluded.last_attempted_by,
+                record_count = excluded.record_count,
+                last_error_message = NULL
+            """, [cluster_id, now, now, actor, actor, record_count])
+    else:
+        con.execute(f"""
+            INSERT INTO {TERMINOLOGY}.ECL_CACHE_METADATA
+                (cluster_id, last_attempted_refresh, last_attempted_by, last_error_message)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (cluster_id) DO UPDATE SET
+                last_attempted_refresh = excluded.last_attempted_refresh,
+                last_attempted_by = excluded.last_attempted_by,
+                last_error_message = excluded.last_error_message
+            """, [cluster_id, now, actor, error])
+
+
+def refresh_ecl_cluster(con, cluster_id, actor=None, force=False):
+    """REFRESH_ECL_CLUSTER / FORCE_REFRESH_ECL_CLUSTER"""
+    cluster = con.execute(
+        f"SELECT ecl_expression, updated_at FROM {TERMINOLOGY}.ECL_CLUSTERS WHERE cluster_id = ?",
+        [cluster_id]
+    ).fetchone()
+    if cluster is None:
+        return f"ERROR: Cluster {cluster_id} not found"
+    ecl_expression, updated_at = cluster
+
+    now = datetime.now()
+    if not force:
+        meta = con.execute(
+            f"SELECT last_successful_refresh FROM {TERMINOLOGY}.ECL_CACHE_METADATA WHERE cluster_id = ?",
+            [cluster_id]
+        ).fetchone()
+        last_refresh = meta[0] if meta else None
+        if last_refresh and (updated_at is None or last_refresh >= updated_at) and now - last_refresh < REFRESH_INTERVAL:
+            return f"SUCCESS: Cluster {cluster_id} cache is up to date"
+
+    try:
+        codes = evaluate_ecl(con, ecl_expression, ECL_FUNCTION_LIMITS['ECL_DETAILS'])
+    except Exception as e:
+        _record_attempt(con, cluster_id, actor, now, error=str(e))
+        return f"ERROR: {e}"
+
+    con.begin()
+    try:
+        con.register('refreshed_codes', codes)
+        session_id = str(uuid.uuid4())
+        # Record codes added and removed since the previous refresh
+        con.execute(f"""
+            INSERT INTO {TERMINOLOGY}.ECL_CLUSTER_CHANGES
+            SELECT
+                (SELECT COALESCE(MAX(change_id), 0) FROM {TERMINOLOGY}.ECL_CLUSTER_CHANGES)
+                    + ROW_NUMBER() OVER (ORDER BY change_type, code),
+                ?, change_type, code, display, system, ?, ?, ?
+            FROM (
+                SELECT 'ADDED' AS change_type, n.CODE AS code, n.DISPLAY AS display, n.SYSTEM AS system
+                FROM refreshed_codes n
+                WHERE n.CODE NOT IN (SELECT code FROM {TERMINOLOGY}.ECL_CACHE WHERE cluster_id = ?)
+                UNION ALL
+                SELECT 'REMOVED', c.code, c.display, c.system
+                FROM {TERMINOLOGY}.ECL_CACHE c
+                WHERE c.cluster_id = ?
+                AND c.code NOT IN (SELECT CODE FROM refreshed_codes)
+            )
+            """, [cluster_id, now, actor, session_id, cluster_id, cluster_id])
+        con.execute(f"DELETE FROM {TERMINOLOGY}.ECL_CACHE WHERE cluster_id = ?", [cluster_id])
+        con.execute(f"""
+            INSERT INTO {TERMINOLOGY}.ECL_CACHE (cluster_id, code, display, system, last_refreshed)
+            SELECT ?, CODE, DISPLAY, SYSTEM, ? FROM refreshed_codes
+            """, [cluster_id, now])
+        _record_attempt(con, cluster_id, actor, now, record_count=len(codes))
+        con.unregister('refreshed_codes')
+        con.commit()
+    except Exception:
+        con.rollback()
+        raise
+    return f"SUCCESS: Cluster {cluster_id} refreshed with {len(codes):,} codes"
+
+
+def upsert_ecl_cluster(con, cluster_id, ecl_expression, description, actor=None, cluster_type=None):
+    """UPSERT_ECL_CLUSTER - create or update a cluster, then refresh its cache"""
+    try:
+        evaluate_ecl(con, ecl_expression, ECL_FUNCTION_LIMITS['ECL_DETAILS'])
+    except Exception as e:
+        return f"ERROR: Invalid ECL expression: {e}"
+
+    now = datetime.now()
+    con.execute(f"""
+        INSERT INTO {TERMINOLOGY}.ECL_CLUSTERS
+            (cluster_id, ecl_expression, description, cluster_type, created_at, updated_at, created_by, updated_by)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (cluster_id) DO UPDATE SET
+            ecl_expression = excluded.ecl_expression,
+            description = excluded.description,
+            cluster_type = excluded.cluster_type,
+            updated_at = excluded.updated_at,
+            updated_by = excluded.updated_by
+        """, [cluster_id, ecl_expression, description, cluster_type or 'OBSERVATION', now, now, actor, actor])
+    refresh = refresh_ecl_cluster(con, cluster_id, actor, force=True)
+    if refresh.startswith("ERROR"):
+        return refresh
+    return f"SUCCESS: Cluster {cluster_id} saved. {refresh[len('SUCCESS: '):]}"
+
+
+def rename_ecl_cluster(con, old_cluster_id, new_cluster_id, ecl_expression, description, actor=None, cluster_type=None):
+    """RENAME_ECL_CLUSTER - move a cluster and its cache/history to a new ID"""
+    exists = con.execute(
+        f"SELECT COUNT(*) FROM {TERMINOLOGY}.ECL_CLUSTERS WHERE cluster_id = ?", [old_cluster_id]
+    ).fetchone()[0]
+    if not exists:
+        return f"ERROR: Cluster {old_cluster_id} not found"
+    if new_cluster_id != old_cluster_id:
+        taken = con.execute(
+            f"SELECT COUNT(*) FROM {TERMINOLOGY}.ECL_CLUSTERS WHERE cluster_id = ?", [new_cluster_id]
+        ).fetchone()[0]
+        if taken:
+            return f"ERROR: Cluster {new_cluster_id} already exists"
+
+    con.begin()
+    try:
+        con.execute(f"""
+            UPDATE {TERMINOLOGY}.ECL_CLUSTERS SET
+                cluster_id = ?,
+                ecl_expression = ?,
+                description = ?,
+                cluster_type = COALESCE(?, cluster_type),
+                updated_at = ?,
+                updated_by = ?
+            WHERE cluster_id = ?
+            """, [new_cluster_id, ecl_expression, description, cluster_type, datetime.now(), actor, old_cluster_id])
+        for table in ('ECL_CACHE', 'ECL_CACHE_METADATA', 'ECL_CLUSTER_CHANGES'):
+            con.execute(
+                f"UPDATE {TERMINOLOGY}.{table} SET cluster_id = ? WHERE cluster_id = ?",
+                [new_cluster_id, old_cluster_id]
+            )
+        con.commit()
+    except Exception as e:
+        con.rollback()
+        return f"ERROR: Rename failed: {e}"
+    return f"SUCCESS: Cluster {old_cluster_id} renamed to {new_cluster_id}"
+
+
+def delete_ecl_cluster(con, cluster_id):
+    """DELETE_ECL_CLUSTER - remove a cluster, its cache and metadata"""
+    exists = con.execute(
+        f"SELECT COUNT(*) FROM {TERMINOLOGY}.ECL_CLUSTERS WHERE cluster_id = ?", [cluster_id]
+    ).fetchone()[0]
+    if not exists:
+        return f"ERROR: Cluster {cluster_id} not found"
+    con.begin()
+    try:
+        for table in ('ECL_CACHE', 'ECL_CACHE_METADATA', 'ECL_CLUSTERS'):
+            con.execute(f"DELETE FROM {TERMINOLOGY}.{table} WHERE cluster_id = ?", [cluster_id])
+        con.commit()
+    except Exception as e:
+        con.rollback()
+        return f"ERROR: Delete failed: {e}"
+    return f"SUCCESS: Cluster {cluster_id} deleted"
+
+
+# Procedure name -> stand-in
+PROCEDURES = {
+    'UPSERT_ECL_CLUSTER': upsert_ecl_cluster,
+    'REFRESH_ECL_CLUSTER': lambda con, cluster_id, actor=None: refresh_ecl_cluster(con, cluster_id, actor),
+    'FORCE_REFRESH_ECL_CLUSTER': lambda con, cluster_id, actor=None: refresh_ecl_cluster(con, cluster_id, actor, force=True),
+    'RENAME_ECL_CLUSTER': rename_ecl_cluster,
+    'DELETE_ECL_CLUSTER': delete_ecl_cluster
+}
@@ -0,0 +1,155 @@
+# =============================================================================
+# SNOMED Cluster Manager - Local Backend Schema
+# =============================================================================
+#
+# DuckDB DDL for the tables the app reads in Snowflake. Each Snowflake
+# database is a separate DuckDB file attached under the same name, so the
+# services' three-part names (DATABASE.SCHEMA.TABLE) resolve unchanged.
+
+# Snowflake database -> DuckDB file name in the local data directory
+LOCAL_CATALOGS = {
+    'DATA_LAKE__NCL': 'data_lake__ncl.duckdb',
+    'DATA_LAKE': 'data_lake.duckdb',
+    'REPORTING': 'reporting.duckdb'
+}
+
+SCHEMAS = [
+    'DATA_LAKE__NCL.TERMINOLOGY',
+    'DATA_LAKE.OLIDS',
+    'REPORTING.OLIDS_PERSON_DEMOGRAPHICS'
+]
+
+TABLES = {
+    # ECL cluster definitions and cache
+    'DATA_LAKE__NCL.TERMINOLOGY.ECL_CLUSTERS': """
+        cluster_id VARCHAR PRIMARY KEY,
+        ecl_expression VARCHAR,
+        description VARCHAR,
+        cluster_type VARCHAR DEFAULT 'OBSERVATION',
+        created_at TIMESTAMP DEFAULT LOCALTIMESTAMP,
+        updated_at TIMESTAMP DEFAULT LOCALTIMESTAMP,
+        created_by VARCHAR,
+        updated_by VARCHAR
+    """,
+    'DATA_LAKE__NCL.TERMINOLOGY.ECL_CACHE': """
+        cluster_id VARCHAR,
+        code VARCHAR,
+        display VARCHAR,
+        system VARCHAR,
+        last_refreshed TIMESTAMP
+    """,
+    'DATA_LAKE__NCL.TERMINOLOGY.ECL_CACHE_METADATA': """
+        cluster_id VARCHAR PRIMARY KEY,
+        last_successful_refresh TIMESTAMP,
+        last_attempted_refresh TIMESTAMP,
+        last_refreshed_by VARCHAR,
+        last_attempted_by VARCHAR,
+        record_count INTEGER,
+        last_error_message VARCHAR
+    """,
+    'DATA_LAKE__NCL.TERMINOLOGY.ECL_CLUSTER_CHANGES': """
+        change_id BIGINT,
+        cluster_id VARCHAR,
+        change_type VARCHAR,
+        code VARCHAR,
+        display VARCHAR,
+        system VARCHAR,
+        change_timestamp TIMESTAMP,
+        changed_by VARCHAR,
+        refresh_session_id VARCHAR
+    """,
+    # Usage cube - sketches are person ID lists here (OBJECT in Snowflake)
+    'DATA_LAKE__NCL.TERMINOLOGY.ECL_USAGE_CUBE': """
+        cluster_id VARCHAR,
+        code VARCHAR,
+        display VARCHAR,
+        month DATE,
+        is_active BOOLEAN,
+        practice_name VARCHAR,
+        pcn_name VARCHAR,
+        borough_registered VARCHAR,
+        neighbourhood_registered VARCHAR,
+        age INTEGER,
+        age_band_5y VARCHAR,
+        sex VARCHAR,
+        event_count BIGINT,
+        person_sketch BIGINT[],
+        recent_person_sketch BIGINT[]
+    """,
+    'DATA_LAKE__NCL.TERMINOLOGY.ECL_USAGE_CUBE_METADATA': """
+        cluster_id VARCHAR PRIMARY KEY,
+        source_refresh TIMESTAMP,
+        recent_since DATE,
+        events_through TIMESTAMP,
+        built_at TIMESTAMP,
+        updated_at TIMESTAMP
+    """,
+    # Local-only terminology used by the ECL_DETAILS stand-in
+    'DATA_LAKE__NCL.TERMINOLOGY.LOCAL_CONCEPT': """
+        code VARCHAR PRIMARY KEY,
+        display VARCHAR,
+        system VARCHAR DEFAULT 'http://snomed.info/sct',
+        active BOOLEAN DEFAULT true
+    """,
+    'DATA_LAKE__NCL.TERMINOLOGY.LOCAL_CONCEPT_PARENT': """
+        code VARCHAR,
+        parent_code VARCHAR
+    """,
+    'DATA_LAKE__NCL.TERMINOLOGY.LOCAL_REFSET_MEMBER': """
+        refset_code VARCHAR,
+        code VARCHAR
+    """,
+    # OLIDS event tables
+    'DATA_LAKE.OLIDS.OBSERVATION': """
+        id BIGINT,
+        person_id BIGINT,
+        mapped_concept_code VARCHAR,
+        clinical_effective_date DATE,
+        lds_start_date_time TIMESTAMP
+    """,
+    'DATA_LAKE.OLIDS.MEDICATION_ORDER': """
+        id BIGINT,
+        person_id BIGINT,
+        mapped_concept_code VARCHAR,
+        clinical_effective_date DATE,
+        order_date DATE,
+        lds_start_date_time TIMESTAMP
+    """,
+    # Person demographics
+    'REPORTING.OLIDS_PERSON_DEMOGRAPHICS.DIM_PERSON_DEMOGRAPHICS': """
+        person_id BIGINT PRIMARY KEY,
+        is_active BOOLEAN,
+        age INTEGER,
+        age_band_5y VARCHAR,
+        sex VARCHAR,
+        practice_code VARCHAR,
+        practice_name VARCHAR,
+        pcn_code VARCHAR,
+        pcn_name VARCHAR,
+        borough_registered VARCHAR,
+        neighbourhood_registered VARCHAR,
+        ethnicity_category VARCHAR,
+        ethnicity_subcategory VARCHAR,
+        imd_decile_19 INTEGER,
+        imd_quintile_19 INTEGER,
+        language_type VARCHAR,
+        main_language VARCHAR,
+        interpreter_needed BOOLEAN
+    """
+}
+
+# Columns added to tables after they were first created - (table, column definition)
+ADDED_COLUMNS = [
+    ('DATA_LAKE__NCL.TERMINOLOGY.ECL_USAGE_CUBE_METADATA', "events_through TIMESTAMP"),
+    ('DATA_LAKE__NCL.TERMINOLOGY.ECL_USAGE_CUBE_METADATA', "updated_at TIMESTAMP"),
+]
+
+
+def create_schema(con):
+    """Create any missing schemas, tables and columns on a connection with the catalogs attached"""
+    for schema in SCHEMAS:
+        con.execute(f"CREATE SCHEMA IF NOT EXISTS {schema}")
+    for table, columns in TABLES.items():
+        con.execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns})")
+    for table, column in ADDED_COLUMNS:
+        con.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column}")
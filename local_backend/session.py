@@ -0,0 +1,241 @@
+# =============================================================================
+# SNOMED Cluster Manager - Local DuckDB Session
+# =============================================================================
+#
+# A Snowpark-shaped session over local DuckDB files so the app can run,
+# be profiled and load-tested without Snowflake. session.sql(query) returns
+# an object with to_pandas() / collect() / to_pandas_batches(); Snowflake-only
+# syntax is rewritten, CALLs are routed to the procedure stand-ins and
+# TABLE(ECL_DETAILS(...)) is evaluated by the local ECL stand-in.
+
+import itertools
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+import duckdb
+import pandas as pd
+from local_backend.ecl import evaluate_ecl
+from local_backend.procedures import PROCEDURES, ECL_FUNCTION_LIMITS
+from local_backend.schema import LOCAL_CATALOGS, create_schema
+
+_CALL = re.compile(r"^\s*CALL\s+(?:[\w$]+\.)*([\w$]+)\s*\((.*)\)\s*;?\s*$", re.IGNORECASE | re.DOTALL)
+_ECL_TABLE = re.compile(
+    r"TABLE\(\s*(?:[\w$]+\.)*(ECL_DETAILS|ECL_TEST_DETAILS)\s*\(\s*('(?:[^']|'')*'|\?)\s*\)\s*\)",
+    re.IGNORECASE
+)
+_CALL_ARGUMENT = re.compile(r"\s*('(?:[^']|'')*'|NULL|\?|-?\d+(?:\.\d+)?|TRUE|FALSE)\s*(?:,|$)", re.IGNORECASE)
+
+# Snowflake syntax -> DuckDB
+_REWRITES = [
+    (re.compile(r"\bCURRENT_TIMESTAMP\(\)", re.IGNORECASE), "LOCALTIMESTAMP"),
+    (re.compile(r"\bDATEADD\(\s*([A-Za-z_]+)\s*,", re.IGNORECASE), r"DATEADD('\1',"),
+]
+
+# Snowflake DATEADD with a quoted date part, and HyperLogLog sketch functions
+# backed by exact lists of distinct values (so local person counts are exact).
+# APPROX_COUNT_DISTINCT is DuckDB's own, whose error is well above Snowflake's.
+_MACROS = [
+    """
+    CREATE OR REPLACE MACRO DATEADD(part, n, ts) AS
+        CASE lower(part)
+            WHEN 'year' THEN ts + to_years(CAST(n AS INTEGER))
+            WHEN 'month' THEN ts + to_months(CAST(n AS INTEGER))
+            WHEN 'week' THEN ts + to_weeks(CAST(n AS INTEGER))
+            WHEN 'day' THEN ts + to_days(CAST(n AS INTEGER))
+            WHEN 'hour' THEN ts + to_hours(CAST(n AS BIGINT))
+            WHEN 'minute' THEN ts + to_minutes(CAST(n AS BIGINT))
+        END
+    """,
+    "CREATE OR REPLACE MACRO HLL_ACCUMULATE(x) AS list_distinct(list(x))",
+    "CREATE OR REPLACE MACRO HLL_COMBINE(sketch) AS list_distinct(flatten(list(sketch)))",
+    "CREATE OR REPLACE MACRO HLL_ESTIMATE(sketch) AS len(sketch)",
+    "CREATE OR REPLACE MACRO HLL_EXPORT(sketch) AS sketch",
+    "CREATE OR REPLACE MACRO HLL_IMPORT(sketch) AS sketch"
+]
+
+
+def _sql_literal(token):
+    """Python value of a SQL literal"""
+    upper = token.upper()
+    if upper == 'NULL':
+        return None
+    if upper in ('TRUE', 'FALSE'):
+        return upper == 'TRUE'
+    if token.startswith("'"):
+        return token[1:-1].replace("''", "'")
+    return float(token) if '.' in token else int(token)
+
+
+def _call_arguments(text, params):
+    """Parse the argument list of a CALL statement"""
+    values = []
+    params = iter(params or [])
+    position = 0
+    text = text.strip()
+    while position < len(text):
+        match = _CALL_ARGUMENT.match(text, position)
+        if not match:
+            raise ValueError(f"Unsupported CALL argument near: {text[position:position + 30]!r}")
+        token = match.group(1)
+        values.append(next(params) if token == '?' else _sql_literal(token))
+        position = match.end()
+    return values
+
+
+def translate_sql(query):
+    """Rewrite Snowflake-only syntax for DuckDB"""
+    for pattern, replacement in _REWRITES:
+        query = pattern.sub(replacement, query)
+    return query
+
+
+class Row(tuple):
+    """Result row supporting positional and column-name access, like snowpark.Row"""
+
+    def __new__(cls, values, columns):
+        row = super().__new__(cls, values)
+        row._columns = {name: i for i, name in enumerate(columns)}
+        return row
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return super().__getitem__(self._columns[key.upper()])
+        return super().__getitem__(key)
+
+    def as_dict(self):
+        return {name: self[i] for name, i in self._columns.items()}
+
+
+class LocalDataFrame:
+    """Lazy query result with the subset of the Snowpark DataFrame API the app uses"""
+
+    def __init__(self, session, query, params=None):
+        self._session = session
+        self._query = query
+        self._params = list(params) if params is not None else None
+
+    def to_pandas(self):
+        """Run the query and return a pandas DataFrame with upper-case columns"""
+        return self._session._execute(self._query, self._params, 'pandas')
+
+    def to_pandas_batches(self):
+        """Run the query and yield pandas DataFrames per Arrow record batch"""
+        return self._session._execute(self._query, self._params, 'batches')
+
+    def collect(self):
+        """Run the query and return a list of rows"""
+        df = self.to_pandas()
+        columns = list(df.columns)
+        return [Row(values, columns) for values in df.itertuples(index=False, name=None)]
+
+
+class LocalSession:
+    """DuckDB-backed stand-in for a Snowpark Session"""
+
+    def __init__(self, data_dir):
+        os.makedirs(data_dir, exist_ok=True)
+        self.data_dir = data_dir
+        self._con = duckdb.connect()
+        for catalog, filename in LOCAL_CATALOGS.items():
+            self._con.execute(f"ATTACH '{os.path.join(data_dir, filename)}' AS {catalog}")
+        create_schema(self._con)
+        for macro in _MACROS:
+            self._con.execute(macro)
+        self._local = threading.local()
+        # Thread ID -> that thread's cursor, for interrupt()
+        self._cursors = {}
+        self._ecl_views = itertools.count()
+
+    def _cursor(self):
+        """Per-thread cursor - DuckDB connections must not be shared across threads"""
+        cursor = getattr(self._local, 'cursor', None)
+        if cursor is None:
+            cursor = self._con.cursor()
+            self._local.cursor = cursor
+            self._cursors[threading.get_ident()] = cursor
+        return cursor
+
+    def interrupt(self, thread_id):
+        """Interrupt the query running on a thread's cursor, if any (stands in for AsyncJob.cancel)"""
+        cursor = self._cursors.get(thread_id)
+        if cursor is not None:
+            cursor.interrupt()
+
+    def sql(self, query, params=None):
+        """Create a lazily evaluated query, like Session.sql"""
+        return LocalDataFrame(self, query, params)
+
+    def _call(self, cursor, match, params):
+        """Run a stored procedure stand-in, returning its message as a one-row frame"""
+        name = match.group(1).upper()
+        procedure = PROCEDURES.get(name)
+        if procedure is None:
+            raise duckdb.CatalogException(f"Unknown procedure {name}")
+        message = procedure(cursor, *_call_arguments(match.group(2), params))
+        return cursor.execute(f"SELECT ? AS {name}", [message])
+
+    def _register_ecl_tables(self, cursor, query, params):
+        """Replace TABLE(ECL_DETAILS('...')) with views over the evaluated codes"""
+        params = list(params) if params is not None else None
+        remaining = []
+        offset = 0
+
+        def replace(match):
+            nonlocal offset
+            function = match.group(1).upper()
+            argument = match.group(2)
+            if argument == '?':
+                # The bound value is consumed here rather than by DuckDB
+                position = query[:match.start()].count('?') - offset
+                ecl_expr = params.pop(position)
+                offset += 1
+            else:
+                ecl_expr = _sql_literal(argument)
+            view = f"ecl_details_{next(self._ecl_views)}"
+            cursor.register(view, evaluate_ecl(cursor, ecl_expr, ECL_FUNCTION_LIMITS[function]))
+            remaining.append(view)
+            return view
+
+        query = _ECL_TABLE.sub(replace, query)
+        return query, params, remaining
+
+    @contextmanager
+    def _relation(self, query, params):
+        """Run a query on this thread's cursor, yielding the DuckDB result"""
+        cursor = self._cursor()
+        call = _CALL.match(query)
+        views = []
+        try:
+            if call:
+                yield self._call(cursor, call, params)
+            else:
+                query, params, views = self._register_ecl_tables(cursor, query, params)
+                yield cursor.execute(translate_sql(query), params)
+        finally:
+            for view in views:
+                cursor.unregister(view)
+
+    def _execute(self, query, params, mode):
+        """Run a query, returning a pandas DataFrame or a generator of them"""
+        if mode == 'batches':
+            return self._stream(query, params)
+        with self._relation(query, params) as relation:
+            if relation.description is None:
+                return pd.DataFrame()
+            return _upper_columns(relation.df())
+
+    def _stream(self, query, params, batch_size=100_000):
+        """Yield a query result as pandas frames, one Arrow record batch at a time"""
+        with self._relation(query, params) as relation:
+            if relation.description is None:
+                return
+            for batch in relation.fetch_record_batch(batch_size):
+                yield _upper_columns(batch.to_pandas())
+
+
+def _upper_columns(df):
+    """Upper-case column names, as Snowflake returns unquoted identifiers"""
+    df.columns = [c.upper() for c in df.columns]
+    return df
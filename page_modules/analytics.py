@@ -8,361 +8,312 @@ import time
 from database import rerun
 from services.cluster_service import get_all_clusters, get_cluster_cache, refresh_cluster
 from services.analytics_service import (
-    get_observation_analytics, get_medication_analytics, get_distinct_persons_obs, 
-    get_distinct_persons_med, get_observation_time_series, get_medication_time_series,
-    get_cluster_demographics, get_cluster_age_sex_distribution, get_cluster_standardized_rates,
-    get_cluster_ethnicity_analysis, get_cluster_deprivation_analysis, 
-    get_cluster_language_analysis, get_cluster_neighbourhood_analysis
+    get_cluster_usage, get_cluster_usage_sample, get_cluster_equity, usage_totals, code_usage, usage_time_series,
+    demographics_summary, age_sex_distribution, org_rates, org_rates_from_sketches, ethnicity_analysis,
+    deprivation_analysis, language_analysis, neighbourhood_analysis
 )
+from services.cube_service import get_practice_sketches
+from services.metric_service import are_estimates, sampled_percent
+from services.demographics_service import get_active_population
+from services.dispatch_service import start_job
+from components.lazy_tabs import render_lazy_tabs, reset_section_results, load_section_data
 from components.chart_components import create_practice_scatter, create_org_bar_chart
 from utils.charts import (
     create_population_pyramid, create_age_slope_chart, create_ethnicity_bar_chart,
     create_deprivation_line_chart, create_language_bar_chart, create_neighbourhood_bar_chart
 )
-from config import DB_ANALYTICS, DB_SCHEMA, DB_STORE, DB_DEMOGRAPHICS
+from utils.helpers import format_count
+from utils.hll import CONFIDENCE_Z, RELATIVE_ERROR
+from config import (
+    DB_ANALYTICS, DB_SCHEMA, DB_STORE, DB_DEMOGRAPHICS, ORG_LEVEL_COLUMNS, PROVISIONAL_SAMPLE_PERCENT,
+    PROGRESSIVE_POLL_SECONDS
+)
 
 
-def render_analytics():
-    """Render the Analytics page"""
-    if not st.session_state.selected_cluster:
-        st.error("No cluster selected")
-        st.session_state.page = 'home'
-        rerun()
-    
-    cluster_id = st.session_state.selected_cluster
-    
-    # Header with back button
-    col1, col2 = st.columns([1, 6])
-    with col1:
-        if st.button("← Back", use_container_width=True):
-            st.session_state.page = 'details'
+# Health Equity sections: (title, population column, derivation, chart, empty message)
+EQUITY_SECTIONS = [
+    ("📊 Ethnicity", 'ETHNICITY_SUBCATEGORY', ethnicity_analysis,
+     create_ethnicity_bar_chart, "No ethnicity data available"),
+    ("💰 Social Deprivation", 'IMD_DECILE_19', deprivation_analysis,
+     create_deprivation_line_chart, "No deprivation data available"),
+    ("🗣️ Language & Access", None, lambda metrics, population: language_analysis(metrics),
+     create_language_bar_chart, "No language data available"),
+    ("🏘️ Neighbourhood Comparison", 'NEIGHBOURHOOD_REGISTERED', neighbourhood_analysis,
+     create_neighbourhood_bar_chart, "No neighbourhood data available"),
+]
+
+
+def _fast_mode():
+    """Whether the page estimates counts rather than counting exactly"""
+    return st.session_state.get("analytics_fast_mode", False)
+
+
+def _progressive_mode():
+    """Whether the page shows provisional counts while the exact ones load"""
+    return st.session_state.get("analytics_progressive", False) and not _fast_mode()
+
+
+def _exact_job(cluster_id, cluster_type):
+    """The background exact count for the loaded cluster, started if there isn't one"""
+    scope = st.session_state["section_results"]["scope"]
+    entry = st.session_state.get("analytics_exact_job")
+    if entry is not None and entry["scope"] == scope:
+        return entry["job"]
+    if entry is not None:
+        # Another cluster's count - no longer wanted
+        entry["job"].cancel()
+    job = start_job(lambda: get_cluster_usage(cluster_id, cluster_type))
+    st.session_state["analytics_exact_job"] = {"scope": scope, "job": job}
+    return job
+
+
+def _load_progressive_metrics(cluster_id, cluster_type):
+    """Provisional usage breakdowns while the exact count runs in the background
+
+    Returns None once the exact count has finished - its result is then in
+    the section data, or (on error) loads again as usual.
+    """
+    job = _exact_job(cluster_id, cluster_type)
+    if job.done() and not job.cancelled:
+        del st.session_state["analytics_exact_job"]
+        load_section_data("metrics", job.result)
+        return None
+    with st.spinner("Sampling patients..."):
+        metrics = load_section_data("metrics_sample", lambda: get_cluster_usage_sample(cluster_id, cluster_type))
+    if metrics and usage_totals(metrics)[0] > 0:
+        return metrics
+    # Nobody in the sample (e.g. a rarely used cluster) - nothing worth showing early
+    with st.spinner("Loading cluster analytics..."):
+        load_section_data("metrics", lambda: job.result() or {})
+    del st.session_state["analytics_exact_job"]
+    return None
+
+
+def _load_metrics(cluster_id, cluster_type):
+    """Load the usage tabs' breakdowns once - one query shared by those tabs"""
+    fast = _fast_mode()
+    if _progressive_mode() and "metrics" not in st.session_state["section_results"]["results"]:
+        metrics = _load_progressive_metrics(cluster_id, cluster_type)
+        if metrics is not None:
+            return metrics
+    with st.spinner("Loading cluster analytics..."):
+        return load_section_data(
+            "metrics_fast" if fast else "metrics",
+            lambda: get_cluster_usage(cluster_id, cluster_type, True if fast else None)
+        )
+
+
+def _load_exact_metrics(cluster_id, cluster_type):
+    """Load the usage tabs' breakdowns counted exactly, for downloads"""
+    with st.spinner("Counting exactly..."):
+        return load_section_data("metrics_exact", lambda: get_cluster_usage(cluster_id, cluster_type, False))
+
+
+def _render_exact_progress(status):
+    """While provisional counts show, offer to cancel the exact count and rerun once it finishes
+
+    Called after the tab has rendered; the poll loop's updates let a click on
+    Cancel (or anything else) interrupt the wait.
+    """
+    entry = st.session_state.get("analytics_exact_job")
+    if entry is None or entry["scope"] != st.session_state["section_results"]["scope"]:
+        return
+    job = entry["job"]
+    if "metrics" in st.session_state["section_results"]["results"]:
+        # Counted exactly meanwhile (progressive mode switched off)
+        job.cancel()
+        del st.session_state["analytics_exact_job"]
+        return
+    with status:
+        if job.cancelled:
+            col1, col2 = st.columns([5, 1])
+            col1.warning(
+                f"Exact count cancelled - counts marked ~ are provisional, from a {PROVISIONAL_SAMPLE_PERCENT}% "
+                "sample of patients."
+            )
+            if col2.button("🔢 Count exactly", use_container_width=True):
+                del st.session_state["analytics_exact_job"]
+                rerun()
+            return
+        col1, col2 = st.columns([5, 1])
+        progress = col1.empty()
+        if col2.button("✖ Cancel exact count", use_container_width=True):
+            job.cancel()
             rerun()
+    while not job.done():
+        progress.info(
+            f"⏳ Counts marked ~ are provisional, from a {PROVISIONAL_SAMPLE_PERCENT}% sample of patients. "
+            f"Counting exactly... {job.elapsed():.0f}s"
+        )
+        time.sleep(PROGRESSIVE_POLL_SECONDS)
+    rerun()
+
+
+def _render_estimate_note(estimated, provisional=None):
+    """Note under estimated counts giving their error bound, or the sample provisional counts came from"""
+    if provisional:
+        st.caption(
+            f"~ Provisional: patient and event counts are scaled up from a {provisional}% sample of patients "
+            "and rounded. Downloads are counted exactly."
+        )
+    elif estimated:
+        st.caption(
+            f"≈ Patient and event counts are HyperLogLog estimates, shown ± their {CONFIDENCE_Z * RELATIVE_ERROR:.1%} "
+            "error bound (95% confidence). Downloads are counted exactly."
+        )
+
+
+def _render_download(label, data, file_name, estimated, exact_data, key):
+    """Download button for a table - estimated tables are recounted exactly
+    (exact_data() returns the CSV) once the user asks for the download"""
+    if not estimated:
+        st.download_button(label=label, data=data, file_name=file_name, mime="text/csv")
+        return
+    if st.session_state.get(key) or st.button(f"{label} (exact counts)", key=f"{key}_prepare"):
+        st.session_state[key] = True
+        st.download_button(label=label, data=exact_data(), file_name=file_name, mime="text/csv")
+
+
+def _load_equity_metrics(cluster_id, cluster_type):
+    """Load the health equity breakdowns once"""
+    with st.spinner("Loading cluster analytics..."):
+        return load_section_data("equity_metrics", lambda: get_cluster_equity(cluster_id, cluster_type))
+
+
+def _render_health_equity(cluster_id, cluster_type):
+    """Render the Health Equity tab"""
+    st.subheader("⚖️ Health Equity Analysis")
+    st.markdown("Analysis of health inequalities across different population groups")
     
-    st.title(f"📈 Analytics: {cluster_id}")
-    
-    # Get cluster information
-    clusters_df = get_all_clusters()
-    cluster_info = clusters_df[clusters_df['CLUSTER_ID'] == cluster_id]
-    if cluster_info.empty:
-        st.error(f"Cluster '{cluster_id}' not found")
-        st.session_state.page = 'home'
-        rerun()
-        
-    cluster = cluster_info.iloc[0]
-    cluster_type = cluster.get('CLUSTER_TYPE', 'OBSERVATION')
+    metrics = _load_equity_metrics(cluster_id, cluster_type)
     
-    # Check if cluster has cached data
-    if not cluster.get('RECORD_COUNT') or cluster.get('RECORD_COUNT') == 0:
-        st.warning("⚠️ This cluster has no cached codes. Please refresh the cluster first.")
-        if st.button("🔄 Refresh Cluster Now"):
-            result = refresh_cluster(cluster_id, force=True)
-            if result.startswith("SUCCESS"):
-                st.success(f"✅ {result}")
-                time.sleep(1)
-                rerun()
+    # Denominators all come from the one shared active-population load
+    with st.spinner("Loading health equity data..."):
+        for i, (title, population_col, derive, chart, empty_message) in enumerate(EQUITY_SECTIONS):
+            if i > 0:
+                st.divider()
+            st.subheader(title)
+            data = derive(metrics, get_active_population(population_col) if population_col else None)
+            if not data.empty:
+                chart(data)
             else:
-                st.error(f"❌ {result}")
+                st.info(empty_message)
+
+
+def _render_observation_overview(cluster_id, cluster_type):
+    """Render the Overview tab for an observation cluster"""
+    st.subheader("📊 Usage Summary")
+    st.markdown("Summary statistics for all observations in this cluster")
+
+    metrics = _load_metrics(cluster_id, cluster_type)
+    obs_df = code_usage(metrics, cluster_type)
+    total_persons, active_persons, total_observations = usage_totals(metrics)
+    if not obs_df.empty:
+        # Get total cluster codes for comparison
+        cluster_codes = load_section_data("cluster_codes", lambda: get_cluster_cache(cluster_id))
+        total_codes_in_cluster = len(cluster_codes) if not cluster_codes.empty else 0
+        unused_codes = total_codes_in_cluster - len(obs_df)
+
+        # Overview metrics
+        estimated, provisional = are_estimates(metrics), sampled_percent(metrics)
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric(
+                "Persons Ever Coded (Active / Total)",
+                f"{format_count(active_persons, estimated, provisional)} / {format_count(total_persons, estimated, provisional)}"
+            )
+        with col2:
+            st.metric("Total Observations", format_count(total_observations, estimated, provisional))
+        with col3:
+            avg_per_person = total_observations / active_persons if active_persons > 0 else 0
+            st.metric("Avg per Person", f"{avg_per_person:.1f}")
+        with col4:
+            st.metric("Codes with Usage", f"{len(obs_df)}/{total_codes_in_cluster}")
+        _render_estimate_note(estimated, provisional)
+
+        # Show unused codes warning if any
+        # Codes used by patients outside a sample aren't missing from the full data
+        if unused_codes > 0 and not provisional:
+            st.warning(f"⚠️ {unused_codes} code(s) in this cluster have never been used in observations")
+
+        # Usage over time chart integrated into overview  
+        st.subheader("📈 Usage Over Time (Last 5 Years)")
+        time_df = usage_time_series(metrics, cluster_type)
+
+        if not time_df.empty:
+            st.markdown("**Observations per Month:**")
+            if 'MONTH_YEAR' not in time_df.columns or not pd.api.types.is_datetime64_any_dtype(time_df['MONTH_YEAR']):
+                time_df['MONTH_YEAR'] = pd.to_datetime(time_df['MONTH_YEAR'])
+            chart_df = time_df.set_index('MONTH_YEAR')['OBSERVATION_COUNT']
+            st.line_chart(chart_df, height=400)
+        else:
+            st.info("No observation data found")
     else:
-        # Create tabs based on cluster type
-        if cluster_type == 'OBSERVATION':
-            tabs = st.tabs(["📊 Overview", "📄 Code Usage", "👥 Age/Sex", "🏥 Organisation Counts", "⚖️ Health Equity", "💻 SQL Templates"])
-        elif cluster_type == 'MEDICATION':
-            tabs = st.tabs(["💊 Overview", "📄 Code Usage", "👥 Age/Sex", "🏥 Care Teams", "⚖️ Health Equity", "💻 SQL Templates"])
+        st.info("No observation data found for these codes - none have ever been used in patient records.")
+
+
+def _render_observation_code_usage(cluster_id, cluster_type):
+    """Render the Code Usage tab for an observation cluster"""
+    st.subheader("📋 Code Usage Analysis")
+    st.markdown("Ranking of codes by usage frequency and patient reach")
+
+    metrics = _load_metrics(cluster_id, cluster_type)
+    obs_df = code_usage(metrics, cluster_type)
+
+    # Get cluster codes for analysis
+    cluster_codes = load_section_data("cluster_codes", lambda: get_cluster_cache(cluster_id))
+    total_codes_in_cluster = len(cluster_codes) if not cluster_codes.empty else 0
+    used_codes = len(obs_df) if not obs_df.empty else 0
+    unused_codes = total_codes_in_cluster - used_codes
+
+    # Code-level breakdown (only show if we have data)
+    if not obs_df.empty:
+        st.caption("Ranked by patient reach - shows only codes that have been recorded at least once")
+        st.dataframe(
+            obs_df[['CODE', 'DISPLAY', 'PERSON_COUNT', 'OBSERVATION_COUNT']],
+            use_container_width=True
+        )
+
+        _render_estimate_note(are_estimates(metrics), sampled_percent(metrics))
+
+        # Download button
+        _render_download(
+            "📥 Download Observation Data", obs_df.to_csv(index=False), f"{cluster_id}_observation_analytics.csv",
+            are_estimates(metrics),
+            lambda: code_usage(_load_exact_metrics(cluster_id, cluster_type), cluster_type).to_csv(index=False),
+            key=f"exact_code_usage_{cluster_id}"
+        )
+    else:
+        st.info("No observation data found for these codes - none have ever been used in patient records.")
+
+    # Show unused codes if any - not known until the exact count is in
+    if unused_codes > 0 and not sampled_percent(metrics):
+        st.divider()
+        st.caption(f"**Unused codes:** These {unused_codes} code(s) are in the cluster but have never been recorded")
+
+        # Get unused codes
+        if not obs_df.empty:
+            used_codes_set = set(obs_df['CODE'].tolist())
+            all_codes_set = set(cluster_codes['CODE'].tolist()) if not cluster_codes.empty else set()
+            unused_codes_set = all_codes_set - used_codes_set
+
+            if unused_codes_set:
+                unused_display_df = cluster_codes[cluster_codes['CODE'].isin(unused_codes_set)][['CODE', 'DISPLAY']]
+                st.dataframe(unused_display_df, use_container_width=True)
         else:
-            # Default to observation if type is unknown
-            tabs = st.tabs(["📊 Overview", "📄 Code Usage", "👥 Demographics", "⚖️ Health Equity", "💻 SQL Templates"])
-            cluster_type = 'OBSERVATION'
-        
-        # Load data based on cluster type
-        if cluster_type == 'OBSERVATION':
-            # Tab 1: Overview
-            with tabs[0]:
-                st.subheader("📊 Usage Summary")
-                st.markdown("Summary statistics for all observations in this cluster")
-                
-                with st.spinner("Loading observation data..."):
-                    obs_df = get_observation_analytics(cluster_id)
-                    total_persons, active_persons, total_observations = get_distinct_persons_obs(cluster_id)
-                if not obs_df.empty:
-                    # Get total cluster codes for comparison
-                    cluster_codes = get_cluster_cache(cluster_id)
-                    total_codes_in_cluster = len(cluster_codes) if not cluster_codes.empty else 0
-                    unused_codes = total_codes_in_cluster - len(obs_df)
-                    
-                    # Overview metrics
-                    col1, col2, col3, col4 = st.columns(4)
-                    with col1:
-                        st.metric(
-                            "Persons Ever Coded (Active / Total)",
-                            f"{active_persons:,} / {total_persons:,}"
-                        )
-                    with col2:
-                        st.metric("Total Observations", f"{total_observations:,}")
-                    with col3:
-                        avg_per_person = total_observations / active_persons if active_persons > 0 else 0
-                        st.metric("Avg per Person", f"{avg_per_person:.1f}")
-                    with col4:
-                        st.metric("Codes with Usage", f"{len(obs_df)}/{total_codes_in_cluster}")
-                    
-                    # Show unused codes warning if any
-                    if unused_codes > 0:
-                        st.warning(f"⚠️ {unused_codes} code(s) in this cluster have never been used in observations")
-                    
-                    # Usage over time chart integrated into overview  
-                    st.subheader("📈 Usage Over Time (Last 5 Years)")
-                    time_df = get_observation_time_series(cluster_id)
-                    
-                    if not time_df.empty:
-                        st.markdown("**Observations per Month:**")
-                        if 'MONTH_YEAR' not in time_df.columns or not pd.api.types.is_datetime64_any_dtype(time_df['MONTH_YEAR']):
-                            time_df['MONTH_YEAR'] = pd.to_datetime(time_df['MONTH_YEAR'])
-                        chart_df = time_df.set_index('MONTH_YEAR')['OBSERVATION_COUNT']
-                        st.line_chart(chart_df, height=400)
-                    else:
-                        st.info("No observation data found")
-                else:
-                    st.info("No observation data found for these codes - none have ever been used in patient records.")
-            
-            # Tab 2: Code Usage
-            with tabs[1]:
-                st.subheader("📋 Code Usage Analysis")
-                st.markdown("Ranking of codes by usage frequency and patient reach")
-                
-                with st.spinner("Loading code usage data..."):
-                    obs_df = get_observation_analytics(cluster_id)
-                
-                # Get cluster codes for analysis
-                cluster_codes = get_cluster_cache(cluster_id)
-                total_codes_in_cluster = len(cluster_codes) if not cluster_codes.empty else 0
-                used_codes = len(obs_df) if not obs_df.empty else 0
-                unused_codes = total_codes_in_cluster - used_codes
-                
-                # Code-level breakdown (only show if we have data)
-                if not obs_df.empty:
-                    st.caption("Ranked by patient reach - shows only codes that have been recorded at least once")
-                    st.dataframe(
-                        obs_df[['CODE', 'DISPLAY', 'PERSON_COUNT', 'OBSERVATION_COUNT']],
-                        use_container_width=True
-                    )
-                    
-                    # Download button
-                    csv = obs_df.to_csv(index=False)
-                    st.download_button(
-                        label="📥 Download Observation Data",
-                        data=csv,
-                        file_name=f"{cluster_id}_observation_analytics.csv",
-                        mime="text/csv"
-                    )
-                else:
-                    st.info("No observation data found for these codes - none have ever been used in patient records.")
-                
-                # Show unused codes if any
-                if unused_codes > 0:
-                    st.divider()
-                    st.caption(f"**Unused codes:** These {unused_codes} code(s) are in the cluster but have never been recorded")
-                    
-                    # Get unused codes
-                    if not obs_df.empty:
-                        used_codes_set = set(obs_df['CODE'].tolist())
-                        all_codes_set = set(cluster_codes['CODE'].tolist()) if not cluster_codes.empty else set()
-                        unused_codes_set = all_codes_set - used_codes_set
-                        
-                        if unused_codes_set:
-                            unused_display_df = cluster_codes[cluster_codes['CODE'].isin(unused_codes_set)][['CODE', 'DISPLAY']]
-                            st.dataframe(unused_display_df, use_container_width=True)
-                    else:
-                        # All codes are unused
-                        st.dataframe(cluster_codes[['CODE', 'DISPLAY']], use_container_width=True)
-            
-            # Tab 3: Age/Sex
-            with tabs[2]:
-                st.subheader("👥 Age & Sex Distribution")
-                st.markdown("Age and sex breakdown of patients with observations in this cluster")
-                
-                with st.spinner("Loading demographics data..."):
-                    cluster_demographics = get_cluster_demographics(cluster_id, cluster_type)
-                    
-                    if not cluster_demographics.empty:
-                        summary = cluster_demographics.iloc[0]
-                        
-                        # Summary metrics
-                        col1, col2, col3, col4 = st.columns(4)
-                        with col1:
-                            st.metric("Active Patients", f"{summary['TOTAL_PATIENTS']:,.0f}")
-                        with col2:
-                            st.metric("Average Age", f"{summary['AVG_AGE']:.1f} years")
-                        with col3:
-                            male_pct = (summary['MALE_COUNT'] / summary['TOTAL_PATIENTS']) * 100
-                            st.metric("Male %", f"{male_pct:.1f}%")
-                        with col4:
-                            female_pct = (summary['FEMALE_COUNT'] / summary['TOTAL_PATIENTS']) * 100
-                            st.metric("Female %", f"{female_pct:.1f}%")
-                        
-                        # Population pyramid and age distribution charts
-                        age_sex_dist = get_cluster_age_sex_distribution(cluster_id, cluster_type)
-                        if not age_sex_dist.empty:
-                            create_population_pyramid(age_sex_dist)
-                            create_age_slope_chart(age_sex_dist)
-                        else:
-                            st.warning("No age/sex distribution data available")
-                        
-                        # Rates analysis moved to Care Teams tab
-                    else:
-                        st.info("No demographics data available for this cluster.")
-            
-            # Tab 4: Organisation Counts
-            with tabs[3]:
-                st.subheader("🏥 Organisation Analysis")
-                st.markdown("Patient counts by organisational unit")
-                
-                with st.spinner("Loading organisation data..."):
-                    # Load practice-level data (always needed for scatter plot)
-                    practice_rates = get_cluster_standardized_rates(cluster_id, cluster_type, "Practice")
-                    
-                    if not practice_rates.empty:
-                        # Summary metrics
-                        col1, col2, col3, col4 = st.columns(4)
-                        with col1:
-                            total_patients = practice_rates['PATIENTS_WITH_CODE'].sum()
-                            st.metric("Total Patients", f"{total_patients:,}")
-                        with col2:
-                            avg_rate = practice_rates['RATE_PER_1000'].mean()
-                            st.metric("Average Rate", f"{avg_rate:.2f} per 1,000")
-                        with col3:
-                            new_patients = practice_rates['NEW_PATIENTS_30D'].sum()
-                            st.metric("New (30 days)", f"{new_patients:,}")
-                        with col4:
-                            practice_count = len(practice_rates)
-                            st.metric("Practices", practice_count)
-                        
-                        st.divider()
-                        
-                        # Always show practice scatter plot
-                        st.subheader("Practice Distribution")
-                        scatter_chart = create_practice_scatter(practice_rates)
-                        if scatter_chart:
-                            st.altair_chart(scatter_chart, use_container_width=True)
-                        
-                        # Aggregated view section
-                        st.subheader("Aggregated View")
-                        
-                        # Aggregation level selector for bar chart
-                        col1, col2 = st.columns([1, 3])
-                        with col1:
-                            agg_level = st.selectbox(
-                                "Aggregate by:",
-                                options=["Borough", "PCN", "Neighbourhood"],
-                                index=0,
-                                help="Choose aggregation level for bar chart",
-                                key="org_agg_level"
-                            )
-                        
-                        # Load and display aggregated data
-                        agg_rates = get_cluster_standardized_rates(cluster_id, cluster_type, agg_level)
-                        if not agg_rates.empty:
-                            bar_chart = create_org_bar_chart(agg_rates, agg_level)
-                            if bar_chart:
-                                st.altair_chart(bar_chart, use_container_width=True)
-                        
-                        # Data table (always visible)
-                        st.subheader("Data Table")
-                        
-                        # Selector for which data to show in table
-                        table_view = st.radio(
-                            "Show data for:",
-                            options=["Practices", agg_level],
-                            horizontal=True,
-                            key="table_view_selector"
-                        )
-                        
-                        # Display appropriate data
-                        if table_view == "Practices":
-                            display_df = practice_rates.copy()
-                        else:
-                            display_df = agg_rates.copy()
-                        
-                        # Format the dataframe for display
-                        display_df['RATE_PER_1000'] = display_df['RATE_PER_1000'].round(2)
-                        display_df['AVG_AGE'] = display_df['AVG_AGE'].round(1)
-                        
-                        # Rename columns for display
-                        display_df = display_df.rename(columns={
-                            'UNIT_NAME': 'Practice' if table_view == "Practices" else agg_level,
-                            'TOTAL_POPULATION': 'Population',
-                            'PATIENTS_WITH_CODE': 'Patients',
-                            'AVG_AGE': 'Avg Age',
-                            'NEW_PATIENTS_30D': 'New (30d)',
-                            'RATE_PER_1000': 'Rate/1000'
-                        })
-                        
-                        st.dataframe(display_df, use_container_width=True)
-                        
-                        # Download button
-                        csv = display_df.to_csv(index=False)
-                        st.download_button(
-                            label="📥 Download Data",
-                            data=csv,
-                            file_name=f"rates_{table_view.lower().replace(' ', '_')}_{cluster_id}.csv",
-                            mime="text/csv"
-                        )
-                    else:
-                        st.info("No data available")
-            
-            # Tab 5: Health Equity
-            with tabs[4]:
-                st.subheader("⚖️ Health Equity Analysis")
-                st.markdown("Analysis of health inequalities across different population groups")
-                
-                with st.spinner("Loading health equity data..."):
-                    # Load all equity data
-                    ethnicity_data = get_cluster_ethnicity_analysis(cluster_id, cluster_type)
-                    deprivation_data = get_cluster_deprivation_analysis(cluster_id, cluster_type)
-                    language_data = get_cluster_language_analysis(cluster_id, cluster_type)
-                    neighbourhood_data = get_cluster_neighbourhood_analysis(cluster_id, cluster_type)
-                    
-                    # Ethnicity Analysis
-                    st.subheader("📊 Ethnicity")
-                    if not ethnicity_data.empty:
-                        create_ethnicity_bar_chart(ethnicity_data)
-                    else:
-                        st.info("No ethnicity data available")
-                    
-                    st.divider()
-                    
-                    # Deprivation Analysis
-                    st.subheader("💰 Social Deprivation")
-                    if not deprivation_data.empty:
-                        create_deprivation_line_chart(deprivation_data)
-                    else:
-                        st.info("No deprivation data available")
-                    
-                    st.divider()
-                    
-                    # Language Analysis
-                    st.subheader("🗣️ Language & Access")
-                    if not language_data.empty:
-                        create_language_bar_chart(language_data)
-                    else:
-                        st.info("No language data available")
-                    
-                    st.divider()
-                    
-                    # Neighbourhood Analysis
-                    st.subheader("🏘️ Neighbourhood Comparison")
-                    if not neighbourhood_data.empty:
-                        create_neighbourhood_bar_chart(neighbourhood_data)
-                    else:
-                        st.info("No neighbourhood data available")
-            
-            # Tab 6: SQL Templates  
-            with tabs[5]:
-                st.subheader("SQL Query Templates")
-                st.markdown("#### 💻 Data Export Queries")
-                st.markdown("Copy these queries to extract data from Snowflake. Each query is ready to run - just paste into your SQL editor.")
-                
-                # Basic codes query
-                st.markdown("### Get All Codes in This Cluster")
-                query1 = f"""-- Get all SNOMED codes in cluster {cluster_id}
+            # All codes are unused
+            st.dataframe(cluster_codes[['CODE', 'DISPLAY']], use_container_width=True)
+
+
+def _render_observation_sql_templates(cluster_id, cluster_type):
+    """Render the SQL Templates tab for an observation cluster"""
+    st.subheader("SQL Query Templates")
+    st.markdown("#### 💻 Data Export Queries")
+    st.markdown("Copy these queries to extract data from Snowflake. Each query is ready to run - just paste into your SQL editor.")
+    
+    # Basic codes query
+    st.markdown("### Get All Codes in This Cluster")
+    query1 = f"""-- Get all SNOMED codes in cluster {cluster_id}
 SELECT 
     code,
     display,
@@ -370,11 +321,11 @@ SELECT
 FROM {DB_SCHEMA}.ecl_cache
 WHERE cluster_id = '{cluster_id}'
 ORDER BY code;"""
-                st.code(query1, language='sql')
-                
-                # Patient list query
-                st.markdown("### Get Patients with These Observations")
-                query2 = f"""-- Get list of patients with observations in cluster {cluster_id}
+    st.code(query1, language='sql')
+    
+    # Patient list query
+    st.markdown("### Get Patients with These Observations")
+    query2 = f"""-- Get list of patients with observations in cluster {cluster_id}
 SELECT DISTINCT
     d.person_id,
     d.practice_name,
@@ -390,11 +341,11 @@ WHERE ec.cluster_id = '{cluster_id}'
 AND d.is_active = true
 GROUP BY d.person_id, d.practice_name, d.age, d.sex
 ORDER BY observation_count DESC;"""
-                st.code(query2, language='sql')
-                
-                # Practice summary query
-                st.markdown("### Summary by Practice")
-                query3 = f"""-- Get practice-level summary for cluster {cluster_id}
+    st.code(query2, language='sql')
+    
+    # Practice summary query
+    st.markdown("### Summary by Practice")
+    query3 = f"""-- Get practice-level summary for cluster {cluster_id}
 SELECT 
     d.practice_name,
     d.pcn_name,
@@ -411,11 +362,11 @@ AND d.is_active = true
 GROUP BY d.practice_name, d.pcn_name, d.borough_registered
 HAVING patient_count >= 5  -- Privacy threshold
 ORDER BY patient_count DESC;"""
-                st.code(query3, language='sql')
-                
-                # Time series query
-                st.markdown("### Monthly Trend Analysis")
-                query4 = f"""-- Get monthly observation counts for cluster {cluster_id}
+    st.code(query3, language='sql')
+    
+    # Time series query
+    st.markdown("### Monthly Trend Analysis")
+    query4 = f"""-- Get monthly observation counts for cluster {cluster_id}
 SELECT 
     DATE_TRUNC('month', o.clinical_effective_date) as month,
     COUNT(DISTINCT d.person_id) as unique_patients,
@@ -428,11 +379,11 @@ AND o.clinical_effective_date >= DATEADD('month', -24, CURRENT_DATE())
 AND o.clinical_effective_date < CURRENT_DATE()
 GROUP BY DATE_TRUNC('month', o.clinical_effective_date)
 ORDER BY month DESC;"""
-                st.code(query4, language='sql')
-                
-                # Demographics breakdown
-                st.markdown("### Demographics Analysis")
-                query5 = f"""-- Get demographic breakdown for cluster {cluster_id}
+    st.code(query4, language='sql')
+    
+    # Demographics breakdown
+    st.markdown("### Demographics Analysis")
+    query5 = f"""-- Get demographic breakdown for cluster {cluster_id}
 SELECT 
     d.age_band_5y,
     d.sex,
@@ -445,294 +396,123 @@ WHERE ec.cluster_id = '{cluster_id}'
 AND d.is_active = true
 GROUP BY d.age_band_5y, d.sex, d.ethnicity_category
 ORDER BY d.age_band_5y, d.sex, d.ethnicity_category;"""
-                st.code(query5, language='sql')
-                
-        elif cluster_type == 'MEDICATION':
-            with st.spinner("Loading medication data..."):
-                med_df = get_medication_analytics(cluster_id)
-            
-            # Tab 1: Overview
-            with tabs[0]:
-                st.subheader("💊 Usage Summary")
-                if not med_df.empty:
-                    # Get total cluster codes for comparison
-                    cluster_codes = get_cluster_cache(cluster_id)
-                    total_codes_in_cluster = len(cluster_codes) if not cluster_codes.empty else 0
-                    unused_codes = total_codes_in_cluster - len(med_df)
-                    
-                    # Overview metrics
-                    col1, col2, col3, col4 = st.columns(4)
-                    with col1:
-                        # Get distinct person count across all codes in cluster
-                        total_persons, active_persons, total_orders = get_distinct_persons_med(cluster_id)
-                        st.metric(
-                            f"Persons Ever Ordered (Active / Total)",
-                            f"{active_persons:,} / {total_persons:,}"
-                        )
-                    with col2:
-                        total_orders = med_df['ORDER_COUNT'].sum()
-                        st.metric("Total Orders", f"{total_orders:,}")
-                    with col3:
-                        avg_per_person = total_orders / total_persons if total_persons > 0 else 0
-                        st.metric("Avg per Person", f"{avg_per_person:.1f}")
-                    with col4:
-                        st.metric("Meds with Usage", f"{len(med_df)}/{total_codes_in_cluster}")
-                    
-                    # Show unused codes warning if any
-                    if unused_codes > 0:
-                        st.warning(f"⚠️ {unused_codes} medication(s) in this cluster have never been ordered")
-                    
-                    # Usage over time chart integrated into overview
-                    st.subheader("📈 Usage Over Time (Last 5 Years)")
-                    time_df = get_medication_time_series(cluster_id)
-                    
-                    if not time_df.empty:
-                        st.markdown("**Orders per Month:**")
-                        time_df['MONTH_YEAR'] = pd.to_datetime(time_df['MONTH_YEAR'])
-                        chart_df = time_df.set_index('MONTH_YEAR')['ORDER_COUNT']
-                        st.line_chart(chart_df, height=400)
-                    else:
-                        st.info("No medication data found in the last 5 years")
-                else:
-                    st.info("No medication data found for these codes - none have ever been ordered.")
-            
-            # Tab 2: Code Usage
-            with tabs[1]:
-                st.subheader("📋 Code Usage Analysis")
-                
-                # Always get cluster codes for analysis
-                cluster_codes = get_cluster_cache(cluster_id)
-                total_codes_in_cluster = len(cluster_codes) if not cluster_codes.empty else 0
-                used_codes = len(med_df) if not med_df.empty else 0
-                unused_codes = total_codes_in_cluster - used_codes
-                
-                # Code-level breakdown (only show if we have data)
-                if not med_df.empty:
-                    st.subheader("Medications Ever Ordered")
-                    st.caption("Shows only medications that have been ordered at least once")
-                    st.dataframe(
-                        med_df[['CODE', 'DISPLAY', 'PERSON_COUNT', 'ORDER_COUNT']],
-                        use_container_width=True
-                    )
-                    
-                    # Download button
-                    csv = med_df.to_csv(index=False)
-                    st.download_button(
-                        label="📥 Download Medication Data",
-                        data=csv,
-                        file_name=f"{cluster_id}_medication_analytics.csv",
-                        mime="text/csv"
-                    )
-                else:
-                    st.info("No medication data found for these codes - none have ever been ordered.")
-                
-                # Show unused codes if any
-                if unused_codes > 0:
-                    st.subheader("Medications Never Ordered")
-                    st.caption(f"These {unused_codes} medication(s) are in the cluster but have never been ordered")
-                    
-                    # Get unused codes
-                    if not med_df.empty:
-                        used_codes_set = set(med_df['CODE'].tolist())
-                        all_codes_set = set(cluster_codes['CODE'].tolist()) if not cluster_codes.empty else set()
-                        unused_codes_set = all_codes_set - used_codes_set
-                        
-                        if unused_codes_set:
-                            unused_display_df = cluster_codes[cluster_codes['CODE'].isin(unused_codes_set)][['CODE', 'DISPLAY']]
-                            st.dataframe(unused_display_df, use_container_width=True)
-                    else:
-                        # All codes are unused
-                        st.dataframe(cluster_codes[['CODE', 'DISPLAY']], use_container_width=True)
-            
-            # Tab 3: Demographics
-            with tabs[2]:
-                st.subheader("👥 Age & Sex Distribution")
-                st.markdown("Age and sex breakdown of patients with medication orders in this cluster")
-                
-                with st.spinner("Loading demographics data..."):
-                    cluster_demographics = get_cluster_demographics(cluster_id, cluster_type)
-                    
-                    if not cluster_demographics.empty:
-                        summary = cluster_demographics.iloc[0]
-                        
-                        # Summary metrics
-                        col1, col2, col3, col4 = st.columns(4)
-                        with col1:
-                            st.metric("Active Patients", f"{summary['TOTAL_PATIENTS']:,.0f}")
-                        with col2:
-                            st.metric("Average Age", f"{summary['AVG_AGE']:.1f} years")
-                        with col3:
-                            male_pct = (summary['MALE_COUNT'] / summary['TOTAL_PATIENTS']) * 100
-                            st.metric("Male %", f"{male_pct:.1f}%")
-                        with col4:
-                            female_pct = (summary['FEMALE_COUNT'] / summary['TOTAL_PATIENTS']) * 100
-                            st.metric("Female %", f"{female_pct:.1f}%")
-                        
-                        # Population pyramid and age distribution charts
-                        age_sex_dist = get_cluster_age_sex_distribution(cluster_id, cluster_type)
-                        if not age_sex_dist.empty:
-                            create_population_pyramid(age_sex_dist)
-                            create_age_slope_chart(age_sex_dist)
-                        else:
-                            st.warning("No age/sex distribution data available")
-                        
-                        # Rates analysis moved to Care Teams tab
-                    else:
-                        st.info("No demographics data available for this cluster.")
-            
-            # Tab 4: Organisation Counts
-            with tabs[3]:
-                st.subheader("🏥 Organisation Analysis")
-                st.markdown("Patient counts by organisational unit")
-                
-                with st.spinner("Loading organisation data..."):
-                    # Load practice-level data (always needed for scatter plot)
-                    practice_rates = get_cluster_standardized_rates(cluster_id, cluster_type, "Practice")
-                    
-                    if not practice_rates.empty:
-                        # Summary metrics
-                        col1, col2, col3, col4 = st.columns(4)
-                        with col1:
-                            total_patients = practice_rates['PATIENTS_WITH_CODE'].sum()
-                            st.metric("Total Patients", f"{total_patients:,}")
-                        with col2:
-                            avg_rate = practice_rates['RATE_PER_1000'].mean()
-                            st.metric("Average Rate", f"{avg_rate:.2f} per 1,000")
-                        with col3:
-                            new_patients = practice_rates['NEW_PATIENTS_30D'].sum()
-                            st.metric("New (30 days)", f"{new_patients:,}")
-                        with col4:
-                            practice_count = len(practice_rates)
-                            st.metric("Practices", practice_count)
-                        
-                        st.divider()
-                        
-                        # Always show practice scatter plot
-                        st.subheader("Practice Distribution")
-                        scatter_chart = create_practice_scatter(practice_rates)
-                        if scatter_chart:
-                            st.altair_chart(scatter_chart, use_container_width=True)
-                        
-                        # Aggregated view section
-                        st.subheader("Aggregated View")
-                        
-                        # Aggregation level selector for bar chart
-                        col1, col2 = st.columns([1, 3])
-                        with col1:
-                            agg_level = st.selectbox(
-                                "Aggregate by:",
-                                options=["Borough", "PCN", "Neighbourhood"],
-                                index=0,
-                                help="Choose aggregation level for bar chart",
-                                key="org_agg_level"
-                            )
-                        
-                        # Load and display aggregated data
-                        agg_rates = get_cluster_standardized_rates(cluster_id, cluster_type, agg_level)
-                        if not agg_rates.empty:
-                            bar_chart = create_org_bar_chart(agg_rates, agg_level)
-                            if bar_chart:
-                                st.altair_chart(bar_chart, use_container_width=True)
-                        
-                        # Data table (always visible)
-                        st.subheader("Data Table")
-                        
-                        # Selector for which data to show in table
-                        table_view = st.radio(
-                            "Show data for:",
-                            options=["Practices", agg_level],
-                            horizontal=True,
-                            key="table_view_selector"
-                        )
-                        
-                        # Display appropriate data
-                        if table_view == "Practices":
-                            display_df = practice_rates.copy()
-                        else:
-                            display_df = agg_rates.copy()
-                        
-                        # Format the dataframe for display
-                        display_df['RATE_PER_1000'] = display_df['RATE_PER_1000'].round(2)
-                        display_df['AVG_AGE'] = display_df['AVG_AGE'].round(1)
-                        
-                        # Rename columns for display
-                        display_df = display_df.rename(columns={
-                            'UNIT_NAME': 'Practice' if table_view == "Practices" else agg_level,
-                            'TOTAL_POPULATION': 'Population',
-                            'PATIENTS_WITH_CODE': 'Patients',
-                            'AVG_AGE': 'Avg Age',
-                            'NEW_PATIENTS_30D': 'New (30d)',
-                            'RATE_PER_1000': 'Rate/1000'
-                        })
-                        
-                        st.dataframe(display_df, use_container_width=True)
-                        
-                        # Download button
-                        csv = display_df.to_csv(index=False)
-                        st.download_button(
-                            label="📥 Download Data",
-                            data=csv,
-                            file_name=f"rates_{table_view.lower().replace(' ', '_')}_{cluster_id}.csv",
-                            mime="text/csv"
-                        )
-                    else:
-                        st.info("No data available")
-            
-            # Tab 5: Health Equity
-            with tabs[4]:
-                st.subheader("⚖️ Health Equity Analysis")
-                st.markdown("Analysis of health inequalities across different population groups")
-                
-                with st.spinner("Loading health equity data..."):
-                    # Load all equity data
-                    ethnicity_data = get_cluster_ethnicity_analysis(cluster_id, cluster_type)
-                    deprivation_data = get_cluster_deprivation_analysis(cluster_id, cluster_type)
-                    language_data = get_cluster_language_analysis(cluster_id, cluster_type)
-                    neighbourhood_data = get_cluster_neighbourhood_analysis(cluster_id, cluster_type)
-                    
-                    # Ethnicity Analysis
-                    st.subheader("📊 Ethnicity")
-                    if not ethnicity_data.empty:
-                        create_ethnicity_bar_chart(ethnicity_data)
-                    else:
-                        st.info("No ethnicity data available")
-                    
-                    st.divider()
-                    
-                    # Deprivation Analysis
-                    st.subheader("💰 Social Deprivation")
-                    if not deprivation_data.empty:
-                        create_deprivation_line_chart(deprivation_data)
-                    else:
-                        st.info("No deprivation data available")
-                    
-                    st.divider()
-                    
-                    # Language Analysis
-                    st.subheader("🗣️ Language & Access")
-                    if not language_data.empty:
-                        create_language_bar_chart(language_data)
-                    else:
-                        st.info("No language data available")
-                    
-                    st.divider()
-                    
-                    # Neighbourhood Analysis
-                    st.subheader("🏘️ Neighbourhood Comparison")
-                    if not neighbourhood_data.empty:
-                        create_neighbourhood_bar_chart(neighbourhood_data)
-                    else:
-                        st.info("No neighbourhood data available")
-            
-            # Tab 6: SQL Templates  
-            with tabs[5]:
-                st.subheader("SQL Query Templates")
-                st.markdown("#### 💻 Data Export Queries")
-                st.markdown("Copy these queries to extract data from Snowflake. Each query is ready to run - just paste into your SQL editor.")
-                
-                # Basic codes query
-                st.markdown("### Get All Medication Codes in This Cluster")
-                query1 = f"""-- Get all SNOMED medication codes in cluster {cluster_id}
+    st.code(query5, language='sql')
+
+
+
+def _render_medication_overview(cluster_id, cluster_type):
+    """Render the Overview tab for a medication cluster"""
+    st.subheader("💊 Usage Summary")
+    metrics = _load_metrics(cluster_id, cluster_type)
+    med_df = code_usage(metrics, cluster_type)
+    if not med_df.empty:
+        # Get total cluster codes for comparison
+        cluster_codes = load_section_data("cluster_codes", lambda: get_cluster_cache(cluster_id))
+        total_codes_in_cluster = len(cluster_codes) if not cluster_codes.empty else 0
+        unused_codes = total_codes_in_cluster - len(med_df)
+
+        # Overview metrics
+        estimated, provisional = are_estimates(metrics), sampled_percent(metrics)
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            # Get distinct person count across all codes in cluster
+            total_persons, active_persons, total_orders = usage_totals(metrics)
+            st.metric(
+                f"Persons Ever Ordered (Active / Total)",
+                f"{format_count(active_persons, estimated, provisional)} / {format_count(total_persons, estimated, provisional)}"
+            )
+        with col2:
+            total_orders = med_df['ORDER_COUNT'].sum()
+            st.metric("Total Orders", format_count(total_orders, estimated, provisional))
+        with col3:
+            avg_per_person = total_orders / total_persons if total_persons > 0 else 0
+            st.metric("Avg per Person", f"{avg_per_person:.1f}")
+        with col4:
+            st.metric("Meds with Usage", f"{len(med_df)}/{total_codes_in_cluster}")
+        _render_estimate_note(estimated, provisional)
+
+        # Show unused codes warning if any
+        # Codes used by patients outside a sample aren't missing from the full data
+        if unused_codes > 0 and not provisional:
+            st.warning(f"⚠️ {unused_codes} medication(s) in this cluster have never been ordered")
+
+        # Usage over time chart integrated into overview
+        st.subheader("📈 Usage Over Time (Last 5 Years)")
+        time_df = usage_time_series(metrics, cluster_type)
+
+        if not time_df.empty:
+            st.markdown("**Orders per Month:**")
+            time_df['MONTH_YEAR'] = pd.to_datetime(time_df['MONTH_YEAR'])
+            chart_df = time_df.set_index('MONTH_YEAR')['ORDER_COUNT']
+            st.line_chart(chart_df, height=400)
+        else:
+            st.info("No medication data found in the last 5 years")
+    else:
+        st.info("No medication data found for these codes - none have ever been ordered.")
+
+
+def _render_medication_code_usage(cluster_id, cluster_type):
+    """Render the Code Usage tab for a medication cluster"""
+    st.subheader("📋 Code Usage Analysis")
+    
+    metrics = _load_metrics(cluster_id, cluster_type)
+    med_df = code_usage(metrics, cluster_type)
+
+    # Always get cluster codes for analysis
+    cluster_codes = load_section_data("cluster_codes", lambda: get_cluster_cache(cluster_id))
+    total_codes_in_cluster = len(cluster_codes) if not cluster_codes.empty else 0
+    used_codes = len(med_df) if not med_df.empty else 0
+    unused_codes = total_codes_in_cluster - used_codes
+
+    # Code-level breakdown (only show if we have data)
+    if not med_df.empty:
+        st.subheader("Medications Ever Ordered")
+        st.caption("Shows only medications that have been ordered at least once")
+        st.dataframe(
+            med_df[['CODE', 'DISPLAY', 'PERSON_COUNT', 'ORDER_COUNT']],
+            use_container_width=True
+        )
+
+        _render_estimate_note(are_estimates(metrics), sampled_percent(metrics))
+
+        # Download button
+        _render_download(
+            "📥 Download Medication Data", med_df.to_csv(index=False), f"{cluster_id}_medication_analytics.csv",
+            are_estimates(metrics),
+            lambda: code_usage(_load_exact_metrics(cluster_id, cluster_type), cluster_type).to_csv(index=False),
+            key=f"exact_code_usage_{cluster_id}"
+        )
+    else:
+        st.info("No medication data found for these codes - none have ever been ordered.")
+
+    # Show unused codes if any - not known until the exact count is in
+    if unused_codes > 0 and not sampled_percent(metrics):
+        st.subheader("Medications Never Ordered")
+        st.caption(f"These {unused_codes} medication(s) are in the cluster but have never been ordered")
+
+        # Get unused codes
+        if not med_df.empty:
+            used_codes_set = set(med_df['CODE'].tolist())
+            all_codes_set = set(cluster_codes['CODE'].tolist()) if not cluster_codes.empty else set()
+            unused_codes_set = all_codes_set - used_codes_set
+
+            if unused_codes_set:
+                unused_display_df = cluster_codes[cluster_codes['CODE'].isin(unused_codes_set)][['CODE', 'DISPLAY']]
+                st.dataframe(unused_display_df, use_container_width=True)
+        else:
+            # All codes are unused
+            st.dataframe(cluster_codes[['CODE', 'DISPLAY']], use_container_width=True)
+
+
+def _render_medication_sql_templates(cluster_id, cluster_type):
+    """Render the SQL Templates tab for a medication cluster"""
+    st.subheader("SQL Query Templates")
+    st.markdown("#### 💻 Data Export Queries")
+    st.markdown("Copy these queries to extract data from Snowflake. Each query is ready to run - just paste into your SQL editor.")
+    
+    # Basic codes query
+    st.markdown("### Get All Medication Codes in This Cluster")
+    query1 = f"""-- Get all SNOMED medication codes in cluster {cluster_id}
 SELECT 
     code,
     display,
@@ -740,11 +520,11 @@ SELECT
 FROM {DB_SCHEMA}.ecl_cache
 WHERE cluster_id = '{cluster_id}'
 ORDER BY code;"""
-                st.code(query1, language='sql')
-                
-                # Patient medication list
-                st.markdown("### Get Patients on These Medications")
-                query2 = f"""-- Get list of patients with medication orders in cluster {cluster_id}
+    st.code(query1, language='sql')
+    
+    # Patient medication list
+    st.markdown("### Get Patients on These Medications")
+    query2 = f"""-- Get list of patients with medication orders in cluster {cluster_id}
 SELECT DISTINCT
     d.person_id,
     d.practice_name,
@@ -760,11 +540,11 @@ WHERE ec.cluster_id = '{cluster_id}'
 AND d.is_active = true
 GROUP BY d.person_id, d.practice_name, d.age, d.sex
 ORDER BY order_count DESC;"""
-                st.code(query2, language='sql')
-                
-                # Practice prescribing patterns
-                st.markdown("### Prescribing Patterns by Practice")
-                query3 = f"""-- Get practice-level prescribing for cluster {cluster_id}
+    st.code(query2, language='sql')
+    
+    # Practice prescribing patterns
+    st.markdown("### Prescribing Patterns by Practice")
+    query3 = f"""-- Get practice-level prescribing for cluster {cluster_id}
 SELECT 
     d.practice_name,
     d.pcn_name,
@@ -781,11 +561,11 @@ AND d.is_active = true
 GROUP BY d.practice_name, d.pcn_name, d.borough_registered
 HAVING patient_count >= 5  -- Privacy threshold
 ORDER BY patient_count DESC;"""
-                st.code(query3, language='sql')
-                
-                # Monthly prescribing trends
-                st.markdown("### Monthly Prescribing Trends")
-                query4 = f"""-- Get monthly medication order counts for cluster {cluster_id}
+    st.code(query3, language='sql')
+    
+    # Monthly prescribing trends
+    st.markdown("### Monthly Prescribing Trends")
+    query4 = f"""-- Get monthly medication order counts for cluster {cluster_id}
 SELECT 
     DATE_TRUNC('month', mo.clinical_effective_date) as month,
     COUNT(DISTINCT d.person_id) as unique_patients,
@@ -799,11 +579,11 @@ AND mo.clinical_effective_date >= DATEADD('month', -24, CURRENT_DATE())
 AND mo.clinical_effective_date < CURRENT_DATE()
 GROUP BY DATE_TRUNC('month', mo.clinical_effective_date)
 ORDER BY month DESC;"""
-                st.code(query4, language='sql')
-                
-                # Top medications
-                st.markdown("### Most Prescribed Medications")
-                query5 = f"""-- Get top medications by patient count for cluster {cluster_id}
+    st.code(query4, language='sql')
+    
+    # Top medications
+    st.markdown("### Most Prescribed Medications")
+    query5 = f"""-- Get top medications by patient count for cluster {cluster_id}
 SELECT 
     ec.code,
     ec.display,
@@ -817,4 +597,257 @@ WHERE ec.cluster_id = '{cluster_id}'
 GROUP BY ec.code, ec.display
 ORDER BY patient_count DESC
 LIMIT 20;"""
-                st.code(query5, language='sql')
\ No newline at end of file
+    st.code(query5, language='sql')
+
+
+def _render_age_sex(cluster_id, cluster_type):
+    """Render the Age/Sex tab"""
+    st.subheader("👥 Age & Sex Distribution")
+    if cluster_type == 'MEDICATION':
+        st.markdown("Age and sex breakdown of patients with medication orders in this cluster")
+    else:
+        st.markdown("Age and sex breakdown of patients with observations in this cluster")
+
+    metrics = _load_metrics(cluster_id, cluster_type)
+    with st.spinner("Loading demographics data..."):
+        cluster_demographics = demographics_summary(metrics)
+
+        if not cluster_demographics.empty:
+            summary = cluster_demographics.iloc[0]
+
+            # Summary metrics
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.metric(
+                    "Active Patients",
+                    format_count(summary['TOTAL_PATIENTS'], are_estimates(metrics), sampled_percent(metrics))
+                )
+            with col2:
+                st.metric("Average Age", f"{summary['AVG_AGE']:.1f} years")
+            with col3:
+                male_pct = (summary['MALE_COUNT'] / summary['TOTAL_PATIENTS']) * 100
+                st.metric("Male %", f"{male_pct:.1f}%")
+            with col4:
+                female_pct = (summary['FEMALE_COUNT'] / summary['TOTAL_PATIENTS']) * 100
+                st.metric("Female %", f"{female_pct:.1f}%")
+            _render_estimate_note(are_estimates(metrics), sampled_percent(metrics))
+
+            # Population pyramid and age distribution charts
+            age_sex_dist = age_sex_distribution(metrics)
+            if not age_sex_dist.empty:
+                create_population_pyramid(age_sex_dist)
+                create_age_slope_chart(age_sex_dist)
+            else:
+                st.warning("No age/sex distribution data available")
+
+            # Rates analysis moved to Care Teams tab
+        else:
+            st.info("No demographics data available for this cluster.")
+
+
+def _format_rates_table(rates, unit_label):
+    """Rates table rounded and with display column names"""
+    display_df = rates.copy()
+    display_df['RATE_PER_1000'] = display_df['RATE_PER_1000'].round(2)
+    display_df['AVG_AGE'] = display_df['AVG_AGE'].round(1)
+    return display_df.rename(columns={
+        'UNIT_NAME': unit_label,
+        'TOTAL_POPULATION': 'Population',
+        'PATIENTS_WITH_CODE': 'Patients',
+        'AVG_AGE': 'Avg Age',
+        'NEW_PATIENTS_30D': 'New (30d)',
+        'RATE_PER_1000': 'Rate/1000'
+    })
+
+
+def _render_organisation(cluster_id, cluster_type):
+    """Render the Organisation tab"""
+    st.subheader("🏥 Organisation Analysis")
+    st.markdown("Patient counts by organisational unit")
+
+    if _fast_mode():
+        # Practice sketches roll up to every other level without another query
+        with st.spinner("Loading cluster analytics..."):
+            sketches = load_section_data("practice_sketches", lambda: get_practice_sketches(cluster_id, cluster_type))
+        unit_rates = lambda population, level: org_rates_from_sketches(sketches, population, level)
+        estimated, provisional = True, None
+    else:
+        metrics = _load_metrics(cluster_id, cluster_type)
+        unit_rates = lambda population, level: org_rates(metrics, population, level)
+        estimated, provisional = are_estimates(metrics), sampled_percent(metrics)
+
+    with st.spinner("Loading organisation data..."):
+        # Load practice-level data (always needed for scatter plot)
+        practice_population = get_active_population(ORG_LEVEL_COLUMNS["Practice"])
+        practice_rates = unit_rates(practice_population, "Practice")
+
+        if not practice_rates.empty:
+            # Summary metrics
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                total_patients = practice_rates['PATIENTS_WITH_CODE'].sum()
+                st.metric("Total Patients", format_count(total_patients, estimated, provisional))
+            with col2:
+                avg_rate = practice_rates['RATE_PER_1000'].mean()
+                st.metric("Average Rate", f"{avg_rate:.2f} per 1,000")
+            with col3:
+                new_patients = practice_rates['NEW_PATIENTS_30D'].sum()
+                st.metric("New (30 days)", format_count(new_patients, estimated, provisional))
+            with col4:
+                practice_count = len(practice_rates)
+                st.metric("Practices", practice_count)
+            _render_estimate_note(estimated, provisional)
+
+            st.divider()
+
+            # Always show practice scatter plot
+            st.subheader("Practice Distribution")
+            scatter_chart = create_practice_scatter(practice_rates)
+            if scatter_chart:
+                st.altair_chart(scatter_chart, use_container_width=True)
+
+            # Aggregated view section
+            st.subheader("Aggregated View")
+
+            # Aggregation level selector for bar chart
+            col1, col2 = st.columns([1, 3])
+            with col1:
+                agg_level = st.selectbox(
+                    "Aggregate by:",
+                    options=["Borough", "PCN", "Neighbourhood"],
+                    index=0,
+                    help="Choose aggregation level for bar chart",
+                    key="org_agg_level"
+                )
+
+            # Load and display aggregated data
+            agg_population = get_active_population(ORG_LEVEL_COLUMNS[agg_level])
+            agg_rates = unit_rates(agg_population, agg_level)
+            if not agg_rates.empty:
+                bar_chart = create_org_bar_chart(agg_rates, agg_level)
+                if bar_chart:
+                    st.altair_chart(bar_chart, use_container_width=True)
+
+            # Data table (always visible)
+            st.subheader("Data Table")
+
+            # Selector for which data to show in table
+            table_view = st.radio(
+                "Show data for:",
+                options=["Practices", agg_level],
+                horizontal=True,
+                key="table_view_selector"
+            )
+
+            # Display appropriate data
+            if table_view == "Practices":
+                level, population, rates = "Practice", practice_population, practice_rates
+            else:
+                level, population, rates = agg_level, agg_population, agg_rates
+            unit_label = 'Practice' if table_view == "Practices" else agg_level
+            display_df = _format_rates_table(rates, unit_label)
+
+            st.dataframe(display_df, use_container_width=True)
+
+            # Download button
+            _render_download(
+                "📥 Download Data", display_df.to_csv(index=False),
+                f"rates_{table_view.lower().replace(' ', '_')}_{cluster_id}.csv", estimated,
+                lambda: _format_rates_table(
+                    org_rates(_load_exact_metrics(cluster_id, cluster_type), population, level), unit_label
+                ).to_csv(index=False),
+                key=f"exact_rates_{cluster_id}"
+            )
+        else:
+            st.info("No data available")
+
+
+# Tabs per cluster type: (label, renderer)
+ANALYTICS_TABS = {
+    'OBSERVATION': [
+        ("📊 Overview", _render_observation_overview),
+        ("📄 Code Usage", _render_observation_code_usage),
+        ("👥 Age/Sex", _render_age_sex),
+        ("🏥 Organisation Counts", _render_organisation),
+        ("⚖️ Health Equity", _render_health_equity),
+        ("💻 SQL Templates", _render_observation_sql_templates),
+    ],
+    'MEDICATION': [
+        ("💊 Overview", _render_medication_overview),
+        ("📄 Code Usage", _render_medication_code_usage),
+        ("👥 Age/Sex", _render_age_sex),
+        ("🏥 Care Teams", _render_organisation),
+        ("⚖️ Health Equity", _render_health_equity),
+        ("💻 SQL Templates", _render_medication_sql_templates),
+    ],
+}
+
+
+def render_analytics():
+    """Render the Analytics page"""
+    if not st.session_state.selected_cluster:
+        st.error("No cluster selected")
+        st.session_state.page = 'home'
+        rerun()
+    
+    cluster_id = st.session_state.selected_cluster
+    
+    # Header with back button
+    col1, col2 = st.columns([1, 6])
+    with col1:
+        if st.button("← Back", use_container_width=True):
+            st.session_state.page = 'details'
+            rerun()
+    
+    st.title(f"📈 Analytics: {cluster_id}")
+    st.toggle(
+        "⚡ Fast mode",
+        key="analytics_fast_mode",
+        help="Estimate patient and event counts with HyperLogLog instead of counting them exactly. "
+             "Much cheaper on large clusters; downloads are still counted exactly."
+    )
+    st.toggle(
+        "⏩ Progressive",
+        key="analytics_progressive",
+        disabled=_fast_mode(),
+        help=f"Show counts scaled up from a {PROVISIONAL_SAMPLE_PERCENT}% sample of patients straight away, "
+             "and swap in the exact counts when they finish."
+    )
+    status = st.container()
+    
+    # Get cluster information
+    clusters_df = get_all_clusters()
+    cluster_info = clusters_df[clusters_df['CLUSTER_ID'] == cluster_id]
+    if cluster_info.empty:
+        st.error(f"Cluster '{cluster_id}' not found")
+        st.session_state.page = 'home'
+        rerun()
+        
+    cluster = cluster_info.iloc[0]
+    cluster_type = cluster.get('CLUSTER_TYPE', 'OBSERVATION')
+    
+    # Check if cluster has cached data
+    if not cluster.get('RECORD_COUNT') or cluster.get('RECORD_COUNT') == 0:
+        st.warning("⚠️ This cluster has no cached codes. Please refresh the cluster first.")
+        if st.button("🔄 Refresh Cluster Now"):
+            result = refresh_cluster(cluster_id, force=True)
+            if result.startswith("SUCCESS"):
+                st.success(f"✅ {result}")
+                time.sleep(1)
+                rerun()
+            else:
+                st.error(f"❌ {result}")
+    else:
+        # Default to observation if type is unknown
+        if cluster_type not in ANALYTICS_TABS:
+            cluster_type = 'OBSERVATION'
+        
+        # Loaded section data is kept until the cluster or its refresh changes
+        reset_section_results((cluster_id, str(cluster.get('LAST_SUCCESSFUL_REFRESH'))))
+        
+        # Only the selected tab's queries run on each rerun
+        tabs = ANALYTICS_TABS[cluster_type]
+        selected_tab = render_lazy_tabs([label for label, _ in tabs], key="analytics_tab")
+        render_tab = dict(tabs)[selected_tab]
+        render_tab(cluster_id, cluster_type)
+        _render_exact_progress(status)
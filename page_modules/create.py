@@ -4,7 +4,7 @@
 
 import streamlit as st
 from database import rerun
-from services.cluster_service import test_ecl_expression, create_new_cluster
+from services.cluster_service import preview_ecl_expression, create_new_cluster
 
 
 def render_create():
@@ -99,12 +99,12 @@ def render_create():
             else:
                 # Test ECL expression first
                 st.info("🧪 Testing ECL expression...")
-                test_result = test_ecl_expression(ecl_expression.strip())
+                _, code_count = preview_ecl_expression(ecl_expression.strip())
                 
-                if test_result.empty:
+                if not code_count:
                     st.error("❌ ECL expression is invalid or returns no results. Please test in the Playground first.")
                 else:
-                    st.success(f"✅ ECL expression is valid! Found {len(test_result):,} codes")
+                    st.success(f"✅ ECL expression is valid! Found {code_count:,} codes")
                     
                     # Create cluster
                     with st.spinner("Creating cluster..."):
@@ -7,7 +7,7 @@ import pandas as pd
 import time
 from database import rerun
 from services.cluster_service import get_all_clusters, get_cluster_cache, refresh_cluster, delete_cluster
-from services.analytics_service import get_observation_analytics, get_distinct_persons_obs, get_observation_time_series, get_cluster_demographics, get_cluster_age_sex_distribution, get_cluster_standardized_rates
+from services.overlap_service import get_similar_clusters
 from components.cluster_components import render_flash_message, render_change_history
 from components.chart_components import create_practice_scatter, create_org_bar_chart
 from utils.helpers import format_time_ago, format_ecl_for_display
@@ -173,6 +173,10 @@ def render_details():
         else:
             st.info(f"No codes match '{code_search}'")
     
+    # Clusters with overlapping code sets
+    if not cache_df.empty:
+        render_similar_clusters(cluster_id)
+    
     # SQL query section
     if cluster['ECL_EXPRESSION']:
         st.subheader("💻 SQL Query")
@@ -188,4 +192,34 @@ ORDER BY code;"""
         st.code(sql_query, language='sql')
     
     # Change history
-    render_change_history(cluster_id, cluster)
\ No newline at end of file
+    render_change_history(cluster_id, cluster)
+
+def render_similar_clusters(cluster_id):
+    """Clusters whose code sets overlap this one's, with a jump to each"""
+    st.subheader("🔗 Similar Clusters")
+    similar_df = get_similar_clusters(cluster_id)
+    if similar_df.empty:
+        st.caption("No other cluster shares most of its codes with this one.")
+        return
+    
+    display_df = similar_df[['OTHER_CLUSTER_ID', 'RELATION', 'SHARED_CODES', 'OTHER_CODES', 'JACCARD']].rename(columns={
+        'OTHER_CLUSTER_ID': 'Cluster', 'RELATION': 'Relation', 'SHARED_CODES': 'Shared Codes',
+        'OTHER_CODES': 'Codes', 'JACCARD': 'Overlap'
+    })
+    display_df['Relation'] = display_df['Relation'].map({
+        'identical': 'Identical', 'subset': 'Contains this cluster',
+        'superset': 'Contained in this cluster', 'overlap': 'Overlaps'
+    })
+    st.dataframe(
+        display_df, use_container_width=True, hide_index=True,
+        column_config={'Overlap': st.column_config.ProgressColumn('Overlap', format='%.2f', min_value=0, max_value=1)}
+    )
+    
+    col1, col2 = st.columns([4, 1])
+    with col1:
+        other_id = st.selectbox("Open similar cluster", similar_df['OTHER_CLUSTER_ID'].tolist(),
+                                key=f"similar_{cluster_id}", label_visibility="collapsed")
+    with col2:
+        if st.button("Open", use_container_width=True, key=f"open_similar_{cluster_id}"):
+            st.session_state.selected_cluster = other_id
+            rerun()
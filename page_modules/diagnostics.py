@@ -0,0 +1,121 @@
+# =============================================================================
+# SNOMED Cluster Manager - Diagnostics Page
+# =============================================================================
+
+import streamlit as st
+from database import rerun
+from services.cache_service import get_query_cache
+from services.diagnostics_service import get_query_log, current_session_id
+
+
+def _hit_rate(hits, misses):
+    """Cache hit rate as a percentage string"""
+    lookups = hits + misses
+    return f"{hits / lookups:.0%}" if lookups else "-"
+
+
+def render_diagnostics():
+    """Render the hidden query diagnostics page"""
+    col1, col2 = st.columns([1, 6])
+    with col1:
+        if st.button("← Back", use_container_width=True):
+            st.session_state.page = 'home'
+            rerun()
+
+    st.title("🩺 Query Diagnostics")
+
+    scope = st.radio("Scope", ["This session", "All sessions"], horizontal=True)
+    session_id = current_session_id() if scope == "This session" else None
+
+    query_log = get_query_log()
+    queries = query_log.queries(session_id)
+    cache_events = query_log.cache_events(session_id)
+
+    hits = int(cache_events['HITS'].sum()) if not cache_events.empty else 0
+    misses = int(cache_events['MISSES'].sum()) if not cache_events.empty else 0
+
+    # Summary metrics
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Queries", f"{len(queries):,}")
+    with col2:
+        total_seconds = queries['WALL_MS'].sum() / 1000 if not queries.empty else 0
+        st.metric("Warehouse Time", f"{total_seconds:,.1f}s")
+    with col3:
+        errors = int(queries['ERROR'].notna().sum()) if not queries.empty else 0
+        st.metric("Errors", errors)
+    with col4:
+        st.metric("Cache Hit Rate", _hit_rate(hits, misses))
+
+    if queries.empty:
+        st.info("No queries recorded yet.")
+    else:
+        # Per-page query counts
+        st.subheader("Queries by Page")
+        by_page = queries.fillna({'PAGE': '(none)'}).groupby('PAGE').agg(
+            QUERIES=('QUERY', 'size'),
+            TOTAL_MS=('WALL_MS', 'sum'),
+            MEDIAN_MS=('WALL_MS', 'median'),
+            ROWS=('ROWS', 'sum')
+        ).reset_index().sort_values('TOTAL_MS', ascending=False)
+        st.dataframe(by_page, use_container_width=True, hide_index=True)
+
+        # Per-function timings
+        st.subheader("Queries by Service Function")
+        by_function = queries.groupby('FUNCTION').agg(
+            QUERIES=('QUERY', 'size'),
+            STATEMENTS=('QUERY', 'nunique'),
+            TOTAL_MS=('WALL_MS', 'sum'),
+            MEDIAN_MS=('WALL_MS', 'median'),
+            MAX_MS=('WALL_MS', 'max'),
+            ROWS=('ROWS', 'sum'),
+            BYTES=('BYTES', 'sum')
+        ).reset_index().sort_values('TOTAL_MS', ascending=False)
+        st.dataframe(by_function, use_container_width=True, hide_index=True)
+
+        # Slowest individual queries
+        st.subheader("Slowest Queries")
+        slowest = queries.sort_values('WALL_MS', ascending=False).head(25)
+        st.dataframe(
+            slowest[['TIMESTAMP', 'PAGE', 'FUNCTION', 'MODE', 'WALL_MS', 'ROWS', 'BYTES', 'SFQID', 'ERROR', 'QUERY', 'PARAMS']],
+            use_container_width=True,
+            hide_index=True
+        )
+
+    # Cache effectiveness
+    st.subheader("Query Cache")
+    cache = get_query_cache()
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Cached Entries", f"{len(cache):,}")
+    with col2:
+        st.metric("Process Hits / Misses", f"{cache.hits:,} / {cache.misses:,}")
+    with col3:
+        st.metric("Process Hit Rate", _hit_rate(cache.hits, cache.misses))
+
+    if not cache_events.empty:
+        by_cached_function = cache_events.groupby('FUNCTION')[['HITS', 'MISSES']].sum().reset_index()
+        by_cached_function['HIT_RATE'] = [
+            _hit_rate(h, m) for h, m in zip(by_cached_function['HITS'], by_cached_function['MISSES'])
+        ]
+        st.dataframe(
+            by_cached_function.sort_values('MISSES', ascending=False),
+            use_container_width=True,
+            hide_index=True
+        )
+
+    st.markdown("---")
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("🗑️ Clear Query Log", use_container_width=True):
+            query_log.clear()
+            rerun()
+    with col2:
+        if not queries.empty:
+            st.download_button(
+                label="📥 Download Query Log",
+                data=queries.to_csv(index=False),
+                file_name="query_log.csv",
+                mime="text/csv",
+                use_container_width=True
+            )
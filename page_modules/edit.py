@@ -4,7 +4,7 @@
 
 import streamlit as st
 from database import rerun
-from services.cluster_service import test_ecl_expression, update_existing_cluster, rename_cluster, get_all_clusters
+from services.cluster_service import preview_ecl_expression, update_existing_cluster, rename_cluster, get_all_clusters
 from components.cluster_components import render_flash_message
 
 
@@ -109,13 +109,13 @@ def render_edit():
                 # Test ECL expression if changed
                 if current_ecl != cluster.get('ECL_EXPRESSION', ''):
                     st.info("🧪 Testing updated ECL expression...")
-                    test_result = test_ecl_expression(current_ecl)
+                    _, code_count = preview_ecl_expression(current_ecl)
                     
-                    if test_result.empty:
+                    if not code_count:
                         st.error("❌ ECL expression is invalid or returns no results. Please test in the Playground first.")
                         st.stop()
                     else:
-                        st.success(f"✅ ECL expression is valid! Found {len(test_result):,} codes")
+                        st.success(f"✅ ECL expression is valid! Found {code_count:,} codes")
                 
                 # Update cluster
                 with st.spinner("Updating cluster..."):
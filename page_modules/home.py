@@ -6,8 +6,9 @@ import streamlit as st
 import pandas as pd
 from database import rerun
 from services.cluster_service import get_all_clusters
+from services.analytics_service import get_clusters_usage
 from components.cluster_components import render_flash_message
-from utils.helpers import get_status_emoji, format_time_ago
+from utils.helpers import get_status_emoji, format_time_ago, format_sparkline
 from config import CLUSTER_TYPE_DISPLAY, STALE_LABEL
 
 
@@ -44,7 +45,18 @@ def render_home():
             total_codes = clusters_df['RECORD_COUNT'].fillna(0).sum()
             st.metric("Total Codes", f"{int(total_codes):,}")
         
+        if st.button("📊 Portfolio Overview", help="Usage across all clusters"):
+            st.session_state.page = 'portfolio'
+            rerun()
+
         st.markdown("---")
+
+        # Usage for every cluster scans both event tables - only on request
+        usage = None
+        if st.toggle("👥 Show usage", key="home_show_usage",
+                     help="Patients, trend and last use for every cluster - one scan of the event tables"):
+            usage = get_clusters_usage()
+            usage = usage.set_index('CLUSTER_ID') if not usage.empty else None
         
         # Search bar
         st.subheader("Search Clusters")
@@ -68,7 +80,7 @@ def render_home():
                 status_emoji = get_status_emoji(cluster, STALE_LABEL)
                 
                 # Row layout
-                col1, col2, col3, col4, col5 = st.columns([0.3, 3.5, 2.2, 1.4, 1])
+                col1, col2, col3, col4, col5, col6 = st.columns([0.3, 3.0, 1.8, 1.8, 1.3, 1])
                 
                 with col1:
                     st.markdown(f"<div style='text-align: center; line-height: 1.2;'>{status_emoji}</div>", 
@@ -93,13 +105,25 @@ def render_home():
                     st.caption(f"Refreshed {refresh_text}")
                 
                 with col4:
+                    # Usage and trend over the last months
+                    if usage is not None and cluster['CLUSTER_ID'] in usage.index:
+                        cluster_usage = usage.loc[cluster['CLUSTER_ID']]
+                        patients = int(cluster_usage['PERSON_COUNT'])
+                        st.text(f"{patients:,} patient{'s' if patients != 1 else ''}")
+                        if patients:
+                            st.caption(f"{format_sparkline(cluster_usage['TREND'])} · "
+                                       f"used {format_time_ago(cluster_usage['LAST_USED'])}")
+                        else:
+                            st.caption("Not used")
+
+                with col5:
                     updated_by = cluster.get('UPDATED_BY', 'N/A')
                     if pd.isna(updated_by):
                         updated_by = 'N/A'
                     st.caption("Updated by")
                     st.text(str(updated_by))
 
-                with col5:
+                with col6:
                     # Action buttons
                     btn_col1, btn_col2 = st.columns(2)
                     with btn_col1:
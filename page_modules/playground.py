@@ -4,7 +4,7 @@
 
 import streamlit as st
 from database import rerun
-from services.cluster_service import test_ecl_expression
+from services.cluster_service import test_ecl_expression, preview_ecl_expression, export_ecl_expression_csv, local_ecl_available
 
 
 def render_playground():
@@ -38,6 +38,8 @@ def render_playground():
         st.session_state.playground_test_results = None
     if 'playground_tested_ecl' not in st.session_state:
         st.session_state.playground_tested_ecl = None
+    if 'playground_test_total' not in st.session_state:
+        st.session_state.playground_test_total = 0
     
     # Handle example selection
     if "selected_example_ecl" in st.session_state:
@@ -63,8 +65,13 @@ def render_playground():
     # Test button
     test_clicked = st.button("🔍 Test Expression", type="primary")
     
-    # Warning about API limit
-    st.caption("⚠️ Queries returning more than 50,000 codes will error due to API limits")
+    # Warning about API limit - none when expanded from the local index
+    local_ecl = local_ecl_available()
+    if local_ecl:
+        st.caption("⚡ Expanded locally from the terminology index, with no code limit. "
+                   "Expressions with filters or history go to the terminology server")
+    else:
+        st.caption("⚠️ Queries returning more than 50,000 codes will error due to API limits")
     
     # Get the current ECL expression value
     test_ecl = st.session_state.get("ecl_input", st.session_state.playground_ecl).strip()
@@ -74,14 +81,18 @@ def render_playground():
         # Update session state with the current value to persist it
         st.session_state.playground_ecl = test_ecl
         with st.spinner("Testing ECL expression..."):
-            result_df = test_ecl_expression(test_ecl)
+            result_df, total_codes = preview_ecl_expression(test_ecl)
         
-        # Store test results in session state
+        # Store test results in session state - only the first rows, the full
+        # result is fetched if the user searches or exports
+        st.session_state.pop("playground_export_csv", None)
         if not result_df.empty:
             st.session_state.playground_test_results = result_df
+            st.session_state.playground_test_total = total_codes
             st.session_state.playground_tested_ecl = test_ecl
         else:
             st.session_state.playground_test_results = None
+            st.session_state.playground_test_total = 0
             st.session_state.playground_tested_ecl = None
             st.error("❌ ECL expression returned no results or contains errors")
     
@@ -93,21 +104,27 @@ def render_playground():
         st.session_state.playground_tested_ecl == test_ecl):
         
         result_df = st.session_state.playground_test_results
+        total_codes = st.session_state.playground_test_total
         
         # Show appropriate limit message based on result count
-        if len(result_df) == 50000:
-            st.success(f"✅ ECL expression is valid! Found {len(result_df):,} codes (showing first 50,000)")
-        elif len(result_df) == 10000:
-            st.success(f"✅ ECL expression is valid! Found {len(result_df):,} codes (showing first 10,000)")
+        if local_ecl:
+            st.success(f"✅ ECL expression is valid! Found {total_codes:,} codes")
+        elif total_codes == 50000:
+            st.success(f"✅ ECL expression is valid! Found {total_codes:,} codes (showing first 50,000)")
+        elif total_codes == 10000:
+            st.success(f"✅ ECL expression is valid! Found {total_codes:,} codes (showing first 10,000)")
         else:
-            st.success(f"✅ ECL expression is valid! Found {len(result_df):,} codes")
+            st.success(f"✅ ECL expression is valid! Found {total_codes:,} codes")
         
         # Search functionality
         search_term = st.text_input("🔍 Search results", placeholder="Search by code or description...", key="search_results_input")
         
-        # Filter results
+        # Filter results - searching needs every code, not just the preview
         filtered_df = result_df
         if search_term:
+            if total_codes > len(result_df):
+                with st.spinner(f"Loading all {total_codes:,} codes..."):
+                    result_df = test_ecl_expression(test_ecl)
             mask = (result_df['CODE'].astype(str).str.contains(search_term, case=False, na=False) | 
                    result_df['DISPLAY'].str.contains(search_term, case=False, na=False))
             filtered_df = result_df[mask]
@@ -116,8 +133,23 @@ def render_playground():
         if not filtered_df.empty:
             st.dataframe(filtered_df, use_container_width=True)
             
-            if len(filtered_df) < len(result_df):
+            if search_term and len(filtered_df) < len(result_df):
                 st.caption(f"Showing {len(filtered_df)} of {len(result_df)} results")
+            elif len(filtered_df) < total_codes:
+                st.caption(f"Showing first {len(filtered_df):,} of {total_codes:,} codes - search or export to see the rest")
+            
+            # Export all codes, streamed from the warehouse in batches
+            if "playground_export_csv" in st.session_state:
+                st.download_button(
+                    label="📥 Download CSV",
+                    data=st.session_state["playground_export_csv"],
+                    file_name="ecl_codes.csv",
+                    mime="text/csv"
+                )
+            elif st.button("📥 Export all codes"):
+                with st.spinner(f"Exporting {total_codes:,} codes..."):
+                    st.session_state["playground_export_csv"] = export_ecl_expression_csv(test_ecl)
+                rerun()
             
             # Quick create cluster section
             st.markdown("---")
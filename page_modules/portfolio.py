@@ -0,0 +1,153 @@
+# =============================================================================
+# SNOMED Cluster Manager - Portfolio Page
+# =============================================================================
+
+import streamlit as st
+from database import rerun
+from services.cluster_service import get_all_clusters
+from services.analytics_service import get_clusters_usage
+from services.cohort_service import build_cohort, get_cohort_overlap
+from config import USAGE_TREND_MONTHS
+
+
+def render_portfolio():
+    """Render the Portfolio page - usage across every cluster"""
+
+    # Header with back button
+    col1, col2 = st.columns([1, 6])
+    with col1:
+        if st.button("← Back", use_container_width=True):
+            st.session_state.page = 'home'
+            rerun()
+
+    st.title("📊 Cluster Portfolio")
+    st.markdown("Usage of every cluster's code set in the event data.")
+
+    clusters_df = get_all_clusters()
+    if clusters_df.empty:
+        st.info("No clusters found.")
+        return
+
+    with st.spinner("Loading cluster usage..."):
+        usage = get_clusters_usage()
+    if usage.empty:
+        st.error("Unable to load cluster usage")
+        return
+
+    portfolio = usage.merge(
+        clusters_df[['CLUSTER_ID', 'DESCRIPTION', 'RECORD_COUNT', 'LAST_SUCCESSFUL_REFRESH']],
+        on='CLUSTER_ID', how='left'
+    )
+    portfolio['RECENT_EVENTS'] = portfolio['TREND'].apply(sum)
+
+    # Summary metrics
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Clusters", len(portfolio))
+    with col2:
+        st.metric(f"Used (last {USAGE_TREND_MONTHS} months)", int((portfolio['RECENT_EVENTS'] > 0).sum()))
+    with col3:
+        st.metric("Never Used", int((portfolio['EVENT_COUNT'] == 0).sum()))
+    with col4:
+        st.metric("Total Events", f"{int(portfolio['EVENT_COUNT'].sum()):,}")
+
+    st.divider()
+
+    # Filters
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        cluster_type = st.selectbox("Type:", options=["All", "OBSERVATION", "MEDICATION"], key="portfolio_type")
+    with col2:
+        search_term = st.text_input("Search:", placeholder="Search by name or description...", key="portfolio_search")
+    if cluster_type != "All":
+        portfolio = portfolio[portfolio['CLUSTER_TYPE'] == cluster_type]
+    if search_term:
+        mask = (portfolio['CLUSTER_ID'].str.contains(search_term, case=False, na=False) |
+                portfolio['DESCRIPTION'].str.contains(search_term, case=False, na=False))
+        portfolio = portfolio[mask]
+
+    if portfolio.empty:
+        st.info("No clusters match the filters")
+        return
+
+    table = portfolio[[
+        'CLUSTER_ID', 'CLUSTER_TYPE', 'DESCRIPTION', 'RECORD_COUNT', 'PERSON_COUNT', 'EVENT_COUNT',
+        'RECENT_EVENTS', 'TREND', 'LAST_USED', 'LAST_SUCCESSFUL_REFRESH'
+    ]].sort_values('RECENT_EVENTS', ascending=False)
+    st.dataframe(
+        table,
+        use_container_width=True,
+        hide_index=True,
+        column_config={
+            'CLUSTER_ID': "Cluster",
+            'CLUSTER_TYPE': "Type",
+            'DESCRIPTION': "Description",
+            'RECORD_COUNT': st.column_config.NumberColumn("Codes", format="%d"),
+            'PERSON_COUNT': st.column_config.NumberColumn("Patients", format="%d"),
+            'EVENT_COUNT': st.column_config.NumberColumn("Events", format="%d"),
+            'RECENT_EVENTS': st.column_config.NumberColumn(f"Events ({USAGE_TREND_MONTHS}m)", format="%d"),
+            'TREND': st.column_config.LineChartColumn(f"Monthly events ({USAGE_TREND_MONTHS}m)", y_min=0),
+            'LAST_USED': st.column_config.DateColumn("Last Used"),
+            'LAST_SUCCESSFUL_REFRESH': st.column_config.DatetimeColumn("Refreshed")
+        }
+    )
+
+    # Download button
+    csv = table.assign(TREND=table['TREND'].apply(lambda trend: " ".join(str(v) for v in trend))).to_csv(index=False)
+    st.download_button(
+        label="📥 Download Portfolio",
+        data=csv,
+        file_name="cluster_portfolio.csv",
+        mime="text/csv"
+    )
+
+    # Drill into one cluster
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        selected = st.selectbox("Open analytics for:", options=table['CLUSTER_ID'].tolist(), key="portfolio_cluster")
+    with col2:
+        st.markdown("<br>", unsafe_allow_html=True)
+        if st.button("📈 Analytics", use_container_width=True):
+            st.session_state.selected_cluster = selected
+            st.session_state.page = 'analytics'
+            rerun()
+
+    st.divider()
+    render_cohort_builder(clusters_df['CLUSTER_ID'].tolist())
+
+
+def render_cohort_builder(cluster_ids):
+    """Count active patients in combinations of clusters"""
+    st.subheader("🧩 Patient Cohorts")
+    st.markdown("Active patients with events in combinations of clusters.")
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        all_of = st.multiselect("In all of:", options=cluster_ids, key="cohort_all")
+    with col2:
+        any_of = st.multiselect("In any of:", options=cluster_ids, key="cohort_any")
+    with col3:
+        none_of = st.multiselect("Not in:", options=cluster_ids, key="cohort_none")
+    if not (all_of or any_of or none_of):
+        st.caption("Pick clusters to count the patients they share.")
+        return
+
+    with st.spinner("Loading cluster patients..."):
+        cohort, people = build_cohort(all_of, any_of, none_of)
+    if cohort is None:
+        return
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("Patients", f"{len(cohort):,}")
+    with col2:
+        share = 100 * len(cohort) / len(people) if len(people) else 0
+        st.metric("Of Active Population", f"{share:.1f}%")
+
+    selected = list(dict.fromkeys([*all_of, *any_of, *none_of]))
+    if len(selected) > 1:
+        overlap = get_cohort_overlap(selected)
+        if not overlap.empty:
+            st.markdown("**% of each row's patients also in each column's cluster**")
+            matrix = overlap.pivot(index='CLUSTER_ID', columns='OTHER_CLUSTER_ID', values='SHARED_PERCENT')
+            st.dataframe(matrix.loc[selected, selected], use_container_width=True)
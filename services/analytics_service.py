@@ -1,641 +1,422 @@
 # =============================================================================
 # SNOMED Cluster Manager - Analytics Service
 # =============================================================================
+#
+# Cluster analytics over the metric catalogue (services/metric_service.py).
+# The analytics page loads its usage tabs' breakdowns with one query
+# (get_cluster_usage, answered from the usage cube when it's current) and the
+# health equity tab's with another (get_cluster_equity), and derives each
+# table from those; the get_* functions below load just the breakdown they need.
+# get_clusters_usage summarises many clusters at once for the home list and
+# the portfolio page. In fast mode the usage tabs' counts are HyperLogLog
+# estimates and organisational counts roll up from per-practice sketches. In
+# progressive mode they are first scaled up from a sample of patients
+# (get_cluster_usage_sample) while the exact query runs.
 
 import pandas as pd
-import streamlit as st
-from database import get_connection
-from config import DB_SCHEMA, DB_ANALYTICS, DB_STORE, DB_DEMOGRAPHICS
+from services.metric_service import get_cluster_metrics, get_batch_usage, ACTIVE_ONLY
+from services.cube_service import get_usage_metrics
+from utils.hll import merge_sketches
+from services.cluster_service import get_all_clusters
+from services.demographics_service import get_active_population
+from config import ORG_LEVEL_COLUMNS, USAGE_TREND_MONTHS, PROVISIONAL_SAMPLE_PERCENT
+
+
+# Event count column per cluster type
+EVENT_COUNT_COLUMNS = {
+    'OBSERVATION': 'OBSERVATION_COUNT',
+    'MEDICATION': 'ORDER_COUNT'
+}
+
+# Minimum unit population for organisational rates
+MIN_UNIT_POPULATION = 100
+
+# Minimum patients per practice in the care team breakdown
+PRIVACY_THRESHOLD = 5
+
+# Breakdowns: (label, dimensions)
+TOTAL = ('TOTAL', ())
+CODE = ('CODE', ('CODE', 'DISPLAY'))
+MONTH = ('MONTH', ('MONTH',))
+SUMMARY = ('SUMMARY', (ACTIVE_ONLY,))
+AGE_SEX = ('AGE_SEX', (ACTIVE_ONLY, 'AGE_BAND_5Y', 'SEX'))
+CARE_TEAM = ('CARE_TEAM', (ACTIVE_ONLY, 'PRACTICE_NAME', 'PCN_NAME'))
+ORG_LEVELS = {
+    level: (level.upper(), (ACTIVE_ONLY, column))
+    for level, column in ORG_LEVEL_COLUMNS.items()
+}
+ETHNICITY = ('ETHNICITY', (ACTIVE_ONLY, 'ETHNICITY_SUBCATEGORY'))
+DEPRIVATION = ('DEPRIVATION', (ACTIVE_ONLY, 'IMD_DECILE_19', 'IMD_QUINTILE_19'))
+LANGUAGE = ('LANGUAGE', (ACTIVE_ONLY, 'LANGUAGE_TYPE', 'MAIN_LANGUAGE', 'INTERPRETER_NEEDED'))
+
+USAGE_METRICS = ('PERSON_COUNT', 'ACTIVE_PERSON_COUNT', 'EVENT_COUNT')
+PROFILE_METRICS = (
+    'PERSON_COUNT', 'AVG_AGE', 'MALE_COUNT', 'FEMALE_COUNT',
+    'CHILDREN_COUNT', 'ELDERLY_COUNT', 'AVG_IMD_DECILE', 'NEW_PATIENTS_30D'
+)
+
+# What the usage tabs (overview, code usage, age/sex, organisation) show -
+# all of it held by the usage cube
+USAGE_BREAKDOWNS = (TOTAL, CODE, MONTH, SUMMARY, AGE_SEX, *ORG_LEVELS.values())
+USAGE_VIEW_METRICS = USAGE_METRICS + ('AVG_AGE', 'MALE_COUNT', 'FEMALE_COUNT', 'NEW_PATIENTS_30D')
+
+# The usage tabs in fast mode - organisational counts come from practice sketches
+FAST_USAGE_BREAKDOWNS = (TOTAL, CODE, MONTH, SUMMARY, AGE_SEX)
+
+# What the health equity tab shows - person attributes the cube doesn't carry
+EQUITY_BREAKDOWNS = (ETHNICITY, DEPRIVATION, LANGUAGE, ORG_LEVELS['Neighbourhood'])
+EQUITY_METRICS = ('PERSON_COUNT', 'AVG_AGE', 'AVG_IMD_DECILE')
+
+
+def get_cluster_usage(cluster_id, cluster_type, approximate=None):
+    """Get every usage tab breakdown for a cluster in one query
+
+    Args:
+        approximate: True for fast mode (estimates, without the organisational
+            breakdowns), False for exact counts, None for the cube when current
+    """
+    breakdowns = FAST_USAGE_BREAKDOWNS if approximate else USAGE_BREAKDOWNS
+    return get_usage_metrics(cluster_id, cluster_type, breakdowns, USAGE_VIEW_METRICS, approximate)
+
+
+def get_cluster_usage_sample(cluster_id, cluster_type, sample_percent=PROVISIONAL_SAMPLE_PERCENT):
+    """Get every usage tab breakdown scaled up from a sample of patients - provisional counts"""
+    return get_cluster_metrics(cluster_id, cluster_type, USAGE_BREAKDOWNS, USAGE_VIEW_METRICS, sample_percent)
+
+
+def get_cluster_equity(cluster_id, cluster_type):
+    """Get every health equity breakdown for a cluster in one query"""
+    return get_cluster_metrics(cluster_id, cluster_type, EQUITY_BREAKDOWNS, EQUITY_METRICS)
+
+
+def _trend_months():
+    """Month starts of the trend window, oldest first"""
+    this_month = pd.Timestamp.today().normalize().replace(day=1)
+    return [this_month - pd.DateOffset(months=n) for n in range(USAGE_TREND_MONTHS, 0, -1)]
+
+
+def get_clusters_usage(cluster_ids=None):
+    """Get persons, events, last-used date and monthly trend for many clusters
+
+    One grouped query per cluster type covers every requested cluster.
+
+    Args:
+        cluster_ids: Cluster IDs to include - all clusters if None
+
+    Returns:
+        DataFrame of CLUSTER_ID, CLUSTER_TYPE, PERSON_COUNT, EVENT_COUNT,
+        LAST_USED and TREND (event counts for the last USAGE_TREND_MONTHS
+        complete months, oldest first)
+    """
+    clusters = get_all_clusters()
+    if clusters.empty:
+        return pd.DataFrame()
+    if cluster_ids is not None:
+        wanted = {cluster_id.upper().strip() for cluster_id in cluster_ids}
+        clusters = clusters[clusters['CLUSTER_ID'].isin(wanted)]
+    clusters = clusters[['CLUSTER_ID', 'CLUSTER_TYPE']].reset_index(drop=True)
+
+    rows = []
+    for cluster_type, group in clusters.groupby('CLUSTER_TYPE'):
+        usage = get_batch_usage(tuple(sorted(group['CLUSTER_ID'])), cluster_type)
+        if not usage.empty:
+            rows.append(usage)
+    usage = pd.concat(rows, ignore_index=True) if rows else pd.DataFrame(
+        columns=['CLUSTER_ID', 'MONTH', 'ALL_MONTHS', 'PERSON_COUNT', 'EVENT_COUNT', 'LAST_USED']
+    )
+
+    totals = usage[usage['ALL_MONTHS'] == 1][['CLUSTER_ID', 'PERSON_COUNT', 'EVENT_COUNT', 'LAST_USED']]
+    result = clusters.merge(totals, on='CLUSTER_ID', how='left')
+    result[['PERSON_COUNT', 'EVENT_COUNT']] = result[['PERSON_COUNT', 'EVENT_COUNT']].fillna(0).astype('int64')
+    result['LAST_USED'] = pd.to_datetime(result['LAST_USED'])
+
+    months = _trend_months()
+    monthly = usage[(usage['ALL_MONTHS'] == 0) & usage['MONTH'].notna()]
+    trend = (monthly.assign(MONTH=pd.to_datetime(monthly['MONTH']))
+             .pivot_table(index='CLUSTER_ID', columns='MONTH', values='EVENT_COUNT', aggfunc='sum')
+             .reindex(index=result['CLUSTER_ID'], columns=months)
+             .fillna(0)
+             .astype('int64'))
+    result['TREND'] = trend.values.tolist()
+    return result
+
+
+# -----------------------------------------------------------------------------
+# Derivations - metrics is a get_cluster_metrics result holding the breakdown
+# -----------------------------------------------------------------------------
+
+def _breakdown(metrics, breakdown):
+    """Frame for a breakdown, empty if it wasn't loaded"""
+    return metrics.get(breakdown[0], pd.DataFrame())
+
+
+def _population_total(population):
+    """Total population from a get_active_population frame"""
+    if population is None or population.empty:
+        return 0
+    return population['TOTAL_POPULATION'].sum()
+
+
+def _rate_per_1000(counts, total):
+    """Rate per 1,000 population, NaN where there is no population"""
+    if not total:
+        return counts * float('nan')
+    return counts * 1000.0 / total
+
+
+def usage_totals(metrics):
+    """Total persons, active persons and total events"""
+    total = _breakdown(metrics, TOTAL)
+    if total.empty:
+        return 0, 0, 0
+    row = total.iloc[0]
+    return int(row['PERSON_COUNT']), int(row['ACTIVE_PERSON_COUNT']), int(row['EVENT_COUNT'])
 
 
-# Get connection instance
-conn = get_connection()
+def code_usage(metrics, cluster_type):
+    """Persons and events per code, by patient reach"""
+    df = _breakdown(metrics, CODE)
+    if df.empty:
+        return pd.DataFrame()
+    return (df[['CODE', 'DISPLAY', 'PERSON_COUNT', 'EVENT_COUNT']]
+            .rename(columns={'EVENT_COUNT': EVENT_COUNT_COLUMNS.get(cluster_type, 'EVENT_COUNT')})
+            .sort_values('PERSON_COUNT', ascending=False)
+            .reset_index(drop=True))
 
 
-def get_observation_analytics(cluster_id):
-    """Get observation analytics for cluster codes"""
-    try:
-        query = f"""
-        SELECT 
-            ec.code,
-            ec.display,
-            COUNT(DISTINCT d.person_id) as person_count,
-            COUNT(DISTINCT o.id) as observation_count
-        FROM {DB_STORE}.observation o
-        JOIN {DB_SCHEMA}.ecl_cache ec ON o.mapped_concept_code = ec.code
-        JOIN {DB_DEMOGRAPHICS}.DIM_PERSON_DEMOGRAPHICS d ON o.person_id = d.person_id
-        WHERE ec.cluster_id = '{cluster_id}'
-        GROUP BY ec.code, ec.display
-        ORDER BY person_count DESC
-        """
-        return conn.sql(query).to_pandas()
-    except Exception as e:
-        st.error(f"Error loading observation data: {str(e)}")
+def usage_time_series(metrics, cluster_type):
+    """Events per month over the time-series window"""
+    df = _breakdown(metrics, MONTH)
+    df = df[df['MONTH'].notna()] if not df.empty else df
+    if df.empty:
+        return pd.DataFrame()
+    return (df[['MONTH', 'EVENT_COUNT']]
+            .rename(columns={
+                'MONTH': 'MONTH_YEAR',
+                'EVENT_COUNT': EVENT_COUNT_COLUMNS.get(cluster_type, 'EVENT_COUNT')
+            })
+            .sort_values('MONTH_YEAR')
+            .reset_index(drop=True))
+
+
+def demographics_summary(metrics):
+    """Demographic summary of active persons"""
+    df = _breakdown(metrics, SUMMARY)
+    if df.empty or not df['PERSON_COUNT'].sum():
         return pd.DataFrame()
+    return (df[['PERSON_COUNT', 'AVG_AGE', 'MALE_COUNT', 'FEMALE_COUNT']]
+            .rename(columns={'PERSON_COUNT': 'TOTAL_PATIENTS'})
+            .reset_index(drop=True))
 
 
-def get_medication_analytics(cluster_id):
-    """Get medication analytics for cluster codes"""
-    try:
-        query = f"""
-        SELECT 
-            ec.code,
-            ec.display,
-            COUNT(DISTINCT d.person_id) as person_count,
-            COUNT(DISTINCT mo.id) as order_count
-        FROM {DB_STORE}.medication_order mo
-        JOIN {DB_SCHEMA}.ecl_cache ec ON mo.mapped_concept_code = ec.code
-        JOIN REPORTING.OLIDS_PERSON_DEMOGRAPHICS.DIM_PERSON_DEMOGRAPHICS d ON mo.person_id = d.person_id
-        WHERE ec.cluster_id = '{cluster_id}'
-        GROUP BY ec.code, ec.display
-        ORDER BY person_count DESC
-        """
-        return conn.sql(query).to_pandas()
-    except Exception as e:
-        st.error(f"Error loading medication data: {str(e)}")
+def age_sex_distribution(metrics):
+    """Age band/sex counts of active persons"""
+    df = _breakdown(metrics, AGE_SEX)
+    if df.empty:
         return pd.DataFrame()
+    return (df[['AGE_BAND_5Y', 'SEX', 'PERSON_COUNT']]
+            .rename(columns={'AGE_BAND_5Y': 'AGE_BAND', 'PERSON_COUNT': 'PATIENT_COUNT'})
+            .sort_values(['AGE_BAND', 'SEX'])
+            .reset_index(drop=True))
 
 
-def get_distinct_persons_med(cluster_id):
-    """Get distinct person counts for medications"""
-    try:
-        query = f"""
-        SELECT 
-            COUNT(DISTINCT d.person_id) as total_persons,
-            COUNT(DISTINCT CASE WHEN d.is_active THEN d.person_id END) as active_persons,
-            COUNT(DISTINCT mo.id) as total_orders
-        FROM {DB_STORE}.medication_order mo
-        JOIN {DB_SCHEMA}.ecl_cache ec ON mo.mapped_concept_code = ec.code
-        JOIN REPORTING.OLIDS_PERSON_DEMOGRAPHICS.DIM_PERSON_DEMOGRAPHICS d ON mo.person_id = d.person_id
-        WHERE ec.cluster_id = '{cluster_id}'
-        """
-        result = conn.sql(query).to_pandas()
-        if not result.empty:
-            return (result.iloc[0]['TOTAL_PERSONS'] or 0, 
-                   result.iloc[0]['ACTIVE_PERSONS'] or 0,
-                   result.iloc[0]['TOTAL_ORDERS'] or 0)
-        return 0, 0, 0
-    except Exception as e:
-        st.error(f"Error loading distinct persons: {str(e)}")
-        return 0, 0, 0
+def care_team_analysis(metrics):
+    """Practice/PCN profile of active persons, suppressing small practices"""
+    df = _breakdown(metrics, CARE_TEAM)
+    if df.empty:
+        return pd.DataFrame()
+    df = df[df['PERSON_COUNT'] >= PRIVACY_THRESHOLD]
+    return (df[['PRACTICE_NAME', 'PCN_NAME', 'PERSON_COUNT', 'AVG_AGE', 'MALE_COUNT',
+                'FEMALE_COUNT', 'CHILDREN_COUNT', 'ELDERLY_COUNT']]
+            .rename(columns={'PERSON_COUNT': 'TOTAL_PATIENTS'})
+            .sort_values('TOTAL_PATIENTS', ascending=False)
+            .reset_index(drop=True))
+
+
+def org_rates(metrics, population, agg_level="Borough"):
+    """Rates per 1,000 by organisational level
+
+    Args:
+        metrics: get_cluster_metrics result holding ORG_LEVELS[agg_level]
+        population: UNIT_NAME/TOTAL_POPULATION frame for the same level
+        agg_level: Key of ORG_LEVEL_COLUMNS
+    """
+    if population is None or population.empty:
+        return pd.DataFrame()
+    if agg_level not in ORG_LEVELS:
+        agg_level = 'Neighbourhood'
+    group_col = ORG_LEVEL_COLUMNS[agg_level]
+    units = population[population['TOTAL_POPULATION'] >= MIN_UNIT_POPULATION]
+
+    per_unit = _breakdown(metrics, ORG_LEVELS[agg_level])
+    if per_unit.empty:
+        per_unit = pd.DataFrame(columns=[group_col, 'PERSON_COUNT', 'AVG_AGE', 'NEW_PATIENTS_30D'])
+    per_unit = (per_unit[[group_col, 'PERSON_COUNT', 'AVG_AGE', 'NEW_PATIENTS_30D']]
+                .rename(columns={group_col: 'UNIT_NAME', 'PERSON_COUNT': 'PATIENTS_WITH_CODE'}))
+
+    rates = units[['UNIT_NAME', 'TOTAL_POPULATION']].merge(per_unit, on='UNIT_NAME', how='left')
+    rates['PATIENTS_WITH_CODE'] = rates['PATIENTS_WITH_CODE'].fillna(0).astype(int)
+    rates['NEW_PATIENTS_30D'] = rates['NEW_PATIENTS_30D'].fillna(0).astype(int)
+    rates['AVG_AGE'] = rates['AVG_AGE'].astype(float).round(1)
+    rates['RATE_PER_1000'] = (rates['PATIENTS_WITH_CODE'] * 1000.0 / rates['TOTAL_POPULATION']).round(2)
+    return rates.sort_values('RATE_PER_1000', ascending=False).reset_index(drop=True)
+
+
+def org_rates_from_sketches(sketches, population, agg_level="Borough"):
+    """Rates per 1,000 by organisational level, rolled up from practice sketches
+
+    Args:
+        sketches: get_practice_sketches result
+        population: UNIT_NAME/TOTAL_POPULATION frame for the level
+        agg_level: Key of ORG_LEVEL_COLUMNS
+
+    Returns:
+        Same columns as org_rates, with estimated counts
+    """
+    if population is None or population.empty or sketches.empty:
+        return pd.DataFrame()
+    if agg_level not in ORG_LEVELS:
+        agg_level = 'Neighbourhood'
+    group_col = ORG_LEVEL_COLUMNS[agg_level]
+    per_unit = pd.DataFrame([
+        {
+            'UNIT_NAME': unit,
+            'PERSON_COUNT': round(merge_sketches(rows['PERSON_SKETCH']).estimate()),
+            'NEW_PATIENTS_30D': round(merge_sketches(rows['RECENT_SKETCH']).estimate()),
+            'AVG_AGE': rows['AGE_TOTAL'].sum() / rows['AGED_PERSONS'].sum() if rows['AGED_PERSONS'].sum() else None
+        }
+        for unit, rows in sketches.groupby(group_col)
+    ], columns=['UNIT_NAME', 'PERSON_COUNT', 'NEW_PATIENTS_30D', 'AVG_AGE'])
+    return org_rates({ORG_LEVELS[agg_level][0]: per_unit.rename(columns={'UNIT_NAME': group_col})},
+                     population, agg_level)
+
+
+def ethnicity_analysis(metrics, population):
+    """Ethnicity breakdown of active persons"""
+    df = _breakdown(metrics, ETHNICITY)
+    df = df[df['ETHNICITY_SUBCATEGORY'].notna()] if not df.empty else df
+    if df.empty:
+        return pd.DataFrame()
+    result = df[['ETHNICITY_SUBCATEGORY', 'PERSON_COUNT']].rename(columns={
+        'ETHNICITY_SUBCATEGORY': 'ETHNICITY', 'PERSON_COUNT': 'PATIENT_COUNT'
+    })
+    result['RATE_PER_1000'] = _rate_per_1000(result['PATIENT_COUNT'], _population_total(population))
+    return result.sort_values('PATIENT_COUNT', ascending=False).reset_index(drop=True)
+
+
+def deprivation_analysis(metrics, population):
+    """Deprivation (IMD) breakdown of active persons"""
+    df = _breakdown(metrics, DEPRIVATION)
+    df = df[df['IMD_DECILE_19'].notna()] if not df.empty else df
+    if df.empty:
+        return pd.DataFrame()
+    result = df[['IMD_DECILE_19', 'IMD_QUINTILE_19', 'PERSON_COUNT']].rename(columns={
+        'IMD_DECILE_19': 'IMD_DECILE', 'IMD_QUINTILE_19': 'IMD_QUINTILE', 'PERSON_COUNT': 'PATIENT_COUNT'
+    })
+    result['RATE_PER_1000'] = _rate_per_1000(result['PATIENT_COUNT'], _population_total(population))
+    return result.sort_values('IMD_DECILE').reset_index(drop=True)
+
+
+def language_analysis(metrics):
+    """Language breakdown of active persons"""
+    df = _breakdown(metrics, LANGUAGE)
+    df = df[df['MAIN_LANGUAGE'].notna()] if not df.empty else df
+    if df.empty:
+        return pd.DataFrame()
+    return (df[['LANGUAGE_TYPE', 'MAIN_LANGUAGE', 'INTERPRETER_NEEDED', 'PERSON_COUNT']]
+            .rename(columns={'PERSON_COUNT': 'PATIENT_COUNT'})
+            .sort_values('PATIENT_COUNT', ascending=False)
+            .reset_index(drop=True))
 
 
-def get_medication_time_series(cluster_id):
-    """Get medication time series data"""
-    try:
-        query = f"""
-        SELECT 
-            DATE_TRUNC('month', mo.clinical_effective_date) as month_year,
-            COUNT(DISTINCT mo.id) as order_count
-        FROM {DB_STORE}.medication_order mo
-        JOIN {DB_SCHEMA}.ecl_cache ec ON mo.mapped_concept_code = ec.code
-        JOIN REPORTING.OLIDS_PERSON_DEMOGRAPHICS.DIM_PERSON_DEMOGRAPHICS d ON mo.person_id = d.person_id
-        WHERE ec.cluster_id = '{cluster_id}'
-        AND mo.clinical_effective_date >= DATE_TRUNC('month', DATEADD(month, -60, CURRENT_DATE()))
-        AND mo.clinical_effective_date < DATE_TRUNC('month', CURRENT_DATE())
-        AND mo.clinical_effective_date IS NOT NULL
-        GROUP BY DATE_TRUNC('month', mo.clinical_effective_date)
-        ORDER BY month_year
-        """
-        return conn.sql(query).to_pandas()
-    except Exception as e:
-        st.error(f"Error loading time series data: {str(e)}")
+def neighbourhood_analysis(metrics, population):
+    """Neighbourhood breakdown of active persons"""
+    df = _breakdown(metrics, ORG_LEVELS['Neighbourhood'])
+    df = df[df['NEIGHBOURHOOD_REGISTERED'].notna()] if not df.empty else df
+    if df.empty:
         return pd.DataFrame()
+    result = df[['NEIGHBOURHOOD_REGISTERED', 'PERSON_COUNT', 'AVG_AGE', 'AVG_IMD_DECILE']].rename(columns={
+        'NEIGHBOURHOOD_REGISTERED': 'NEIGHBOURHOOD', 'PERSON_COUNT': 'PATIENT_COUNT'
+    })
+    result['RATE_PER_1000'] = _rate_per_1000(result['PATIENT_COUNT'], _population_total(population))
+    return result.sort_values('PATIENT_COUNT', ascending=False).reset_index(drop=True)
+
+
+# -----------------------------------------------------------------------------
+# Single-breakdown loaders (cached by get_cluster_metrics)
+# -----------------------------------------------------------------------------
+
+def get_observation_analytics(cluster_id):
+    """Get observation analytics for cluster codes"""
+    return code_usage(get_usage_metrics(cluster_id, 'OBSERVATION', (CODE,), USAGE_METRICS), 'OBSERVATION')
+
+
+def get_medication_analytics(cluster_id):
+    """Get medication analytics for cluster codes"""
+    return code_usage(get_usage_metrics(cluster_id, 'MEDICATION', (CODE,), USAGE_METRICS), 'MEDICATION')
 
 
 def get_distinct_persons_obs(cluster_id):
     """Get distinct person counts for observations"""
-    try:
-        query = f"""
-        SELECT 
-            COUNT(DISTINCT d.person_id) as total_persons,
-            COUNT(DISTINCT CASE WHEN d.is_active THEN d.person_id END) as active_persons,
-            COUNT(DISTINCT o.id) as total_observations
-        FROM {DB_STORE}.observation o
-        JOIN {DB_SCHEMA}.ecl_cache ec ON o.mapped_concept_code = ec.code
-        JOIN {DB_DEMOGRAPHICS}.DIM_PERSON_DEMOGRAPHICS d ON o.person_id = d.person_id
-        WHERE ec.cluster_id = '{cluster_id}'
-        """
-        result = conn.sql(query).to_pandas()
-        if not result.empty:
-            return (result.iloc[0]['TOTAL_PERSONS'] or 0, 
-                   result.iloc[0]['ACTIVE_PERSONS'] or 0,
-                   result.iloc[0]['TOTAL_OBSERVATIONS'] or 0)
-        return 0, 0, 0
-    except Exception as e:
-        st.error(f"Error loading distinct persons: {str(e)}")
-        return 0, 0, 0
+    return usage_totals(get_usage_metrics(cluster_id, 'OBSERVATION', (TOTAL,), USAGE_METRICS))
+
+
+def get_distinct_persons_med(cluster_id):
+    """Get distinct person counts for medications"""
+    return usage_totals(get_usage_metrics(cluster_id, 'MEDICATION', (TOTAL,), USAGE_METRICS))
 
 
 def get_observation_time_series(cluster_id):
     """Get observation time series data"""
-    try:
-        query = f"""
-        SELECT 
-            DATE_TRUNC('month', o.clinical_effective_date) as month_year,
-            COUNT(DISTINCT o.id) as observation_count
-        FROM {DB_STORE}.observation o
-        JOIN {DB_SCHEMA}.ecl_cache ec ON o.mapped_concept_code = ec.code
-        JOIN {DB_DEMOGRAPHICS}.DIM_PERSON_DEMOGRAPHICS d ON o.person_id = d.person_id
-        WHERE ec.cluster_id = '{cluster_id}'
-        AND o.clinical_effective_date >= DATE_TRUNC('month', DATEADD(month, -60, CURRENT_DATE()))
-        AND o.clinical_effective_date < DATE_TRUNC('month', CURRENT_DATE())
-        AND o.clinical_effective_date IS NOT NULL
-        GROUP BY DATE_TRUNC('month', o.clinical_effective_date)
-        ORDER BY month_year
-        """
-        return conn.sql(query).to_pandas()
-    except Exception as e:
-        st.error(f"Error loading time series data: {str(e)}")
-        return pd.DataFrame()
+    return usage_time_series(get_usage_metrics(cluster_id, 'OBSERVATION', (MONTH,), USAGE_METRICS), 'OBSERVATION')
 
 
 def get_medication_time_series(cluster_id):
     """Get medication time series data"""
-    try:
-        query = f"""
-        SELECT 
-            DATE_TRUNC('month', mo.clinical_effective_date) as month_year,
-            COUNT(DISTINCT mo.id) as order_count
-        FROM {DB_STORE}.medication_order mo
-        JOIN {DB_SCHEMA}.ecl_cache ec ON mo.mapped_concept_code = ec.code
-        JOIN REPORTING.OLIDS_PERSON_DEMOGRAPHICS.DIM_PERSON_DEMOGRAPHICS d ON mo.person_id = d.person_id
-        WHERE ec.cluster_id = '{cluster_id}'
-        AND mo.clinical_effective_date >= DATE_TRUNC('month', DATEADD(month, -60, CURRENT_DATE()))
-        AND mo.clinical_effective_date < DATE_TRUNC('month', CURRENT_DATE())
-        AND mo.clinical_effective_date IS NOT NULL
-        GROUP BY DATE_TRUNC('month', mo.clinical_effective_date)
-        ORDER BY month_year
-        """
-        return conn.sql(query).to_pandas()
-    except Exception as e:
-        st.error(f"Error loading time series data: {str(e)}")
-        return pd.DataFrame()
+    return usage_time_series(get_usage_metrics(cluster_id, 'MEDICATION', (MONTH,), USAGE_METRICS), 'MEDICATION')
 
 
 def get_cluster_demographics(cluster_id, cluster_type):
     """Get demographic summary for patients with codes in a specific cluster"""
-    try:
-        
-        # Choose the right table based on cluster type
-        if cluster_type == 'OBSERVATION':
-            query = f"""
-            SELECT 
-                COUNT(DISTINCT CASE WHEN d.is_active = true THEN d.person_id END) as total_patients,
-                AVG(CASE WHEN d.is_active = true THEN d.age END) as avg_age,
-                COUNT(DISTINCT CASE WHEN d.is_active = true AND d.sex = 'Male' THEN d.person_id END) as male_count,
-                COUNT(DISTINCT CASE WHEN d.is_active = true AND d.sex = 'Female' THEN d.person_id END) as female_count
-            FROM {DB_STORE}.observation o
-            JOIN {DB_SCHEMA}.ecl_cache ec ON o.mapped_concept_code = ec.code
-            JOIN {DB_DEMOGRAPHICS}.DIM_PERSON_DEMOGRAPHICS d ON o.person_id = d.person_id
-            WHERE ec.cluster_id = '{cluster_id}'
-            AND d.is_active = true
-            """
-        else:  # MEDICATION
-            query = f"""
-            SELECT 
-                COUNT(DISTINCT CASE WHEN d.is_active = true THEN d.person_id END) as total_patients,
-                AVG(CASE WHEN d.is_active = true THEN d.age END) as avg_age,
-                COUNT(DISTINCT CASE WHEN d.is_active = true AND d.sex = 'Male' THEN d.person_id END) as male_count,
-                COUNT(DISTINCT CASE WHEN d.is_active = true AND d.sex = 'Female' THEN d.person_id END) as female_count
-            FROM {DB_STORE}.medication_order m
-            JOIN {DB_SCHEMA}.ecl_cache ec ON m.mapped_concept_code = ec.code
-            JOIN {DB_DEMOGRAPHICS}.DIM_PERSON_DEMOGRAPHICS d ON m.person_id = d.person_id
-            WHERE ec.cluster_id = '{cluster_id}'
-            AND d.is_active = true
-            """
-        
-        return conn.sql(query).to_pandas()
-    except Exception as e:
-        st.error(f"Error loading cluster demographics: {str(e)}")
-        return pd.DataFrame()
+    return demographics_summary(get_usage_metrics(cluster_id, cluster_type, (SUMMARY,), USAGE_VIEW_METRICS))
 
 
 def get_cluster_age_sex_distribution(cluster_id, cluster_type):
     """Get age/sex distribution for patients with codes in a specific cluster"""
-    try:
-        # Choose the right table based on cluster type
-        if cluster_type == 'OBSERVATION':
-            query = f"""
-            SELECT 
-                d.age_band_5y AS AGE_BAND,
-                d.sex AS SEX,
-                COUNT(DISTINCT d.person_id) AS PATIENT_COUNT
-            FROM {DB_STORE}.observation o
-            JOIN {DB_SCHEMA}.ecl_cache ec ON o.mapped_concept_code = ec.code
-            JOIN {DB_DEMOGRAPHICS}.DIM_PERSON_DEMOGRAPHICS d ON o.person_id = d.person_id
-            WHERE ec.cluster_id = '{cluster_id}'
-            AND d.is_active = true
-            GROUP BY d.age_band_5y, d.sex
-            ORDER BY d.age_band_5y, d.sex
-            """
-        else:  # MEDICATION
-            query = f"""
-            SELECT 
-                d.age_band_5y AS AGE_BAND,
-                d.sex AS SEX,
-                COUNT(DISTINCT d.person_id) AS PATIENT_COUNT
-            FROM {DB_STORE}.medication_order m
-            JOIN {DB_SCHEMA}.ecl_cache ec ON m.mapped_concept_code = ec.code
-            JOIN {DB_DEMOGRAPHICS}.DIM_PERSON_DEMOGRAPHICS d ON m.person_id = d.person_id
-            WHERE ec.cluster_id = '{cluster_id}'
-            AND d.is_active = true
-            GROUP BY d.age_band_5y, d.sex
-            ORDER BY d.age_band_5y, d.sex
-            """
-        
-        return conn.sql(query).to_pandas()
-    except Exception as e:
-        st.error(f"Error loading cluster age/sex distribution: {str(e)}")
-        return pd.DataFrame()
+    return age_sex_distribution(get_usage_metrics(cluster_id, cluster_type, (AGE_SEX,), USAGE_VIEW_METRICS))
 
 
 def get_cluster_care_team_analysis(cluster_id, cluster_type):
     """Get care team analysis for patients with codes in a specific cluster"""
-    try:
-        
-        # Choose the right table based on cluster type
-        if cluster_type == 'OBSERVATION':
-            query = f"""
-            SELECT 
-                d.practice_name as practice_name,
-                d.pcn_name as pcn_name,
-                COUNT(DISTINCT d.person_id) as total_patients,
-                AVG(d.age) as avg_age,
-                COUNT(DISTINCT CASE WHEN d.sex = 'Male' THEN d.person_id END) as male_count,
-                COUNT(DISTINCT CASE WHEN d.sex = 'Female' THEN d.person_id END) as female_count,
-                COUNT(DISTINCT CASE WHEN d.age < 15 THEN d.person_id END) as children_count,
-                COUNT(DISTINCT CASE WHEN d.age >= 65 THEN d.person_id END) as elderly_count
-            FROM {DB_STORE}.observation o
-            JOIN {DB_SCHEMA}.ecl_cache ec ON o.mapped_concept_code = ec.code
-            JOIN {DB_DEMOGRAPHICS}.DIM_PERSON_DEMOGRAPHICS d ON o.person_id = d.person_id
-            WHERE ec.cluster_id = '{cluster_id}'
-            AND d.is_active = true
-            GROUP BY d.practice_name, d.pcn_name
-            HAVING COUNT(DISTINCT d.person_id) >= 5  -- Privacy threshold
-            ORDER BY total_patients DESC
-            """
-        else:  # MEDICATION
-            query = f"""
-            SELECT 
-                d.practice_name as practice_name,
-                d.pcn_name as pcn_name,
-                COUNT(DISTINCT d.person_id) as total_patients,
-                AVG(d.age) as avg_age,
-                COUNT(DISTINCT CASE WHEN d.sex = 'Male' THEN d.person_id END) as male_count,
-                COUNT(DISTINCT CASE WHEN d.sex = 'Female' THEN d.person_id END) as female_count,
-                COUNT(DISTINCT CASE WHEN d.age < 15 THEN d.person_id END) as children_count,
-                COUNT(DISTINCT CASE WHEN d.age >= 65 THEN d.person_id END) as elderly_count
-            FROM {DB_STORE}.medication_order m
-            JOIN {DB_SCHEMA}.ecl_cache ec ON m.mapped_concept_code = ec.code
-            JOIN {DB_DEMOGRAPHICS}.DIM_PERSON_DEMOGRAPHICS d ON m.person_id = d.person_id
-            WHERE ec.cluster_id = '{cluster_id}'
-            AND d.is_active = true
-            GROUP BY d.practice_name, d.pcn_name
-            HAVING COUNT(DISTINCT d.person_id) >= 5  -- Privacy threshold
-            ORDER BY total_patients DESC
-            """
-        
-        return conn.sql(query).to_pandas()
-    except Exception as e:
-        st.error(f"Error loading cluster care team analysis: {str(e)}")
-        return pd.DataFrame()
+    return care_team_analysis(get_cluster_metrics(cluster_id, cluster_type, (CARE_TEAM,), PROFILE_METRICS))
 
 
 def get_cluster_standardized_rates(cluster_id, cluster_type, agg_level="Borough"):
     """Get simple rates table by organisational level"""
-    try:
-        # Choose aggregation column
-        if agg_level == "Practice":
-            group_col = "PRACTICE_NAME"
-            group_label = "Practice"
-        elif agg_level == "PCN":
-            group_col = "PCN_NAME"
-            group_label = "PCN"
-        elif agg_level == "Borough":
-            group_col = "BOROUGH_REGISTERED"
-            group_label = "Borough"
-        else:  # Neighbourhood
-            group_col = "NEIGHBOURHOOD_REGISTERED"
-            group_label = "Neighbourhood"
-        
-        # Get date column name and join logic based on cluster type
-        if cluster_type == 'OBSERVATION':
-            date_col = "CLINICAL_EFFECTIVE_DATE"
-            # Optimized query for observations - start from cluster codes
-            query = f"""
-            WITH cluster_patients AS (
-                -- First get all patients with the cluster codes
-                SELECT DISTINCT 
-                    d.person_id,
-                    d.{group_col},
-                    d.age,
-                    MIN(o.{date_col}) AS first_code_date,
-                    MAX(o.{date_col}) AS last_code_date
-                FROM {DB_SCHEMA}.ecl_cache ec
-                JOIN {DB_STORE}.observation o ON ec.code = o.mapped_concept_code
-                JOIN {DB_DEMOGRAPHICS}.DIM_PERSON_DEMOGRAPHICS d ON o.person_id = d.person_id
-                WHERE ec.cluster_id = '{cluster_id}'
-                AND d.is_active = true
-                AND d.{group_col} IS NOT NULL
-                GROUP BY d.person_id, d.{group_col}, d.age
-            ),
-            total_pop AS (
-                -- Get total population per unit for rate calculation
-                SELECT 
-                    {group_col},
-                    COUNT(DISTINCT person_id) AS total_population,
-                    AVG(age) AS avg_age_all
-                FROM {DB_DEMOGRAPHICS}.DIM_PERSON_DEMOGRAPHICS
-                WHERE is_active = true
-                AND {group_col} IS NOT NULL
-                GROUP BY {group_col}
-            )
-            SELECT 
-                tp.{group_col} AS UNIT_NAME,
-                tp.total_population,
-                COUNT(DISTINCT cp.person_id) AS patients_with_code,
-                ROUND(AVG(cp.age), 1) AS avg_age,
-                COUNT(DISTINCT CASE 
-                    WHEN cp.last_code_date >= DATEADD('day', -30, CURRENT_DATE())
-                    THEN cp.person_id 
-                END) AS new_patients_30d,
-                ROUND(
-                    COUNT(DISTINCT cp.person_id) * 1000.0 / tp.total_population, 
-                    2
-                ) AS rate_per_1000
-            FROM total_pop tp
-            LEFT JOIN cluster_patients cp ON tp.{group_col} = cp.{group_col}
-            WHERE tp.total_population >= 100  -- Minimum population
-            GROUP BY tp.{group_col}, tp.total_population
-            ORDER BY rate_per_1000 DESC
-            """
-        else:  # MEDICATION
-            date_col = "ORDER_DATE"
-            # Optimized query for medications - start from cluster codes
-            query = f"""
-            WITH cluster_patients AS (
-                -- First get all patients with the cluster codes
-                SELECT DISTINCT 
-                    d.person_id,
-                    d.{group_col},
-                    d.age,
-                    MIN(mo.{date_col}) AS first_code_date,
-                    MAX(mo.{date_col}) AS last_code_date
-                FROM {DB_SCHEMA}.ecl_cache ec
-                JOIN {DB_STORE}.medication_order mo ON ec.code = mo.mapped_concept_code
-                JOIN REPORTING.OLIDS_PERSON_DEMOGRAPHICS.DIM_PERSON_DEMOGRAPHICS d ON mo.person_id = d.person_id
-                WHERE ec.cluster_id = '{cluster_id}'
-                AND d.is_active = true
-                AND d.{group_col} IS NOT NULL
-                GROUP BY d.person_id, d.{group_col}, d.age
-            ),
-            total_pop AS (
-                -- Get total population per unit for rate calculation
-                SELECT 
-                    {group_col},
-                    COUNT(DISTINCT person_id) AS total_population,
-                    AVG(age) AS avg_age_all
-                FROM {DB_DEMOGRAPHICS}.DIM_PERSON_DEMOGRAPHICS
-                WHERE is_active = true
-                AND {group_col} IS NOT NULL
-                GROUP BY {group_col}
-            )
-            SELECT 
-                tp.{group_col} AS UNIT_NAME,
-                tp.total_population,
-                COUNT(DISTINCT cp.person_id) AS patients_with_code,
-                ROUND(AVG(cp.age), 1) AS avg_age,
-                COUNT(DISTINCT CASE 
-                    WHEN cp.last_code_date >= DATEADD('day', -30, CURRENT_DATE())
-                    THEN cp.person_id 
-                END) AS new_patients_30d,
-                ROUND(
-                    COUNT(DISTINCT cp.person_id) * 1000.0 / tp.total_population, 
-                    2
-                ) AS rate_per_1000
-            FROM total_pop tp
-            LEFT JOIN cluster_patients cp ON tp.{group_col} = cp.{group_col}
-            WHERE tp.total_population >= 100  -- Minimum population
-            GROUP BY tp.{group_col}, tp.total_population
-            ORDER BY rate_per_1000 DESC
-            """
-        
-        return conn.sql(query).to_pandas()
-    except Exception as e:
-        st.error(f"Error loading rates: {str(e)}")
-        return pd.DataFrame()
+    if agg_level not in ORG_LEVELS:
+        agg_level = 'Neighbourhood'
+    metrics = get_usage_metrics(cluster_id, cluster_type, (ORG_LEVELS[agg_level],), USAGE_VIEW_METRICS)
+    return org_rates(metrics, get_active_population(ORG_LEVEL_COLUMNS[agg_level]), agg_level)
 
 
 def get_cluster_ethnicity_analysis(cluster_id, cluster_type):
     """Get ethnicity breakdown for patients with codes in cluster"""
-    try:
-        # Choose table based on cluster type
-        if cluster_type == 'OBSERVATION':
-            query = f"""
-            WITH total_pop AS (
-                SELECT COUNT(DISTINCT person_id) AS total_count
-                FROM {DB_DEMOGRAPHICS}.DIM_PERSON_DEMOGRAPHICS 
-                WHERE is_active = true 
-                AND ethnicity_subcategory IS NOT NULL
-            )
-            SELECT 
-                d.ethnicity_subcategory AS ETHNICITY,
-                COUNT(DISTINCT d.person_id) AS PATIENT_COUNT,
-                COUNT(DISTINCT d.person_id) * 1000.0 / tp.total_count AS RATE_PER_1000
-            FROM {DB_SCHEMA}.ecl_cache ec
-            JOIN {DB_STORE}.observation o ON ec.code = o.mapped_concept_code
-            JOIN {DB_DEMOGRAPHICS}.DIM_PERSON_DEMOGRAPHICS d ON o.person_id = d.person_id
-            CROSS JOIN total_pop tp
-            WHERE ec.cluster_id = '{cluster_id}'
-            AND d.is_active = true
-            AND d.ethnicity_subcategory IS NOT NULL
-            GROUP BY d.ethnicity_subcategory, tp.total_count
-            ORDER BY PATIENT_COUNT DESC
-            """
-        else:  # MEDICATION
-            query = f"""
-            WITH total_pop AS (
-                SELECT COUNT(DISTINCT person_id) AS total_count
-                FROM {DB_DEMOGRAPHICS}.DIM_PERSON_DEMOGRAPHICS 
-                WHERE is_active = true 
-                AND ethnicity_subcategory IS NOT NULL
-            )
-            SELECT 
-                d.ethnicity_subcategory AS ETHNICITY,
-                COUNT(DISTINCT d.person_id) AS PATIENT_COUNT,
-                COUNT(DISTINCT d.person_id) * 1000.0 / tp.total_count AS RATE_PER_1000
-            FROM {DB_SCHEMA}.ecl_cache ec
-            JOIN {DB_STORE}.medication_order mo ON ec.code = mo.mapped_concept_code
-            JOIN REPORTING.OLIDS_PERSON_DEMOGRAPHICS.DIM_PERSON_DEMOGRAPHICS d ON mo.person_id = d.person_id
-            CROSS JOIN total_pop tp
-            WHERE ec.cluster_id = '{cluster_id}'
-            AND d.is_active = true
-            AND d.ethnicity_subcategory IS NOT NULL
-            GROUP BY d.ethnicity_subcategory, tp.total_count
-            ORDER BY PATIENT_COUNT DESC
-            """
-        
-        return conn.sql(query).to_pandas()
-    except Exception as e:
-        st.error(f"Error loading ethnicity analysis: {str(e)}")
-        return pd.DataFrame()
+    metrics = get_cluster_metrics(cluster_id, cluster_type, (ETHNICITY,), PROFILE_METRICS)
+    return ethnicity_analysis(metrics, get_active_population('ETHNICITY_SUBCATEGORY'))
 
 
 def get_cluster_deprivation_analysis(cluster_id, cluster_type):
     """Get deprivation (IMD) breakdown for patients with codes in cluster"""
-    try:
-        # Choose table based on cluster type
-        if cluster_type == 'OBSERVATION':
-            query = f"""
-            WITH total_pop AS (
-                SELECT COUNT(DISTINCT person_id) AS total_count
-                FROM {DB_DEMOGRAPHICS}.DIM_PERSON_DEMOGRAPHICS 
-                WHERE is_active = true 
-                AND imd_decile_19 IS NOT NULL
-            )
-            SELECT 
-                d.imd_decile_19 AS IMD_DECILE,
-                d.imd_quintile_19 AS IMD_QUINTILE,
-                COUNT(DISTINCT d.person_id) AS PATIENT_COUNT,
-                COUNT(DISTINCT d.person_id) * 1000.0 / tp.total_count AS RATE_PER_1000
-            FROM {DB_SCHEMA}.ecl_cache ec
-            JOIN {DB_STORE}.observation o ON ec.code = o.mapped_concept_code
-            JOIN {DB_DEMOGRAPHICS}.DIM_PERSON_DEMOGRAPHICS d ON o.person_id = d.person_id
-            CROSS JOIN total_pop tp
-            WHERE ec.cluster_id = '{cluster_id}'
-            AND d.is_active = true
-            AND d.imd_decile_19 IS NOT NULL
-            GROUP BY d.imd_decile_19, d.imd_quintile_19, tp.total_count
-            ORDER BY d.imd_decile_19
-            """
-        else:  # MEDICATION
-            query = f"""
-            WITH total_pop AS (
-                SELECT COUNT(DISTINCT person_id) AS total_count
-                FROM {DB_DEMOGRAPHICS}.DIM_PERSON_DEMOGRAPHICS 
-                WHERE is_active = true 
-                AND imd_decile_19 IS NOT NULL
-            )
-            SELECT 
-                d.imd_decile_19 AS IMD_DECILE,
-                d.imd_quintile_19 AS IMD_QUINTILE,
-                COUNT(DISTINCT d.person_id) AS PATIENT_COUNT,
-                COUNT(DISTINCT d.person_id) * 1000.0 / tp.total_count AS RATE_PER_1000
-            FROM {DB_SCHEMA}.ecl_cache ec
-            JOIN {DB_STORE}.medication_order mo ON ec.code = mo.mapped_concept_code
-            JOIN REPORTING.OLIDS_PERSON_DEMOGRAPHICS.DIM_PERSON_DEMOGRAPHICS d ON mo.person_id = d.person_id
-            CROSS JOIN total_pop tp
-            WHERE ec.cluster_id = '{cluster_id}'
-            AND d.is_active = true
-            AND d.imd_decile_19 IS NOT NULL
-            GROUP BY d.imd_decile_19, d.imd_quintile_19, tp.total_count
-            ORDER BY d.imd_decile_19
-            """
-        
-        return conn.sql(query).to_pandas()
-    except Exception as e:
-        st.error(f"Error loading deprivation analysis: {str(e)}")
-        return pd.DataFrame()
+    metrics = get_cluster_metrics(cluster_id, cluster_type, (DEPRIVATION,), PROFILE_METRICS)
+    return deprivation_analysis(metrics, get_active_population('IMD_DECILE_19'))
 
 
 def get_cluster_language_analysis(cluster_id, cluster_type):
     """Get language breakdown for patients with codes in cluster"""
-    try:
-        # Choose table based on cluster type
-        if cluster_type == 'OBSERVATION':
-            query = f"""
-            SELECT 
-                d.language_type AS LANGUAGE_TYPE,
-                d.main_language AS MAIN_LANGUAGE,
-                d.interpreter_needed AS INTERPRETER_NEEDED,
-                COUNT(DISTINCT d.person_id) AS PATIENT_COUNT
-            FROM {DB_STORE}.observation o
-            JOIN {DB_SCHEMA}.ecl_cache ec ON o.mapped_concept_code = ec.code
-            JOIN {DB_DEMOGRAPHICS}.DIM_PERSON_DEMOGRAPHICS d ON o.person_id = d.person_id
-            WHERE ec.cluster_id = '{cluster_id}'
-            AND d.is_active = true
-            AND d.main_language IS NOT NULL
-            GROUP BY d.language_type, d.main_language, d.interpreter_needed
-            ORDER BY PATIENT_COUNT DESC
-            """
-        else:  # MEDICATION
-            query = f"""
-            SELECT 
-                d.language_type AS LANGUAGE_TYPE,
-                d.main_language AS MAIN_LANGUAGE,
-                d.interpreter_needed AS INTERPRETER_NEEDED,
-                COUNT(DISTINCT d.person_id) AS PATIENT_COUNT
-            FROM {DB_STORE}.medication_order mo
-            JOIN {DB_SCHEMA}.ecl_cache ec ON mo.mapped_concept_code = ec.code
-            JOIN REPORTING.OLIDS_PERSON_DEMOGRAPHICS.DIM_PERSON_DEMOGRAPHICS d ON mo.person_id = d.person_id
-            WHERE ec.cluster_id = '{cluster_id}'
-            AND d.is_active = true
-            AND d.main_language IS NOT NULL
-            GROUP BY d.language_type, d.main_language, d.interpreter_needed
-            ORDER BY PATIENT_COUNT DESC
-            """
-        
-        return conn.sql(query).to_pandas()
-    except Exception as e:
-        st.error(f"Error loading language analysis: {str(e)}")
-        return pd.DataFrame()
+    return language_analysis(get_cluster_metrics(cluster_id, cluster_type, (LANGUAGE,), PROFILE_METRICS))
 
 
 def get_cluster_neighbourhood_analysis(cluster_id, cluster_type):
     """Get neighbourhood breakdown for patients with codes in cluster"""
-    try:
-        # Choose table based on cluster type
-        if cluster_type == 'OBSERVATION':
-            query = f"""
-            WITH total_pop AS (
-                SELECT COUNT(DISTINCT person_id) AS total_count
-                FROM {DB_DEMOGRAPHICS}.DIM_PERSON_DEMOGRAPHICS 
-                WHERE is_active = true 
-                AND neighbourhood_registered IS NOT NULL
-            )
-            SELECT 
-                d.neighbourhood_registered AS NEIGHBOURHOOD,
-                COUNT(DISTINCT d.person_id) AS PATIENT_COUNT,
-                AVG(d.age) AS AVG_AGE,
-                AVG(d.imd_decile_19) AS AVG_IMD_DECILE,
-                COUNT(DISTINCT d.person_id) * 1000.0 / tp.total_count AS RATE_PER_1000
-            FROM {DB_SCHEMA}.ecl_cache ec
-            JOIN {DB_STORE}.observation o ON ec.code = o.mapped_concept_code
-            JOIN {DB_DEMOGRAPHICS}.DIM_PERSON_DEMOGRAPHICS d ON o.person_id = d.person_id
-            CROSS JOIN total_pop tp
-            WHERE ec.cluster_id = '{cluster_id}'
-            AND d.is_active = true
-            AND d.neighbourhood_registered IS NOT NULL
-            GROUP BY d.neighbourhood_registered, tp.total_count
-            ORDER BY PATIENT_COUNT DESC
-            """
-        else:  # MEDICATION
-            query = f"""
-            WITH total_pop AS (
-                SELECT COUNT(DISTINCT person_id) AS total_count
-                FROM {DB_DEMOGRAPHICS}.DIM_PERSON_DEMOGRAPHICS 
-                WHERE is_active = true 
-                AND neighbourhood_registered IS NOT NULL
-            )
-            SELECT 
-                d.neighbourhood_registered AS NEIGHBOURHOOD,
-                COUNT(DISTINCT d.person_id) AS PATIENT_COUNT,
-                AVG(d.age) AS AVG_AGE,
-                AVG(d.imd_decile_19) AS AVG_IMD_DECILE,
-                COUNT(DISTINCT d.person_id) * 1000.0 / tp.total_count AS RATE_PER_1000
-            FROM {DB_SCHEMA}.ecl_cache ec
-            JOIN {DB_STORE}.medication_order mo ON ec.code = mo.mapped_concept_code
-            JOIN REPORTING.OLIDS_PERSON_DEMOGRAPHICS.DIM_PERSON_DEMOGRAPHICS d ON mo.person_id = d.person_id
-            CROSS JOIN total_pop tp
-            WHERE ec.cluster_id = '{cluster_id}'
-            AND d.is_active = true
-            AND d.neighbourhood_registered IS NOT NULL
-            GROUP BY d.neighbourhood_registered, tp.total_count
-            ORDER BY PATIENT_COUNT DESC
-            """
-        
-        return conn.sql(query).to_pandas()
-    except Exception as e:
-        st.error(f"Error loading neighbourhood analysis: {str(e)}")
-        return pd.DataFrame()
\ No newline at end of file
+    metrics = get_cluster_metrics(cluster_id, cluster_type, (ORG_LEVELS['Neighbourhood'],), PROFILE_METRICS)
+    return neighbourhood_analysis(metrics, get_active_population('NEIGHBOURHOOD_REGISTERED'))
@@ -0,0 +1,198 @@
+# =============================================================================
+# SNOMED Cluster Manager - Query Result Cache
+# =============================================================================
+#
+# Process-wide LRU/TTL cache for service query results. Cluster-scoped entries
+# are keyed on the cluster's LAST_SUCCESSFUL_REFRESH so they stay valid until
+# the cluster is refreshed, and are dropped immediately when this app refreshes,
+# updates, renames or deletes the cluster.
+
+import functools
+import inspect
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+import streamlit as st
+from database import fetch_pandas
+from services.diagnostics_service import record_cache_event
+from config import DB_SCHEMA, CACHE_TTL_SECONDS, CACHE_MAX_ENTRIES, REFRESH_TOKEN_TTL_SECONDS
+from utils.helpers import canonical_cluster_id
+
+
+# Tag for entries that depend on the cluster list as a whole
+CATALOGUE_TAG = "__catalogue__"
+
+
+class QueryCache:
+    """Thread-safe LRU cache with per-entry expiry and tag invalidation"""
+
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expires_at, tag, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return (hit, value) for a key"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[2]
+
+    def set(self, key, value, tag=None, ttl_seconds=None):
+        """Store a value, evicting the least recently used entries"""
+        expires_at = time.monotonic() + (ttl_seconds or self.ttl_seconds)
+        with self._lock:
+            self._entries[key] = (expires_at, tag, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, tag):
+        """Drop every entry stored with a tag"""
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if entry[1] == tag]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self):
+        """Drop all entries"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+@st.cache_resource
+def get_query_cache():
+    """Get the process-wide query cache"""
+    return QueryCache(CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS)
+
+
+def get_refresh_token(cluster_id):
+    """Get LAST_SUCCESSFUL_REFRESH for a cluster (briefly cached)"""
+    cache = get_query_cache()
+    cluster_key = canonical_cluster_id(cluster_id)
+    key = ("__refresh_token__", cluster_key)
+    hit, token = cache.get(key)
+    if hit:
+        return token
+
+    result = fetch_pandas(f"""
+        SELECT MAX(last_successful_refresh) AS last_successful_refresh
+        FROM {DB_SCHEMA}.ECL_CACHE_METADATA
+        WHERE cluster_id = ?
+        """, [cluster_key])
+    token = None
+    if not result.empty and not pd.isnull(result.iloc[0, 0]):
+        token = str(result.iloc[0, 0])
+    cache.set(key, token, cluster_key, REFRESH_TOKEN_TTL_SECONDS)
+    return token
+
+
+def seed_refresh_tokens(refreshes):
+    """Store refresh tokens already fetched elsewhere (e.g. with the catalogue)
+
+    Args:
+        refreshes: Iterable of (cluster_id, LAST_SUCCESSFUL_REFRESH) pairs
+    """
+    cache = get_query_cache()
+    for cluster_id, refreshed in refreshes:
+        cluster_key = canonical_cluster_id(cluster_id)
+        token = None if pd.isnull(refreshed) else str(refreshed)
+        cache.set(("__refresh_token__", cluster_key), token, cluster_key, REFRESH_TOKEN_TTL_SECONDS)
+
+
+def _is_cacheable(value):
+    """Empty frames/dicts are what services return on error - don't keep them"""
+    if isinstance(value, tuple):
+        return all(_is_cacheable(item) for item in value)
+    if isinstance(value, dict):
+        return bool(value)
+    return not (isinstance(value, pd.DataFrame) and value.empty)
+
+
+def _copy(value):
+    """Copy frames so callers can't mutate the cached result"""
+    if isinstance(value, tuple):
+        return tuple(_copy(item) for item in value)
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    return value.copy() if isinstance(value, pd.DataFrame) else value
+
+
+def cached_query(scope="cluster", ttl_seconds=None):
+    """Cache a service function's result
+
+    Args:
+        scope: 'cluster' - first argument is a cluster ID, entries are keyed on
+               its refresh timestamp and dropped when the cluster changes;
+               'catalogue' - dropped whenever any cluster changes;
+               'global' - expire by TTL only
+        ttl_seconds: Override the default TTL
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache = get_query_cache()
+            token = None
+            tag = None
+            try:
+                if scope == "cluster":
+                    cluster_id = args[0] if args else kwargs.get("cluster_id")
+                    tag = canonical_cluster_id(cluster_id)
+                    token = get_refresh_token(cluster_id)
+                elif scope == "catalogue":
+                    tag = CATALOGUE_TAG
+                key = (func.__module__, func.__qualname__, args, tuple(sorted(kwargs.items())), token)
+                hash(key)
+            except Exception:
+                # Unhashable arguments or token lookup failure - run uncached
+                return func(*args, **kwargs)
+
+            hit, value = cache.get(key)
+            record_cache_event(f"{func.__module__.split('.')[-1]}.{func.__name__}", hit)
+            if hit:
+                return _copy(value)
+            value = func(*args, **kwargs)
+            if _is_cacheable(value):
+                cache.set(key, value, tag, ttl_seconds)
+            return _copy(value)
+        return wrapper
+    return decorator
+
+
+def invalidate_cluster(cluster_id):
+    """Drop cached results for a cluster and for the cluster catalogue"""
+    cache = get_query_cache()
+    cache.invalidate(canonical_cluster_id(cluster_id))
+    cache.invalidate(CATALOGUE_TAG)
+
+
+def invalidates_cluster(*id_params):
+    """Invalidate cached results for the named cluster ID parameters after the call"""
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            finally:
+                bound = signature.bind_partial(*args, **kwargs)
+                for param in id_params:
+                    if bound.arguments.get(param):
+                        invalidate_cluster(bound.arguments[param])
+        return wrapper
+    return decorator
@@ -0,0 +1,198 @@
+# =============================================================================
+# SNOMED Cluster Manager - Cluster Catalogue
+# =============================================================================
+#
+# Process-wide copy of ECL_CLUSTERS joined to ECL_CACHE_METADATA. It loads
+# once, then every CATALOGUE_SYNC_SECONDS fetches only the clusters whose
+# updated_at or last_attempted_refresh moved since the last sync (less
+# CATALOGUE_SYNC_OVERLAP_SECONDS, for rows committed late), so page
+# navigation normally costs no catalogue query. Edits made through this app
+# are applied to the copy straight away; the next sync replaces them with the
+# warehouse's rows.
+
+import functools
+import inspect
+import threading
+import time
+
+import pandas as pd
+import streamlit as st
+from database import fetch_pandas
+from services.cache_service import seed_refresh_tokens
+from config import DB_SCHEMA, CATALOGUE_SYNC_SECONDS, CATALOGUE_SYNC_OVERLAP_SECONDS
+from utils.helpers import canonical_cluster_id
+
+
+CATALOGUE_COLUMNS = """
+            c.cluster_id AS CLUSTER_ID,
+            c.ecl_expression AS ECL_EXPRESSION,
+            c.description AS DESCRIPTION,
+            c.cluster_type AS CLUSTER_TYPE,
+            c.created_at AS CREATED_AT,
+            c.updated_at AS UPDATED_AT,
+            c.created_by AS CREATED_BY,
+            c.updated_by AS UPDATED_BY,
+            m.last_successful_refresh AS LAST_SUCCESSFUL_REFRESH,
+            m.last_attempted_refresh AS LAST_ATTEMPTED_REFRESH,
+            m.last_refreshed_by AS LAST_REFRESHED_BY,
+            m.last_attempted_by AS LAST_ATTEMPTED_BY,
+            m.record_count AS RECORD_COUNT,
+            m.last_error_message AS LAST_ERROR_MESSAGE,
+            m.last_successful_refresh AS LAST_UPDATED"""
+
+# Columns whose maximum is the sync watermark
+_WATERMARK_COLUMNS = ['CREATED_AT', 'UPDATED_AT', 'LAST_ATTEMPTED_REFRESH']
+
+
+class ClusterCatalogue:
+    """Thread-safe cluster list kept current by delta syncs"""
+
+    def __init__(self, sync_seconds):
+        self.sync_seconds = sync_seconds
+        self.full_loads = 0
+        self.delta_syncs = 0
+        self._clusters = None  # DataFrame indexed by CLUSTER_ID
+        self._watermark = None
+        self._synced_at = 0.0
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        """Current clusters ordered by ID, syncing first if the copy is due"""
+        with self._lock:
+            if self._clusters is None:
+                self._full_load()
+            elif time.monotonic() - self._synced_at >= self.sync_seconds:
+                try:
+                    self._delta_sync()
+                except Exception as e:
+                    # Keep serving the last good copy - the next call retries
+                    st.warning(f"Cluster list may be out of date: {str(e)}")
+            return self._clusters.sort_index().reset_index()
+
+    def _full_load(self):
+        """Fetch every cluster"""
+        clusters = fetch_pandas(f"""
+        SELECT {CATALOGUE_COLUMNS}
+        FROM {DB_SCHEMA}.ECL_CLUSTERS c
+        LEFT JOIN {DB_SCHEMA}.ECL_CACHE_METADATA m ON c.cluster_id = m.cluster_id
+        """)
+        self._clusters = clusters.set_index('CLUSTER_ID')
+        self._synced(clusters)
+        self.full_loads += 1
+
+    def _delta_sync(self):
+        """Fetch clusters changed since the watermark, with the warehouse's cluster count
+
+        The window starts CATALOGUE_SYNC_OVERLAP_SECONDS before the watermark:
+        timestamps are set when a statement starts, so a row committed after
+        the last sync can carry a time before its watermark. Rows fetched
+        again just replace themselves.
+
+        A count that doesn't match after merging means clusters were deleted
+        or renamed elsewhere - those leave no changed row, so reload in full.
+        """
+        if self._watermark is None:
+            self._full_load()
+            return
+        result = fetch_pandas(f"""
+        SELECT n.CLUSTER_TOTAL, changed.*
+        FROM (SELECT COUNT(*) AS CLUSTER_TOTAL FROM {DB_SCHEMA}.ECL_CLUSTERS) n
+        LEFT JOIN (
+            SELECT {CATALOGUE_COLUMNS}
+            FROM {DB_SCHEMA}.ECL_CLUSTERS c
+            LEFT JOIN {DB_SCHEMA}.ECL_CACHE_METADATA m ON c.cluster_id = m.cluster_id
+            WHERE COALESCE(c.updated_at, c.created_at) >= ?
+            OR m.last_attempted_refresh >= ?
+        ) changed ON 1 = 1
+        """, [(self._watermark - pd.Timedelta(seconds=CATALOGUE_SYNC_OVERLAP_SECONDS)).to_pydatetime()] * 2)
+        total = int(result['CLUSTER_TOTAL'].iloc[0])
+        changed = (result.drop(columns='CLUSTER_TOTAL').dropna(subset=['CLUSTER_ID'])
+                   .drop_duplicates('CLUSTER_ID', keep='last'))
+        merged = self._clusters
+        if not changed.empty:
+            merged = pd.concat([merged.drop(changed['CLUSTER_ID'], errors='ignore'),
+                                changed.set_index('CLUSTER_ID')])
+        if len(merged) != total:
+            self._full_load()
+            return
+        self._clusters = merged
+        self._synced(changed)
+        self.delta_syncs += 1
+
+    def _synced(self, fetched):
+        """Advance the watermark and sync time after fetching rows"""
+        seed_refresh_tokens(zip(fetched['CLUSTER_ID'], fetched['LAST_SUCCESSFUL_REFRESH']))
+        latest = pd.concat([fetched[c].dropna() for c in _WATERMARK_COLUMNS]).max() if not fetched.empty else None
+        if latest is not None and not pd.isnull(latest):
+            self._watermark = latest if self._watermark is None else max(latest, self._watermark)
+        self._synced_at = time.monotonic()
+
+    def _now(self):
+        """Current time in the same timezone as the fetched timestamps"""
+        tz = getattr(self._clusters['UPDATED_AT'].dtype, 'tz', None)
+        return pd.Timestamp.now(tz=tz)
+
+    def upsert(self, cluster_id, fields, touch=()):
+        """Apply a local create/update until the next sync replaces it
+
+        Args:
+            cluster_id: Cluster ID (canonicalised)
+            fields: Column -> value
+            touch: Columns to set to the current time
+        """
+        with self._lock:
+            if self._clusters is None:
+                return
+            now = self._now()
+            values = dict(fields, **{column: now for column in touch})
+            key = canonical_cluster_id(cluster_id)
+            for column, value in values.items():
+                self._clusters.loc[key, column] = value
+
+    def rename(self, old_cluster_id, new_cluster_id):
+        """Apply a local rename until the next sync replaces it"""
+        with self._lock:
+            if self._clusters is None:
+                return
+            old_key = canonical_cluster_id(old_cluster_id)
+            if old_key in self._clusters.index:
+                self._clusters = self._clusters.rename(index={old_key: canonical_cluster_id(new_cluster_id)})
+
+    def remove(self, cluster_id):
+        """Apply a local delete"""
+        with self._lock:
+            if self._clusters is not None:
+                self._clusters = self._clusters.drop(canonical_cluster_id(cluster_id), errors='ignore')
+
+    def expire(self):
+        """Make the next snapshot sync - for changes whose values aren't known locally"""
+        with self._lock:
+            self._synced_at = 0.0
+
+    def clear(self):
+        """Drop the copy - the next snapshot loads in full"""
+        with self._lock:
+            self._clusters = None
+            self._watermark = None
+
+
+@st.cache_resource
+def get_cluster_catalogue():
+    """Get the process-wide cluster catalogue"""
+    return ClusterCatalogue(CATALOGUE_SYNC_SECONDS)
+
+
+def updates_catalogue(apply):
+    """Apply a mutation's outcome to the catalogue: apply(catalogue, result, **arguments)"""
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            result = func(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            apply(get_cluster_catalogue(), result, **bound.arguments)
+            return result
+        return wrapper
+    return decorator
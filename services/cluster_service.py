@@ -4,125 +4,283 @@
 
 import pandas as pd
 import streamlit as st
-from database import get_connection
-from config import DB_SCHEMA, STALE_LABEL
-from utils.helpers import normalize_whitespace
+from database import fetch_pandas, fetch_head, fetch_csv, execute_statement
+from services.cache_service import cached_query, invalidates_cluster
+from services.catalogue_service import get_cluster_catalogue, updates_catalogue
+from config import DB_SCHEMA, STALE_LABEL, STALE_AFTER_DAYS, ECL_PREVIEW_ROWS, SNOMED_SYSTEM
+from utils.helpers import normalize_whitespace, canonical_cluster_id
+from terminology.ecl import ECLSyntaxError, canonical_ecl
+from terminology.evaluate import ECLNotSupported, expand_ecl
+from terminology.index import load_index
 
 
-# Get connection instance
-conn = get_connection()
+def _refresh_status(last_refresh):
+    """Status label for each cluster's LAST_SUCCESSFUL_REFRESH"""
+    refreshed = pd.to_datetime(last_refresh)
+    stale_before = pd.Timestamp.now(tz=refreshed.dt.tz) - pd.Timedelta(days=STALE_AFTER_DAYS)
+    status = pd.Series('Fresh', index=last_refresh.index)
+    status[refreshed < stale_before] = STALE_LABEL
+    status[refreshed.isna()] = 'Never refreshed'
+    return status
 
 
 def get_all_clusters():
-    """Get all ECL clusters with metadata"""
+    """Get all ECL clusters with metadata
+
+    Served from the process-wide catalogue, which only queries the warehouse
+    for clusters changed since its last sync. STATUS is worked out here so it
+    moves with the clock between syncs.
+    """
     try:
-        stale_label = STALE_LABEL
-        query = f"""
-        SELECT 
-            c.cluster_id AS CLUSTER_ID,
-            c.ecl_expression AS ECL_EXPRESSION,
-            c.description AS DESCRIPTION,
-            c.cluster_type AS CLUSTER_TYPE,
-            c.created_at AS CREATED_AT,
-            c.updated_at AS UPDATED_AT,
-            c.created_by AS CREATED_BY,
-            c.updated_by AS UPDATED_BY,
-            m.last_successful_refresh AS LAST_SUCCESSFUL_REFRESH,
-            m.last_attempted_refresh AS LAST_ATTEMPTED_REFRESH,
-            m.last_refreshed_by AS LAST_REFRESHED_BY,
-            m.last_attempted_by AS LAST_ATTEMPTED_BY,
-            m.record_count AS RECORD_COUNT,
-            m.last_error_message AS LAST_ERROR_MESSAGE,
-            CASE 
-                WHEN m.last_successful_refresh IS NULL THEN 'Never refreshed'
-                WHEN m.last_successful_refresh < DATEADD(day, -28, CURRENT_TIMESTAMP()) THEN '{stale_label}'
-                ELSE 'Fresh'
-            END as STATUS,
-            CASE 
-                WHEN m.last_successful_refresh IS NULL THEN 'Never refreshed'
-                WHEN m.last_successful_refresh < DATEADD(day, -28, CURRENT_TIMESTAMP()) THEN '{stale_label}'
-                ELSE 'Fresh'
-            END as STATUS_LABEL,
-            m.last_successful_refresh AS LAST_UPDATED
-        FROM {DB_SCHEMA}.ECL_CLUSTERS c
-        LEFT JOIN {DB_SCHEMA}.ECL_CACHE_METADATA m ON c.cluster_id = m.cluster_id
-        ORDER BY c.cluster_id
-        """
-        return conn.sql(query).to_pandas()
+        clusters = get_cluster_catalogue().snapshot()
+        if clusters.empty:
+            return clusters
+        clusters['STATUS'] = _refresh_status(clusters['LAST_SUCCESSFUL_REFRESH'])
+        clusters['STATUS_LABEL'] = clusters['STATUS']
+        return clusters
     except Exception as e:
         st.error(f"Error connecting to ECL tables: {str(e)}")
         st.info("Please ensure the ECL cache system is properly installed in DATA_LAKE__NCL.TERMINOLOGY schema.")
         return pd.DataFrame()
 
 
-def test_ecl_expression(ecl_expr):
-    """Test an ECL expression using ECL_DETAILS function (supports full 50k limit)"""
+def _ecl_details_query(function):
+    """Code lookup query for an ECL table function - the expression is bound"""
+    return f"SELECT code, display, system FROM TABLE({DB_SCHEMA}.{function}(?))"
+
+
+def _single_line(text):
+    """Collapse line breaks - ECL and descriptions are stored on one line"""
+    return text.replace("\n", " ").replace("\r", " ")
+
+
+def _current_actor():
+    """Upper-cased email of the signed-in user, '' if unknown"""
+    actor = st.user.get("email") if hasattr(st, 'user') else None
+    return (actor or "").upper()
+
+
+# Columns UPSERT_ECL_CLUSTER sets to now - it saves and refreshes the cluster
+_SAVED_COLUMNS = ('UPDATED_AT', 'LAST_SUCCESSFUL_REFRESH', 'LAST_ATTEMPTED_REFRESH', 'LAST_UPDATED')
+
+
+def _saved_fields(ecl_expression, description, cluster_type):
+    """Catalogue columns for a cluster saved through this app"""
+    actor = _current_actor()
+    return {
+        'ECL_EXPRESSION': _single_line(ecl_expression),
+        'DESCRIPTION': _single_line(description),
+        'CLUSTER_TYPE': cluster_type.upper() if cluster_type else 'OBSERVATION',
+        'UPDATED_BY': actor,
+        'LAST_REFRESHED_BY': actor,
+        'LAST_ATTEMPTED_BY': actor,
+        'LAST_ERROR_MESSAGE': None
+    }
+
+
+def _apply_create(catalogue, created, cluster_id, ecl_expression, description, cluster_type):
+    if created:
+        fields = _saved_fields(ecl_expression, description, cluster_type)
+        fields['CREATED_BY'] = fields['UPDATED_BY']
+        catalogue.upsert(cluster_id, fields, touch=('CREATED_AT',) + _SAVED_COLUMNS)
+        # The procedure refreshes the codes too - their count is only known to the warehouse
+        catalogue.expire()
+
+
+def _apply_update(catalogue, updated, cluster_id, ecl_expression, description, cluster_type):
+    if updated:
+        catalogue.upsert(cluster_id, _saved_fields(ecl_expression, description, cluster_type), touch=_SAVED_COLUMNS)
+        catalogue.expire()
+
+
+def _apply_rename(catalogue, renamed, old_cluster_id, new_cluster_id, ecl_expression, description, cluster_type):
+    if renamed:
+        catalogue.rename(old_cluster_id, new_cluster_id)
+        fields = _saved_fields(ecl_expression, description, cluster_type)
+        if not cluster_type:
+            # The procedure keeps the existing type
+            del fields['CLUSTER_TYPE']
+        catalogue.upsert(new_cluster_id, fields, touch=('UPDATED_AT',))
+
+
+def _apply_delete(catalogue, deleted, cluster_id):
+    if deleted:
+        catalogue.remove(cluster_id)
+
+
+def _apply_refresh(catalogue, result, cluster_id, force):
+    # Code counts and errors are only known to the warehouse - sync on next read
+    catalogue.expire()
+
+
+def _checked_ecl(ecl_expr):
+    """Canonical form of an expression to send to the warehouse - None after
+    showing where it isn't valid ECL, so a typo never costs a round trip"""
+    try:
+        return canonical_ecl(ecl_expr)
+    except ECLSyntaxError as e:
+        st.error(f"ECL Syntax Error: {e}")
+        return None
+
+
+def _local_index():
+    """The local terminology index, None without one (or with one needing a rebuild)"""
+    try:
+        return load_index()
+    except ValueError as e:
+        st.warning(f"Terminology index not used: {e}")
+        return None
+
+
+def local_ecl_available():
+    """Whether ECL is expanded in-process from a local terminology index"""
+    return _local_index() is not None
+
+
+def _expand_locally(canonical_ecl_expr):
+    """Active concepts matching an expression, from the local index - (index,
+    positions), or None to ask the warehouse: no index, or the expression
+    needs data the index doesn't hold (filters, history, concrete values)"""
+    index = _local_index()
+    if index is None:
+        return None
+    try:
+        positions = expand_ecl(index, canonical_ecl_expr)
+    except ECLNotSupported:
+        return None
+    return index, positions[index.is_active(positions)]
+
+
+def _local_codes(index, positions):
+    """Codes in the shape ECL_DETAILS returns them"""
+    return pd.DataFrame({
+        'CODE': index.concept_ids(positions),
+        'DISPLAY': index.terms(positions),
+        'SYSTEM': SNOMED_SYSTEM,
+    })
+
+
+@cached_query(scope="global")
+def _fetch_ecl_codes(canonical_ecl_expr):
     try:
-        safe_expr = ecl_expr.replace("'", "''")
         # Try ECL_DETAILS first (full API limit), fallback to ECL_TEST_DETAILS (10k limit) if needed
         try:
-            return conn.sql(f"SELECT code, display, system FROM TABLE({DB_SCHEMA}.ECL_DETAILS('{safe_expr}'))").to_pandas()
+            return fetch_pandas(_ecl_details_query("ECL_DETAILS"), [canonical_ecl_expr])
         except:
             # Fallback to TEST version if ECL_DETAILS doesn't exist
-            return conn.sql(f"SELECT code, display, system FROM TABLE({DB_SCHEMA}.ECL_TEST_DETAILS('{safe_expr}'))").to_pandas()
+            return fetch_pandas(_ecl_details_query("ECL_TEST_DETAILS"), [canonical_ecl_expr])
     except Exception as e:
         st.error(f"ECL Error: {str(e)}")
         return pd.DataFrame()
 
 
-def get_cluster_cache(cluster_id):
-    """Get cached codes for a cluster - only latest refresh"""
+def test_ecl_expression(ecl_expr):
+    """Test an ECL expression using ECL_DETAILS function (supports full 50k limit)
+
+    Checked locally first. With a local terminology index the codes are
+    expanded in-process, with no code limit; otherwise (or if the index can't
+    evaluate the expression) they are looked up and cached by canonical form,
+    so rewording, reordering or re-terming an expression reuses them.
+    """
+    canonical = _checked_ecl(ecl_expr)
+    if canonical is None:
+        return pd.DataFrame()
+    local = _expand_locally(canonical)
+    return _fetch_ecl_codes(canonical) if local is None else _local_codes(*local)
+
+
+@cached_query(scope="global")
+def _fetch_ecl_preview(canonical_ecl_expr, limit):
+    try:
+        try:
+            return fetch_head(_ecl_details_query("ECL_DETAILS"), limit, [canonical_ecl_expr])
+        except:
+            return fetch_head(_ecl_details_query("ECL_TEST_DETAILS"), limit, [canonical_ecl_expr])
+    except Exception as e:
+        st.error(f"ECL Error: {str(e)}")
+        return pd.DataFrame(), 0
+
+
+def preview_ecl_expression(ecl_expr, limit=ECL_PREVIEW_ROWS):
+    """Get the first codes for an ECL expression and the total code count"""
+    canonical = _checked_ecl(ecl_expr)
+    if canonical is None:
+        return pd.DataFrame(), 0
+    local = _expand_locally(canonical)
+    if local is None:
+        return _fetch_ecl_preview(canonical, limit)
+    # Only the shown rows need their terms decoded
+    index, positions = local
+    return _local_codes(index, positions[:max(1, int(limit))]), len(positions)
+
+
+def export_ecl_expression_csv(ecl_expr):
+    """Get the codes for an ECL expression as CSV, streamed from the warehouse"""
+    canonical = _checked_ecl(ecl_expr)
+    if canonical is None:
+        return ""
+    local = _expand_locally(canonical)
+    if local is not None:
+        return _local_codes(*local).to_csv(index=False)
+    try:
+        try:
+            return fetch_csv(_ecl_details_query("ECL_DETAILS"), [canonical])
+        except:
+            return fetch_csv(_ecl_details_query("ECL_TEST_DETAILS"), [canonical])
+    except Exception as e:
+        st.error(f"ECL Error: {str(e)}")
+        return ""
+
+
+@cached_query()
+def _fetch_cluster_codes(cluster_key):
+    """Codes from a cluster's latest refresh in one round trip"""
     try:
-        normalized_cluster_id_upper = cluster_id.upper().strip()
-        
-        # Get the latest refresh timestamp for this cluster
-        latest_refresh_query = f"""
-        SELECT MAX(last_refreshed) as latest_refresh
-        FROM {DB_SCHEMA}.ECL_CACHE
-        WHERE UPPER(cluster_id) = '{normalized_cluster_id_upper}'
-        """
-        latest_result = conn.sql(latest_refresh_query).to_pandas()
-        
-        if latest_result.empty or latest_result.iloc[0, 0] is None:
-            return pd.DataFrame()
-            
-        latest_refresh = latest_result.iloc[0, 0]
-        
-        # Get only codes from the latest refresh
         query = f"""
         SELECT code, display, system, last_refreshed
         FROM {DB_SCHEMA}.ECL_CACHE
-        WHERE UPPER(cluster_id) = '{normalized_cluster_id_upper}'
-        AND last_refreshed = '{latest_refresh}'
+        WHERE cluster_id = ?
+        QUALIFY last_refreshed = MAX(last_refreshed) OVER ()
         ORDER BY code
         """
-        return conn.sql(query).to_pandas()
+        return fetch_pandas(query, [cluster_key])
     except Exception as e:
         st.error(f"Cache Error: {str(e)}")
         return pd.DataFrame()
 
 
+def get_cluster_cache(cluster_id):
+    """Get cached codes for a cluster - only latest refresh
+
+    Looked up by the canonical cluster ID (IDs are stored upper case, so the
+    equality filter can prune ECL_CACHE partitions) and kept in the query
+    cache until the cluster's next refresh, however the ID was typed.
+    """
+    return _fetch_cluster_codes(canonical_cluster_id(cluster_id))
+
+
+@updates_catalogue(_apply_refresh)
+@invalidates_cluster("cluster_id")
 def refresh_cluster(cluster_id, force=False):
     """Refresh a specific cluster"""
     try:
         normalized_cluster_id = cluster_id.strip()
-        safe_cluster_id = normalized_cluster_id.replace("'", "''")
         
         if force:
-            query = f"CALL {DB_SCHEMA}.FORCE_REFRESH_ECL_CLUSTER('{safe_cluster_id}')"
+            query = f"CALL {DB_SCHEMA}.FORCE_REFRESH_ECL_CLUSTER(?)"
         else:
-            query = f"CALL {DB_SCHEMA}.REFRESH_ECL_CLUSTER('{safe_cluster_id}')"
+            query = f"CALL {DB_SCHEMA}.REFRESH_ECL_CLUSTER(?)"
         
-        result = conn.sql(query).to_pandas()
+        result = fetch_pandas(query, [normalized_cluster_id])
         return result.iloc[0, 0] if not result.empty else "No result"
     except Exception as e:
         return f"Error: {str(e)}"
 
 
+@cached_query()
 def get_cluster_change_history(cluster_id, limit=50):
     """Get change history for a cluster from ECL_CLUSTER_CHANGES table"""
     try:
-        safe_cluster_id = cluster_id.strip().replace("'", "''")
         query = f"""
         SELECT 
             change_id,
@@ -134,20 +292,20 @@ def get_cluster_change_history(cluster_id, limit=50):
             changed_by,
             refresh_session_id
         FROM {DB_SCHEMA}.ECL_CLUSTER_CHANGES
-        WHERE cluster_id = '{safe_cluster_id}'
+        WHERE cluster_id = ?
         ORDER BY change_timestamp DESC
-        LIMIT {limit}
+        LIMIT ?
         """
-        return conn.sql(query).to_pandas()
+        return fetch_pandas(query, [cluster_id.strip(), int(limit)])
     except Exception as e:
         st.error(f"Change History Error: {str(e)}")
         return pd.DataFrame()
 
 
+@cached_query()
 def get_cluster_change_summary(cluster_id, days=30):
     """Get summary of changes over time for a cluster"""
     try:
-        safe_cluster_id = cluster_id.strip().replace("'", "''")
         query = f"""
         SELECT 
             DATE(change_timestamp) as change_date,
@@ -155,17 +313,18 @@ def get_cluster_change_summary(cluster_id, days=30):
             COUNT(*) as change_count,
             refresh_session_id
         FROM {DB_SCHEMA}.ECL_CLUSTER_CHANGES
-        WHERE cluster_id = '{safe_cluster_id}'
-        AND change_timestamp >= DATEADD(day, -{days}, CURRENT_TIMESTAMP())
+        WHERE cluster_id = ?
+        AND change_timestamp >= DATEADD(day, ?, CURRENT_TIMESTAMP())
         GROUP BY DATE(change_timestamp), change_type, refresh_session_id
         ORDER BY change_date DESC, change_type
         """
-        return conn.sql(query).to_pandas()
+        return fetch_pandas(query, [cluster_id.strip(), -int(days)])
     except Exception as e:
         st.error(f"Change Summary Error: {str(e)}")
         return pd.DataFrame()
 
 
+@cached_query(scope="catalogue")
 def get_recent_cluster_changes(limit=100):
     """Get recent changes across all clusters"""
     try:
@@ -180,9 +339,9 @@ def get_recent_cluster_changes(limit=100):
             c.refresh_session_id
         FROM {DB_SCHEMA}.ECL_CLUSTER_CHANGES c
         ORDER BY c.change_timestamp DESC
-        LIMIT {limit}
+        LIMIT ?
         """
-        return conn.sql(query).to_pandas()
+        return fetch_pandas(query, [int(limit)])
     except Exception as e:
         st.error(f"Recent Changes Error: {str(e)}")
         return pd.DataFrame()
@@ -191,14 +350,14 @@ def get_recent_cluster_changes(limit=100):
 def cluster_matches_expected(cluster_id: str, expected_ecl: str, expected_desc: str) -> bool:
     """Check if cluster matches expected values"""
     try:
-        safe_id = cluster_id.upper().strip().replace("'", "''")
-        df = conn.sql(
+        df = fetch_pandas(
             f"""
             SELECT ecl_expression, description
             FROM {DB_SCHEMA}.ECL_CLUSTERS
-            WHERE cluster_id = '{safe_id}'
-            """
-        ).to_pandas()
+            WHERE cluster_id = ?
+            """,
+            [cluster_id.upper().strip()]
+        )
         if df.empty:
             return False
         current_ecl = normalize_whitespace(df.iloc[0]["ECL_EXPRESSION"]) if "ECL_EXPRESSION" in df.columns else ""
@@ -208,20 +367,20 @@ def cluster_matches_expected(cluster_id: str, expected_ecl: str, expected_desc:
         return False
 
 
+@updates_catalogue(_apply_create)
+@invalidates_cluster("cluster_id")
 def create_new_cluster(cluster_id, ecl_expression, description, cluster_type='OBSERVATION'):
     """Create a new cluster - prevents duplicates"""
     try:
-        safe_id = cluster_id.upper().strip().replace("'", "''")
-        safe_ecl = ecl_expression.replace("'", "''").replace("\n", " ").replace("\r", " ")
-        safe_desc = description.replace("'", "''").replace("\n", " ").replace("\r", " ")
-        safe_type = cluster_type.upper() if cluster_type else 'OBSERVATION'
-        actor = st.user.get("email") if hasattr(st, 'user') else None
-        actor_upper = (actor or "").upper()
-        actor_safe = actor_upper.replace("'", "''")
-        query = f"CALL {DB_SCHEMA}.UPSERT_ECL_CLUSTER('{safe_id}', '{safe_ecl}', '{safe_desc}', '{actor_safe}', '{safe_type}')"
-        result = conn.sql(query).to_pandas()
+        cluster_key = cluster_id.upper().strip()
+        cluster_type = cluster_type.upper() if cluster_type else 'OBSERVATION'
+        actor = _current_actor()
+        query = f"CALL {DB_SCHEMA}.UPSERT_ECL_CLUSTER(?, ?, ?, ?, ?)"
+        result = fetch_pandas(query, [
+            cluster_key, _single_line(ecl_expression), _single_line(description), actor, cluster_type
+        ])
         if result.empty:
-            if cluster_matches_expected(safe_id, ecl_expression, description):
+            if cluster_matches_expected(cluster_id, ecl_expression, description):
                 return True
             st.error("❌ Procedure returned no result")
             return False
@@ -229,12 +388,12 @@ def create_new_cluster(cluster_id, ecl_expression, description, cluster_type='OB
         if msg.startswith("SUCCESS"):
             return True
         else:
-            if cluster_matches_expected(safe_id, ecl_expression, description):
+            if cluster_matches_expected(cluster_id, ecl_expression, description):
                 return True
             st.error(f"❌ {msg}")
             return False
     except Exception as e:
-        if cluster_matches_expected(safe_id, ecl_expression, description):
+        if cluster_matches_expected(cluster_id, ecl_expression, description):
             return True
         
         details = getattr(e, 'msg', None) or str(e)
@@ -246,20 +405,20 @@ def create_new_cluster(cluster_id, ecl_expression, description, cluster_type='OB
         return False
 
 
+@updates_catalogue(_apply_update)
+@invalidates_cluster("cluster_id")
 def update_existing_cluster(cluster_id, ecl_expression, description, cluster_type='OBSERVATION'):
     """Update an existing cluster"""
     try:
-        safe_id = cluster_id.upper().strip().replace("'", "''")
-        safe_ecl = ecl_expression.replace("'", "''").replace("\n", " ").replace("\r", " ")
-        safe_desc = description.replace("'", "''").replace("\n", " ").replace("\r", " ")
-        safe_type = cluster_type.upper() if cluster_type else 'OBSERVATION'
-        actor = st.user.get("email") if hasattr(st, 'user') else None
-        actor_upper = (actor or "").upper()
-        actor_safe = actor_upper.replace("'", "''")
-        query = f"CALL {DB_SCHEMA}.UPSERT_ECL_CLUSTER('{safe_id}', '{safe_ecl}', '{safe_desc}', '{actor_safe}', '{safe_type}')"
-        result = conn.sql(query).to_pandas()
+        cluster_key = cluster_id.upper().strip()
+        cluster_type = cluster_type.upper() if cluster_type else 'OBSERVATION'
+        actor = _current_actor()
+        query = f"CALL {DB_SCHEMA}.UPSERT_ECL_CLUSTER(?, ?, ?, ?, ?)"
+        result = fetch_pandas(query, [
+            cluster_key, _single_line(ecl_expression), _single_line(description), actor, cluster_type
+        ])
         if result.empty:
-            if cluster_matches_expected(safe_id, ecl_expression, description):
+            if cluster_matches_expected(cluster_id, ecl_expression, description):
                 return True
             st.error("❌ Update failed: procedure returned no result")
             return False
@@ -267,35 +426,39 @@ def update_existing_cluster(cluster_id, ecl_expression, description, cluster_typ
         if msg.startswith("SUCCESS"):
             return True
         else:
-            if cluster_matches_expected(safe_id, ecl_expression, description):
+            if cluster_matches_expected(cluster_id, ecl_expression, description):
                 return True
             st.error(f"Update Error: {msg}")
             return False
     except Exception as e:
-        if cluster_matches_expected(safe_id, ecl_expression, description):
+        if cluster_matches_expected(cluster_id, ecl_expression, description):
             return True
         
         # Fallback: perform MERGE directly if CALL failed
         try:
             merge_sql = f"""
             MERGE INTO {DB_SCHEMA}.ECL_CLUSTERS AS target
-            USING (SELECT '{safe_id}' AS cluster_id) AS source
+            USING (
+                SELECT ? AS cluster_id, ? AS ecl_expression, ? AS description, ? AS cluster_type, ? AS actor
+            ) AS source
             ON target.cluster_id = source.cluster_id
             WHEN MATCHED THEN UPDATE SET 
-                ecl_expression = '{safe_ecl}',
-                description = '{safe_desc}',
-                cluster_type = '{safe_type}',
+                ecl_expression = source.ecl_expression,
+                description = source.description,
+                cluster_type = source.cluster_type,
                 updated_at = CURRENT_TIMESTAMP(),
-                updated_by = '{actor_safe or ""}'
+                updated_by = source.actor
             WHEN NOT MATCHED THEN INSERT (cluster_id, ecl_expression, description, cluster_type, created_by, updated_by)
-                VALUES ('{safe_id}', '{safe_ecl}', '{safe_desc}', '{safe_type}', '{actor_safe or ""}', '{actor_safe or ""}');
+                VALUES (source.cluster_id, source.ecl_expression, source.description, source.cluster_type, source.actor, source.actor);
             """
-            conn.sql(merge_sql).collect()
-            conn.sql(f"CALL {DB_SCHEMA}.FORCE_REFRESH_ECL_CLUSTER('{safe_id}', '{actor_safe}')").collect()
+            execute_statement(merge_sql, [
+                cluster_key, _single_line(ecl_expression), _single_line(description), cluster_type, actor
+            ])
+            execute_statement(f"CALL {DB_SCHEMA}.FORCE_REFRESH_ECL_CLUSTER(?, ?)", [cluster_key, actor])
             st.info("ℹ️ Procedure call failed; applied direct MERGE + refresh fallback.")
             return True
         except Exception as e2:
-            if cluster_matches_expected(safe_id, ecl_expression, description):
+            if cluster_matches_expected(cluster_id, ecl_expression, description):
                 return True
             details = getattr(e2, 'msg', None) or str(e2)
             sfqid = getattr(e2, 'sfqid', None)
@@ -306,11 +469,12 @@ def update_existing_cluster(cluster_id, ecl_expression, description, cluster_typ
             return False
 
 
+@updates_catalogue(_apply_delete)
+@invalidates_cluster("cluster_id")
 def delete_cluster(cluster_id):
     """Delete a cluster and its cache"""
     try:
-        safe_id = cluster_id.strip().replace("'", "''")
-        result = conn.sql(f"CALL {DB_SCHEMA}.DELETE_ECL_CLUSTER('{safe_id}')").collect()
+        result = execute_statement(f"CALL {DB_SCHEMA}.DELETE_ECL_CLUSTER(?)", [cluster_id.strip()])
         
         # Check if the stored procedure returned an error
         if result and len(result) > 0:
@@ -332,23 +496,18 @@ def delete_cluster(cluster_id):
         return False
 
 
+@updates_catalogue(_apply_rename)
+@invalidates_cluster("old_cluster_id", "new_cluster_id")
 def rename_cluster(old_cluster_id: str, new_cluster_id: str, ecl_expression: str, description: str, cluster_type: str = None) -> bool:
     """Rename a cluster across all tables in a single transaction"""
     try:
-        safe_old = old_cluster_id.strip().replace("'", "''")
-        safe_new = new_cluster_id.upper().strip().replace("'", "''")
-        safe_ecl = ecl_expression.replace("'", "''").replace("\n", " ").replace("\r", " ")
-        safe_desc = description.replace("'", "''").replace("\n", " ").replace("\r", " ")
-        actor = st.user.get("email") if hasattr(st, 'user') else None
-        actor_upper = (actor or "").upper()
-        actor_safe = actor_upper.replace("'", "''")
-        safe_type = cluster_type.upper() if cluster_type else 'NULL'
-        
-        if safe_type == 'NULL':
-            query = f"CALL {DB_SCHEMA}.RENAME_ECL_CLUSTER('{safe_old}', '{safe_new}', '{safe_ecl}', '{safe_desc}', '{actor_safe}', NULL)"
-        else:
-            query = f"CALL {DB_SCHEMA}.RENAME_ECL_CLUSTER('{safe_old}', '{safe_new}', '{safe_ecl}', '{safe_desc}', '{actor_safe}', '{safe_type}')"
-        result = conn.sql(query)
+        # A NULL cluster type keeps the existing type
+        query = f"CALL {DB_SCHEMA}.RENAME_ECL_CLUSTER(?, ?, ?, ?, ?, ?)"
+        result = fetch_pandas(query, [
+            old_cluster_id.strip(), new_cluster_id.upper().strip(),
+            _single_line(ecl_expression), _single_line(description),
+            _current_actor(), cluster_type.upper() if cluster_type else None
+        ])
         if result.empty:
             st.error("❌ Rename failed: procedure returned no result")
             return False
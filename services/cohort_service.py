@@ -0,0 +1,161 @@
+# =============================================================================
+# SNOMED Cluster Manager - Patient Cohorts
+# =============================================================================
+#
+# Each cluster's active patients as a compressed bitmap (utils/bitmap.py)
+# over a person dictionary that numbers the active population 0..n-1. A
+# cluster's bitmap is loaded once, with the same event and demographics joins
+# as the usage metrics, and kept until the cluster is refreshed; "in A and B
+# but not C" is then answered in memory rather than by a query per combination.
+
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+from database import fetch_pandas
+from services.cache_service import cached_query
+from services.cluster_service import get_all_clusters
+from services.metric_service import SOURCES
+from utils.bitmap import Bitmap
+from utils.helpers import canonical_cluster_id
+from config import DB_SCHEMA, DB_STORE, DB_DEMOGRAPHICS, DENOMINATOR_TTL_SECONDS
+
+
+class PersonDictionary:
+    """Active person IDs numbered by position, shared by every cohort bitmap"""
+
+    def __init__(self, person_ids):
+        self._index = pd.Index(person_ids)
+
+    def __len__(self):
+        return len(self._index)
+
+    def bitmap(self, person_ids):
+        """Bitmap of the positions of the given persons - unknown persons are left out"""
+        positions = self._index.get_indexer(person_ids)
+        return Bitmap.from_values(positions[positions >= 0])
+
+    def person_ids(self, bitmap):
+        """Person IDs of a bitmap's positions"""
+        return self._index[bitmap.to_array().astype(np.int64)]
+
+
+@cached_query(scope="global", ttl_seconds=DENOMINATOR_TTL_SECONDS)
+def _load_person_dictionary():
+    """Number the active population (raises on error so failures aren't cached)"""
+    df = fetch_pandas(f"""
+        SELECT person_id AS PERSON_ID
+        FROM {DB_DEMOGRAPHICS}.DIM_PERSON_DEMOGRAPHICS
+        WHERE is_active = true
+        ORDER BY person_id
+        """)
+    return PersonDictionary(df['PERSON_ID'].to_numpy())
+
+
+@cached_query(scope="cluster")
+def _load_cluster_cohort(cluster_id, cluster_type, people):
+    """A cluster's active patients over a person dictionary (raises on error)
+
+    The dictionary is part of the cache key, so bitmaps numbered by an expired
+    dictionary are never combined with ones from its replacement.
+    """
+    source = SOURCES.get(cluster_type, SOURCES['OBSERVATION'])
+    df = fetch_pandas(f"""
+        SELECT DISTINCT d.person_id AS PERSON_ID
+        FROM {DB_STORE}.{source['table']} e
+        JOIN {DB_SCHEMA}.ecl_cache ec ON e.mapped_concept_code = ec.code
+        JOIN {DB_DEMOGRAPHICS}.DIM_PERSON_DEMOGRAPHICS d ON e.person_id = d.person_id
+        WHERE ec.cluster_id = ?
+          AND d.is_active = true
+        """, [canonical_cluster_id(cluster_id)])
+    return people.bitmap(df['PERSON_ID'].to_numpy())
+
+
+def get_person_dictionary():
+    """Get the active-population person dictionary, or None on error"""
+    try:
+        return _load_person_dictionary()
+    except Exception as e:
+        st.error(f"Error loading active population: {str(e)}")
+        return None
+
+
+def get_cluster_cohort(cluster_id, cluster_type, people=None):
+    """Get a cluster's active patients as a Bitmap, or None on error
+
+    Bitmaps are only comparable when numbered by the same person dictionary -
+    pass one in when combining several.
+    """
+    if people is None:
+        people = get_person_dictionary()
+    if people is None:
+        return None
+    try:
+        return _load_cluster_cohort(cluster_id, cluster_type, people)
+    except Exception as e:
+        st.error(f"Error loading patients for {cluster_id}: {str(e)}")
+        return None
+
+
+def _cluster_cohorts(cluster_ids, people):
+    """Bitmaps of several clusters by ID, or None if any failed to load"""
+    cluster_types = get_all_clusters().set_index('CLUSTER_ID')['CLUSTER_TYPE'].to_dict()
+    cohorts = {}
+    for cluster_id in dict.fromkeys(cluster_ids):
+        cohort = get_cluster_cohort(cluster_id, cluster_types.get(cluster_id, 'OBSERVATION'), people)
+        if cohort is None:
+            return None
+        cohorts[cluster_id] = cohort
+    return cohorts
+
+
+def build_cohort(all_of=(), any_of=(), none_of=()):
+    """Active patients in every cluster of all_of, at least one of any_of and none of none_of
+
+    Args:
+        all_of, any_of, none_of: Cluster IDs - an empty all_of and any_of
+            starts from the whole active population
+
+    Returns:
+        (Bitmap, PersonDictionary), or (None, None) on error
+    """
+    people = get_person_dictionary()
+    cohorts = _cluster_cohorts([*all_of, *any_of, *none_of], people) if people is not None else None
+    if cohorts is None:
+        return None, None
+
+    if all_of or any_of:
+        included = [reduce(lambda a, b: a & b, (cohorts[c] for c in all_of))] if all_of else []
+        if any_of:
+            included.append(reduce(lambda a, b: a | b, (cohorts[c] for c in any_of)))
+        cohort = reduce(lambda a, b: a & b, included)
+    else:
+        cohort = Bitmap.from_values(np.arange(len(people)))
+    for cluster_id in none_of:
+        cohort = cohort - cohorts[cluster_id]
+    return cohort, people
+
+
+def get_cohort_overlap(cluster_ids):
+    """Patients shared by each pair of clusters
+
+    Returns:
+        DataFrame of CLUSTER_ID, OTHER_CLUSTER_ID, PATIENTS (in CLUSTER_ID),
+        SHARED_PATIENTS and SHARED_PERCENT (of CLUSTER_ID's patients), or an
+        empty DataFrame on error
+    """
+    people = get_person_dictionary()
+    cohorts = _cluster_cohorts(cluster_ids, people) if people is not None else None
+    if cohorts is None:
+        return pd.DataFrame()
+
+    sizes = {cluster_id: len(cohort) for cluster_id, cohort in cohorts.items()}
+    rows = []
+    for cluster_id, cohort in cohorts.items():
+        for other_id, other in cohorts.items():
+            shared = sizes[cluster_id] if other_id == cluster_id else len(cohort & other)
+            rows.append((cluster_id, other_id, sizes[cluster_id], shared))
+    df = pd.DataFrame(rows, columns=['CLUSTER_ID', 'OTHER_CLUSTER_ID', 'PATIENTS', 'SHARED_PATIENTS'])
+    df['SHARED_PERCENT'] = (100 * df['SHARED_PATIENTS'] / df['PATIENTS'].where(df['PATIENTS'] > 0)).round(1)
+    return df
@@ -0,0 +1,634 @@
+# =============================================================================
+# SNOMED Cluster Manager - Usage Cube
+# =============================================================================
+#
+# ECL_USAGE_CUBE holds each cluster's events pre-aggregated per code, month,
+# practice (with its PCN, borough and neighbourhood), age, sex and active
+# status: an event count plus HyperLogLog sketches of the persons. Sketches
+# merge across cells, so any roll-up of those dimensions gets its distinct
+# person count without touching the event tables. jobs/usage_cube.py builds
+# the cube and keeps it up to date incrementally; analytics read it while it
+# matches the cluster's current code set and holds every event ingested so
+# far, and fall back to the event tables otherwise.
+#
+# Person counts from warehouse sketches are estimates (HLL's error is about
+# 1-2%); the local backend's stand-in sketches are exact. Results read from
+# the cube are flagged with mark_estimates. In fast mode the same per-age
+# roll-up runs over raw events with APPROX_COUNT_DISTINCT when the cube can't
+# answer, and get_practice_sketches returns mergeable per-practice sketches.
+
+from datetime import date, timedelta
+
+import pandas as pd
+import streamlit as st
+from database import fetch_pandas, execute_statement
+from services.cache_service import cached_query
+from services.metric_service import (
+    SOURCES, EVENT_DIMENSIONS, get_cluster_metrics, validate_breakdowns, grouping_value, split_breakdowns,
+    mark_estimates
+)
+from utils.hll import HyperLogLog
+from config import (
+    DB_SCHEMA, DB_STORE, DB_DEMOGRAPHICS, SEX_MALE, SEX_FEMALE, RECENT_DAYS,
+    USAGE_CUBE_MAX_AGE_HOURS, USAGE_CUBE_FULL_REBUILD_DAYS
+)
+
+
+CUBE_TABLE = f"{DB_SCHEMA}.ECL_USAGE_CUBE"
+CUBE_METADATA_TABLE = f"{DB_SCHEMA}.ECL_USAGE_CUBE_METADATA"
+
+# Person columns of a cube cell. The org columns and age band follow from
+# practice and age, so carrying them adds no cells.
+CUBE_PERSON_COLUMNS = [
+    'IS_ACTIVE', 'PRACTICE_NAME', 'PCN_NAME', 'BOROUGH_REGISTERED', 'NEIGHBOURHOOD_REGISTERED',
+    'AGE', 'AGE_BAND_5Y', 'SEX'
+]
+
+# Metric catalogue dimensions the cube can group by -> expression over cube rows (c)
+CUBE_DIMENSIONS = {
+    'CODE': "c.code",
+    'DISPLAY': "c.display",
+    'MONTH': EVENT_DIMENSIONS['MONTH'].format(date="c.month"),
+    **{d: f"c.{d.lower()}" for d in CUBE_PERSON_COLUMNS if d != 'AGE'}
+}
+
+# Person counts per group and age -> sketch column they merge
+_PERSON_SKETCHES = {
+    'PERSONS': "g.PERSON_SKETCH",
+    'ACTIVE_PERSONS': "CASE WHEN g.CELL_ACTIVE THEN g.PERSON_SKETCH END",
+    'MALE_PERSONS': f"CASE WHEN g.CELL_SEX = '{SEX_MALE}' THEN g.PERSON_SKETCH END",
+    'FEMALE_PERSONS': f"CASE WHEN g.CELL_SEX = '{SEX_FEMALE}' THEN g.PERSON_SKETCH END",
+    'RECENT_PERSONS': "g.RECENT_PERSON_SKETCH"
+}
+
+# The same person counts over raw event cells, for estimates from the event tables
+_APPROX_PERSONS = {
+    'PERSONS': "g.PERSON_ID",
+    'ACTIVE_PERSONS': "CASE WHEN g.CELL_ACTIVE THEN g.PERSON_ID END",
+    'MALE_PERSONS': f"CASE WHEN g.CELL_SEX = '{SEX_MALE}' THEN g.PERSON_ID END",
+    'FEMALE_PERSONS': f"CASE WHEN g.CELL_SEX = '{SEX_FEMALE}' THEN g.PERSON_ID END",
+    'RECENT_PERSONS': (
+        f"CASE WHEN g.EVENT_DATE >= DATEADD('day', -{RECENT_DAYS}, CURRENT_DATE()) THEN g.PERSON_ID END"
+    )
+}
+
+# Ingest watermark of an event table: its newest lds_start_date_time up to
+# now. Rows stamped in the future are left until their time has passed.
+_INGEST_WATERMARK = """SELECT MAX(lds_start_date_time)
+                FROM {table}
+                WHERE lds_start_date_time <= CURRENT_TIMESTAMP()"""
+
+# Metric catalogue metrics the cube can answer -> aggregate over per-age rows (a).
+# Each person has one age, so per-age person counts add up exactly.
+# NEW_PATIENTS_30D counts the RECENT_DAYS before the cube was last updated.
+CUBE_METRICS = {
+    'PERSON_COUNT': "SUM(a.PERSONS)",
+    'ACTIVE_PERSON_COUNT': "SUM(a.ACTIVE_PERSONS)",
+    'EVENT_COUNT': "SUM(a.EVENTS)",
+    'AVG_AGE': "SUM(a.AGE * a.PERSONS) / NULLIF(SUM(CASE WHEN a.AGE IS NOT NULL THEN a.PERSONS END), 0)",
+    'MALE_COUNT': "SUM(a.MALE_PERSONS)",
+    'FEMALE_COUNT': "SUM(a.FEMALE_PERSONS)",
+    'CHILDREN_COUNT': "SUM(CASE WHEN a.AGE < 15 THEN a.PERSONS ELSE 0 END)",
+    'ELDERLY_COUNT': "SUM(CASE WHEN a.AGE >= 65 THEN a.PERSONS ELSE 0 END)",
+    'NEW_PATIENTS_30D': "SUM(a.RECENT_PERSONS)"
+}
+
+
+# Set when a cube read finds the cube tables missing - the process then reads
+# the event tables without trying the cube again
+_cube_missing = False
+
+
+# -----------------------------------------------------------------------------
+# Reading
+# -----------------------------------------------------------------------------
+
+def _is_missing_object(error):
+    """Whether a query failed on a table that doesn't exist (Snowflake error 2003, DuckDB catalog errors)"""
+    code = getattr(error, 'errno', None) or getattr(error, 'sql_error_code', None)
+    return code == 2003 or type(error).__name__ == 'CatalogException'
+
+
+def _read_cube(read):
+    """Run a cube read, returning None if the cube can't be read
+
+    Deployments without the cube tables are remembered for the process; other
+    failures are reported with st.warning. Either way callers fall back to
+    the event tables.
+    """
+    global _cube_missing
+    if _cube_missing:
+        return None
+    try:
+        return read()
+    except Exception as e:
+        if _is_missing_object(e):
+            _cube_missing = True
+        else:
+            st.warning(f"Usage cube not read, counting from the event tables: {str(e)}")
+        return None
+
+
+def _cube_is_current(cluster_type):
+    """SQL condition on cube rows (c): the cluster's cube matches its current
+    code set, was updated within USAGE_CUBE_MAX_AGE_HOURS (bound as a negative
+    number of hours) and is up to the event table's ingest watermark"""
+    source = SOURCES.get(cluster_type, SOURCES['OBSERVATION'])
+    watermark = _INGEST_WATERMARK.format(table=f"{DB_STORE}.{source['table']}")
+    return f"""EXISTS (
+                SELECT 1
+                FROM {CUBE_METADATA_TABLE} u
+                JOIN {DB_SCHEMA}.ECL_CACHE_METADATA m ON u.cluster_id = m.cluster_id
+                WHERE u.cluster_id = c.cluster_id
+                AND u.source_refresh = m.last_successful_refresh
+                AND u.updated_at >= DATEADD(hour, ?, CURRENT_TIMESTAMP())
+                AND u.events_through >= ({watermark})
+            )"""
+
+
+def cube_can_answer(breakdowns, metrics):
+    """Whether every dimension and metric of a request is in the cube"""
+    return (all(d in CUBE_DIMENSIONS for _, dims in breakdowns for d in dims)
+            and all(m in CUBE_METRICS for m in metrics))
+
+
+def _compile_by_age(cells, count_columns, breakdowns, metrics):
+    """Count groups per age over cells, then sum the ages to CUBE_METRICS
+
+    Args:
+        cells: SQL of a cells subquery with each dimension's column plus AGE
+        count_columns: SQL of EVENTS and every _PERSON_SKETCHES count over
+            cells (g) per group and age
+
+    Returns:
+        SQL with the same columns as compile_metrics_query's
+    """
+    all_dims = []
+    for _, dims in breakdowns:
+        all_dims += [d for d in dims if d not in all_dims]
+    if all_dims:
+        cases = " ".join(
+            f"WHEN {grouping_value(all_dims, dims)} THEN '{label}'" for label, dims in breakdowns
+        )
+        label_column = f"CASE GROUPING({', '.join(f'g.{d}' for d in all_dims)}) {cases} END"
+    else:
+        label_column = f"'{breakdowns[0][0]}'"
+    count_columns = ",\n                ".join(
+        [f"g.{d} AS {d}" for d in all_dims] + ["g.AGE AS AGE"] + count_columns
+    )
+    grouping_sets = ", ".join(
+        "(" + ", ".join([f"g.{d}" for d in dims] + ["g.AGE"]) + ")" for _, dims in breakdowns
+    )
+    select_columns = ",\n            ".join(
+        ["a.BREAKDOWN"] + [f"a.{d} AS {d}" for d in all_dims] + [f"{CUBE_METRICS[m]} AS {m}" for m in metrics]
+    )
+    group_columns = ", ".join(["a.BREAKDOWN"] + [f"a.{d}" for d in all_dims])
+    return f"""
+        WITH cells AS ({cells}
+        ),
+        by_age AS (
+            SELECT
+                {label_column} AS BREAKDOWN,
+                {count_columns}
+            FROM cells g
+            GROUP BY GROUPING SETS ({grouping_sets})
+        )
+        SELECT
+            {select_columns}
+        FROM by_age a
+        GROUP BY {group_columns}
+        """
+
+
+def compile_cube_query(cluster_id, cluster_type, breakdowns, metrics):
+    """Compile metrics over named breakdowns into one statement over the cube
+
+    Groups are first counted per age, merging the cells' sketches, and then
+    summed - which is what lets the cube give average ages. The result has the
+    same columns as compile_metrics_query's, and no rows unless the cube was
+    brought up to the cluster's current code set and the event table's ingest
+    watermark within USAGE_CUBE_MAX_AGE_HOURS.
+
+    Returns:
+        (SQL, params)
+    """
+    validate_breakdowns(breakdowns, metrics)
+    all_dims = []
+    for _, dims in breakdowns:
+        all_dims += [d for d in dims if d not in all_dims]
+
+    cell_columns = ",\n                ".join(
+        [f"{CUBE_DIMENSIONS[d]} AS {d}" for d in all_dims] + [
+            "c.age AS AGE", "c.is_active AS CELL_ACTIVE", "c.sex AS CELL_SEX", "c.event_count AS EVENT_COUNT",
+            "c.person_sketch AS PERSON_SKETCH", "c.recent_person_sketch AS RECENT_PERSON_SKETCH"
+        ]
+    )
+    cells = f"""
+            SELECT
+                {cell_columns}
+            FROM {CUBE_TABLE} c
+            WHERE c.cluster_id = ?
+            AND {_cube_is_current(cluster_type)}"""
+    count_columns = ["SUM(g.EVENT_COUNT) AS EVENTS"] + [
+        f"COALESCE(HLL_ESTIMATE(HLL_COMBINE(HLL_IMPORT({sketch}))), 0) AS {name}"
+        for name, sketch in _PERSON_SKETCHES.items()
+    ]
+    return _compile_by_age(cells, count_columns, breakdowns, metrics), [cluster_id, -USAGE_CUBE_MAX_AGE_HOURS]
+
+
+def approx_can_answer(breakdowns, metrics):
+    """Whether the event tables can estimate every metric of a request"""
+    return all(m in CUBE_METRICS for m in metrics)
+
+
+def compile_approx_metrics_query(cluster_id, cluster_type, breakdowns, metrics):
+    """Compile metrics over named breakdowns into one statement estimating from the event tables
+
+    Like compile_cube_query, but the cells are the cluster's events and the
+    counts are APPROX_COUNT_DISTINCT (HyperLogLog) estimates, so no per-person
+    grain is built.
+
+    Returns:
+        (SQL, params)
+    """
+    validate_breakdowns(breakdowns, metrics)
+    source = SOURCES.get(cluster_type, SOURCES['OBSERVATION'])
+    event_date = f"e.{source['date_column']}"
+    all_dims = []
+    for _, dims in breakdowns:
+        all_dims += [d for d in dims if d not in all_dims]
+
+    cell_columns = ",\n                ".join(
+        [
+            f"{EVENT_DIMENSIONS[d].format(date=event_date)} AS {d}" if d in EVENT_DIMENSIONS else f"d.{d.lower()} AS {d}"
+            for d in all_dims
+        ] + [
+            "d.age AS AGE", "d.is_active AS CELL_ACTIVE", "d.sex AS CELL_SEX", "e.id AS EVENT_ID",
+            "d.person_id AS PERSON_ID", f"{event_date} AS EVENT_DATE"
+        ]
+    )
+    cells = f"""
+            SELECT
+                {cell_columns}
+            FROM {DB_STORE}.{source['table']} e
+            JOIN {DB_SCHEMA}.ecl_cache ec ON e.mapped_concept_code = ec.code
+            JOIN {DB_DEMOGRAPHICS}.DIM_PERSON_DEMOGRAPHICS d ON e.person_id = d.person_id
+            WHERE ec.cluster_id = ?"""
+    count_columns = ["APPROX_COUNT_DISTINCT(g.EVENT_ID) AS EVENTS"] + [
+        f"APPROX_COUNT_DISTINCT({person}) AS {name}" for name, person in _APPROX_PERSONS.items()
+    ]
+    return _compile_by_age(cells, count_columns, breakdowns, metrics), [cluster_id]
+
+
+@cached_query()
+def get_usage_metrics(cluster_id, cluster_type, breakdowns, metrics, approximate=None):
+    """Get metrics like get_cluster_metrics, from the usage cube when it can answer
+
+    Args:
+        approximate: None reads the cube when it is current and can answer,
+            and counts exactly from the event tables otherwise; True also
+            estimates from the event tables (fast mode); False always counts
+            exactly (exports)
+
+    Returns:
+        Dict of breakdown label -> DataFrame, flagged by mark_estimates when
+        the person counts are estimates, or {} on error
+    """
+    if approximate is not False and cube_can_answer(breakdowns, metrics):
+        df = _read_cube(lambda: fetch_pandas(*compile_cube_query(cluster_id, cluster_type, breakdowns, metrics)))
+        if df is not None and not df.empty:
+            return mark_estimates(split_breakdowns(df, breakdowns, metrics))
+    if approximate and approx_can_answer(breakdowns, metrics):
+        try:
+            query, params = compile_approx_metrics_query(cluster_id, cluster_type, breakdowns, metrics)
+            return mark_estimates(split_breakdowns(fetch_pandas(query, params), breakdowns, metrics))
+        except Exception as e:
+            st.error(f"Error estimating cluster metrics: {str(e)}")
+            return {}
+    return get_cluster_metrics(cluster_id, cluster_type, breakdowns, metrics)
+
+
+# Organisation columns of a practice, rolled up from practice sketches
+PRACTICE_COLUMNS = ['PRACTICE_NAME', 'PCN_NAME', 'BOROUGH_REGISTERED', 'NEIGHBOURHOOD_REGISTERED']
+
+
+def _compile_practice_sketches(cells, person, recent):
+    """SQL of per-practice sketches over per-age cells (c)
+
+    Args:
+        cells: FROM and WHERE clauses selecting active persons' cells
+        person, recent: Per-age HLL states of all and recently seen persons
+    """
+    columns = ", ".join(f"c.{c.lower()}" for c in PRACTICE_COLUMNS)
+    return f"""
+        WITH by_age AS (
+            SELECT
+                {columns},
+                c.age,
+                {person} AS persons,
+                {recent} AS recent_persons
+            {cells}
+            GROUP BY {columns}, c.age
+        )
+        SELECT
+            {", ".join(f"{c.lower()} AS {c}" for c in PRACTICE_COLUMNS)},
+            HLL_EXPORT(HLL_COMBINE(persons)) AS PERSON_SKETCH,
+            HLL_EXPORT(HLL_COMBINE(recent_persons)) AS RECENT_SKETCH,
+            SUM(age * HLL_ESTIMATE(persons)) AS AGE_TOTAL,
+            SUM(CASE WHEN age IS NOT NULL THEN HLL_ESTIMATE(persons) END) AS AGED_PERSONS
+        FROM by_age
+        GROUP BY {", ".join(c.lower() for c in PRACTICE_COLUMNS)}
+        """
+
+
+@cached_query()
+def get_practice_sketches(cluster_id, cluster_type):
+    """Get mergeable person sketches of a cluster's active patients per practice
+
+    Read from the cube when it is current, else estimated from the event
+    tables. Sketches merge (utils/hll.py), so PCN, borough and neighbourhood
+    counts roll up from these rows without another query.
+
+    Returns:
+        DataFrame of PRACTICE_COLUMNS, PERSON_SKETCH and RECENT_SKETCH
+        (HyperLogLog), AGE_TOTAL and AGED_PERSONS, or an empty DataFrame on error
+    """
+    df = _read_cube(lambda: fetch_pandas(_compile_practice_sketches(
+        f"""FROM {CUBE_TABLE} c
+            WHERE c.cluster_id = ?
+            AND c.is_active = true
+            AND {_cube_is_current(cluster_type)}""",
+        "HLL_COMBINE(HLL_IMPORT(c.person_sketch))",
+        "HLL_COMBINE(HLL_IMPORT(c.recent_person_sketch))"
+    ), [cluster_id, -USAGE_CUBE_MAX_AGE_HOURS]))
+    try:
+        if df is None or df.empty:
+            source = SOURCES.get(cluster_type, SOURCES['OBSERVATION'])
+            event_date = f"e.{source['date_column']}"
+            df = fetch_pandas(_compile_practice_sketches(
+                f"""FROM {DB_STORE}.{source['table']} e
+            JOIN {DB_SCHEMA}.ecl_cache ec ON e.mapped_concept_code = ec.code
+            JOIN {DB_DEMOGRAPHICS}.DIM_PERSON_DEMOGRAPHICS c ON e.person_id = c.person_id
+            WHERE ec.cluster_id = ?
+            AND c.is_active = true""",
+                "HLL_ACCUMULATE(c.person_id)",
+                f"HLL_ACCUMULATE(CASE WHEN {event_date} >= DATEADD('day', -{RECENT_DAYS}, CURRENT_DATE()) "
+                "THEN c.person_id END)"
+            ), [cluster_id])
+        for column in ('PERSON_SKETCH', 'RECENT_SKETCH'):
+            df[column] = df[column].map(HyperLogLog.from_export)
+        return df
+    except Exception as e:
+        st.error(f"Error loading practice sketches: {str(e)}")
+        return pd.DataFrame()
+
+
+# -----------------------------------------------------------------------------
+# Building (jobs/usage_cube.py)
+# -----------------------------------------------------------------------------
+#
+# A full build aggregates every event ingested up to a watermark (the event
+# table's _INGEST_WATERMARK when the job started). Later runs update the cube
+# incrementally, recomputing from their events:
+#   - months holding events ingested since the cube's watermark, for every
+#     code - recomputed rather than appended to, so a row ingested again or
+#     corrected since is still counted once
+#   - codes ADDED or REMOVED since the cube's code set, per ECL_CLUSTER_CHANGES
+#   - months from the start of the recent window on, so the recent person
+#     sketches follow the window (older cells drop theirs)
+# Person attributes are taken when a cell is written, and rows deleted from an
+# event table leave no ingest time to find them by, so cubes are fully rebuilt
+# every USAGE_CUBE_FULL_REBUILD_DAYS to catch up with both.
+
+# Events the cube counts up to a watermark - rows without an ingest time are
+# only read by full builds and recomputes, never as new events
+_INGESTED = "(e.lds_start_date_time IS NULL OR e.lds_start_date_time <= ?)"
+
+# Codes of a cluster added or removed after a code-set refresh
+_CHANGED_CODES = f"""
+    SELECT code
+    FROM {DB_SCHEMA}.ECL_CLUSTER_CHANGES
+    WHERE cluster_id = ?
+    AND change_timestamp > ?
+    AND change_type IN ('ADDED', 'REMOVED')
+    AND code IS NOT NULL
+    """
+
+
+def _insert_cells(cluster_id, cluster_type, recent_since, condition, params):
+    """Aggregate one cluster's events matching a condition into new cube cells
+
+    Args:
+        cluster_id: Cluster to build cells for
+        cluster_type: OBSERVATION or MEDICATION, selecting the event table
+        recent_since: Start of the recent window for the recent person sketch
+        condition: SQL condition over events (e), the cluster's codes (ec) and
+                   {date}, the event date
+        params: Values bound by condition
+    """
+    source = SOURCES.get(cluster_type, SOURCES['OBSERVATION'])
+    event_date = f"e.{source['date_column']}"
+    columns = [c.lower() for c in CUBE_PERSON_COLUMNS]
+    person_columns = ", ".join(f"d.{c}" for c in columns)
+    execute_statement(f"""
+        INSERT INTO {CUBE_TABLE} (
+            cluster_id, code, display, month, {", ".join(columns)},
+            event_count, person_sketch, recent_person_sketch
+        )
+        SELECT
+            ec.cluster_id,
+            ec.code,
+            ec.display,
+            DATE_TRUNC('month', {event_date}),
+            {person_columns},
+            COUNT(DISTINCT e.id),
+            HLL_EXPORT(HLL_ACCUMULATE(d.person_id)),
+            CASE WHEN MAX({event_date}) >= ?
+                THEN HLL_EXPORT(HLL_ACCUMULATE(CASE WHEN {event_date} >= ? THEN d.person_id END))
+            END
+        FROM {DB_STORE}.{source['table']} e
+        JOIN {DB_SCHEMA}.ECL_CACHE ec ON e.mapped_concept_code = ec.code
+        JOIN {DB_DEMOGRAPHICS}.DIM_PERSON_DEMOGRAPHICS d ON e.person_id = d.person_id
+        WHERE ec.cluster_id = ?
+        AND ({condition.format(date=event_date)})
+        GROUP BY ec.cluster_id, ec.code, ec.display, DATE_TRUNC('month', {event_date}), {person_columns}
+        """, [recent_since, recent_since, cluster_id, *params])
+
+
+def _month_condition(column, months):
+    """SQL condition matching a month column to a list of months (None for
+    undated), with its params"""
+    dated = [month for month in months if month is not None]
+    conditions = [f"{column} IN ({', '.join('?' * len(dated))})"] if dated else []
+    if len(dated) < len(months):
+        conditions.append(f"{column} IS NULL")
+    return f"({' OR '.join(conditions)})", dated
+
+
+def _ingested_months(cluster_id, cluster_type, before, after, through):
+    """Months before a date holding a cluster's events ingested in (after, through],
+    None standing for undated events"""
+    source = SOURCES.get(cluster_type, SOURCES['OBSERVATION'])
+    event_date = f"e.{source['date_column']}"
+    df = fetch_pandas(f"""
+        SELECT DISTINCT DATE_TRUNC('month', {event_date}) AS MONTH
+        FROM {DB_STORE}.{source['table']} e
+        JOIN {DB_SCHEMA}.ECL_CACHE ec ON e.mapped_concept_code = ec.code
+        WHERE ec.cluster_id = ?
+        AND ({event_date} < ? OR {event_date} IS NULL)
+        AND e.lds_start_date_time > ? AND e.lds_start_date_time <= ?
+        """, [cluster_id, before, after, through])
+    return [None if pd.isna(month) else pd.Timestamp(month).date() for month in df['MONTH']]
+
+
+def _record_build(cluster_id, recent_since, events_through, full):
+    """Record the code set, recent window and watermark a cube is now current to"""
+    execute_statement(f"""
+        MERGE INTO {CUBE_METADATA_TABLE} AS target
+        USING (
+            SELECT cluster_id, last_successful_refresh AS source_refresh,
+                ? AS recent_since, ? AS events_through, ? AS full_build
+            FROM {DB_SCHEMA}.ECL_CACHE_METADATA
+            WHERE cluster_id = ?
+        ) AS source
+        ON target.cluster_id = source.cluster_id
+        WHEN MATCHED THEN UPDATE SET
+            source_refresh = source.source_refresh,
+            recent_since = source.recent_since,
+            events_through = source.events_through,
+            built_at = CASE WHEN source.full_build THEN CURRENT_TIMESTAMP() ELSE target.built_at END,
+            updated_at = CURRENT_TIMESTAMP()
+        WHEN NOT MATCHED THEN INSERT (cluster_id, source_refresh, recent_since, events_through, built_at, updated_at)
+            VALUES (source.cluster_id, source.source_refresh, source.recent_since, source.events_through,
+                    CURRENT_TIMESTAMP(), CURRENT_TIMESTAMP())
+        """, [recent_since, events_through, bool(full), cluster_id])
+
+
+def _in_transaction(work):
+    """Run work() between BEGIN and COMMIT, rolling back if it raises"""
+    execute_statement("BEGIN")
+    try:
+        work()
+        execute_statement("COMMIT")
+    except Exception:
+        execute_statement("ROLLBACK")
+        raise
+
+
+def recent_window_start():
+    """First day of the recent window for NEW_PATIENTS_30D, as of today"""
+    return date.today() - timedelta(days=RECENT_DAYS)
+
+
+def get_events_through(cluster_type):
+    """Ingest watermark of a cluster type's event table (_INGEST_WATERMARK)"""
+    source = SOURCES.get(cluster_type, SOURCES['OBSERVATION'])
+    df = fetch_pandas(f"""
+        SELECT ({_INGEST_WATERMARK.format(table=f"{DB_STORE}.{source['table']}")}) AS EVENTS_THROUGH
+        """)
+    events_through = df['EVENTS_THROUGH'].iloc[0] if not df.empty else None
+    return None if pd.isna(events_through) else pd.Timestamp(events_through).to_pydatetime()
+
+
+def build_usage_cube(cluster_id, cluster_type, events_through):
+    """Replace a cluster's cube cells with ones built from all events up to a watermark"""
+    recent_since = recent_window_start()
+
+    def work():
+        execute_statement(f"DELETE FROM {CUBE_TABLE} WHERE cluster_id = ?", [cluster_id])
+        _insert_cells(cluster_id, cluster_type, recent_since, _INGESTED, [events_through])
+        _record_build(cluster_id, recent_since, events_through, full=True)
+
+    _in_transaction(work)
+
+
+def update_usage_cube(cluster_id, cluster_type, source_refresh, previous_through, events_through):
+    """Bring a cluster's cube up to a watermark and its current code set incrementally
+
+    Args:
+        cluster_id: Cluster whose cube to update
+        cluster_type: OBSERVATION or MEDICATION
+        source_refresh: Code-set refresh the cube was last brought up to
+        previous_through: Watermark the cube was last brought up to
+        events_through: Watermark to bring it up to
+    """
+    recent_since = recent_window_start()
+    recent_month = recent_since.replace(day=1)
+    changed = [cluster_id, source_refresh]
+    before_recent = "({date} < ? OR {date} IS NULL)"
+
+    def work():
+        # Recent months, for every current code
+        execute_statement(f"DELETE FROM {CUBE_TABLE} WHERE cluster_id = ? AND month >= ?", [cluster_id, recent_month])
+        execute_statement(f"""
+            UPDATE {CUBE_TABLE} SET recent_person_sketch = NULL
+            WHERE cluster_id = ? AND recent_person_sketch IS NOT NULL
+            """, [cluster_id])
+        _insert_cells(cluster_id, cluster_type, recent_since,
+                      f"{{date}} >= ? AND {_INGESTED}", [recent_month, events_through])
+
+        # Earlier months of changed codes, and earlier months of any code
+        # holding events ingested since the last run
+        months = _ingested_months(cluster_id, cluster_type, recent_month, previous_through, events_through)
+        execute_statement(f"""
+            DELETE FROM {CUBE_TABLE}
+            WHERE cluster_id = ?
+            AND code IN ({_CHANGED_CODES})
+            AND (month < ? OR month IS NULL)
+            """, [cluster_id, *changed, recent_month])
+        _insert_cells(cluster_id, cluster_type, recent_since,
+                      f"ec.code IN ({_CHANGED_CODES}) AND {before_recent} AND {_INGESTED}",
+                      [*changed, recent_month, events_through])
+        if months:
+            in_months, month_params = _month_condition("month", months)
+            execute_statement(f"""
+                DELETE FROM {CUBE_TABLE}
+                WHERE cluster_id = ?
+                AND code NOT IN ({_CHANGED_CODES})
+                AND {in_months}
+                """, [cluster_id, *changed, *month_params])
+            in_months, month_params = _month_condition("DATE_TRUNC('month', {date})", months)
+            _insert_cells(cluster_id, cluster_type, recent_since,
+                          f"ec.code NOT IN ({_CHANGED_CODES}) AND {in_months} AND {_INGESTED}",
+                          [*changed, *month_params, events_through])
+
+        _record_build(cluster_id, recent_since, events_through, full=False)
+
+    _in_transaction(work)
+
+
+def get_cube_clusters(full_rebuild_days=USAGE_CUBE_FULL_REBUILD_DAYS):
+    """Refreshed clusters with what their cube (if any) is current to
+
+    Args:
+        full_rebuild_days: Age of a full build after which FULL_REBUILD_DUE is set
+
+    Returns:
+        DataFrame of CLUSTER_ID, CLUSTER_TYPE, LAST_SUCCESSFUL_REFRESH and the
+        cube's SOURCE_REFRESH, RECENT_SINCE, EVENTS_THROUGH and FULL_REBUILD_DUE
+        (NULL without a cube)
+    """
+    return fetch_pandas(f"""
+        SELECT
+            c.cluster_id AS CLUSTER_ID,
+            c.cluster_type AS CLUSTER_TYPE,
+            m.last_successful_refresh AS LAST_SUCCESSFUL_REFRESH,
+            u.source_refresh AS SOURCE_REFRESH,
+            u.recent_since AS RECENT_SINCE,
+            u.events_through AS EVENTS_THROUGH,
+            u.built_at < DATEADD(day, ?, CURRENT_TIMESTAMP()) AS FULL_REBUILD_DUE
+        FROM {DB_SCHEMA}.ECL_CLUSTERS c
+        JOIN {DB_SCHEMA}.ECL_CACHE_METADATA m ON c.cluster_id = m.cluster_id
+        LEFT JOIN {CUBE_METADATA_TABLE} u ON c.cluster_id = u.cluster_id
+        WHERE m.last_successful_refresh IS NOT NULL
+        ORDER BY c.cluster_id
+        """, [-int(full_rebuild_days)])
+
+
+def drop_orphaned_cubes():
+    """Delete cubes of clusters that were deleted or renamed"""
+    for table in (CUBE_TABLE, CUBE_METADATA_TABLE):
+        execute_statement(f"""
+            DELETE FROM {table}
+            WHERE cluster_id NOT IN (SELECT cluster_id FROM {DB_SCHEMA}.ECL_CLUSTERS)
+            """)
@@ -1,119 +1,150 @@
 # =============================================================================
 # SNOMED Cluster Manager - Demographics Service
 # =============================================================================
+#
+# System-wide population figures, derived from the shared active-population
+# denominators (services/denominator_service.py) rather than separate scans of
+# the person dimension.
 
 import pandas as pd
 import streamlit as st
-from database import get_connection
-from config import DB_DEMOGRAPHICS
+from database import fetch_pandas
+from services.cache_service import cached_query
+from services.denominator_service import get_denominators, population_by, denominator_set_for
+from services.metric_service import PERSON_DIMENSIONS
+from config import DB_DEMOGRAPHICS, SEX_MALE, SEX_FEMALE
 
 
-# Get connection instance
-conn = get_connection()
+# 5-year age bands counted as children and elderly
+CHILD_AGE_BANDS = ('0-4', '5-9', '10-14')
+ELDERLY_AGE_BANDS = ('65-69', '70-74', '75-79', '80-84', '85+')
+
+# Care team level -> (code column, name column) of its denominator set
+CARE_TEAM_COLUMNS = {
+    'PCN': ('PCN_CODE', 'PCN_NAME'),
+    'Practice': ('PRACTICE_CODE', 'PRACTICE_NAME')
+}
+
+
+def _average_age(df):
+    """Average age per row of a population_by frame"""
+    return df['AGE_TOTAL'] / df['AGED_PERSONS'].where(df['AGED_PERSONS'] > 0)
+
+
+def _sex_counts(age_sex):
+    """Male and female counts per row of a population_by frame that includes SEX"""
+    return (age_sex['PERSONS'].where(age_sex['SEX'] == SEX_MALE, 0),
+            age_sex['PERSONS'].where(age_sex['SEX'] == SEX_FEMALE, 0))
 
 
 def get_demographics_summary():
     """Get overall population demographics summary"""
-    try:
-        query = f"""
-        SELECT 
-            COUNT(DISTINCT person_id) as total_active_patients,
-            COUNT(DISTINCT practice_code) as total_practices,
-            COUNT(DISTINCT pcn_code) as total_pcns,
-            AVG(age) as avg_age,
-            COUNT(CASE WHEN sex = 'M' THEN 1 END) as male_count,
-            COUNT(CASE WHEN sex = 'F' THEN 1 END) as female_count
-        FROM {DB_DEMOGRAPHICS}.DIM_PERSON_DEMOGRAPHICS
-        WHERE is_active = true
-        """
-        return conn.sql(query).to_pandas()
-    except Exception as e:
-        st.error(f"Error loading demographics summary: {str(e)}")
+    denominators = get_denominators()
+    if not denominators:
         return pd.DataFrame()
+    total = population_by(denominators, ())
+    by_sex = population_by(denominators, ('SEX',))
+    male, female = _sex_counts(by_sex)
+    practices = population_by(denominators, ('PRACTICE_CODE',))
+    pcns = population_by(denominators, ('PCN_CODE',))
+    return pd.DataFrame({
+        'TOTAL_ACTIVE_PATIENTS': total['PERSONS'],
+        'TOTAL_PRACTICES': [int(practices['PRACTICE_CODE'].notna().sum())],
+        'TOTAL_PCNS': [int(pcns['PCN_CODE'].notna().sum())],
+        'AVG_AGE': _average_age(total),
+        'MALE_COUNT': [int(male.sum())],
+        'FEMALE_COUNT': [int(female.sum())]
+    })
 
 
 def get_demographics_by_care_team(care_team_level):
     """Get demographics breakdown by care team level"""
-    try:
-        # Determine aggregation field and name based on care team level
-        if care_team_level == "PCN":
-            agg_field = "pcn_code"
-            name_field = "pcn_name"
-        elif care_team_level == "Practice":
-            agg_field = "practice_code" 
-            name_field = "practice_name"
-        else:  # System level
-            agg_field = "'System'"
-            name_field = "'Overall Population'"
-            
-        query = f"""
-        SELECT 
-            {agg_field} as care_team_code,
-            {name_field} as care_team_name,
-            age_band_5y,
-            sex,
-            COUNT(*) as patient_count
-        FROM {DB_DEMOGRAPHICS}.DIM_PERSON_DEMOGRAPHICS
-        WHERE is_active = true
-        AND {agg_field} IS NOT NULL
-        GROUP BY {agg_field}, {name_field}, age_band_5y, sex
-        ORDER BY care_team_code, age_band_5y, sex
-        """
-        return conn.sql(query).to_pandas()
-    except Exception as e:
-        st.error(f"Error loading care team demographics: {str(e)}")
+    denominators = get_denominators()
+    if not denominators:
         return pd.DataFrame()
+    if care_team_level in CARE_TEAM_COLUMNS:
+        code, name = CARE_TEAM_COLUMNS[care_team_level]
+        df = population_by(denominators, (code, name, 'AGE_BAND_5Y', 'SEX'))
+        df = df[df[code].notna()].rename(columns={code: 'CARE_TEAM_CODE', name: 'CARE_TEAM_NAME'})
+    else:  # System level
+        df = population_by(denominators, ('AGE_BAND_5Y', 'SEX'))
+        df.insert(0, 'CARE_TEAM_CODE', 'System')
+        df.insert(1, 'CARE_TEAM_NAME', 'Overall Population')
+    return (df.rename(columns={'PERSONS': 'PATIENT_COUNT'})
+            [['CARE_TEAM_CODE', 'CARE_TEAM_NAME', 'AGE_BAND_5Y', 'SEX', 'PATIENT_COUNT']]
+            .sort_values(['CARE_TEAM_CODE', 'AGE_BAND_5Y', 'SEX'])
+            .reset_index(drop=True))
 
 
 def get_care_team_summary(care_team_level):
     """Get summary statistics by care team"""
-    try:
-        if care_team_level == "PCN":
-            agg_field = "pcn_code"
-            name_field = "pcn_name"
-        elif care_team_level == "Practice":
-            agg_field = "practice_code"
-            name_field = "practice_name"
-        else:  # System level
-            return get_demographics_summary()
-            
-        query = f"""
-        SELECT 
-            {agg_field} as care_team_code,
-            {name_field} as care_team_name,
-            COUNT(DISTINCT person_id) as total_patients,
-            AVG(age) as avg_age,
-            COUNT(CASE WHEN sex = 'M' THEN 1 END) as male_count,
-            COUNT(CASE WHEN sex = 'F' THEN 1 END) as female_count,
-            COUNT(CASE WHEN age_band_5y IN ('0-4', '5-9', '10-14') THEN 1 END) as children_count,
-            COUNT(CASE WHEN age_band_5y IN ('65-69', '70-74', '75-79', '80-84', '85+') THEN 1 END) as elderly_count
-        FROM {DB_DEMOGRAPHICS}.DIM_PERSON_DEMOGRAPHICS
-        WHERE is_active = true
-        AND {agg_field} IS NOT NULL
-        GROUP BY {agg_field}, {name_field}
-        ORDER BY total_patients DESC
-        """
-        return conn.sql(query).to_pandas()
-    except Exception as e:
-        st.error(f"Error loading care team summary: {str(e)}")
+    if care_team_level not in CARE_TEAM_COLUMNS:  # System level
+        return get_demographics_summary()
+    denominators = get_denominators()
+    if not denominators:
         return pd.DataFrame()
+    code, name = CARE_TEAM_COLUMNS[care_team_level]
+    df = population_by(denominators, (code, name, 'AGE_BAND_5Y', 'SEX'))
+    df = df[df[code].notna()]
+    df['MALE_COUNT'], df['FEMALE_COUNT'] = _sex_counts(df)
+    df['CHILDREN_COUNT'] = df['PERSONS'].where(df['AGE_BAND_5Y'].isin(CHILD_AGE_BANDS), 0)
+    df['ELDERLY_COUNT'] = df['PERSONS'].where(df['AGE_BAND_5Y'].isin(ELDERLY_AGE_BANDS), 0)
+    summary = (df.groupby([code, name], dropna=False)
+               [['PERSONS', 'AGED_PERSONS', 'AGE_TOTAL', 'MALE_COUNT', 'FEMALE_COUNT',
+                 'CHILDREN_COUNT', 'ELDERLY_COUNT']]
+               .sum()
+               .reset_index())
+    summary['AVG_AGE'] = _average_age(summary)
+    return (summary.rename(columns={code: 'CARE_TEAM_CODE', name: 'CARE_TEAM_NAME', 'PERSONS': 'TOTAL_PATIENTS'})
+            [['CARE_TEAM_CODE', 'CARE_TEAM_NAME', 'TOTAL_PATIENTS', 'AVG_AGE', 'MALE_COUNT', 'FEMALE_COUNT',
+              'CHILDREN_COUNT', 'ELDERLY_COUNT']]
+            .sort_values('TOTAL_PATIENTS', ascending=False)
+            .reset_index(drop=True))
 
 
 def get_system_age_sex_distribution():
     """Get system-wide age/sex distribution for standardization"""
+    denominators = get_denominators()
+    if not denominators:
+        return pd.DataFrame()
+    df = population_by(denominators, ('AGE_BAND_5Y', 'SEX'))
+    df = df.rename(columns={'AGE_BAND_5Y': 'AGE_BAND', 'PERSONS': 'PATIENT_COUNT'})
+    df['PERCENTAGE'] = df['PATIENT_COUNT'] * 100.0 / df['PATIENT_COUNT'].sum()
+    return (df[['AGE_BAND', 'SEX', 'PATIENT_COUNT', 'PERCENTAGE']]
+            .sort_values(['AGE_BAND', 'SEX'])
+            .reset_index(drop=True))
+
+
+def get_active_population(group_col):
+    """Get active population counts per value of a demographics column"""
+    if denominator_set_for((group_col,)) is None:
+        return _query_active_population(group_col)
+    df = population_by(get_denominators(), (group_col,))
+    if df.empty:
+        return df
+    return (df[df[group_col].notna()]
+            .rename(columns={group_col: 'UNIT_NAME', 'PERSONS': 'TOTAL_POPULATION'})
+            [['UNIT_NAME', 'TOTAL_POPULATION']]
+            .reset_index(drop=True))
+
+
+@cached_query(scope="global")
+def _query_active_population(group_col):
+    """Active population counts for a column no denominator set holds"""
     try:
+        # Column names can't be bound - only accept known demographics columns
+        if group_col not in PERSON_DIMENSIONS:
+            raise ValueError(f"Unknown demographics column: {group_col}")
         query = f"""
         SELECT 
-            age_band_5y,
-            sex,
-            COUNT(*) as patient_count,
-            COUNT(*) * 100.0 / SUM(COUNT(*)) OVER () as percentage
+            {group_col} AS UNIT_NAME,
+            COUNT(DISTINCT person_id) AS TOTAL_POPULATION
         FROM {DB_DEMOGRAPHICS}.DIM_PERSON_DEMOGRAPHICS
         WHERE is_active = true
-        GROUP BY age_band_5y, sex
-        ORDER BY age_band_5y, sex
+        AND {group_col} IS NOT NULL
+        GROUP BY {group_col}
         """
-        return conn.sql(query).to_pandas()
+        return fetch_pandas(query)
     except Exception as e:
-        st.error(f"Error loading system distribution: {str(e)}")
-        return pd.DataFrame()
\ No newline at end of file
+        st.error(f"Error loading population counts: {str(e)}")
+        return pd.DataFrame()
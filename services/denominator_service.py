@@ -0,0 +1,111 @@
+# =============================================================================
+# SNOMED Cluster Manager - Population Denominators
+# =============================================================================
+#
+# Active-population counts for every dimension rates are broken down by,
+# computed in one GROUPING SETS scan of the person dimension and kept in the
+# query cache for DENOMINATOR_TTL_SECONDS - a few thousand aggregate rows in
+# place of a scan per rate. The demographics page and the
+# analytics rates read these frames instead of each rescanning the table.
+
+import pandas as pd
+import streamlit as st
+from database import fetch_pandas
+from services.cache_service import cached_query
+from services.metric_service import grouping_value
+from config import DB_DEMOGRAPHICS, DENOMINATOR_TTL_SECONDS
+
+
+# Denominator sets: label -> demographics columns counted together. Coarser
+# groupings (e.g. practice alone, or sex alone) are sums over a set's rows.
+DENOMINATOR_SETS = {
+    'TOTAL': (),
+    'AGE_SEX': ('AGE_BAND_5Y', 'SEX'),
+    'PRACTICE': ('PRACTICE_CODE', 'PRACTICE_NAME', 'AGE_BAND_5Y', 'SEX'),
+    'PCN': ('PCN_CODE', 'PCN_NAME', 'AGE_BAND_5Y', 'SEX'),
+    'BOROUGH': ('BOROUGH_REGISTERED',),
+    'NEIGHBOURHOOD': ('NEIGHBOURHOOD_REGISTERED',),
+    'ETHNICITY': ('ETHNICITY_CATEGORY', 'ETHNICITY_SUBCATEGORY'),
+    'DEPRIVATION': ('IMD_DECILE_19', 'IMD_QUINTILE_19'),
+    'LANGUAGE': ('LANGUAGE_TYPE', 'MAIN_LANGUAGE', 'INTERPRETER_NEEDED'),
+}
+
+# Counts per group - AGE_TOTAL / AGED_PERSONS gives the average age
+DENOMINATOR_MEASURES = {
+    'PERSONS': "COUNT(*)",
+    'AGED_PERSONS': "COUNT(age)",
+    'AGE_TOTAL': "SUM(age)"
+}
+
+
+@cached_query(scope="global", ttl_seconds=DENOMINATOR_TTL_SECONDS)
+def get_denominators():
+    """Get active-population counts for every denominator set in one query
+
+    Returns:
+        Dict of set label -> DataFrame of the set's columns and measures, or {} on error
+    """
+    try:
+        all_columns = []
+        for columns in DENOMINATOR_SETS.values():
+            all_columns += [c for c in columns if c not in all_columns]
+        cases = " ".join(
+            f"WHEN {grouping_value(all_columns, columns)} THEN '{label}'"
+            for label, columns in DENOMINATOR_SETS.items()
+        )
+        select_columns = ",\n            ".join(
+            [f"CASE GROUPING({', '.join(all_columns)}) {cases} END AS DENOMINATOR"]
+            + [f"{c.lower()} AS {c}" for c in all_columns]
+            + [f"{sql} AS {name}" for name, sql in DENOMINATOR_MEASURES.items()]
+        )
+        grouping_sets = ", ".join(
+            "(" + ", ".join(c.lower() for c in columns) + ")" for columns in DENOMINATOR_SETS.values()
+        )
+        df = fetch_pandas(f"""
+        SELECT
+            {select_columns}
+        FROM {DB_DEMOGRAPHICS}.DIM_PERSON_DEMOGRAPHICS
+        WHERE is_active = true
+        GROUP BY GROUPING SETS ({grouping_sets})
+        """)
+        parts = dict(iter(df.groupby('DENOMINATOR', sort=False)))
+        return {
+            label: parts[label][[*columns, *DENOMINATOR_MEASURES]].reset_index(drop=True)
+            for label, columns in DENOMINATOR_SETS.items()
+            if label in parts
+        }
+    except Exception as e:
+        st.error(f"Error loading population denominators: {str(e)}")
+        return {}
+
+
+def denominator_set_for(columns):
+    """Label of the first denominator set holding all the columns, or None"""
+    for label, set_columns in DENOMINATOR_SETS.items():
+        if all(c in set_columns for c in columns):
+            return label
+    return None
+
+
+def population_by(denominators, columns):
+    """Sum a get_denominators result to the given columns
+
+    Args:
+        denominators: get_denominators result
+        columns: Demographics columns to group by, all in one denominator set
+
+    Returns:
+        DataFrame of the columns and measures, or an empty
+        frame when no set holds the columns or the denominators didn't load
+    """
+    label = denominator_set_for(columns)
+    if label is None or label not in denominators:
+        return pd.DataFrame()
+    df = denominators[label]
+    if not columns:
+        return df[list(DENOMINATOR_MEASURES)].sum().to_frame().T
+    if set(columns) == set(DENOMINATOR_SETS[label]):
+        return df[[*columns, *DENOMINATOR_MEASURES]].copy()
+    return (df.groupby(list(columns), dropna=False)[list(DENOMINATOR_MEASURES)]
+            .sum()
+            .reset_index())
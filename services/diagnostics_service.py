@@ -0,0 +1,159 @@
+# =============================================================================
+# SNOMED Cluster Manager - Query Diagnostics
+# =============================================================================
+#
+# Process-wide log of warehouse queries and query-cache lookups. database.py
+# records every fetch here with its wall time, rows, result size, Snowflake
+# query id and the service function that issued it; the hidden diagnostics
+# page reads it back per session or for the whole process.
+
+import sys
+import threading
+import time
+from collections import deque
+
+import pandas as pd
+import streamlit as st
+from config import DIAGNOSTICS_MAX_QUERIES
+
+try:
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+except ImportError:  # Older Streamlit versions
+    get_script_run_ctx = None
+
+
+# Modules skipped when looking for the service function behind a query
+_INFRASTRUCTURE_MODULES = ('database', 'services.diagnostics_service')
+
+
+class QueryLog:
+    """Thread-safe bounded log of query records and cache lookup counts"""
+
+    def __init__(self, max_queries):
+        self._queries = deque(maxlen=max_queries)
+        self._cache_events = {}  # (session_id, page, function) -> [hits, misses]
+        self._lock = threading.Lock()
+
+    def add_query(self, record):
+        """Append a query record"""
+        with self._lock:
+            self._queries.append(record)
+
+    def add_cache_event(self, session_id, page, function, hit):
+        """Count a cache hit or miss"""
+        with self._lock:
+            counts = self._cache_events.setdefault((session_id, page, function), [0, 0])
+            counts[0 if hit else 1] += 1
+
+    def queries(self, session_id=None):
+        """Query records as a DataFrame, optionally for one session"""
+        with self._lock:
+            records = list(self._queries)
+        if session_id is not None:
+            records = [r for r in records if r['SESSION_ID'] == session_id]
+        return pd.DataFrame(records)
+
+    def cache_events(self, session_id=None):
+        """Cache hit/miss counts as a DataFrame, optionally for one session"""
+        with self._lock:
+            items = list(self._cache_events.items())
+        rows = [
+            {'SESSION_ID': key[0], 'PAGE': key[1], 'FUNCTION': key[2], 'HITS': counts[0], 'MISSES': counts[1]}
+            for key, counts in items
+            if session_id is None or key[0] == session_id
+        ]
+        return pd.DataFrame(rows)
+
+    def clear(self):
+        """Drop all records"""
+        with self._lock:
+            self._queries.clear()
+            self._cache_events.clear()
+
+
+@st.cache_resource
+def get_query_log():
+    """Get the process-wide query log"""
+    return QueryLog(DIAGNOSTICS_MAX_QUERIES)
+
+
+def current_session_id():
+    """Streamlit session ID of the running script, if any"""
+    ctx = get_script_run_ctx() if get_script_run_ctx is not None else None
+    return getattr(ctx, 'session_id', None)
+
+
+def _current_page():
+    """Page the current session is on"""
+    try:
+        return st.session_state.get('page')
+    except Exception:
+        # No script context (e.g. a background thread without one)
+        return None
+
+
+def _calling_function():
+    """Name of the nearest services.* function on the stack"""
+    frame = sys._getframe(1)
+    fallback = None
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module not in _INFRASTRUCTURE_MODULES:
+            if module.startswith('services.'):
+                return f"{module.split('.', 1)[1]}.{frame.f_code.co_name}"
+            if fallback is None and module.startswith('page_modules.'):
+                fallback = f"{module}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return fallback or 'unknown'
+
+
+def _result_size(result):
+    """Rows and bytes of a fetched result"""
+    if isinstance(result, pd.DataFrame):
+        return len(result), int(result.memory_usage(index=False, deep=True).sum())
+    if isinstance(result, list):
+        return len(result), sum(sys.getsizeof(row) for row in result)
+    return None, None
+
+
+def record_query(query, params, mode, started, rows=None, result_bytes=None, sfqid=None, error=None):
+    """Record a finished query
+
+    Args:
+        query: SQL text
+        params: Bound parameter values (or None)
+        mode: Fetch mode (pandas, batches, head, statement)
+        started: time.perf_counter() value taken before the query was sent
+    """
+    get_query_log().add_query({
+        'TIMESTAMP': pd.Timestamp.now(),
+        'SESSION_ID': current_session_id(),
+        'PAGE': _current_page(),
+        'FUNCTION': _calling_function(),
+        'MODE': mode,
+        'WALL_MS': round((time.perf_counter() - started) * 1000, 1),
+        'ROWS': rows,
+        'BYTES': result_bytes,
+        'SFQID': sfqid,
+        'ERROR': error,
+        'QUERY': " ".join(query.split()),
+        'PARAMS': repr(list(params)) if params is not None else None
+    })
+
+
+def timed_fetch(query, params, mode, fetch):
+    """Run fetch() -> (result, sfqid) and record it, returning the result"""
+    started = time.perf_counter()
+    try:
+        result, sfqid = fetch()
+    except Exception as e:
+        record_query(query, params, mode, started, sfqid=getattr(e, 'sfqid', None), error=str(e))
+        raise
+    rows, result_bytes = _result_size(result)
+    record_query(query, params, mode, started, rows, result_bytes, sfqid)
+    return result
+
+
+def record_cache_event(function, hit):
+    """Record a query-cache lookup for a service function"""
+    get_query_log().add_cache_event(current_session_id(), _current_page(), function, hit)
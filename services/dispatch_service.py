@@ -0,0 +1,74 @@
+# =============================================================================
+# SNOMED Cluster Manager - Background Query Jobs
+# =============================================================================
+#
+# Runs service calls on a bounded, process-wide thread pool. Background jobs
+# outlive the script run that starts them: later reruns check on them and can
+# cancel them.
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+from database import cancel_thread_queries, resume_thread_queries
+from config import MAX_QUERY_WORKERS
+
+
+@st.cache_resource
+def _background_executor():
+    """Process-wide pool for background jobs"""
+    return ThreadPoolExecutor(max_workers=MAX_QUERY_WORKERS, thread_name_prefix="background_job")
+
+
+class BackgroundJob:
+    """A service call running in the background - keep it in session state
+
+    The call runs without a script context, as the run that started it may be
+    long gone: st.error calls inside it are dropped, so check the result for
+    the service's error value instead.
+    """
+
+    def __init__(self, func):
+        self.started = time.time()
+        self.cancelled = False
+        self._thread_id = None
+        self._lock = threading.Lock()
+        self._future = _background_executor().submit(self._run, func)
+
+    def _run(self, func):
+        with self._lock:
+            if self.cancelled:
+                return None
+            self._thread_id = threading.get_ident()
+        try:
+            return func()
+        finally:
+            with self._lock:
+                self._thread_id = None
+                resume_thread_queries(threading.get_ident())
+
+    def done(self):
+        """Whether the call has finished (or was cancelled)"""
+        return self.cancelled or self._future.done()
+
+    def elapsed(self):
+        """Seconds since the job was started"""
+        return time.time() - self.started
+
+    def result(self):
+        """The call's result - None if it was cancelled"""
+        return None if self.cancelled else self._future.result()
+
+    def cancel(self):
+        """Stop the job, cancelling the warehouse query it is waiting on"""
+        with self._lock:
+            self.cancelled = True
+            # Under the lock, so the thread can't have moved on to another job
+            if self._thread_id is not None:
+                cancel_thread_queries(self._thread_id)
+
+
+def start_job(func):
+    """Start a zero-argument callable in the background, returning its BackgroundJob"""
+    return BackgroundJob(func)
@@ -0,0 +1,336 @@
+# =============================================================================
+# SNOMED Cluster Manager - Metric Catalogue
+# =============================================================================
+#
+# Event sources, dimensions and metrics are declared once here. A request for
+# several metrics over several named breakdowns compiles into one statement:
+# cluster events are collapsed to one row per person (per event dimension,
+# e.g. code or month) and each group of breakdowns is a GROUPING SETS over
+# those rows, so person counts and averages are exact without COUNT(DISTINCT).
+
+import pandas as pd
+import streamlit as st
+from database import fetch_pandas
+from services.cache_service import cached_query
+from config import (
+    DB_SCHEMA, DB_STORE, DB_DEMOGRAPHICS, SEX_MALE, SEX_FEMALE, TIME_SERIES_MONTHS, RECENT_DAYS,
+    USAGE_TREND_MONTHS
+)
+
+
+# Event table per cluster type
+SOURCES = {
+    'OBSERVATION': {'table': 'observation', 'date_column': 'clinical_effective_date'},
+    'MEDICATION': {'table': 'medication_order', 'date_column': 'clinical_effective_date'}
+}
+
+# Event-level dimensions -> expression over the event (e) and cluster code (ec)
+# rows, {date} being the event date column. MONTH is NULL outside the
+# time-series window, so those events drop out of MONTH breakdowns but still
+# count everywhere else.
+EVENT_DIMENSIONS = {
+    'CODE': "ec.code",
+    'DISPLAY': "ec.display",
+    'MONTH': (
+        "CASE WHEN {date} >= DATE_TRUNC('month', DATEADD(month, -" + str(TIME_SERIES_MONTHS) + ", CURRENT_DATE()))"
+        " AND {date} < DATE_TRUNC('month', CURRENT_DATE())"
+        " THEN DATE_TRUNC('month', {date}) END"
+    )
+}
+
+# Month of an event within the last USAGE_TREND_MONTHS complete months, else NULL
+TREND_MONTH = (
+    "CASE WHEN {date} >= DATE_TRUNC('month', DATEADD(month, -" + str(USAGE_TREND_MONTHS) + ", CURRENT_DATE()))"
+    " AND {date} < DATE_TRUNC('month', CURRENT_DATE())"
+    " THEN DATE_TRUNC('month', {date}) END"
+)
+
+# Person-level dimensions - DIM_PERSON_DEMOGRAPHICS columns. Add IS_ACTIVE to a
+# breakdown to restrict it to active persons.
+PERSON_DIMENSIONS = [
+    'IS_ACTIVE', 'AGE_BAND_5Y', 'SEX',
+    'PRACTICE_NAME', 'PCN_NAME', 'BOROUGH_REGISTERED', 'NEIGHBOURHOOD_REGISTERED',
+    'ETHNICITY_SUBCATEGORY', 'IMD_DECILE_19', 'IMD_QUINTILE_19',
+    'LANGUAGE_TYPE', 'MAIN_LANGUAGE', 'INTERPRETER_NEEDED'
+]
+ACTIVE_ONLY = 'IS_ACTIVE'
+
+# Person columns every grain row carries for the metrics below
+_GRAIN_PERSON_COLUMNS = ['IS_ACTIVE', 'AGE', 'SEX', 'IMD_DECILE_19']
+
+# Metrics -> aggregate over grain rows (one row per person per event dimension values)
+METRICS = {
+    'PERSON_COUNT': "COUNT(*)",
+    'ACTIVE_PERSON_COUNT': "SUM(CASE WHEN g.IS_ACTIVE THEN 1 ELSE 0 END)",
+    'EVENT_COUNT': "SUM(g.EVENT_COUNT)",
+    'AVG_AGE': "AVG(g.AGE)",
+    'MALE_COUNT': f"SUM(CASE WHEN g.SEX = '{SEX_MALE}' THEN 1 ELSE 0 END)",
+    'FEMALE_COUNT': f"SUM(CASE WHEN g.SEX = '{SEX_FEMALE}' THEN 1 ELSE 0 END)",
+    'CHILDREN_COUNT': "SUM(CASE WHEN g.AGE < 15 THEN 1 ELSE 0 END)",
+    'ELDERLY_COUNT': "SUM(CASE WHEN g.AGE >= 65 THEN 1 ELSE 0 END)",
+    'AVG_IMD_DECILE': "AVG(g.IMD_DECILE_19)",
+    'NEW_PATIENTS_30D': (
+        f"SUM(CASE WHEN g.LAST_DATE >= DATEADD('day', -{RECENT_DAYS}, CURRENT_DATE()) THEN 1 ELSE 0 END)"
+    )
+}
+
+# Metrics returned as floats - the rest are counts
+AVERAGE_METRICS = {'AVG_AGE', 'AVG_IMD_DECILE'}
+
+# Keeps a person's events when their person ID hashes into the first ? of 100
+# buckets - a sample of whole patients, the same ones for every breakdown
+SAMPLE_CONDITION = "ABS(HASH(e.person_id)) % 100 < ?"
+
+
+def validate_breakdowns(breakdowns, metrics):
+    """Reject unknown dimensions/metrics and duplicate breakdown labels"""
+    labels = [label for label, _ in breakdowns]
+    if len(set(labels)) != len(labels):
+        raise ValueError(f"Duplicate breakdown labels: {labels}")
+    seen = {}
+    for label, dims in breakdowns:
+        unknown = [d for d in dims if d not in EVENT_DIMENSIONS and d not in PERSON_DIMENSIONS]
+        if unknown:
+            raise ValueError(f"Unknown dimension(s) in breakdown {label}: {unknown}")
+        # Labels are assigned by GROUPING(), so dimension sets must differ
+        other = seen.setdefault(frozenset(dims), label)
+        if other != label:
+            raise ValueError(f"Breakdowns {other} and {label} have the same dimensions")
+    unknown = [m for m in metrics if m not in METRICS]
+    if unknown:
+        raise ValueError(f"Unknown metric(s): {unknown}")
+
+
+def grouping_value(dims, grouped):
+    """Value of GROUPING(dims...) when only `grouped` are grouping columns"""
+    value = 0
+    for dim in dims:
+        value = value * 2 + (0 if dim in grouped else 1)
+    return value
+
+
+def compile_metrics_query(cluster_id, cluster_type, breakdowns, metrics, sample_percent=None):
+    """Compile metrics over named breakdowns into one statement
+
+    Args:
+        cluster_id: Cluster whose cached codes select the events
+        cluster_type: Key of SOURCES
+        breakdowns: Tuple of (label, dimensions) pairs - () is the overall total
+        metrics: Tuple of METRICS keys
+        sample_percent: Only count this percentage of patients (see scale_sample)
+
+    Returns:
+        (SQL, params) - the SQL returns a BREAKDOWN label column, one column per
+        dimension used by any breakdown (NULL where not grouped) and one per
+        metric. The cluster ID is bound, so the text is the same for every cluster.
+    """
+    validate_breakdowns(breakdowns, metrics)
+    source = SOURCES.get(cluster_type, SOURCES['OBSERVATION'])
+
+    # Breakdowns sharing the same event dimensions share a grain
+    blocks = {}
+    for label, dims in breakdowns:
+        event_dims = tuple(d for d in EVENT_DIMENSIONS if d in dims)
+        blocks.setdefault(event_dims, []).append((label, tuple(dims)))
+
+    all_dims = []
+    for _, dims in breakdowns:
+        all_dims += [d for d in dims if d not in all_dims]
+    event_dims_used = [d for d in EVENT_DIMENSIONS if d in all_dims]
+
+    sample_filter = f"\n              AND {SAMPLE_CONDITION}" if sample_percent else ""
+    event_columns = "".join(
+        f",\n                {EVENT_DIMENSIONS[d].format(date='e.' + source['date_column'])} AS {d}"
+        for d in event_dims_used
+    )
+    ctes = [f"""cluster_events AS (
+            SELECT
+                e.id,
+                e.person_id,
+                e.{source['date_column']} AS event_date{event_columns}
+            FROM {DB_STORE}.{source['table']} e
+            JOIN {DB_SCHEMA}.ecl_cache ec ON e.mapped_concept_code = ec.code
+            WHERE ec.cluster_id = ?{sample_filter}
+        )"""]
+    selects = []
+    for i, (event_dims, block) in enumerate(blocks.items()):
+        block_dims = []
+        for _, dims in block:
+            block_dims += [d for d in dims if d not in block_dims]
+        person_columns = _GRAIN_PERSON_COLUMNS + [
+            d for d in block_dims if d in PERSON_DIMENSIONS and d not in _GRAIN_PERSON_COLUMNS
+        ]
+        keys = [f"d.{c.lower()}" for c in person_columns] + [f"ce.{d}" for d in event_dims]
+        grain_columns = ",\n                ".join(
+            [f"d.{c.lower()} AS {c}" for c in person_columns] + [f"ce.{d} AS {d}" for d in event_dims]
+        )
+        ctes.append(f"""grain_{i} AS (
+            SELECT
+                d.person_id AS PERSON_ID,
+                {grain_columns},
+                COUNT(DISTINCT ce.id) AS EVENT_COUNT,
+                MAX(ce.event_date) AS LAST_DATE
+            FROM cluster_events ce
+            JOIN {DB_DEMOGRAPHICS}.DIM_PERSON_DEMOGRAPHICS d ON ce.person_id = d.person_id
+            GROUP BY d.person_id, {", ".join(keys)}
+        )""")
+
+        if block_dims:
+            cases = " ".join(
+                f"WHEN {grouping_value(block_dims, dims)} THEN '{label}'" for label, dims in block
+            )
+            label_column = f"CASE GROUPING({', '.join(f'g.{d}' for d in block_dims)}) {cases} END"
+        else:
+            label_column = f"'{block[0][0]}'"
+        dim_columns = [f"g.{d} AS {d}" if d in block_dims else f"NULL AS {d}" for d in all_dims]
+        metric_columns = [f"{METRICS[m]} AS {m}" for m in metrics]
+        grouping_sets = ", ".join(
+            "(" + ", ".join(f"g.{d}" for d in dims) + ")" for _, dims in block
+        )
+        select_columns = ",\n            ".join([f"{label_column} AS BREAKDOWN"] + dim_columns + metric_columns)
+        selects.append(f"""SELECT
+            {select_columns}
+        FROM grain_{i} g
+        GROUP BY GROUPING SETS ({grouping_sets})""")
+
+    query = "WITH " + ",\n        ".join(ctes) + "\n        " + "\n        UNION ALL\n        ".join(selects)
+    return query, [cluster_id] + ([sample_percent] if sample_percent else [])
+
+
+def split_breakdowns(df, breakdowns, metrics):
+    """Split a compiled query's result into one frame per breakdown label
+
+    NULL dimension values are groups of their own (e.g. MONTH NULL holds the
+    events outside the time-series window). Breakdowns with IS_ACTIVE keep
+    active persons only.
+    """
+    result = {}
+    for label, dims in breakdowns:
+        columns = list(dims) + list(metrics)
+        if df.empty:
+            frame = pd.DataFrame(columns=columns)
+        else:
+            frame = df.loc[df['BREAKDOWN'] == label, columns]
+        if ACTIVE_ONLY in dims:
+            frame = frame[frame[ACTIVE_ONLY].fillna(False).astype(bool)].drop(columns=ACTIVE_ONLY)
+        frame = frame.astype({m: float if m in AVERAGE_METRICS else 'int64' for m in metrics})
+        result[label] = frame.reset_index(drop=True)
+    return result
+
+
+def mark_estimates(result):
+    """Flag a split_breakdowns result as holding estimated counts"""
+    for frame in result.values():
+        frame.attrs['ESTIMATED'] = True
+    return result
+
+
+def are_estimates(metrics):
+    """Whether a metrics result holds estimated rather than exact counts"""
+    return any(frame.attrs.get('ESTIMATED') for frame in metrics.values())
+
+
+def scale_sample(result, metrics, sample_percent):
+    """Scale a split_breakdowns result over a sample of patients up to the whole population
+
+    Counts are divided by the sampled fraction and flagged as estimates;
+    averages over the sample stand as they are.
+    """
+    for frame in result.values():
+        for metric in metrics:
+            if metric not in AVERAGE_METRICS:
+                frame[metric] = (frame[metric] * 100 / sample_percent).round().astype('int64')
+        frame.attrs['SAMPLE_PERCENT'] = sample_percent
+    return mark_estimates(result)
+
+
+def sampled_percent(metrics):
+    """Percentage of patients a metrics result was scaled up from, or None if not sampled"""
+    return next((frame.attrs['SAMPLE_PERCENT'] for frame in metrics.values() if 'SAMPLE_PERCENT' in frame.attrs), None)
+
+
+@cached_query()
+def get_cluster_metrics(cluster_id, cluster_type, breakdowns, metrics, sample_percent=None):
+    """Get metrics for several breakdowns of a cluster's events in one query
+
+    Args:
+        cluster_id: Cluster ID
+        cluster_type: 'OBSERVATION' or 'MEDICATION'
+        breakdowns: Tuple of (label, dimensions) pairs
+        metrics: Tuple of METRICS keys
+        sample_percent: Count this percentage of patients and scale the
+            counts up (progressive mode's provisional counts)
+
+    Returns:
+        Dict of breakdown label -> DataFrame, or {} on error
+    """
+    try:
+        query, params = compile_metrics_query(cluster_id, cluster_type, breakdowns, metrics, sample_percent)
+        result = split_breakdowns(fetch_pandas(query, params), breakdowns, metrics)
+        return scale_sample(result, metrics, sample_percent) if sample_percent else result
+    except Exception as e:
+        st.error(f"Error loading cluster metrics: {str(e)}")
+        return {}
+
+
+# -----------------------------------------------------------------------------
+# Several clusters at once
+# -----------------------------------------------------------------------------
+
+def compile_batch_usage_query(cluster_type, cluster_count):
+    """Compile usage for several clusters of one type into one grouped scan
+
+    Events of persons missing from DIM_PERSON_DEMOGRAPHICS are left out, as
+    in compile_metrics_query, so totals match the analytics page.
+
+    Returns:
+        SQL binding cluster_count cluster IDs. Rows with ALL_MONTHS = 1 hold each
+        cluster's PERSON_COUNT, EVENT_COUNT and LAST_USED date; the others the
+        same per MONTH of the trend window (MONTH NULL outside it).
+    """
+    source = SOURCES.get(cluster_type, SOURCES['OBSERVATION'])
+    event_date = f"e.{source['date_column']}"
+    placeholders = ", ".join("?" * cluster_count)
+    return f"""
+        WITH cluster_events AS (
+            SELECT
+                ec.cluster_id,
+                e.id,
+                e.person_id,
+                {event_date} AS event_date,
+                {TREND_MONTH.format(date=event_date)} AS month
+            FROM {DB_STORE}.{source['table']} e
+            JOIN {DB_SCHEMA}.ecl_cache ec ON e.mapped_concept_code = ec.code
+            JOIN {DB_DEMOGRAPHICS}.DIM_PERSON_DEMOGRAPHICS d ON e.person_id = d.person_id
+            WHERE ec.cluster_id IN ({placeholders})
+        )
+        SELECT
+            cluster_id AS CLUSTER_ID,
+            month AS MONTH,
+            GROUPING(month) AS ALL_MONTHS,
+            COUNT(DISTINCT person_id) AS PERSON_COUNT,
+            COUNT(DISTINCT id) AS EVENT_COUNT,
+            MAX(event_date) AS LAST_USED
+        FROM cluster_events
+        GROUP BY GROUPING SETS ((cluster_id), (cluster_id, month))
+        """
+
+
+@cached_query(scope="catalogue")
+def get_batch_usage(cluster_ids, cluster_type):
+    """Get usage totals and monthly trend rows for several clusters of one type
+
+    Args:
+        cluster_ids: Tuple of cluster IDs
+        cluster_type: 'OBSERVATION' or 'MEDICATION'
+
+    Returns:
+        compile_batch_usage_query's rows, or an empty DataFrame on error
+    """
+    try:
+        if not cluster_ids:
+            return pd.DataFrame()
+        return fetch_pandas(compile_batch_usage_query(cluster_type, len(cluster_ids)), list(cluster_ids))
+    except Exception as e:
+        st.error(f"Error loading cluster usage: {str(e)}")
+        return pd.DataFrame()
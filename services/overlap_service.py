@@ -0,0 +1,195 @@
+# =============================================================================
+# SNOMED Cluster Manager - Code-Set Overlap Index
+# =============================================================================
+#
+# Every cluster's cached code set, loaded in one query and numbered over a
+# shared code dictionary, with the number of codes each pair of clusters
+# shares. Shared counts come from a vectorised self-join of (code, cluster)
+# entries on code - the work of a sparse M @ M.T - done in chunks so clusters
+# sharing very common codes don't exhaust memory. Pairs that share nothing
+# are never materialised. Jaccard overlap and subset/superset relations
+# follow from the shared counts and the set sizes.
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+from database import fetch_pandas
+from services.cache_service import cached_query
+from utils.helpers import canonical_cluster_id
+from config import DB_SCHEMA, SIMILAR_MIN_JACCARD, SIMILAR_CLUSTERS_LIMIT
+
+
+# Upper bound on (cluster, cluster) entries generated per self-join chunk
+PAIR_CHUNK_SIZE = 5_000_000
+
+# Up to this many clusters, shared counts are summed into a dense
+# clusters x clusters matrix rather than sorted and merged
+DENSE_MAX_CLUSTERS = 4000
+
+
+def _within_group_pairs(starts, counts):
+    """Positions (i, j), i < j, of every pair inside consecutive groups
+
+    Args:
+        starts: Start position of each group
+        counts: Size of each group
+    """
+    positions = np.arange(counts.sum()) + np.repeat(starts - np.cumsum(np.r_[0, counts[:-1]]), counts)
+    group_ends = np.repeat(starts + counts, counts)
+    partners = group_ends - positions - 1
+    total = int(partners.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    first = np.repeat(positions, partners)
+    offsets = np.arange(total) - np.repeat(np.cumsum(partners) - partners, partners)
+    return first, first + offsets + 1
+
+
+def _shared_counts(code_index, cluster_index, cluster_count):
+    """Codes shared by every ordered pair of distinct clusters sharing any
+
+    Args:
+        code_index, cluster_index: One (code, cluster) entry per cached code,
+            without duplicates
+        cluster_count: Number of clusters
+
+    Returns:
+        (left, right, shared) arrays holding both directions of each pair,
+        sorted by left then right
+    """
+    order = np.lexsort((cluster_index, code_index))
+    codes, clusters = code_index[order], cluster_index[order].astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if codes.size else np.empty(0, dtype=np.int64)
+    counts = np.diff(np.r_[starts, codes.size])
+    # Codes in one cluster pair with nothing
+    keep = counts > 1
+    starts, counts = starts[keep], counts[keep]
+
+    dense = cluster_count <= DENSE_MAX_CLUSTERS
+    totals = np.zeros(cluster_count * cluster_count if dense else 0, dtype=np.int64)
+    keys, shared = [], []
+    chunk_ids = np.cumsum(counts * (counts - 1) // 2) // PAIR_CHUNK_SIZE
+    for chunk in np.unique(chunk_ids):
+        in_chunk = chunk_ids == chunk
+        first, second = _within_group_pairs(starts[in_chunk], counts[in_chunk])
+        chunk_keys = clusters[first] * cluster_count + clusters[second]
+        if dense:
+            totals += np.bincount(chunk_keys, minlength=totals.size)
+        else:
+            chunk_keys, chunk_counts = np.unique(chunk_keys, return_counts=True)
+            keys.append(chunk_keys)
+            shared.append(chunk_counts)
+
+    if dense:
+        matrix = totals.reshape(cluster_count, cluster_count)
+        matrix += matrix.T
+        left, right = np.nonzero(matrix)
+        return left, right, matrix[left, right]
+    if not keys:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+    keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+    shared = np.bincount(inverse, weights=np.concatenate(shared)).astype(np.int64)
+    a, b = keys // cluster_count, keys % cluster_count
+    both = np.r_[a * cluster_count + b, b * cluster_count + a]
+    order = np.argsort(both)
+    both, shared = both[order], np.r_[shared, shared][order]
+    return both // cluster_count, both % cluster_count, shared
+
+
+class OverlapIndex:
+    """Code-set sizes and pairwise shared-code counts for every cached cluster"""
+
+    def __init__(self, cluster_codes):
+        """Build from a frame of CLUSTER_ID, CODE rows"""
+        cluster_codes = cluster_codes.drop_duplicates(['CLUSTER_ID', 'CODE'])
+        cluster_index, cluster_ids = pd.factorize(cluster_codes['CLUSTER_ID'], sort=True)
+        code_index, codes = pd.factorize(cluster_codes['CODE'].astype(str))
+        self.cluster_ids = np.asarray(cluster_ids, dtype=object)
+        self.codes = np.asarray(codes, dtype=object)
+        self.sizes = np.bincount(cluster_index, minlength=len(self.cluster_ids))
+        self._positions = {cluster_id: i for i, cluster_id in enumerate(self.cluster_ids)}
+
+        # Both directions of each pair, sorted by cluster, so one cluster's pairs are a slice
+        self.left, self.right, self.shared = _shared_counts(code_index, cluster_index, len(self.cluster_ids))
+        self._bounds = np.searchsorted(self.left, np.arange(len(self.cluster_ids) + 1))
+
+    def _frame(self, left, right, shared):
+        """Pairs as a DataFrame with Jaccard overlap and containment"""
+        left_size, right_size = self.sizes[left], self.sizes[right]
+        union = left_size + right_size - shared
+        relation = np.select(
+            [(shared == left_size) & (shared == right_size), shared == left_size, shared == right_size],
+            ['identical', 'subset', 'superset'],
+            default='overlap'
+        )
+        return pd.DataFrame({
+            'CLUSTER_ID': self.cluster_ids[left],
+            'OTHER_CLUSTER_ID': self.cluster_ids[right],
+            'CODES': left_size,
+            'OTHER_CODES': right_size,
+            'SHARED_CODES': shared,
+            'JACCARD': shared / np.maximum(union, 1),
+            'RELATION': relation
+        })
+
+    def similar_to(self, cluster_id, min_jaccard=SIMILAR_MIN_JACCARD):
+        """Clusters overlapping one cluster by at least min_jaccard, or containing or contained by it
+
+        RELATION reads from the cluster's side: 'subset' means every one of
+        its codes is in the other cluster.
+        """
+        position = self._positions.get(canonical_cluster_id(cluster_id))
+        if position is None:
+            return self._frame(*(np.empty(0, dtype=np.int64),) * 3)
+        rows = slice(self._bounds[position], self._bounds[position + 1])
+        pairs = self._frame(self.left[rows], self.right[rows], self.shared[rows])
+        pairs = pairs[(pairs['JACCARD'] >= min_jaccard) | (pairs['RELATION'] != 'overlap')]
+        return pairs.sort_values(['JACCARD', 'SHARED_CODES'], ascending=False).reset_index(drop=True)
+
+    def pairs(self, min_jaccard=SIMILAR_MIN_JACCARD):
+        """Every pair of clusters (once each) overlapping by at least min_jaccard"""
+        once = self.left < self.right
+        pairs = self._frame(self.left[once], self.right[once], self.shared[once])
+        pairs = pairs[pairs['JACCARD'] >= min_jaccard]
+        return pairs.sort_values(['JACCARD', 'SHARED_CODES'], ascending=False).reset_index(drop=True)
+
+
+@cached_query(scope="catalogue")
+def get_overlap_index():
+    """Get the overlap index over each cluster's codes from its latest refresh
+
+    Raises on query errors so a failed load isn't cached.
+    """
+    return OverlapIndex(fetch_pandas(f"""
+        SELECT cluster_id AS CLUSTER_ID, code AS CODE
+        FROM {DB_SCHEMA}.ECL_CACHE
+        QUALIFY last_refreshed = MAX(last_refreshed) OVER (PARTITION BY cluster_id)
+        """))
+
+
+def get_similar_clusters(cluster_id, min_jaccard=SIMILAR_MIN_JACCARD, limit=SIMILAR_CLUSTERS_LIMIT):
+    """Get the clusters most similar to one cluster's code set
+
+    Returns:
+        DataFrame of OTHER_CLUSTER_ID, OTHER_CODES, SHARED_CODES, JACCARD and
+        RELATION, best match first, or an empty DataFrame on error
+    """
+    try:
+        return get_overlap_index().similar_to(cluster_id, min_jaccard).head(limit)
+    except Exception as e:
+        st.error(f"Error loading similar clusters: {str(e)}")
+        return pd.DataFrame()
+
+
+def get_overlapping_clusters(min_jaccard=SIMILAR_MIN_JACCARD):
+    """Get every pair of clusters whose code sets overlap by at least min_jaccard
+
+    Returns:
+        DataFrame of pairs, most similar first, or an empty DataFrame on error
+    """
+    try:
+        return get_overlap_index().pairs(min_jaccard)
+    except Exception as e:
+        st.error(f"Error loading cluster overlaps: {str(e)}")
+        return pd.DataFrame()
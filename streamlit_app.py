@@ -5,7 +5,7 @@
 import streamlit as st
 import pandas as pd
 from config import PAGE_CONFIG, CUSTOM_CSS
-from database import get_connection, rerun
+from database import get_connection, rerun, get_query_param
 from services.cluster_service import get_all_clusters
 from components.cluster_components import render_flash_message
 
@@ -28,6 +28,11 @@ if 'page' not in st.session_state:
 if 'selected_cluster' not in st.session_state:
     st.session_state.selected_cluster = None
 
+# Hidden diagnostics route - not linked from the UI, open with ?page=diagnostics
+if get_query_param('page') == 'diagnostics' and not st.session_state.get('diagnostics_opened'):
+    st.session_state.page = 'diagnostics'
+    st.session_state.diagnostics_opened = True
+
 # =============================================================================
 # MAIN APPLICATION HEADER
 # =============================================================================
@@ -88,3 +93,11 @@ elif st.session_state.page == 'edit':
 elif st.session_state.page == 'demographics':
     from page_modules.demographics import render_demographics
     render_demographics()
+
+elif st.session_state.page == 'portfolio':
+    from page_modules.portfolio import render_portfolio
+    render_portfolio()
+
+elif st.session_state.page == 'diagnostics':
+    from page_modules.diagnostics import render_diagnostics
+    render_diagnostics()
@@ -0,0 +1,236 @@
+# =============================================================================
+# SNOMED Cluster Manager - Terminology Index Builder
+# =============================================================================
+#
+# Builds the memory-mapped index (terminology/index.py) from RF2 snapshot
+# files: concepts, inferred relationships, descriptions, language reference
+# sets and simple reference sets. Pass several release folders (e.g. the UK
+# clinical and drug extensions) to index them together.
+#
+#   python -m terminology.build --rf2 SnomedCT_UKClinicalRF2_.../Snapshot \
+#       SnomedCT_UKDrugRF2_.../Snapshot --out terminology_index
+#
+# The index is written next to the output directory and swapped in whole, so
+# processes with the old one open keep a consistent view until they reopen.
+
+import argparse
+import csv
+import glob
+import json
+import os
+import shutil
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+from config import TERMINOLOGY_LANGUAGE_REFSETS
+from terminology.index import ARRAYS, FORMAT_VERSION, MANIFEST, TerminologyIndex, default_index_path, search_ids
+
+# Metadata concepts
+IS_A = 116680003
+INFERRED = 900000000000011006
+FSN = 900000000000003001
+SYNONYM = 900000000000013009
+PREFERRED = 900000000000548007
+
+# RF2 snapshot files -> (file name pattern, columns read)
+RF2_FILES = {
+    'concepts': ("sct2_Concept_Snapshot*.txt", ['id', 'active']),
+    'relationships': ("sct2_Relationship_Snapshot*.txt", [
+        'active', 'sourceId', 'destinationId', 'relationshipGroup', 'typeId', 'characteristicTypeId'
+    ]),
+    'descriptions': ("sct2_Description_Snapshot*.txt", ['id', 'active', 'conceptId', 'typeId', 'term']),
+    'language': ("der2_cRefset_LanguageSnapshot*.txt", [
+        'active', 'refsetId', 'referencedComponentId', 'acceptabilityId'
+    ]),
+    'refset_members': ("der2_Refset_SimpleSnapshot*.txt", ['active', 'refsetId', 'referencedComponentId']),
+}
+
+
+def _column_type(column):
+    return bool if column == 'active' else (object if column == 'term' else np.int64)
+
+
+def _read_rf2(path, columns):
+    """One RF2 file's columns - IDs as int64, active as bool, terms as text"""
+    df = pd.read_csv(
+        path, sep='\t', usecols=columns, dtype=str, quoting=csv.QUOTE_NONE,
+        keep_default_na=False, encoding='utf-8'
+    )
+    for column in columns:
+        if column == 'active':
+            df[column] = df[column] == '1'
+        elif column != 'term':
+            df[column] = df[column].astype(np.int64)
+    return df
+
+
+def read_rf2_snapshot(roots):
+    """Read the snapshot files under one or more RF2 release folders
+
+    Returns:
+        Dict of RF2_FILES key -> DataFrame with RF2 column names; files a
+        release doesn't have (e.g. no simple reference sets) give empty frames
+    """
+    frames = {}
+    for name, (pattern, columns) in RF2_FILES.items():
+        paths = sorted({
+            path for root in roots for path in glob.glob(os.path.join(root, "**", pattern), recursive=True)
+        })
+        if name in ('concepts', 'relationships') and not paths:
+            raise FileNotFoundError(f"No {pattern} under {', '.join(roots)}")
+        parts = [_read_rf2(path, columns) for path in paths]
+        frames[name] = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(
+            {column: pd.Series(dtype=_column_type(column)) for column in columns}
+        )
+    return frames
+
+
+def _csr(owners, count):
+    """CSR offsets for rows sorted by owner"""
+    offsets = np.zeros(count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(owners, minlength=count), out=offsets[1:])
+    return offsets
+
+
+def _preferred_terms(concept_ids, descriptions, language):
+    """Each concept's preferred term: the preferred synonym of the first
+    TERMINOLOGY_LANGUAGE_REFSETS entry that has one (then any language
+    reference set), else its fully specified name, else ''"""
+    descriptions = descriptions[descriptions['active']]
+    preferred = language[language['active'] & (language['acceptabilityId'] == PREFERRED)]
+    priority = {int(refset): rank for rank, refset in enumerate(TERMINOLOGY_LANGUAGE_REFSETS)}
+    preferred = preferred.assign(
+        RANK=preferred['refsetId'].map(priority).fillna(len(priority))
+    )[['referencedComponentId', 'RANK']]
+
+    synonyms = descriptions[descriptions['typeId'] == SYNONYM].merge(
+        preferred, left_on='id', right_on='referencedComponentId'
+    )
+    # Fully specified names rank after every preferred synonym
+    names = descriptions[descriptions['typeId'] == FSN].assign(RANK=len(priority) + 1)
+    candidates = pd.concat([synonyms[['conceptId', 'term', 'RANK']], names[['conceptId', 'term', 'RANK']]])
+    best = candidates.sort_values(['conceptId', 'RANK']).drop_duplicates('conceptId').set_index('conceptId')['term']
+    return best.reindex(concept_ids).fillna('')
+
+
+def build_index(out_dir, concepts, relationships, descriptions, language, refset_members, sources=()):
+    """Write an index from RF2-shaped frames (see read_rf2_snapshot) and return it opened
+
+    Args:
+        out_dir: Index directory - replaced whole if it exists
+        sources: Release folder names recorded in the manifest
+    """
+    started = time.perf_counter()
+    concepts = concepts.drop_duplicates('id').sort_values('id')
+    concept_ids = concepts['id'].to_numpy(dtype=np.int64)
+    count = len(concept_ids)
+
+    arrays = {'concept_ids': concept_ids, 'active': concepts['active'].to_numpy(dtype=np.bool_)}
+
+    # Inferred relationships between known concepts
+    relationships = relationships[relationships['active'] & (relationships['characteristicTypeId'] == INFERRED)]
+    source = search_ids(concept_ids, relationships['sourceId'])
+    destination = search_ids(concept_ids, relationships['destinationId'])
+    relationship_type = search_ids(concept_ids, relationships['typeId'])
+    known = (source >= 0) & (destination >= 0)
+    is_a = known & (relationships['typeId'].to_numpy() == IS_A)
+
+    edges = {'parent': (source[is_a], destination[is_a]), 'child': (destination[is_a], source[is_a])}
+    for kind, (owners, values) in edges.items():
+        order = np.lexsort((values, owners))
+        arrays[f'{kind}_offsets'] = _csr(owners[order], count)
+        arrays[f'{kind}_indices'] = values[order]
+
+    attribute = known & (relationship_type >= 0) & ~is_a
+    groups = relationships['relationshipGroup'].to_numpy()[attribute]
+    order = np.lexsort((destination[attribute], relationship_type[attribute], groups, source[attribute]))
+    arrays['attribute_offsets'] = _csr(source[attribute][order], count)
+    arrays['attribute_types'] = relationship_type[attribute][order]
+    arrays['attribute_values'] = destination[attribute][order]
+    arrays['attribute_groups'] = groups[order]
+    arrays['attribute_sources'] = source[attribute][order]
+    by_type = np.lexsort((arrays['attribute_sources'], arrays['attribute_types']))
+    arrays['type_offsets'] = _csr(arrays['attribute_types'][by_type], count)
+    arrays['type_rows'] = by_type
+
+    # Simple reference set members that are concepts
+    refsets = search_ids(concept_ids, refset_members['refsetId'].unique())
+    arrays['refsets'] = np.sort(refsets[refsets >= 0])
+    members = refset_members[refset_members['active']]
+    refset = search_ids(concept_ids, members['refsetId'])
+    member = search_ids(concept_ids, members['referencedComponentId'])
+    keep = (refset >= 0) & (member >= 0)
+    order = np.lexsort((member[keep], refset[keep]))
+    arrays['member_offsets'] = _csr(refset[keep][order], count)
+    arrays['member_indices'] = member[keep][order]
+
+    encoded = [term.encode('utf-8') for term in _preferred_terms(concept_ids, descriptions, language)]
+    term_offsets = np.zeros(count + 1, dtype=np.int64)
+    np.cumsum([len(term) for term in encoded], out=term_offsets[1:])
+    arrays['term_offsets'] = term_offsets
+    arrays['term_bytes'] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'built_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'sources': list(sources),
+        'concepts': count,
+        'active_concepts': int(arrays['active'].sum()),
+        'is_a_relationships': len(arrays['parent_indices']),
+        'attribute_relationships': len(arrays['attribute_types']),
+        'refsets': len(arrays['refsets']),
+        'refset_members': len(arrays['member_indices']),
+        'build_seconds': round(time.perf_counter() - started, 1),
+    }
+    _write_index(out_dir, arrays, manifest)
+    return TerminologyIndex.open(out_dir)
+
+
+def _write_index(out_dir, arrays, manifest):
+    """Write arrays and manifest to a sibling directory, then swap it in for out_dir"""
+    out_dir = os.path.abspath(out_dir)
+    building = f"{out_dir}.building"
+    shutil.rmtree(building, ignore_errors=True)
+    os.makedirs(building)
+    for name, dtype in ARRAYS.items():
+        np.save(os.path.join(building, f"{name}.npy"), np.ascontiguousarray(arrays[name], dtype=dtype))
+    # The manifest goes last - an index without one is never opened
+    with open(os.path.join(building, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    previous = f"{out_dir}.previous"
+    shutil.rmtree(previous, ignore_errors=True)
+    if os.path.exists(out_dir):
+        os.rename(out_dir, previous)
+    os.rename(building, out_dir)
+    # Open mappings of the old files stay valid after they are unlinked
+    shutil.rmtree(previous, ignore_errors=True)
+
+
+def _release_name(root):
+    """Release folder name of an RF2 folder, from above its Snapshot folder if given that"""
+    root = os.path.normpath(os.path.abspath(root))
+    if os.path.basename(root).lower() == 'snapshot':
+        root = os.path.dirname(root)
+    return os.path.basename(root)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the local SNOMED CT index from RF2 snapshot files")
+    parser.add_argument("--rf2", nargs="+", required=True,
+                        help="RF2 release folders (or their Snapshot folders) to index together")
+    parser.add_argument("--out", default=default_index_path(), help="Index directory")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    frames = read_rf2_snapshot(args.rf2)
+    print(f"[{time.perf_counter() - started:7.1f}s] Read {len(frames['concepts']):,} concepts, "
+          f"{len(frames['relationships']):,} relationships, {len(frames['descriptions']):,} descriptions", flush=True)
+    index = build_index(args.out, **frames, sources=[_release_name(root) for root in args.rf2])
+    print(f"[{time.perf_counter() - started:7.1f}s] Wrote {index!r} to {args.out}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,769 @@
+# =============================================================================
+# SNOMED Cluster Manager - ECL Parser
+# =============================================================================
+#
+# Parses SNOMED CT Expression Constraint Language 2.x into a tree of frozen
+# dataclasses. Every node carries the (start, end) character span it was read
+# from, for pointing at errors. Spans and display terms are left out of
+# equality, so two spellings of the same constraint parse to equal trees.
+#
+# to_ecl() writes a tree back out as ECL; canonical_ecl() writes one normal
+# form per constraint, for use as a cache key: short operators, no terms,
+# redundant parentheses dropped, and AND/OR operands flattened, sorted and
+# deduplicated.
+
+import re
+from dataclasses import dataclass, field
+from typing import Optional, Tuple, Union
+
+Span = Optional[Tuple[int, int]]
+
+# Constraint operators, short form -> long form
+CONSTRAINT_OPERATORS = {
+    '<<!': 'childOrSelfOf',
+    '<<': 'descendantOrSelfOf',
+    '<!': 'childOf',
+    '<': 'descendantOf',
+    '>>!': 'parentOrSelfOf',
+    '>>': 'ancestorOrSelfOf',
+    '>!': 'parentOf',
+    '>': 'ancestorOf',
+    '!!>': 'top',
+    '!!<': 'bottom',
+}
+_LONG_OPERATORS = {long.lower(): short for short, long in CONSTRAINT_OPERATORS.items() if short[0] != '!'}
+
+# Comparison operators of attributes and filters
+COMPARISON_OPERATORS = ('=', '!=', '<', '<=', '>', '>=')
+
+# History supplement profiles ({{ +HISTORY-MIN }} etc.)
+HISTORY_PROFILES = ('MIN', 'MOD', 'MAX')
+
+# Filter constraint domains - description, concept and member filters
+FILTER_DOMAINS = ('D', 'C', 'M')
+
+
+# -----------------------------------------------------------------------------
+# Tree
+# -----------------------------------------------------------------------------
+
+def _span():
+    return field(default=None, compare=False, repr=False)
+
+
+@dataclass(frozen=True)
+class ConceptReference:
+    """A concept ID with an optional display term (ignored when comparing)"""
+    concept_id: str
+    term: Optional[str] = field(default=None, compare=False)
+    span: Span = _span()
+
+
+@dataclass(frozen=True)
+class Wildcard:
+    """* - any concept"""
+    span: Span = _span()
+
+
+@dataclass(frozen=True)
+class AlternateIdentifier:
+    """A concept by another scheme's code, e.g. LOINC#54486-6"""
+    scheme: str
+    code: str
+    span: Span = _span()
+
+
+@dataclass(frozen=True)
+class MemberOf:
+    """^ - members of the reference sets, optionally selecting refset fields"""
+    fields: Optional[Tuple[str, ...]] = None
+    span: Span = _span()
+
+
+@dataclass(frozen=True)
+class DialectAcceptability:
+    """A dialect filter value with acceptabilities, e.g. en-gb (prefer)"""
+    dialect: str
+    acceptability: Tuple[str, ...]
+    span: Span = _span()
+
+
+@dataclass(frozen=True)
+class Filter:
+    """One filter of a filter constraint, e.g. term = "heart"
+
+    value is source text for terms, words and numbers (e.g. 'match:"heart"',
+    'en', '#5'), a node for concept values, or a tuple of values for a set.
+    """
+    name: str
+    operator: str
+    value: object
+    span: Span = _span()
+
+
+@dataclass(frozen=True)
+class FilterConstraint:
+    """{{ [D|C|M] filter, filter... }}"""
+    domain: Optional[str]
+    filters: Tuple[Filter, ...]
+    span: Span = _span()
+
+
+@dataclass(frozen=True)
+class HistorySupplement:
+    """{{ +HISTORY[-MIN|-MOD|-MAX|(subset)] }}"""
+    profile: Optional[str] = None
+    subset: object = None
+    span: Span = _span()
+
+
+@dataclass(frozen=True)
+class SubExpression:
+    """[operator] [^] focus [filters] [history] - focus is a concept reference,
+    wildcard, alternate identifier or a parenthesised expression"""
+    focus: object
+    operator: Optional[str] = None
+    member_of: Optional[MemberOf] = None
+    filters: Tuple[FilterConstraint, ...] = ()
+    history: Optional[HistorySupplement] = None
+    span: Span = _span()
+
+
+@dataclass(frozen=True)
+class CompoundExpression:
+    """Operands joined by AND, OR or (two operands) MINUS"""
+    operator: str
+    operands: Tuple[object, ...]
+    span: Span = _span()
+
+
+@dataclass(frozen=True)
+class DottedExpression:
+    """expression . attribute . attribute - values of the attributes"""
+    expression: SubExpression
+    attributes: Tuple[SubExpression, ...]
+    span: Span = _span()
+
+
+@dataclass(frozen=True)
+class Cardinality:
+    """[min..max] - max None for *"""
+    minimum: int
+    maximum: Optional[int]
+    span: Span = _span()
+
+
+@dataclass(frozen=True)
+class ConcreteValue:
+    """#number, "string" or boolean attribute value"""
+    kind: str
+    value: str
+    span: Span = _span()
+
+
+@dataclass(frozen=True)
+class Attribute:
+    """[cardinality] [R] name operator value"""
+    name: SubExpression
+    operator: str
+    value: Union[SubExpression, ConcreteValue]
+    cardinality: Optional[Cardinality] = None
+    reverse: bool = False
+    span: Span = _span()
+
+
+@dataclass(frozen=True)
+class AttributeGroup:
+    """[cardinality] { attribute set }"""
+    refinement: object
+    cardinality: Optional[Cardinality] = None
+    span: Span = _span()
+
+
+@dataclass(frozen=True)
+class RefinementSet:
+    """Attributes, groups or nested sets joined by AND or OR"""
+    operator: str
+    items: Tuple[object, ...]
+    span: Span = _span()
+
+
+@dataclass(frozen=True)
+class RefinedExpression:
+    """expression : refinement"""
+    expression: SubExpression
+    refinement: object
+    span: Span = _span()
+
+
+class ECLSyntaxError(ValueError):
+    """An expression that isn't valid ECL, with the span of the offending text"""
+
+    def __init__(self, message, text, span):
+        self.message = message
+        self.span = span
+        line = text.count('\n', 0, span[0]) + 1
+        column = span[0] - (text.rfind('\n', 0, span[0]) + 1) + 1
+        super().__init__(f"{message} (line {line}, column {column})")
+
+
+# -----------------------------------------------------------------------------
+# Tokens
+# -----------------------------------------------------------------------------
+
+# Symbols, longest first so e.g. '<<!' isn't read as '<<' then '!'
+_SYMBOLS = (
+    '<<!', '>>!', '!!>', '!!<', '<<', '>>', '<!', '>!', '<=', '>=', '!=', '{{', '}}', '..',
+    '<', '>', '=', '^', '(', ')', '{', '}', '[', ']', ':', ',', '.', '#', '*', '+'
+)
+_SYMBOL = re.compile("|".join(re.escape(symbol) for symbol in _SYMBOLS))
+_SKIP = re.compile(r"(?:\s+|/\*.*?\*/)+", re.DOTALL)
+_ID = re.compile(r"\d+")
+_WORD = re.compile(r"[A-Za-z_][A-Za-z0-9_\-]*")
+_TERM = re.compile(r"\|([^|]*)\|")
+_STRING = re.compile(r'"((?:\\.|[^"\\])*)"')
+_NUMBER = re.compile(r"[+-]?(?:\d+(?:\.\d+)?|\.\d+)")
+_ALTERNATE_CODE = re.compile(r'"(?:\\.|[^"\\])*"|[^\s|(){}\[\]:,]+')
+
+
+@dataclass(frozen=True)
+class _Token:
+    kind: str
+    text: str
+    start: int
+    end: int
+
+
+def _tokenize(text):
+    """Split ECL text into tokens - after '#' comes a number, or an alternate
+    code when the '#' follows a scheme name"""
+    tokens = []
+    position = 0
+    while True:
+        skipped = _SKIP.match(text, position)
+        if skipped:
+            position = skipped.end()
+        if position >= len(text):
+            break
+        previous = tokens[-1] if tokens else None
+        after_hash = previous is not None and previous.text == '#'
+        if after_hash and len(tokens) > 1 and tokens[-2].kind == 'word' and tokens[-2].end == previous.start:
+            kind, match = 'code', _ALTERNATE_CODE.match(text, position)
+        elif after_hash:
+            kind, match = 'number', _NUMBER.match(text, position)
+        else:
+            kind, match = None, None
+            for kind, pattern in (('term', _TERM), ('string', _STRING), ('id', _ID), ('word', _WORD)):
+                match = pattern.match(text, position)
+                if match:
+                    break
+            if not match:
+                kind, match = 'symbol', _SYMBOL.match(text, position)
+                if not match:
+                    raise ECLSyntaxError(f"Unexpected character {text[position]!r}", text, (position, position + 1))
+        if not match:
+            raise ECLSyntaxError("Expected a number after '#'", text, (position, position + 1))
+        tokens.append(_Token(kind, match.group(0), match.start(), match.end()))
+        position = match.end()
+    tokens.append(_Token('end', '', len(text), len(text)))
+    return tokens
+
+
+# -----------------------------------------------------------------------------
+# Parser
+# -----------------------------------------------------------------------------
+
+class _Parser:
+    """Recursive descent over ECL 2.x tokens"""
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = _tokenize(text)
+        self.position = 0
+
+    # Token helpers
+
+    def _peek(self, offset=0):
+        return self.tokens[min(self.position + offset, len(self.tokens) - 1)]
+
+    def _at(self, *texts, offset=0):
+        token = self._peek(offset)
+        return token.kind in ('symbol', 'word') and token.text in texts
+
+    def _at_keyword(self, *words, offset=0):
+        token = self._peek(offset)
+        return token.kind == 'word' and token.text.upper() in words
+
+    def _take(self):
+        token = self._peek()
+        self.position += 1
+        return token
+
+    def _error(self, message, token=None):
+        token = token or self._peek()
+        found = "end of expression" if token.kind == 'end' else repr(token.text)
+        return ECLSyntaxError(f"{message}, found {found}", self.text, (token.start, max(token.end, token.start + 1)))
+
+    def _expect(self, text, what=None):
+        if not self._at(text):
+            raise self._error(f"Expected {what or repr(text)}")
+        return self._take()
+
+    def _span_from(self, start):
+        return (start, self.tokens[self.position - 1].end)
+
+    # Expression constraints
+
+    def _compound_operator(self):
+        """AND, OR or MINUS at the current token, else None (',' is AND)"""
+        if self._at(','):
+            return 'AND'
+        if self._at_keyword('AND', 'OR', 'MINUS'):
+            return self._peek().text.upper()
+        return None
+
+    def expression(self):
+        start = self._peek().start
+        first = self.sub_expression()
+        if self._at(':'):
+            self._take()
+            refinement = self.refinement(groups=True)
+            return RefinedExpression(first, refinement, self._span_from(start))
+        if self._at('.'):
+            attributes = []
+            while self._at('.'):
+                self._take()
+                attributes.append(self.sub_expression())
+            return DottedExpression(first, tuple(attributes), self._span_from(start))
+        operator = self._compound_operator()
+        if operator is None:
+            return first
+        operands = [first]
+        while self._compound_operator() == operator:
+            self._take()
+            operands.append(self.sub_expression())
+            if operator == 'MINUS':
+                break
+        if operator == 'MINUS' and self._compound_operator() == 'MINUS':
+            raise self._error("Use parentheses to chain MINUS")
+        if self._compound_operator() is not None:
+            raise self._error(f"Use parentheses to combine {operator} with {self._compound_operator()}")
+        if self._at(':', '.'):
+            raise self._error("Use parentheses around a refined or dotted expression within AND, OR or MINUS")
+        return CompoundExpression(operator, tuple(operands), self._span_from(start))
+
+    def sub_expression(self):
+        start = self._peek().start
+        operator = None
+        if self._peek().kind == 'symbol' and self._peek().text in CONSTRAINT_OPERATORS:
+            operator = self._take().text
+        elif self._peek().kind == 'word' and self._peek().text.lower() in _LONG_OPERATORS:
+            operator = _LONG_OPERATORS[self._take().text.lower()]
+
+        member_of = None
+        if self._at('^'):
+            member_start = self._take().start
+            fields = None
+            if self._at('['):
+                self._take()
+                if self._at('*'):
+                    fields = (self._take().text,)
+                else:
+                    fields = [self._word("a reference set field name")]
+                    while self._at(','):
+                        self._take()
+                        fields.append(self._word("a reference set field name"))
+                    fields = tuple(fields)
+                self._expect(']')
+            member_of = MemberOf(fields, self._span_from(member_start))
+
+        focus = self._focus()
+        filters = []
+        while self._at('{{') and not self._at('+', offset=1):
+            filters.append(self.filter_constraint())
+        history = self.history_supplement() if self._at('{{') else None
+        return SubExpression(focus, operator, member_of, tuple(filters), history, self._span_from(start))
+
+    def _focus(self):
+        token = self._peek()
+        if self._at('('):
+            self._take()
+            inner = self.expression()
+            self._expect(')', "')'")
+            return inner
+        if self._at('*'):
+            self._take()
+            return Wildcard((token.start, token.end))
+        if token.kind == 'id':
+            self._take()
+            term = None
+            if self._peek().kind == 'term':
+                term = self._take().text[1:-1].strip()
+            return ConceptReference(token.text, term, self._span_from(token.start))
+        if token.kind == 'word' and self._at('#', offset=1):
+            self._take()
+            self._take()
+            code = self._take()
+            return AlternateIdentifier(token.text, code.text, (token.start, code.end))
+        raise self._error("Expected a concept ID, '*' or '('")
+
+    def _word(self, what):
+        if self._peek().kind != 'word':
+            raise self._error(f"Expected {what}")
+        return self._take().text
+
+    # Filters and history
+
+    def filter_constraint(self):
+        start = self._expect('{{').start
+        domain = None
+        if self._at_keyword(*FILTER_DOMAINS) and self._peek(1).kind == 'word':
+            domain = self._take().text.upper()
+        filters = [self._filter()]
+        while self._at(','):
+            self._take()
+            filters.append(self._filter())
+        self._expect('}}', "',' or '}}'")
+        return FilterConstraint(domain, tuple(filters), self._span_from(start))
+
+    def _filter(self):
+        start = self._peek().start
+        name = self._word("a filter name (e.g. term, language, active)")
+        if not self._at(*COMPARISON_OPERATORS):
+            raise self._error(f"Expected a comparison operator after {name}")
+        operator = self._take().text
+        value = self._filter_value(name)
+        return Filter(name, operator, value, self._span_from(start))
+
+    def _filter_value(self, name):
+        token = self._peek()
+        if token.kind == 'string':
+            return self._take().text
+        if token.kind == 'word' and self._at(':', offset=1) and self._peek(2).kind == 'string':
+            # Typed search term, e.g. match:"heart" or wild:"card*"
+            self._take()
+            self._take()
+            return f"{token.text.lower()}:{self._take().text}"
+        if self._at('('):
+            self._take()
+            items = []
+            while not self._at(')'):
+                if self._peek().kind == 'end':
+                    raise self._error("Expected ')'")
+                items.append(self._filter_value(name))
+            self._take()
+            return tuple(items)
+        if self._at('#'):
+            self._take()
+            return f"#{self._take().text}"
+        if token.kind == 'id' and name.lower() == 'active':
+            # 1 / 0, not concept IDs
+            return self._take().text
+        if token.kind == 'word' and not (token.text.lower() in _LONG_OPERATORS or self._at('#', offset=1)):
+            self._take()
+            if name.lower().startswith('dialect') and self._at('('):
+                # Acceptability of a dialect, e.g. en-gb (prefer)
+                self._take()
+                acceptability = []
+                while not self._at(')'):
+                    acceptability.append(self._word("an acceptability (e.g. prefer, accept)"))
+                self._take()
+                return DialectAcceptability(token.text, tuple(acceptability), self._span_from(token.start))
+            return token.text
+        return self.sub_expression()
+
+    def history_supplement(self):
+        start = self._expect('{{').start
+        self._expect('+', "'+HISTORY'")
+        keyword = self._word("HISTORY").upper()
+        profile = None
+        subset = None
+        if keyword.startswith('HISTORY-') and keyword[len('HISTORY-'):] in HISTORY_PROFILES:
+            profile = keyword[len('HISTORY-'):]
+        elif keyword != 'HISTORY':
+            raise self._error("Expected HISTORY, HISTORY-MIN, HISTORY-MOD or HISTORY-MAX", self.tokens[self.position - 1])
+        elif self._at('('):
+            self._take()
+            subset = self.expression()
+            self._expect(')', "')'")
+        self._expect('}}')
+        return HistorySupplement(profile, subset, self._span_from(start))
+
+    # Refinements
+
+    def refinement(self, groups):
+        """Attribute sets (and, with groups, attribute groups) joined by AND/OR"""
+        start = self._peek().start
+        items = [self._sub_refinement(groups)]
+        operator = self._refinement_operator()
+        if operator is None:
+            return items[0]
+        while self._refinement_operator() == operator:
+            self._take()
+            items.append(self._sub_refinement(groups))
+        if self._refinement_operator() is not None:
+            raise self._error("Use parentheses to combine AND with OR in a refinement")
+        return RefinementSet(operator, tuple(items), self._span_from(start))
+
+    def _refinement_operator(self):
+        if self._at(','):
+            return 'AND'
+        if self._at_keyword('AND', 'OR'):
+            return self._peek().text.upper()
+        return None
+
+    def _sub_refinement(self, groups):
+        start = self._peek().start
+        if self._at('('):
+            # An attribute whose name is parenthesised, else a nested refinement
+            saved = self.position
+            try:
+                return self.attribute()
+            except ECLSyntaxError as attribute_error:
+                self.position = saved
+                furthest = attribute_error
+            try:
+                self._take()
+                inner = self.refinement(groups)
+                self._expect(')', "')'")
+                return inner
+            except ECLSyntaxError as refinement_error:
+                raise max(furthest, refinement_error, key=lambda error: error.span[0])
+        cardinality = self._cardinality() if self._at('[') else None
+        if self._at('{'):
+            if not groups:
+                raise self._error("Attribute groups can't be nested")
+            self._take()
+            inner = self.refinement(groups=False)
+            self._expect('}', "'}'")
+            return AttributeGroup(inner, cardinality, self._span_from(start))
+        return self.attribute(cardinality, start)
+
+    def _cardinality(self):
+        start = self._expect('[').start
+        if self._peek().kind != 'id':
+            raise self._error("Expected a minimum cardinality")
+        minimum = int(self._take().text)
+        self._expect('..')
+        if self._at('*'):
+            self._take()
+            maximum = None
+        elif self._peek().kind == 'id':
+            maximum = int(self._take().text)
+        else:
+            raise self._error("Expected a maximum cardinality or '*'")
+        self._expect(']')
+        if maximum is not None and maximum < minimum:
+            raise ECLSyntaxError("Cardinality maximum is below its minimum", self.text, self._span_from(start))
+        return Cardinality(minimum, maximum, self._span_from(start))
+
+    def attribute(self, cardinality=None, start=None):
+        start = self._peek().start if start is None else start
+        if cardinality is None and self._at('['):
+            cardinality = self._cardinality()
+        reverse = False
+        if self._at_keyword('R') and not self._at('#', offset=1):
+            self._take()
+            reverse = True
+        name = self.sub_expression()
+        if not self._at(*COMPARISON_OPERATORS):
+            raise self._error("Expected a comparison operator (e.g. '=') after the attribute name")
+        operator = self._take().text
+        token = self._peek()
+        if self._at('#'):
+            self._take()
+            number = self._take()
+            value = ConcreteValue('number', number.text, (token.start, number.end))
+        elif token.kind == 'string':
+            self._take()
+            value = ConcreteValue('string', _unescape(token.text[1:-1]), (token.start, token.end))
+        elif self._at_keyword('TRUE', 'FALSE'):
+            self._take()
+            value = ConcreteValue('boolean', token.text.lower(), (token.start, token.end))
+        elif operator in ('=', '!='):
+            value = self.sub_expression()
+        else:
+            raise self._error(f"Expected a #number after '{operator}'")
+        return Attribute(name, operator, value, cardinality, reverse, self._span_from(start))
+
+    def parse(self):
+        if self._peek().kind == 'end':
+            raise self._error("Expected an expression constraint")
+        node = self.expression()
+        if self._peek().kind != 'end':
+            raise self._error("Expected AND, OR, MINUS or the end of the expression")
+        return node
+
+
+def _unescape(text):
+    return re.sub(r'\\(.)', r'\1', text)
+
+
+def _quote(text):
+    return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def parse_ecl(text):
+    """Parse an ECL expression into a tree, raising ECLSyntaxError if it isn't valid"""
+    return _Parser(text).parse()
+
+
+# -----------------------------------------------------------------------------
+# Writing
+# -----------------------------------------------------------------------------
+
+def _is_bare(node):
+    """A sub-expression that is only a parenthesised expression"""
+    return (isinstance(node, SubExpression) and node.operator is None and node.member_of is None
+            and not node.filters and node.history is None
+            and not isinstance(node.focus, (ConceptReference, Wildcard, AlternateIdentifier)))
+
+
+class _Writer:
+    """Write a tree as ECL - canonical drops terms and orders AND/OR operands"""
+
+    def __init__(self, terms, canonical):
+        self.terms = terms and not canonical
+        self.canonical = canonical
+
+    def _strip(self, node):
+        while self.canonical and _is_bare(node):
+            node = node.focus
+        return node
+
+    def _joined(self, node_type, operator, items):
+        """Operands of a flattened, sorted and deduplicated AND/OR (canonical), else as written"""
+        items = [self._strip(item) for item in items]
+        if not self.canonical or operator == 'MINUS':
+            return items
+        flat = []
+        for item in items:
+            if isinstance(item, node_type) and item.operator == operator:
+                flat += self._joined(node_type, operator, item.operands if node_type is CompoundExpression else item.items)
+            else:
+                flat.append(item)
+        return flat
+
+    def write(self, node):
+        node = self._strip(node)
+        method = getattr(self, f"_{type(node).__name__}")
+        return method(node)
+
+    def _operand(self, node):
+        """An expression where only a sub-expression can stand without parentheses"""
+        node = self._strip(node)
+        text = self.write(node)
+        return text if isinstance(node, SubExpression) else f"({text})"
+
+    def _ConceptReference(self, node):
+        return f"{node.concept_id} |{node.term}|" if self.terms and node.term else node.concept_id
+
+    def _Wildcard(self, node):
+        return "*"
+
+    def _AlternateIdentifier(self, node):
+        return f"{node.scheme}#{node.code}"
+
+    def _SubExpression(self, node):
+        parts = []
+        if node.operator:
+            parts.append(node.operator)
+        if node.member_of is not None:
+            parts.append("^" if node.member_of.fields is None else f"^ [{', '.join(node.member_of.fields)}]")
+        focus = node.focus
+        if isinstance(focus, (ConceptReference, Wildcard, AlternateIdentifier)):
+            parts.append(self.write(focus))
+        else:
+            focus = self._strip(focus)
+            text = self.write(focus)
+            # A lone concept needs no parentheses, e.g. << (123) is << 123
+            plain = (isinstance(focus, SubExpression) and self.canonical and focus.operator is None
+                     and focus.member_of is None and not focus.filters and focus.history is None)
+            parts.append(text if plain else f"({text})")
+        parts += [self.write(constraint) for constraint in node.filters]
+        if node.history is not None:
+            parts.append(self.write(node.history))
+        return " ".join(parts)
+
+    def _CompoundExpression(self, node):
+        operands = self._joined(CompoundExpression, node.operator, node.operands)
+        if self.canonical and node.operator != 'MINUS':
+            distinct = {self.write(item): item for item in operands}
+            if len(distinct) == 1:
+                return next(iter(distinct))
+            operands = [distinct[text] for text in sorted(distinct)]
+        return f" {node.operator} ".join(self._operand(item) for item in operands)
+
+    def _DottedExpression(self, node):
+        return " . ".join([self.write(node.expression)] + [self.write(attribute) for attribute in node.attributes])
+
+    def _RefinedExpression(self, node):
+        return f"{self.write(node.expression)} : {self.write(node.refinement)}"
+
+    def _RefinementSet(self, node):
+        items = []
+        for item in self._joined(RefinementSet, node.operator, node.items):
+            text = self.write(item)
+            items.append(f"({text})" if isinstance(item, RefinementSet) else text)
+        if self.canonical:
+            items = sorted(set(items))
+        return f" {node.operator} ".join(items)
+
+    def _AttributeGroup(self, node):
+        cardinality = f"{self.write(node.cardinality)} " if node.cardinality else ""
+        return f"{cardinality}{{ {self.write(node.refinement)} }}"
+
+    def _Attribute(self, node):
+        parts = []
+        if node.cardinality:
+            parts.append(self.write(node.cardinality))
+        if node.reverse:
+            parts.append("R")
+        name = self._strip(node.name)
+        parts += [self._operand(name), node.operator]
+        value = node.value if isinstance(node.value, ConcreteValue) else self._strip(node.value)
+        parts.append(self.write(value) if isinstance(value, ConcreteValue) else self._operand(value))
+        return " ".join(parts)
+
+    def _Cardinality(self, node):
+        return f"[{node.minimum}..{'*' if node.maximum is None else node.maximum}]"
+
+    def _ConcreteValue(self, node):
+        if node.kind == 'number':
+            return f"#{node.value}"
+        return _quote(node.value) if node.kind == 'string' else node.value
+
+    def _FilterConstraint(self, node):
+        domain = f"{node.domain} " if node.domain else ""
+        return f"{{{{ {domain}{', '.join(self.write(f) for f in node.filters)} }}}}"
+
+    def _Filter(self, node):
+        return f"{node.name} {node.operator} {self._filter_value(node.value)}"
+
+    def _filter_value(self, value):
+        if isinstance(value, tuple):
+            return "(" + " ".join(self._filter_value(item) for item in value) + ")"
+        if isinstance(value, str):
+            return value
+        return self.write(value)
+
+    def _DialectAcceptability(self, node):
+        return f"{node.dialect} ({' '.join(node.acceptability)})"
+
+    def _HistorySupplement(self, node):
+        if node.profile:
+            return f"{{{{ +HISTORY-{node.profile} }}}}"
+        if node.subset is not None:
+            return f"{{{{ +HISTORY ({self.write(node.subset)}) }}}}"
+        return "{{ +HISTORY }}"
+
+
+def to_ecl(node, terms=True):
+    """Write a parsed tree back out as ECL, with display terms unless terms=False"""
+    return _Writer(terms, canonical=False).write(node)
+
+
+def canonical_ecl(expression):
+    """One normal form per constraint (ECL text or a parsed tree) - raises ECLSyntaxError"""
+    node = parse_ecl(expression) if isinstance(expression, str) else expression
+    return _Writer(terms=False, canonical=True).write(node)
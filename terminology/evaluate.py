@@ -0,0 +1,300 @@
+# =============================================================================
+# SNOMED Cluster Manager - Local ECL Evaluation
+# =============================================================================
+#
+# Expands parsed ECL (terminology/ecl.py) to concept sets in-process against
+# the terminology index. Sets are sorted int64 arrays of index positions, so
+# AND and MINUS are numpy intersect1d and setdiff1d, and OR a concatenate,
+# sort and dedupe. Descendants and ancestors are a breadth-first walk over the
+# CSR child and parent arrays, a whole frontier per step. Refinements read the
+# relationships of the attribute types they name from the by-type index and
+# count matches per concept, or per relationship group, with np.unique.
+#
+# Constraints the index holds no data for - description and most concept
+# filters, history supplements, concrete values, alternate identifiers,
+# reference set field selection, members of reference sets that aren't simple
+# reference sets and concepts missing from the indexed release - raise
+# ECLNotSupported, so callers can send the expression to the terminology
+# server instead.
+
+from functools import reduce
+
+import numpy as np
+from terminology.ecl import (
+    AttributeGroup, ConcreteValue, RefinementSet, parse_ecl
+)
+from terminology.build import IS_A
+from terminology.index import csr_slots
+
+# Relationship groups are keyed source * GROUP_STRIDE + group (groups are int16)
+GROUP_STRIDE = 1 << 16
+
+
+class ECLNotSupported(ValueError):
+    """A valid constraint the local index can't evaluate"""
+
+
+def _mask(size, positions):
+    mask = np.zeros(size, dtype=bool)
+    mask[positions] = True
+    return mask
+
+
+def _distinct(values):
+    """Sorted distinct int64 values - a sort and a compare, which beats np.unique's hashing here"""
+    values = np.sort(np.asarray(values, dtype=np.int64))
+    if len(values) == 0:
+        return values
+    keep = np.empty(len(values), dtype=bool)
+    keep[0] = True
+    np.not_equal(values[1:], values[:-1], out=keep[1:])
+    return values[keep]
+
+
+def _union(left, right):
+    return _distinct(np.concatenate([left, right]))
+
+
+def _intersect(left, right):
+    return np.intersect1d(left, right, assume_unique=True)
+
+
+class _Evaluator:
+    """Evaluate a parsed tree node by node against one index"""
+
+    def __init__(self, index):
+        self.index = index
+        # Plain views of the mapped arrays - fancy indexing an np.memmap is slower
+        self.arrays = {name: np.asarray(array) for name, array in index.arrays.items()}
+        self.size = len(index)
+        # IS-A edges are only in the parent arrays - attribute rows past the
+        # attribute arrays' end stand for them (row = attribute count + parent slot)
+        self.attribute_count = len(self.arrays['attribute_types'])
+        self.is_a = int(index.positions([IS_A])[0])
+
+    def evaluate(self, node):
+        """Sorted int64 positions of the concepts a node matches"""
+        method = getattr(self, f"_{type(node).__name__}", None)
+        if method is None:
+            raise ECLNotSupported(f"{type(node).__name__} isn't supported by the local index")
+        return method(node)
+
+    # Focus concepts
+
+    def _ConceptReference(self, node):
+        positions = self.index.positions([node.concept_id])
+        if positions[0] < 0:
+            raise ECLNotSupported(f"{node.concept_id} isn't in the indexed release")
+        return positions.astype(np.int64)
+
+    def _Wildcard(self, node):
+        return np.arange(self.size, dtype=np.int64)
+
+    def _SubExpression(self, node):
+        if node.history is not None:
+            raise ECLNotSupported("History supplements need the terminology server")
+        focus = self.evaluate(node.focus)
+        if node.member_of is not None:
+            if node.member_of.fields is not None:
+                raise ECLNotSupported("Reference set field selection needs the terminology server")
+            if not self.index.is_indexed_refset(focus).all():
+                raise ECLNotSupported("Only simple reference set members are indexed")
+            focus = self._neighbours('member', focus)
+        result = self._constrain(node.operator, focus)
+        for constraint in node.filters:
+            result = self._filter(constraint, result)
+        return result
+
+    def _neighbours(self, kind, positions):
+        """Distinct parents, children or reference set members of positions"""
+        slots, _ = csr_slots(self.arrays[f'{kind}_offsets'], positions)
+        return _distinct(self.arrays[f'{kind}_indices'][slots])
+
+    def _closure(self, kind, start):
+        """Every concept reachable from start through the parent or child arrays"""
+        offsets, indices = self.arrays[f'{kind}_offsets'], self.arrays[f'{kind}_indices']
+        seen = np.zeros(self.size, dtype=bool)
+        frontier = np.asarray(start, dtype=np.int64)
+        while len(frontier):
+            slots, _ = csr_slots(offsets, frontier)
+            reached = indices[slots]
+            reached = reached[~seen[reached]]
+            seen[reached] = True
+            if len(reached) < self.size >> 6:
+                frontier = _distinct(reached)
+            else:
+                # Wide frontiers are deduplicated through a mask rather than a sort
+                step = np.zeros(self.size, dtype=bool)
+                step[reached] = True
+                frontier = np.flatnonzero(step).astype(np.int64)
+        return np.flatnonzero(seen).astype(np.int64)
+
+    def _constrain(self, operator, focus):
+        """Apply a constraint operator to a set of focus concepts"""
+        if operator is None or (operator in ('<<', '>>') and len(focus) == self.size):
+            return focus
+        if operator in ('<', '<<'):
+            descendants = self._closure('child', focus)
+            return descendants if operator == '<' else _union(focus, descendants)
+        if operator in ('>', '>>'):
+            ancestors = self._closure('parent', focus)
+            return ancestors if operator == '>' else _union(focus, ancestors)
+        if operator in ('<!', '<<!'):
+            children = self._neighbours('child', focus)
+            return children if operator == '<!' else _union(focus, children)
+        if operator in ('>!', '>>!'):
+            parents = self._neighbours('parent', focus)
+            return parents if operator == '>!' else _union(focus, parents)
+        # !!> top and !!< bottom - the members with no ancestor / descendant in the set
+        kind = 'child' if operator == '!!>' else 'parent'
+        return np.setdiff1d(focus, self._closure(kind, focus), assume_unique=True)
+
+    def _filter(self, constraint, result):
+        """Apply a filter constraint - only the concept active filter is held in the index"""
+        for item in constraint.filters:
+            if constraint.domain != 'C' or item.name.lower() != 'active' or item.operator not in ('=', '!='):
+                raise ECLNotSupported(f"{item.name} filters need the terminology server")
+            if not isinstance(item.value, str) or item.value.lower() not in ('1', '0', 'true', 'false'):
+                raise ECLNotSupported("Active filters take 1, 0, true or false")
+            wanted = item.value.lower() in ('1', 'true')
+            if item.operator == '!=':
+                wanted = not wanted
+            result = result[self.index.is_active(result) == wanted]
+        return result
+
+    # Expressions
+
+    def _CompoundExpression(self, node):
+        sets = [self.evaluate(operand) for operand in node.operands]
+        if node.operator == 'MINUS':
+            return np.setdiff1d(sets[0], sets[1], assume_unique=True)
+        return reduce(_union if node.operator == 'OR' else _intersect, sets)
+
+    def _DottedExpression(self, node):
+        result = self.evaluate(node.expression)
+        for attribute in node.attributes:
+            _, _, sources, values, _ = self._relationships(self.evaluate(attribute))
+            result = _distinct(values[_mask(self.size, result)[sources]])
+        return result
+
+    def _RefinedExpression(self, node):
+        candidates = self.evaluate(node.expression)
+        return self._satisfying(node.refinement, candidates, grouped=False)
+
+    # Refinements
+
+    def _satisfying(self, node, candidates, grouped):
+        """Sorted keys of the subjects satisfying a refinement - candidate
+        positions, or when grouped the candidates' relationship group keys"""
+        if isinstance(node, RefinementSet):
+            keys = [self._satisfying(item, candidates, grouped) for item in node.items]
+            return reduce(_union if node.operator == 'OR' else _intersect, keys)
+        if isinstance(node, AttributeGroup):
+            groups = self._satisfying(node.refinement, candidates, grouped=True)
+            # One match per satisfying group, counted against the group cardinality
+            return self._counted(self._group_sources(groups), node.cardinality, lambda: candidates)
+        return self._attribute(node, candidates, grouped)
+
+    def _attribute(self, node, candidates, grouped):
+        if isinstance(node.value, ConcreteValue):
+            raise ECLNotSupported("Concrete values need the terminology server")
+        rows, types, sources, targets, groups = self._relationships(self.evaluate(node.name))
+        matches = _mask(self.size, self.evaluate(node.value))
+        in_candidates = _mask(self.size, candidates)
+
+        if node.reverse:
+            if grouped:
+                raise ECLNotSupported("Reverse attributes in attribute groups need the terminology server")
+            # Candidates that are the value of a relationship from a matching source
+            keep = (matches[sources] if node.operator == '=' else ~matches[sources]) & in_candidates[targets]
+            subjects, others = targets[keep], sources[keep]
+        else:
+            keep = (matches[targets] if node.operator == '=' else ~matches[targets]) & in_candidates[sources]
+            subjects, others = sources[keep], targets[keep]
+
+        if grouped:
+            keys = self._group_keys(rows[keep], subjects, groups[keep])
+            return self._counted(keys, node.cardinality, lambda: self._candidate_groups(candidates))
+        if node.cardinality is not None and len(subjects):
+            # Count each attribute-value pair once, whichever groups it is in
+            subjects = np.unique(np.stack([subjects, types[keep], others]), axis=1)[0]
+        return self._counted(subjects, node.cardinality, lambda: candidates)
+
+    def _counted(self, keys, cardinality, universe):
+        """Subjects matched a number of times within a cardinality - keys has
+        one entry per match, universe() gives every subject for [0..n]"""
+        minimum, maximum = (1, None) if cardinality is None else (cardinality.minimum, cardinality.maximum)
+        subjects, counts = np.unique(keys, return_counts=True)
+        within = counts >= minimum
+        if maximum is not None:
+            within &= counts <= maximum
+        if minimum > 0:
+            return subjects[within]
+        return np.setdiff1d(universe(), subjects[~within], assume_unique=True)
+
+    def _relationships(self, type_positions):
+        """Relationships of attribute types, IS-A included when it is one of them
+
+        Returns:
+            (rows, types, sources, values, groups) - int64 arrays, one entry per relationship
+        """
+        rows = self.index.relationships(type_positions)
+        parts = [(
+            rows,
+            self.arrays['attribute_types'][rows],
+            self.arrays['attribute_sources'][rows],
+            self.arrays['attribute_values'][rows],
+            self.arrays['attribute_groups'][rows],
+        )]
+        if self.is_a >= 0 and self.is_a in set(np.asarray(type_positions).tolist()):
+            offsets = self.arrays['parent_offsets']
+            parents = self.arrays['parent_indices']
+            parts.append((
+                self.attribute_count + np.arange(len(parents)),
+                np.full(len(parents), self.is_a),
+                np.repeat(np.arange(self.size), np.diff(offsets)),
+                parents,
+                np.zeros(len(parents)),
+            ))
+        return tuple(np.concatenate([part[i] for part in parts]).astype(np.int64) for i in range(5))
+
+    def _row_sources(self, rows):
+        """Source concept of attribute rows, IS-A rows included"""
+        is_a = rows >= self.attribute_count
+        sources = np.empty(len(rows), dtype=np.int64)
+        sources[~is_a] = self.arrays['attribute_sources'][rows[~is_a]]
+        parent_slots = rows[is_a] - self.attribute_count
+        sources[is_a] = np.searchsorted(self.arrays['parent_offsets'], parent_slots, side='right') - 1
+        return sources
+
+    def _group_keys(self, rows, sources, groups):
+        """Relationship group key of each row - group 0 relationships each form their own group"""
+        return np.where(groups > 0, sources * GROUP_STRIDE + groups, -1 - rows)
+
+    def _group_sources(self, keys):
+        """Source concept of each group key"""
+        sources = keys // GROUP_STRIDE
+        ungrouped = keys < 0
+        sources[ungrouped] = self._row_sources(-1 - keys[ungrouped])
+        return sources
+
+    def _candidate_groups(self, candidates):
+        """Every relationship group key of the candidates"""
+        rows, owners = csr_slots(self.arrays['attribute_offsets'], candidates)
+        groups = self.arrays['attribute_groups'][rows].astype(np.int64)
+        return _distinct(self._group_keys(rows, candidates[owners], groups))
+
+
+def expand_ecl(index, expression):
+    """Positions (sorted int64) of the concepts matching an expression, active or not
+
+    Args:
+        index: Open TerminologyIndex
+        expression: ECL text or a tree from parse_ecl
+
+    Raises:
+        ECLSyntaxError: The text isn't valid ECL
+        ECLNotSupported: The expression needs data the index doesn't hold
+    """
+    node = parse_ecl(expression) if isinstance(expression, str) else expression
+    return _Evaluator(index).evaluate(node)
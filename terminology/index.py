@@ -0,0 +1,207 @@
+# =============================================================================
+# SNOMED Cluster Manager - Terminology Index
+# =============================================================================
+#
+# A read-only SNOMED CT index held as flat numpy arrays, one .npy file each,
+# opened with mmap: loading maps a handful of files however large the release,
+# and every process opening the same index shares its pages through the OS
+# page cache. Concepts are numbered by their position in the sorted concept ID
+# array. IS-A parents and children, attribute relationships and reference set
+# members are CSR adjacency - offsets per concept into flat arrays of
+# positions - and preferred terms are one UTF-8 blob with offsets. Attribute
+# relationships are also indexed by attribute type, for refinements.
+# terminology/build.py writes the index from RF2 snapshot files.
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from config import TERMINOLOGY_INDEX_ENV_VAR, TERMINOLOGY_INDEX_DIR
+
+
+# Bumped when the arrays change - older indexes must be rebuilt
+FORMAT_VERSION = 3
+
+# Build details and counts, next to the arrays
+MANIFEST = "manifest.json"
+
+# Arrays of an index -> dtype. *_offsets have one entry per concept plus one;
+# a concept's neighbours are *_indices[offsets[i]:offsets[i + 1]]
+ARRAYS = {
+    'concept_ids': np.int64,
+    'active': np.bool_,
+    'parent_offsets': np.int64,
+    'parent_indices': np.int32,
+    'child_offsets': np.int64,
+    'child_indices': np.int32,
+    # Attribute relationships (not IS-A) by source concept
+    'attribute_offsets': np.int64,
+    'attribute_types': np.int32,
+    'attribute_values': np.int32,
+    'attribute_groups': np.int16,
+    'attribute_sources': np.int32,
+    # The same relationships by attribute type - rows into the attribute_* arrays
+    'type_offsets': np.int64,
+    'type_rows': np.int64,
+    # Simple reference set members by reference set concept, and the sorted
+    # positions of the reference sets indexed (other kinds have no members here)
+    'member_offsets': np.int64,
+    'member_indices': np.int32,
+    'refsets': np.int32,
+    'term_offsets': np.int64,
+    'term_bytes': np.uint8,
+}
+
+
+def csr_slots(offsets, positions):
+    """Where several concepts' neighbours are in CSR arrays
+
+    Returns:
+        (slots, owners) - slots index the flat arrays, owners[i] is the index
+        into positions that slots[i] belongs to
+    """
+    positions = np.asarray(positions, dtype=np.int64)
+    starts = np.asarray(offsets[positions])
+    lengths = np.asarray(offsets[positions + 1]) - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    owners = np.repeat(np.arange(len(positions)), lengths)
+    # Each neighbour's slot: its owner's start plus its place within the owner
+    slots = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(total)
+    return slots, owners
+
+
+def search_ids(sorted_ids, ids):
+    """Positions of int64 IDs in a sorted ID array - -1 where absent"""
+    ids = np.asarray(ids, dtype=np.int64)
+    if len(sorted_ids) == 0:
+        return np.full(len(ids), -1, dtype=np.int64)
+    positions = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    return np.where(sorted_ids[positions] == ids, positions, -1)
+
+
+class TerminologyIndex:
+    """Memory-mapped SNOMED CT hierarchy, attributes, reference sets and terms"""
+
+    def __init__(self, arrays, manifest):
+        self.arrays = arrays
+        self.manifest = manifest
+
+    @classmethod
+    def open(cls, path):
+        """Map an index directory written by terminology/build.py"""
+        with open(os.path.join(path, MANIFEST)) as f:
+            manifest = json.load(f)
+        if manifest.get('format_version') != FORMAT_VERSION:
+            raise ValueError(
+                f"Terminology index at {path} has format {manifest.get('format_version')}, "
+                f"expected {FORMAT_VERSION} - rebuild it with terminology/build.py"
+            )
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r') for name in ARRAYS}
+        return cls(arrays, manifest)
+
+    def __len__(self):
+        return len(self.arrays['concept_ids'])
+
+    def positions(self, concept_ids):
+        """Positions of concept IDs (strings or integers) - -1 for unknown IDs"""
+        ids = pd.to_numeric(pd.Series(np.asarray(concept_ids, dtype=object).ravel()), errors='coerce')
+        return search_ids(self.arrays['concept_ids'], ids.fillna(-1).astype(np.int64).to_numpy())
+
+    def concept_ids(self, positions):
+        """Concept IDs (as strings, like the code columns) of positions"""
+        return self.arrays['concept_ids'][np.asarray(positions, dtype=np.int64)].astype(str)
+
+    def is_active(self, positions):
+        """Whether the concepts at positions are active"""
+        return np.asarray(self.arrays['active'][np.asarray(positions, dtype=np.int64)])
+
+    def _neighbours(self, kind, positions):
+        slots, _ = csr_slots(self.arrays[f'{kind}_offsets'], positions)
+        return np.unique(self.arrays[f'{kind}_indices'][slots])
+
+    def parents(self, positions):
+        """Distinct IS-A parents of the concepts at positions"""
+        return self._neighbours('parent', positions)
+
+    def children(self, positions):
+        """Distinct IS-A children of the concepts at positions"""
+        return self._neighbours('child', positions)
+
+    def members(self, refset_positions):
+        """Distinct members of the simple reference sets at positions"""
+        return self._neighbours('member', refset_positions)
+
+    def is_indexed_refset(self, positions):
+        """Whether the concepts at positions are reference sets whose members are indexed"""
+        return np.isin(np.asarray(positions, dtype=np.int64), np.asarray(self.arrays['refsets']))
+
+    def attributes(self, positions):
+        """Attribute relationships of the concepts at positions
+
+        Returns:
+            DataFrame of SOURCE, TYPE, VALUE (positions) and GROUP, one row per relationship
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        slots, owners = csr_slots(self.arrays['attribute_offsets'], positions)
+        return pd.DataFrame({
+            'SOURCE': positions[owners],
+            'TYPE': np.asarray(self.arrays['attribute_types'][slots]),
+            'VALUE': np.asarray(self.arrays['attribute_values'][slots]),
+            'GROUP': np.asarray(self.arrays['attribute_groups'][slots]),
+        })
+
+    def relationships(self, type_positions):
+        """Attribute relationships of the given attribute types
+
+        Returns:
+            Rows into the attribute_* arrays (attribute_sources gives their
+            source concepts), ordered by type then source
+        """
+        slots, _ = csr_slots(self.arrays['type_offsets'], type_positions)
+        return np.asarray(self.arrays['type_rows'][slots])
+
+    def term(self, position):
+        """Preferred term of the concept at a position"""
+        offsets = self.arrays['term_offsets']
+        return bytes(self.arrays['term_bytes'][offsets[position]:offsets[position + 1]]).decode('utf-8')
+
+    def terms(self, positions):
+        """Preferred terms of the concepts at positions, as a list"""
+        positions = np.asarray(positions, dtype=np.int64)
+        if len(positions) == 0:
+            return []
+        offsets = self.arrays['term_offsets']
+        starts, ends = np.asarray(offsets[positions]), np.asarray(offsets[positions + 1])
+        # One read of the blob span covering them all, sliced per term
+        base = int(starts.min())
+        blob = bytes(self.arrays['term_bytes'][base:int(ends.max())])
+        return [blob[start:end].decode('utf-8') for start, end in zip((starts - base).tolist(), (ends - base).tolist())]
+
+    def __repr__(self):
+        return f"TerminologyIndex({len(self):,} concepts, {self.manifest.get('built_at')})"
+
+
+# Open indexes by path, with the manifest modification time they were opened at
+_open_indexes = {}
+
+
+def default_index_path():
+    """Index directory from SNOMED_CLUSTER_TERMINOLOGY_INDEX, else TERMINOLOGY_INDEX_DIR"""
+    return os.environ.get(TERMINOLOGY_INDEX_ENV_VAR, TERMINOLOGY_INDEX_DIR)
+
+
+def load_index(path=None):
+    """Open an index once per process, reopening it after a rebuild - None if there isn't one"""
+    path = os.path.abspath(path or default_index_path())
+    try:
+        modified = os.path.getmtime(os.path.join(path, MANIFEST))
+    except OSError:
+        return None
+    opened = _open_indexes.get(path)
+    if opened is None or opened[0] != modified:
+        opened = (modified, TerminologyIndex.open(path))
+        _open_indexes[path] = opened
+    return opened[1]
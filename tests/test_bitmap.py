@@ -0,0 +1,59 @@
+# =============================================================================
+# SNOMED Cluster Manager - Compressed Bitmap Tests
+# =============================================================================
+
+import numpy as np
+import pytest
+from utils.bitmap import ARRAY_MAX, Bitmap, _is_words
+
+
+def _values(seed):
+    """Values over a few chunks - some sparse (array containers), some dense (word containers)"""
+    rng = np.random.default_rng(seed)
+    return np.concatenate([
+        rng.choice(1 << 16, size=rng.integers(1, 200), replace=False),
+        (1 << 16) + rng.choice(1 << 16, size=ARRAY_MAX + rng.integers(1, 20000), replace=False),
+        (2 << 16) + rng.choice(1 << 16, size=rng.integers(ARRAY_MAX - 500, ARRAY_MAX + 500), replace=False),
+        (rng.integers(3, 6) << 16) + rng.choice(1 << 16, size=50, replace=False),
+        [(1 << 32) - 1],
+    ]).astype(np.uint32)
+
+
+def test_containers():
+    bitmap = Bitmap.from_values(_values(0))
+    assert not _is_words(bitmap._containers[0])
+    assert _is_words(bitmap._containers[1])
+    assert not _is_words(bitmap._containers[0xFFFF])
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_operations_match_sets(seed):
+    a_values, b_values = _values(seed), _values(seed + 100)
+    a, b = Bitmap.from_values(a_values), Bitmap.from_values(b_values)
+    assert np.array_equal(a.to_array(), np.unique(a_values))
+    assert len(a) == len(np.unique(a_values))
+    assert np.array_equal((a & b).to_array(), np.intersect1d(a_values, b_values))
+    assert np.array_equal((a | b).to_array(), np.union1d(a_values, b_values))
+    assert np.array_equal((a - b).to_array(), np.setdiff1d(a_values, b_values))
+    assert np.array_equal((b - a).to_array(), np.setdiff1d(b_values, a_values))
+
+
+def test_dense_results_shrink_to_arrays():
+    dense = Bitmap.from_values(np.arange(10000))
+    sparse = Bitmap.from_values(np.arange(0, 10000, 7))
+    assert _is_words(dense._containers[0])
+    overlap = dense & sparse
+    assert not _is_words(overlap._containers[0])
+    assert np.array_equal(overlap.to_array(), np.arange(0, 10000, 7))
+    # Words minus most of themselves compacts back to an array
+    rest = dense - Bitmap.from_values(np.arange(100, 10000))
+    assert not _is_words(rest._containers[0]) and len(rest) == 100
+
+
+def test_empty():
+    empty = Bitmap.from_values([])
+    other = Bitmap.from_values([1, 2, 3])
+    assert not empty and len(empty) == 0 and empty.to_array().dtype == np.uint32
+    assert not (empty & other) and not (other - other)
+    assert np.array_equal((empty | other).to_array(), [1, 2, 3])
+    assert not (other & Bitmap.from_values([1 << 20]))
@@ -0,0 +1,124 @@
+# =============================================================================
+# SNOMED Cluster Manager - ECL Parser Tests
+# =============================================================================
+
+import pytest
+from terminology.ecl import (
+    Attribute, AttributeGroup, Cardinality, CompoundExpression, ConceptReference, ConcreteValue,
+    DottedExpression, ECLSyntaxError, HistorySupplement, RefinedExpression, SubExpression, Wildcard,
+    canonical_ecl, parse_ecl, to_ecl
+)
+
+# One expression per construct the parser covers
+EXPRESSIONS = [
+    "404684003 |Clinical finding|",
+    "<< 404684003", "< 404684003", "<! 404684003", "<<! 404684003",
+    ">> 404684003", "> 404684003", ">! 404684003", ">>! 404684003",
+    "!!> (< 404684003)", "!!< (< 404684003)",
+    "descendantOrSelfOf 404684003",
+    "*",
+    "^ 700043003 |Example problem list concepts reference set|",
+    "^ [referencedComponentId, mapTarget] 447562003",
+    "<< 19829001 OR << 301867009",
+    "<< 19829001 AND << 301867009, < 1",
+    "(<< 19829001 OR < 2) MINUS << 301867009",
+    "< 19829001 : 116676008 |Associated morphology| = << 79654002 |Edema|",
+    "< 404684003 : { 363698007 = << 39057004, 116676008 = << 415582006 }, { 363698007 = << 53085002 }",
+    "< 404684003 : [1..3] { 363698007 = << 39057004 } OR [0..0] 116676008 = *",
+    "< 404684003 : (363698007 = << 1 OR 116676008 = << 2) AND 3 = 4",
+    "< 404684003 : (<< 363698007 OR << 116676008) = << 1",
+    "< 91723000 : R 363698007 = << 125605004",
+    "<< 373873005 . 127489000 . < 1",
+    "* : << 47429007 = << 267038008",
+    "< 27658006 : 1142135004 >= #5.5, 1142136003 = #-2",
+    '< 27658006 : 1142135004 = "a \\"quoted\\" value"',
+    "< 27658006 : 1142135004 = true",
+    "LOINC#54486-6",
+    '< 64572001 {{ term = "heart att" }}',
+    '< 64572001 {{ D term = match:"heart", language = en, type = syn, dialect = en-gb (prefer) }}',
+    '< 64572001 {{ term = ("heart" wild:"card*") }} {{ C active = 1, moduleId = (900000000000207008 < 1) }}',
+    "<< 195967001 {{ +HISTORY-MAX }}",
+    "<< 195967001 {{ +HISTORY (<< 900000000000527005) }}",
+    "<< 1 /* a comment */ OR << 2",
+]
+
+
+@pytest.mark.parametrize("text", EXPRESSIONS)
+def test_round_trip(text):
+    """Writing a tree back out parses to the same tree, and the canonical form is stable"""
+    tree = parse_ecl(text)
+    assert parse_ecl(to_ecl(tree)) == tree
+    canonical = canonical_ecl(text)
+    assert canonical_ecl(canonical) == canonical
+
+
+def test_tree_shapes():
+    tree = parse_ecl("< 19829001 |Disorder of lung| : [1..*] R 116676008 = << 79654002")
+    assert isinstance(tree, RefinedExpression)
+    assert tree.expression == SubExpression(ConceptReference("19829001"), "<")
+    attribute = tree.refinement
+    assert isinstance(attribute, Attribute)
+    assert attribute.reverse and attribute.cardinality == Cardinality(1, None)
+    assert attribute.value == SubExpression(ConceptReference("79654002"), "<<")
+
+    group = parse_ecl("* : [0..1] { 1 = #5 }").refinement
+    assert isinstance(group, AttributeGroup) and group.cardinality == Cardinality(0, 1)
+    assert group.refinement.value == ConcreteValue("number", "5")
+
+    assert isinstance(parse_ecl("1 . 2"), DottedExpression)
+    assert parse_ecl("*").focus == Wildcard()
+    assert parse_ecl("1 {{ +HISTORY-MIN }}").history == HistorySupplement("MIN")
+    compound = parse_ecl("1 OR 2 OR 3")
+    assert isinstance(compound, CompoundExpression) and len(compound.operands) == 3
+
+
+def test_terms_and_spans_ignored_in_equality():
+    assert parse_ecl("<< 1 |One|") == parse_ecl("descendantOrSelfOf   1")
+    tree = parse_ecl("< 19829001 |Disorder of lung| : 116676008 = << 79654002")
+    assert tree.span == (0, 55)
+    assert tree.refinement.value.span == (44, 55)
+    assert tree.expression.focus.term == "Disorder of lung"
+
+
+@pytest.mark.parametrize("left, right", [
+    ("<< 2 OR (<< 1 OR << 2)", "<<1 OR <<2"),
+    ("<<1 , <<2", "<< 2 and << 1"),
+    ("(<<3 OR <<2) AND (<<2 OR <<3)", "<< 2 OR << 3"),
+    ("<< (1)", "<< 1"),
+    ("* : { 2 = 3, 1 = 4 }", "* : { 1 = 4 AND 2 = 3 }"),
+])
+def test_canonical_equivalents(left, right):
+    assert canonical_ecl(left) == canonical_ecl(right)
+
+
+def test_canonical_form():
+    assert canonical_ecl("descendantOrSelfOf 404684003 |Clinical finding|") == "<< 404684003"
+    assert canonical_ecl("(<< 1 and << 2) minus (<<3 or <<4)") == "(<< 1 AND << 2) MINUS (<< 3 OR << 4)"
+    # Parentheses that carry filters are kept
+    assert canonical_ecl("(<< 1 OR << 2) {{ C active = 1 }} OR (<< 2 OR << 1) {{ C active = 1 }}") == \
+        "(<< 1 OR << 2) {{ C active = 1 }}"
+    # MINUS is not commutative
+    assert canonical_ecl("<< 1 MINUS << 2") != canonical_ecl("<< 2 MINUS << 1")
+
+
+@pytest.mark.parametrize("text, message, column", [
+    ("<< 1 AND << 2 OR << 3", "combine AND with OR", 15),
+    ("<< 1 MINUS << 2 MINUS << 3", "chain MINUS", 17),
+    ("<< ", "Expected a concept ID", 4),
+    ("<< 1 : 2 =", "Expected a concept ID", 11),
+    ("<< 1 : [3..1] 2 = 3", "below its minimum", 8),
+    ("<< 1 {{ +HISTORY-X }}", "HISTORY-MIN", 10),
+    ("<< 1 )", "end of the expression", 6),
+    ("<< 1 ; 2", "Unexpected character", 6),
+    ("", "Expected an expression constraint", 1),
+])
+def test_syntax_errors(text, message, column):
+    with pytest.raises(ECLSyntaxError) as error:
+        parse_ecl(text)
+    assert message in str(error.value)
+    assert f"column {column})" in str(error.value)
+
+
+def test_syntax_error_line():
+    with pytest.raises(ECLSyntaxError, match=r"line 2, column 7"):
+        parse_ecl("<< 1\n  AND @")
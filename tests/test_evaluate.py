@@ -0,0 +1,182 @@
+# =============================================================================
+# SNOMED Cluster Manager - Local ECL Evaluation Tests
+# =============================================================================
+#
+# A hand-built release, indexed with build_index:
+#
+#       1               6 (inactive, child of 1)
+#       |
+#       2
+#      / \
+#     3   4
+#      \ /
+#       5
+#
+# Attributes (source -type-> value, group):
+#   3 -100-> 4 (1)   3 -101-> 5 (1)   5 -100-> 4 (1)   5 -101-> 2 (2)
+#   4 -100-> 2 (0)   4 -100-> 3 (0)
+# Simple reference set 8 has members 3 and 5.
+
+import numpy as np
+import pandas as pd
+import pytest
+from terminology.build import FSN, INFERRED, IS_A, build_index
+from terminology.evaluate import ECLNotSupported, expand_ecl
+
+CONCEPTS = [1, 2, 3, 4, 5, 6, 8, 100, 101, IS_A]
+INACTIVE = [6]
+RELATIONSHIPS = [
+    (2, 1, IS_A, 0), (3, 2, IS_A, 0), (4, 2, IS_A, 0), (5, 3, IS_A, 0), (5, 4, IS_A, 0), (6, 1, IS_A, 0),
+    (3, 4, 100, 1), (3, 5, 101, 1), (5, 4, 100, 1), (5, 2, 101, 2), (4, 2, 100, 0), (4, 3, 100, 0),
+]
+MEMBERS = {8: [3, 5]}
+
+
+@pytest.fixture(scope='module')
+def index(tmp_path_factory):
+    concepts = pd.DataFrame({'id': CONCEPTS, 'active': [c not in INACTIVE for c in CONCEPTS]})
+    relationships = pd.DataFrame([
+        {'active': True, 'sourceId': source, 'destinationId': value, 'typeId': type_id,
+         'relationshipGroup': group, 'characteristicTypeId': INFERRED}
+        for source, value, type_id, group in RELATIONSHIPS
+    ])
+    descriptions = pd.DataFrame({
+        'id': range(len(CONCEPTS)), 'active': True, 'conceptId': CONCEPTS,
+        'typeId': FSN, 'term': [f"Concept {c}" for c in CONCEPTS],
+    })
+    language = pd.DataFrame({
+        'active': pd.Series(dtype=bool), 'refsetId': pd.Series(dtype=np.int64),
+        'referencedComponentId': pd.Series(dtype=np.int64), 'acceptabilityId': pd.Series(dtype=np.int64),
+    })
+    members = pd.DataFrame([
+        {'active': True, 'refsetId': refset, 'referencedComponentId': member}
+        for refset, ids in MEMBERS.items() for member in ids
+    ])
+    return build_index(tmp_path_factory.mktemp('index'), concepts, relationships, descriptions, language, members)
+
+
+def expand(index, expression):
+    positions = expand_ecl(index, expression)
+    assert np.all(np.diff(positions) > 0), "results are sorted and distinct"
+    return {int(concept_id) for concept_id in index.concept_ids(positions)}
+
+
+@pytest.mark.parametrize("expression, expected", [
+    ("2", {2}),
+    ("<< 2", {2, 3, 4, 5}),
+    ("< 2", {3, 4, 5}),
+    ("<! 2", {3, 4}),
+    ("<<! 2", {2, 3, 4}),
+    ("> 5", {1, 2, 3, 4}),
+    (">> 5", {1, 2, 3, 4, 5}),
+    (">! 5", {3, 4}),
+    (">>! 5", {3, 4, 5}),
+    ("!!> (<< 2)", {2}),
+    ("!!< (<< 2)", {5}),
+    ("!!< (< 1)", {5, 6}),
+    ("<< 3 OR << 4", {3, 4, 5}),
+    ("<< 3 AND << 4", {5}),
+    ("<< 2 MINUS << 3", {2, 4}),
+    ("(<< 2 MINUS << 3) OR 6", {2, 4, 6}),
+    ("<< 1 {{ C active = 0 }}", {6}),
+    ("<< 1 {{ C active = true }}", {1, 2, 3, 4, 5}),
+    ("<< 1 {{ C active != 1 }}", {6}),
+])
+def test_constraint_operators(index, expression, expected):
+    assert expand(index, expression) == expected
+
+
+def test_wildcard(index):
+    assert expand(index, "*") == set(CONCEPTS)
+    assert expand(index, "<< *") == set(CONCEPTS)
+    # Everything with a parent
+    assert expand(index, "< *") == {2, 3, 4, 5, 6}
+
+
+def test_member_of(index):
+    assert expand(index, "^ 8") == {3, 5}
+    assert expand(index, "< (^ 8)") == {5}
+
+
+@pytest.mark.parametrize("expression, expected", [
+    ("* : 100 = *", {3, 4, 5}),
+    ("* : 100 = 4", {3, 5}),
+    ("* : 100 = << 3", {4}),
+    ("* : 100 != 4", {4}),
+    ("* : (100 OR 101) = 2", {4, 5}),
+    ("<< 3 : 101 = *", {3, 5}),
+    ("* : 100 = 4, 101 = 2", {5}),
+    ("* : 100 = 4 OR 101 = 2", {3, 5}),
+])
+def test_attributes(index, expression, expected):
+    assert expand(index, expression) == expected
+
+
+@pytest.mark.parametrize("expression, expected", [
+    ("* : [2..2] 100 = *", {4}),
+    ("* : [1..1] 100 = *", {3, 5}),
+    ("<< 2 : [0..1] 100 = *", {2, 3, 5}),
+    ("<< 1 : [0..0] 101 = *", {1, 2, 4, 6}),
+    ("* : [2..*] 100 = << 2", {4}),
+])
+def test_cardinality(index, expression, expected):
+    assert expand(index, expression) == expected
+
+
+@pytest.mark.parametrize("expression, expected", [
+    ("* : { 100 = 4, 101 = 5 }", {3}),
+    ("* : { 100 = 4, 101 = 2 }", set()),
+    ("* : { 100 = 4 }, { 101 = 2 }", {5}),
+    ("* : { 100 = 2, 100 = 3 }", set()),
+    # Group 0 relationships are each their own group
+    ("* : [2..*] { 100 = * }", {4}),
+    ("* : [1..1] { 100 = * }", {3, 5}),
+    ("<< 2 : [0..0] { 101 = * }", {2, 4}),
+    ("* : { [2..2] 100 = * }", set()),
+    ("* : { 100 = 4 OR 101 = 2 }", {3, 5}),
+])
+def test_groups(index, expression, expected):
+    assert expand(index, expression) == expected
+
+
+@pytest.mark.parametrize("expression, expected", [
+    ("* : R 100 = 3", {4}),
+    ("* : R 100 = *", {2, 3, 4}),
+    ("<< 3 : R 101 = *", {5}),
+    ("3 . 100", {4}),
+    ("<< 3 . 101", {2, 5}),
+    ("<< 3 . 101 . 100", {4}),
+    ("(<< 3 . 101) AND < 1", {2, 5}),
+])
+def test_reverse_and_dotted(index, expression, expected):
+    assert expand(index, expression) == expected
+
+
+@pytest.mark.parametrize("expression, expected", [
+    (f"< 1 : {IS_A} = 2", {3, 4}),
+    (f"* : R {IS_A} = 5", {3, 4}),
+    (f"<< 5 . {IS_A}", {3, 4}),
+    (f"* : [2..2] {IS_A} = *", {5}),
+    (f"* : {IS_A} = 3, 100 = 4", {5}),
+    # IS-A relationships are ungrouped, so never share a group with an attribute
+    (f"* : {{ {IS_A} = 3, 100 = 4 }}", set()),
+])
+def test_is_a_as_attribute(index, expression, expected):
+    assert expand(index, expression) == expected
+
+
+@pytest.mark.parametrize("expression", [
+    "^ 3",
+    "^ *",
+    "<< 999",
+    "^ [referencedComponentId] 8",
+    '<< 1 {{ term = "heart" }}',
+    "<< 1 {{ C moduleId = 1 }}",
+    "<< 1 {{ +HISTORY-MAX }}",
+    "* : 100 = #5",
+    "* : { R 100 = * }",
+    "LOINC#54486-6",
+])
+def test_not_supported(index, expression):
+    with pytest.raises(ECLNotSupported):
+        expand_ecl(index, expression)
@@ -0,0 +1,56 @@
+# =============================================================================
+# SNOMED Cluster Manager - HyperLogLog Tests
+# =============================================================================
+
+import json
+
+import numpy as np
+import pytest
+from utils.hll import PRECISION, RELATIVE_ERROR, HyperLogLog, error_bound, merge_sketches
+
+
+@pytest.mark.parametrize("count", [10, 1000, 100000])
+def test_estimate_within_error(count):
+    estimate = HyperLogLog.from_values(range(count)).estimate()
+    # Well within four standard errors, plus a little slack for the smallest counts
+    assert abs(estimate - count) <= 4 * RELATIVE_ERROR * count + 1
+
+
+def test_duplicates_and_nulls_ignored():
+    values = [f"patient-{i}" for i in range(500)]
+    once = HyperLogLog.from_values(values)
+    twice = HyperLogLog.from_values(values + values + [None, float('nan')])
+    assert np.array_equal(once.registers, twice.registers)
+
+
+def test_merge_is_union():
+    a = HyperLogLog.from_values(range(0, 6000))
+    b = HyperLogLog.from_values(range(4000, 10000))
+    both = HyperLogLog.from_values(range(10000))
+    assert np.array_equal((a | b).registers, both.registers)
+    assert np.array_equal(merge_sketches([a, b]).registers, both.registers)
+    assert merge_sketches([]).estimate() == 0
+
+
+def test_merge_precision_mismatch():
+    with pytest.raises(ValueError):
+        HyperLogLog.empty() | HyperLogLog.empty(precision=10)
+
+
+def test_from_export():
+    sketch = HyperLogLog.from_values(range(300))
+    dense = {'version': 4, 'precision': PRECISION, 'dense': sketch.registers.tolist()}
+    indices = np.flatnonzero(sketch.registers)
+    sparse = {'version': 4, 'precision': PRECISION, 'sparse': {
+        'indices': indices.tolist(), 'maxLzCounts': sketch.registers[indices].tolist(),
+    }}
+    assert np.array_equal(HyperLogLog.from_export(json.dumps(dense)).registers, sketch.registers)
+    assert np.array_equal(HyperLogLog.from_export(sparse).registers, sketch.registers)
+    # The local backend's stand-in sketches are value lists
+    assert np.array_equal(HyperLogLog.from_export(list(range(300))).registers, sketch.registers)
+    assert HyperLogLog.from_export(None).estimate() == 0
+
+
+def test_error_bound():
+    assert error_bound(0) == 0
+    assert error_bound(1000, z=1) == pytest.approx(1000 * RELATIVE_ERROR)
@@ -0,0 +1,77 @@
+# =============================================================================
+# SNOMED Cluster Manager - Code-Set Overlap Tests
+# =============================================================================
+
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+import services.overlap_service as overlap
+from services.overlap_service import OverlapIndex
+
+CLUSTERS = {
+    'A': {'1', '2', '3', '4'},
+    'B': {'1', '2'},          # subset of A
+    'C': {'3', '4', '5', '6'},
+    'D': {'2', '1'},          # identical to B
+    'E': {'9'},               # shares nothing
+}
+
+
+def _frame(clusters, repeat=()):
+    rows = [(cluster_id, code) for cluster_id, codes in clusters.items() for code in sorted(codes)]
+    return pd.DataFrame(rows + list(repeat), columns=['CLUSTER_ID', 'CODE'])
+
+
+def _expected(clusters):
+    """Every overlapping pair, both ways, from Python sets"""
+    pairs = {}
+    for left, right in itertools.permutations(clusters, 2):
+        a, b = clusters[left], clusters[right]
+        if a & b:
+            relation = ('identical' if a == b else 'subset' if a <= b else 'superset' if a >= b else 'overlap')
+            pairs[(left, right)] = (len(a & b), len(a & b) / len(a | b), relation)
+    return pairs
+
+
+def _assert_pairs(index, expected):
+    pairs = index._frame(index.left, index.right, index.shared)
+    actual = {
+        (row.CLUSTER_ID, row.OTHER_CLUSTER_ID): (row.SHARED_CODES, row.JACCARD, row.RELATION)
+        for row in pairs.itertuples()
+    }
+    assert actual.keys() == expected.keys()
+    for pair, (shared, jaccard, relation) in expected.items():
+        assert (actual[pair][0], actual[pair][2]) == (shared, relation), pair
+        assert actual[pair][1] == pytest.approx(jaccard), pair
+
+
+@pytest.mark.parametrize("dense_max, chunk", [(4000, 5_000_000), (0, 5_000_000), (0, 1)])
+def test_shared_counts_jaccard_and_relations(monkeypatch, dense_max, chunk):
+    """The dense matrix and the chunked sort-and-merge paths agree with set arithmetic"""
+    monkeypatch.setattr(overlap, 'DENSE_MAX_CLUSTERS', dense_max)
+    monkeypatch.setattr(overlap, 'PAIR_CHUNK_SIZE', chunk)
+    # A repeated row counts once
+    index = OverlapIndex(_frame(CLUSTERS, repeat=[('A', '1')]))
+    assert dict(zip(index.cluster_ids, index.sizes)) == {k: len(v) for k, v in CLUSTERS.items()}
+    _assert_pairs(index, _expected(CLUSTERS))
+
+
+def test_random_code_sets():
+    rng = np.random.default_rng(0)
+    clusters = {f"C{i}": {str(c) for c in rng.choice(60, size=rng.integers(1, 25), replace=False)} for i in range(30)}
+    _assert_pairs(OverlapIndex(_frame(clusters)), _expected(clusters))
+
+
+def test_similar_to_and_pairs():
+    index = OverlapIndex(_frame(CLUSTERS))
+    similar = index.similar_to('b', min_jaccard=0.9)
+    # Containment is reported whatever the overlap
+    assert similar[['OTHER_CLUSTER_ID', 'RELATION']].values.tolist() == [['D', 'identical'], ['A', 'subset']]
+    assert index.similar_to('E').empty
+    assert index.similar_to('MISSING').empty
+
+    pairs = index.pairs(min_jaccard=0.3)
+    assert pairs[['CLUSTER_ID', 'OTHER_CLUSTER_ID']].values.tolist() == [['B', 'D'], ['A', 'B'], ['A', 'D'], ['A', 'C']]
+    assert pairs['JACCARD'].tolist() == pytest.approx([1, 0.5, 0.5, 2 / 6])
@@ -0,0 +1,121 @@
+# =============================================================================
+# SNOMED Cluster Manager - Usage Cube Tests
+# =============================================================================
+#
+# Runs jobs/usage_cube.py against a small synthetic dataset on the local
+# backend, whose stand-in sketches are exact, so cube counts must equal the
+# counts from the event tables.
+
+import os
+
+import pandas as pd
+import pytest
+from config import BACKEND_ENV_VAR, LOCAL_DATA_ENV_VAR, DB_STORE
+from database import execute_statement, fetch_pandas, get_connection
+from jobs.usage_cube import update_usage_cubes
+from local_backend.generate import generate
+from services.cube_service import compile_cube_query, get_cube_clusters, get_events_through
+from services.metric_service import compile_metrics_query, split_breakdowns
+
+CLUSTER = 'SYNTHETIC_OBS_000'
+BREAKDOWNS = (('TOTAL', ()), ('CODE', ('CODE', 'DISPLAY')), ('MONTH', ('MONTH',)))
+METRICS = ('PERSON_COUNT', 'ACTIVE_PERSON_COUNT', 'EVENT_COUNT')
+OBSERVATION = f"{DB_STORE}.observation"
+
+
+@pytest.fixture(scope='module')
+def local_backend(tmp_path_factory):
+    data_dir = str(tmp_path_factory.mktemp('local_data'))
+    generate(data_dir, scale=0.02)
+    saved = {name: os.environ.get(name) for name in (BACKEND_ENV_VAR, LOCAL_DATA_ENV_VAR)}
+    os.environ[BACKEND_ENV_VAR] = 'local'
+    os.environ[LOCAL_DATA_ENV_VAR] = data_dir
+    get_connection.clear()
+    # Everything was ingested before yesterday, so new rows land after the watermark
+    execute_statement(f"""
+        UPDATE {OBSERVATION}
+        SET lds_start_date_time = LEAST(lds_start_date_time, CURRENT_TIMESTAMP() - INTERVAL 1 DAY)
+        """)
+    yield
+    get_connection.clear()
+    for name, value in saved.items():
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
+
+
+def _frames(query, params):
+    """Metrics of a compiled query, rows in a fixed order"""
+    frames = {}
+    for label, frame in split_breakdowns(fetch_pandas(query, params), BREAKDOWNS, METRICS).items():
+        if 'MONTH' in frame:
+            frame['MONTH'] = pd.to_datetime(frame['MONTH'])
+        dims = [column for column in frame.columns if column not in METRICS]
+        frames[label] = frame.sort_values(dims).reset_index(drop=True) if dims else frame
+    return frames
+
+
+def _cube_metrics():
+    return _frames(*compile_cube_query(CLUSTER, 'OBSERVATION', BREAKDOWNS, METRICS))
+
+
+def _exact_metrics():
+    return _frames(*compile_metrics_query(CLUSTER, 'OBSERVATION', BREAKDOWNS, METRICS))
+
+
+def _assert_cube_exact():
+    cube, exact = _cube_metrics(), _exact_metrics()
+    assert not cube['TOTAL'].empty, "the cube is current"
+    for label, frame in exact.items():
+        pd.testing.assert_frame_equal(cube[label], frame, check_dtype=False)
+
+
+def _old_events(count):
+    """IDs of the cluster's events from over a year ago"""
+    return fetch_pandas(f"""
+        SELECT DISTINCT e.id AS ID
+        FROM {OBSERVATION} e
+        JOIN DATA_LAKE__NCL.TERMINOLOGY.ECL_CACHE ec ON e.mapped_concept_code = ec.code
+        WHERE ec.cluster_id = ? AND e.clinical_effective_date < CURRENT_DATE() - INTERVAL 400 DAY
+        ORDER BY e.id
+        LIMIT ?
+        """, [CLUSTER, count])['ID'].tolist()
+
+
+def test_incremental_update_matches_exact_counts(local_backend):
+    assert update_usage_cubes([CLUSTER], log=lambda message: None) == []
+    _assert_cube_exact()
+    first_through = get_cube_clusters().set_index('CLUSTER_ID').loc[CLUSTER, 'EVENTS_THROUGH']
+
+    # Ingested two hours ago: a new old-dated event, a row ingested again
+    # unchanged, and a row corrected to another person
+    ingested = "CURRENT_TIMESTAMP() - INTERVAL 2 HOUR"
+    new_id, reingested, corrected = _old_events(3)
+    execute_statement(f"""
+        INSERT INTO {OBSERVATION} (id, person_id, mapped_concept_code, clinical_effective_date, lds_start_date_time)
+        SELECT 10 * (SELECT MAX(id) FROM {OBSERVATION}), person_id + 1, mapped_concept_code,
+            clinical_effective_date - INTERVAL 31 DAY, {ingested}
+        FROM {OBSERVATION} WHERE id = ?
+        """, [new_id])
+    execute_statement(f"UPDATE {OBSERVATION} SET lds_start_date_time = {ingested} WHERE id = ?", [reingested])
+    execute_statement(f"""
+        UPDATE {OBSERVATION} SET person_id = person_id + 1, lds_start_date_time = {ingested} WHERE id = ?
+        """, [corrected])
+
+    # Behind the event table, the cube is no longer read
+    assert _cube_metrics()['TOTAL'].empty
+
+    assert update_usage_cubes([CLUSTER], log=lambda message: None) == []
+    assert get_cube_clusters().set_index('CLUSTER_ID').loc[CLUSTER, 'EVENTS_THROUGH'] > first_through
+    _assert_cube_exact()
+
+
+def test_watermark_ignores_future_ingest_times(local_backend):
+    through = get_events_through('OBSERVATION')
+    execute_statement(f"""
+        INSERT INTO {OBSERVATION} (id, person_id, mapped_concept_code, clinical_effective_date, lds_start_date_time)
+        SELECT MAX(id) + 1, 1, '0', CURRENT_DATE(), CURRENT_TIMESTAMP() + INTERVAL 7 DAY
+        FROM {OBSERVATION}
+        """)
+    assert get_events_through('OBSERVATION') == through
@@ -0,0 +1,155 @@
+# =============================================================================
+# SNOMED Cluster Manager - Compressed Bitmaps
+# =============================================================================
+#
+# A roaring-style bitmap of 32-bit integers in numpy. Values are split into
+# chunks of 65,536 by their high 16 bits; a chunk holding up to ARRAY_MAX
+# values keeps them as a sorted uint16 array, a denser one as 1,024 uint64
+# words. Sparse cohorts stay small, dense ones cost 8KB per chunk, and set
+# operations work a chunk at a time with numpy rather than per value.
+
+import numpy as np
+
+
+# Values per chunk above which a chunk is stored as bit words
+ARRAY_MAX = 4096
+
+# uint64 words per word container (65,536 bits)
+CONTAINER_WORDS = 1024
+
+# Set bits per byte value
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def _is_words(container):
+    return container.dtype == np.uint64
+
+
+def _cardinality(container):
+    if _is_words(container):
+        return int(_POPCOUNT[container.view(np.uint8)].sum(dtype=np.int64))
+    return len(container)
+
+
+def _to_words(values):
+    """Word container of a uint16 array container"""
+    bits = np.zeros(CONTAINER_WORDS * 64, dtype=bool)
+    bits[values] = True
+    return np.packbits(bits, bitorder='little').view(np.uint64)
+
+
+def _to_values(words):
+    """Sorted uint16 values of a word container"""
+    return np.flatnonzero(np.unpackbits(words.view(np.uint8), bitorder='little')).astype(np.uint16)
+
+
+def _contains(words, values):
+    """Which of the values are set in a word container"""
+    values = values.astype(np.uint64)
+    return ((words[values >> np.uint64(6)] >> (values & np.uint64(63))) & np.uint64(1)).astype(bool)
+
+
+def _compact(container):
+    """Container in its smaller form, or None if empty"""
+    count = _cardinality(container)
+    if count == 0:
+        return None
+    if _is_words(container) and count <= ARRAY_MAX:
+        return _to_values(container)
+    if not _is_words(container) and count > ARRAY_MAX:
+        return _to_words(container)
+    return container
+
+
+def _and(a, b):
+    if _is_words(a) and _is_words(b):
+        return a & b
+    if _is_words(a):
+        return b[_contains(a, b)]
+    if _is_words(b):
+        return a[_contains(b, a)]
+    return np.intersect1d(a, b, assume_unique=True)
+
+
+def _or(a, b):
+    if not _is_words(a) and not _is_words(b):
+        return np.union1d(a, b)
+    a = a if _is_words(a) else _to_words(a)
+    b = b if _is_words(b) else _to_words(b)
+    return a | b
+
+
+def _and_not(a, b):
+    if _is_words(a):
+        return a & ~(b if _is_words(b) else _to_words(b))
+    if _is_words(b):
+        return a[~_contains(b, a)]
+    return np.setdiff1d(a, b, assume_unique=True)
+
+
+class Bitmap:
+    """Immutable compressed set of non-negative 32-bit integers
+
+    Supports len(), &, | and - like a set, with results as new bitmaps.
+    """
+
+    __slots__ = ('_containers',)
+
+    def __init__(self, containers=None):
+        # High 16 bits -> container, in key order
+        self._containers = containers or {}
+
+    @classmethod
+    def from_values(cls, values):
+        """Bitmap of an iterable or array of integers in [0, 2**32)"""
+        values = np.unique(np.asarray(values, dtype=np.uint32))
+        if values.size == 0:
+            return cls()
+        keys, starts = np.unique(values >> 16, return_index=True)
+        lows = np.split((values & 0xFFFF).astype(np.uint16), starts[1:])
+        return cls({int(key): _compact(low) for key, low in zip(keys, lows)})
+
+    def _combine(self, other, operation, keys):
+        containers = {}
+        for key in keys:
+            a, b = self._containers.get(key), other._containers.get(key)
+            if a is None or b is None:
+                result = a if b is None else (b if operation is _or else None)
+            else:
+                result = _compact(operation(a, b))
+            if result is not None:
+                containers[key] = result
+        return Bitmap(containers)
+
+    def __and__(self, other):
+        return self._combine(other, _and, [k for k in self._containers if k in other._containers])
+
+    def __or__(self, other):
+        return self._combine(other, _or, sorted(self._containers.keys() | other._containers.keys()))
+
+    def __sub__(self, other):
+        return self._combine(other, _and_not, list(self._containers))
+
+    def __len__(self):
+        return sum(_cardinality(container) for container in self._containers.values())
+
+    def __bool__(self):
+        return bool(self._containers)
+
+    def to_array(self):
+        """Sorted uint32 array of the values"""
+        if not self._containers:
+            return np.empty(0, dtype=np.uint32)
+        return np.concatenate([
+            (np.uint32(key) << np.uint32(16))
+            | (_to_values(container) if _is_words(container) else container).astype(np.uint32)
+            for key, container in self._containers.items()
+        ])
+
+    @property
+    def nbytes(self):
+        """Bytes held by the containers"""
+        return sum(container.nbytes for container in self._containers.values())
+
+    def __repr__(self):
+        return f"Bitmap({len(self):,} values, {self.nbytes:,} bytes)"
@@ -6,6 +6,7 @@ import pandas as pd
 import re
 from datetime import datetime, timedelta
 from config import STATUS_EMOJI, STALE_LABEL
+from utils.hll import error_bound
 
 
 def format_time_ago(timestamp):
@@ -96,6 +97,36 @@ def format_number(num):
         return str(num)
 
 
+def format_count(count, estimated=False, provisional=False):
+    """Format a count, with its 95% error bound if it is an estimate (e.g. '12,345 ±396')
+
+    Provisional counts (scaled up from a sample) are rounded to three
+    significant figures and marked with '~' (e.g. '~12,300').
+    """
+    if provisional:
+        return f"~{float(f'{count:.3g}'):,.0f}"
+    if not estimated:
+        return f"{int(count):,}"
+    return f"{int(count):,} ±{error_bound(count):,.0f}"
+
+
+def format_sparkline(values):
+    """Render a sequence of counts as a text sparkline (e.g. '▁▂▄▇')"""
+    bars = "▁▂▃▄▅▆▇█"
+    values = list(values)
+    if not values:
+        return ""
+    peak = max(values)
+    if peak <= 0:
+        return bars[0] * len(values)
+    return "".join(bars[round(v / peak * (len(bars) - 1))] for v in values)
+
+
+def canonical_cluster_id(cluster_id) -> str:
+    """Canonical form of a cluster ID (trimmed, uppercase)"""
+    return str(cluster_id or "").strip().upper()
+
+
 def normalize_whitespace(text: str) -> str:
     """Normalize whitespace in text for comparison"""
     return re.sub(r'\s+', ' ', text.strip())
@@ -0,0 +1,106 @@
+# =============================================================================
+# SNOMED Cluster Manager - HyperLogLog Sketches
+# =============================================================================
+#
+# Mergeable distinct-count state. Snowflake's HLL_EXPORT objects (dense or
+# sparse registers) are read into numpy registers, merged with an element-wise
+# max and estimated locally, so sketches fetched at a fine grain (e.g. per
+# practice) can be rolled up to any coarser grain without another query.
+# The local backend's stand-in sketches are lists of values; those are hashed
+# into registers here. Registers from the two sources are not mergeable with
+# each other as they use different hashes.
+
+import json
+
+import numpy as np
+import pandas as pd
+
+
+# Register index bits - Snowflake's HLL uses 2^12 registers
+PRECISION = 12
+
+# Standard error of an estimate, relative to the count
+RELATIVE_ERROR = 1.04 / np.sqrt(2 ** PRECISION)
+
+# Normal quantile for the error bounds shown next to estimates (95%)
+CONFIDENCE_Z = 1.96
+
+
+def error_bound(count, z=CONFIDENCE_Z):
+    """Half-width of the confidence interval of an estimated count"""
+    return z * RELATIVE_ERROR * count
+
+
+class HyperLogLog:
+    """Distinct-count sketch: one max-rank register per hash bucket"""
+
+    __slots__ = ('registers',)
+
+    def __init__(self, registers):
+        self.registers = registers
+
+    @classmethod
+    def empty(cls, precision=PRECISION):
+        return cls(np.zeros(2 ** precision, dtype=np.uint8))
+
+    @classmethod
+    def from_values(cls, values, precision=PRECISION):
+        """Sketch of an iterable of values, NULLs ignored"""
+        values = pd.Series(list(values), dtype=object).dropna()
+        sketch = cls.empty(precision)
+        if values.empty:
+            return sketch
+        hashes = pd.util.hash_array(values.to_numpy())
+        buckets = (hashes >> np.uint64(64 - precision)).astype(np.intp)
+        rest = (hashes & np.uint64((1 << (64 - precision)) - 1)).astype(np.float64)
+        # Rank = leading zeros of the remaining bits + 1; frexp's exponent is
+        # the bit length, exact as the remaining bits fit a float's mantissa
+        ranks = (64 - precision) - np.frexp(rest)[1] + 1
+        np.maximum.at(sketch.registers, buckets, ranks.astype(np.uint8))
+        return sketch
+
+    @classmethod
+    def from_export(cls, exported):
+        """Sketch of an HLL_EXPORT value - a JSON string or object, or a local value list"""
+        if exported is None or (isinstance(exported, float) and np.isnan(exported)):
+            return cls.empty()
+        if isinstance(exported, str):
+            exported = json.loads(exported)
+        if not isinstance(exported, dict):
+            return cls.from_values(exported)
+
+        precision = int(exported.get('precision', PRECISION))
+        sketch = cls.empty(precision)
+        if 'dense' in exported:
+            sketch.registers[:] = np.asarray(exported['dense'], dtype=np.uint8)
+        elif 'sparse' in exported:
+            indices = np.asarray(exported['sparse']['indices'], dtype=np.intp)
+            sketch.registers[indices] = np.asarray(exported['sparse']['maxLzCounts'], dtype=np.uint8)
+        return sketch
+
+    def __or__(self, other):
+        if len(self.registers) != len(other.registers):
+            raise ValueError("Cannot merge sketches of different precision")
+        return HyperLogLog(np.maximum(self.registers, other.registers))
+
+    def estimate(self):
+        """Estimated number of distinct values"""
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            return m * np.log(m / zeros)
+        return float(raw)
+
+    def __repr__(self):
+        return f"HyperLogLog(~{self.estimate():,.0f})"
+
+
+def merge_sketches(sketches):
+    """Union of an iterable of sketches"""
+    merged = None
+    for sketch in sketches:
+        merged = sketch if merged is None else merged | sketch
+    return merged if merged is not None else HyperLogLog.empty()